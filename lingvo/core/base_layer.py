@@ -17,18 +17,22 @@
 
 import abc
 import collections
+import contextlib
 import enum
+import functools
 import itertools
 import re
 import lingvo.compat as tf
 from lingvo.core import cluster_factory
 from lingvo.core import hyperparams
 from lingvo.core import py_utils
+from lingvo.core import tshape
 
 FLAGS = tf.flags.FLAGS
 
 _LAYER_STACK = py_utils.ThreadLocalStack()
 _CREATE_VARIABLES_STACK = py_utils.ThreadLocalStack()
+_FPROP_META_CACHE_STACK = py_utils.ThreadLocalStack()
 
 
 class Accumulator:
@@ -154,6 +158,110 @@ def RecursiveFindLayerParams(params):
   return layer_params
 
 
+def _FPropMetaArgKey(arg):
+  """Returns a hashable key of an FPropMeta() arg.
+
+  Symbolic dims of `tshape.Shape` are sympy dummies, which only compare equal
+  to themselves, so a cached result is never shared between distinct symbols.
+
+  Args:
+    arg: An arg of FPropMeta().
+
+  Returns:
+    A hashable key.
+
+  Raises:
+    TypeError: if arg has no key.
+  """
+  if arg is None or isinstance(arg, (bool, int, float, str, tf.DType)):
+    return (type(arg), arg)
+  if isinstance(arg, tshape.Shape):
+    return (tshape.Shape, tuple(arg[i] for i in range(arg.rank)))
+  if isinstance(arg, tf.TensorShape):
+    return (tf.TensorShape, str(arg))
+  if isinstance(arg, (list, tuple)):
+    return (type(arg), tuple(_FPropMetaArgKey(x) for x in arg))
+  if isinstance(arg, dict):
+    return (type(arg),
+            tuple(sorted((k, _FPropMetaArgKey(v)) for k, v in arg.items())))
+  raise TypeError('No FPropMeta cache key for %r' % (arg,))
+
+
+class _FPropMetaCache:
+  """The FPropMeta() results memoized within an FPropMetaCacheScope()."""
+
+  def __init__(self):
+    # id(params) -> (params, text of params). Holding on to params keeps its id
+    # from being reused within the scope.
+    self._params_texts = {}
+    # (FPropMeta fn, layer class, params text, args key) -> FPropMeta result.
+    self.results = {}
+
+  def ParamsKey(self, params):
+    """Returns the text of params, computed once per params object."""
+    entry = self._params_texts.get(id(params))
+    if entry is None:
+      entry = (params, str(params))
+      self._params_texts[id(params)] = entry
+    return entry[1]
+
+
+@contextlib.contextmanager
+def FPropMetaCacheScope():
+  """Memoizes the FPropMeta() of all the layers within the scope.
+
+  The same layer params are often given the same input shapes many times, e.g.
+  by each program building its own copy of a model, or by the layers calling
+  FPropMeta() of their children in __init__ or FProp.
+
+  Params are keyed by their text, which is only computed the first time a
+  params object is seen, so the params given to FPropMeta() must not be
+  modified within the scope. Nested scopes share the cache of the outermost
+  one, which is dropped when it exits.
+
+  Yields:
+    None.
+  """
+  _FPROP_META_CACHE_STACK.stack.append(
+      _FPROP_META_CACHE_STACK.stack[0]
+      if _FPROP_META_CACHE_STACK.stack else _FPropMetaCache())
+  try:
+    yield
+  finally:
+    _FPROP_META_CACHE_STACK.stack.pop()
+
+
+def _FPropMetaCacheWrapper(func):  # pylint: disable=invalid-name
+  """A decorator memoizing a layer's FPropMeta within FPropMetaCacheScope().
+
+  Args:
+    func: The FPropMeta function (not classmethod) of `BaseLayer`'s subclasses.
+
+  Returns:
+    A wrapper of func, returning cached results for args it has already seen in
+    the current FPropMetaCacheScope(). Args it can not key, e.g. tensors, are
+    never cached.
+  """
+
+  @functools.wraps(func)
+  def Wrapper(cls, params, *args, **kwargs):
+    if not _FPROP_META_CACHE_STACK.stack:
+      return func(cls, params, *args, **kwargs)
+    cache = _FPROP_META_CACHE_STACK.stack[-1]
+    try:
+      key = (func, cls, cache.ParamsKey(params), _FPropMetaArgKey(args),
+             _FPropMetaArgKey(kwargs))
+    except TypeError:
+      return func(cls, params, *args, **kwargs)
+    if key not in cache.results:
+      cache.results[key] = func(cls, params, *args, **kwargs)
+    meta = cache.results[key]
+    # Callers may update the returned NestedMap, e.g. its flops.
+    return meta.DeepCopy() if isinstance(meta, py_utils.NestedMap) else meta
+
+  return Wrapper
+
+
 class BaseLayerMeta(type):
   """Metaclass tracking child layers and variable initialization."""
 
@@ -168,6 +276,9 @@ class BaseLayerMeta(type):
       cls.__init__ = TrivialInit
 
     cls.__init__ = _BaseLayerInitWrapper(cls.__init__)
+    if isinstance(dct.get('FPropMeta'), classmethod):
+      cls.FPropMeta = classmethod(
+          _FPropMetaCacheWrapper(dct['FPropMeta'].__func__))
     return cls
   # pylint: enable=bad-mcs-classmethod-argument
 
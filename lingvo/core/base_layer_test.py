@@ -20,6 +20,7 @@ from lingvo.core import base_layer
 from lingvo.core import hyperparams
 from lingvo.core import py_utils
 from lingvo.core import test_utils
+from lingvo.core import tshape
 
 
 class AddingAccumulator(base_layer.Accumulator):
@@ -59,6 +60,17 @@ class TestLayer(base_layer.BaseLayer):
             ]))
 
 
+class CountingMetaLayer(base_layer.BaseLayer):
+  """Counts the calls to FPropMeta() that are not cached."""
+
+  num_fprop_meta_calls = 0
+
+  @classmethod
+  def FPropMeta(cls, p, inputs):
+    cls.num_fprop_meta_calls += 1
+    return py_utils.NestedMap(flops=inputs.size, out_shapes=(inputs,))
+
+
 class BaseLayerTest(test_utils.TestCase):
 
   def testCopyBaseParams(self):
@@ -321,6 +333,48 @@ class BaseLayerTest(test_utils.TestCase):
         base_layer.IsLayerParams(
             hyperparams.InstantiableParams(base_layer.Accumulator)))
 
+  def testFPropMetaIsCached(self):
+    p = CountingMetaLayer.Params().Set(name='counting')
+    start_calls = CountingMetaLayer.num_fprop_meta_calls
+    # Not cached outside of FPropMetaCacheScope().
+    p.cls.FPropMeta(p, tshape.Shape([2, 3]))
+    p.cls.FPropMeta(p, tshape.Shape([2, 3]))
+    self.assertEqual(start_calls + 2, CountingMetaLayer.num_fprop_meta_calls)
+
+    start_calls = CountingMetaLayer.num_fprop_meta_calls
+    with base_layer.FPropMetaCacheScope():
+      meta = p.cls.FPropMeta(p, tshape.Shape([2, 3]))
+      self.assertEqual(6, meta.flops)
+      # Updates of the returned meta do not affect the cache.
+      meta.flops += 10
+      self.assertEqual(6, p.cls.FPropMeta(p, tshape.Shape([2, 3])).flops)
+      # Nor do copies of the params, as built by each program.
+      p.cls.FPropMeta(p.Copy(), tshape.Shape([2, 3]))
+      with base_layer.FPropMetaCacheScope():
+        p.cls.FPropMeta(p, tshape.Shape([2, 3]))
+      self.assertEqual(start_calls + 1, CountingMetaLayer.num_fprop_meta_calls)
+
+      # Different shapes or params are not cached.
+      p.cls.FPropMeta(p, tshape.Shape([2, 4]))
+      self.assertEqual(start_calls + 2, CountingMetaLayer.num_fprop_meta_calls)
+      p.cls.FPropMeta(p.Copy().Set(name='other'), tshape.Shape([2, 4]))
+      self.assertEqual(start_calls + 3, CountingMetaLayer.num_fprop_meta_calls)
+
+      # Symbolic dims only hit the cache for the same symbols.
+      symbolic = tshape.Shape(['batch', 3])
+      out_shape = p.cls.FPropMeta(p, symbolic).out_shapes[0]
+      self.assertIs(symbolic[0], out_shape[0])
+      p.cls.FPropMeta(p, symbolic)
+      self.assertEqual(start_calls + 4, CountingMetaLayer.num_fprop_meta_calls)
+      other_out_shape = p.cls.FPropMeta(p, tshape.Shape(['batch',
+                                                        3])).out_shapes[0]
+      self.assertIsNot(symbolic[0], other_out_shape[0])
+      self.assertEqual(start_calls + 5, CountingMetaLayer.num_fprop_meta_calls)
+
+    # The cache is dropped with the scope.
+    with base_layer.FPropMetaCacheScope():
+      p.cls.FPropMeta(p, tshape.Shape([2, 3]))
+    self.assertEqual(start_calls + 6, CountingMetaLayer.num_fprop_meta_calls)
 
 if __name__ == '__main__':
   tf.test.main()
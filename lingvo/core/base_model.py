@@ -25,6 +25,7 @@ from lingvo.core import build_data
 from lingvo.core import cluster_factory
 from lingvo.core import early_stop
 from lingvo.core import hyperparams
+from lingvo.core import input_generator_helper
 from lingvo.core import learner
 from lingvo.core import optimizer
 from lingvo.core import py_utils
@@ -528,8 +529,89 @@ class BaseTask(base_layer.BaseLayer):
       else:
         input_batch = self.input_generator.SplitInputBatch(
             self.cluster.num_splits_per_client)
+    num_micro_batches = self._NumMicroBatches()
+    if num_micro_batches > 1:
+      return self._FPropMicroBatches(self.theta, input_batch, num_micro_batches)
     return self.FProp(self.theta, input_batch)
 
+  def _NumMicroBatches(self):
+    """Returns the number of micro-batches to split training batches into."""
+    if self.do_eval or 'learners' not in self.children:
+      return 1
+    num_micro_batches = set(
+        lrn.params.num_micro_batches for lrn in self.learners)
+    if len(num_micro_batches) > 1:
+      raise ValueError('All the learners must use the same num_micro_batches, '
+                       'got %s.' % sorted(num_micro_batches))
+    num_micro_batches = num_micro_batches.pop()
+    if num_micro_batches > 1 and py_utils.use_tpu():
+      raise ValueError('num_micro_batches > 1 is not supported on TPU.')
+    return num_micro_batches
+
+  def _FPropMicroBatches(self, theta, input_batch, num_micro_batches):
+    """Forward propagation and gradients of micro-batches of `input_batch`.
+
+    Splits the input batch of each tower into `num_micro_batches` parts along
+    their first dimension, and computes the forward pass of each micro-batch
+    and the gradients of its losses after the accumulation of the gradients of
+    the previous micro-batch, so that only the activations of one micro-batch
+    are alive at a time. `BProp` then applies the accumulated gradients once.
+
+    The step seed is only reset at the start of the step, so that dropout and
+    variational noise differ across micro-batches. The metrics are the weighted
+    averages of the metrics of the micro-batches and the per-example tensors
+    are concatenated, as for towers.
+
+    Args:
+      theta: A `.NestedMap` object containing weights' values of this layer and
+        its children layers.
+      input_batch: The input batch. A `NestedMap` of tensors, or a list of
+        `NestedMap`, one for each split.
+      num_micro_batches: The number of micro-batches.
+
+    Returns:
+      (dict, dict), the metrics and per-example tensors as returned by `FProp`.
+
+    Raises:
+      ValueError: if a loss of a learner is not in the metrics.
+    """
+    p = self.params
+    splits = input_batch if isinstance(input_batch, list) else [input_batch]
+    # micro_batches[i][j] is the i-th micro-batch of the j-th split.
+    micro_batches = [[] for _ in range(num_micro_batches)]
+    for split in splits:
+      split_tensors = input_generator_helper.SplitTensors(
+          split.Flatten(), num_micro_batches)
+      for i in range(num_micro_batches):
+        micro_batches[i].append(split.Pack([x[i] for x in split_tensors]))
+    if not isinstance(input_batch, list):
+      micro_batches = [micro_batch[0] for micro_batch in micro_batches]
+
+    all_metrics = []
+    all_per_example_tensors = []
+    accumulated_grads = []
+    with tf.name_scope('fprop'), tf.name_scope(p.name):
+      py_utils.ResetStepSeed()
+      for i, micro_batch in enumerate(micro_batches):
+        with tf.name_scope('micro_batch_%d' % i), tf.control_dependencies(
+            accumulated_grads):
+          metrics, per_example = self._FPropSplitInputBatch(theta, micro_batch)
+          accumulated_grads = []
+          for lrn in self.learners:
+            loss_name = lrn.params.name
+            if loss_name not in metrics:
+              raise ValueError('Loss %s not found in metrics %s' %
+                               (loss_name, list(metrics.keys())))
+            loss, weight = metrics[loss_name]
+            accumulated_grads += lrn.AccumulateMicroBatchGradients(
+                loss, weight, self.vars)
+        all_metrics.append(metrics)
+        all_per_example_tensors.append(per_example)
+      metrics = py_utils.WeightedAvgOfMetrics(all_metrics)
+      per_example = py_utils.ConcatPerExampleTensors(all_per_example_tensors)
+      self._FPropResult(metrics, per_example)
+    return metrics, per_example
+
   def AdjustGradients(self, vars_gradients):
     """Allow for custom gradient manipulation prior to clipping."""
     tf.logging.info('BaseTask.AdjustGradients')
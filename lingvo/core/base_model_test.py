@@ -25,6 +25,7 @@ from lingvo.core import base_model_params
 from lingvo.core import hyperparams
 from lingvo.core import layers
 from lingvo.core import learner
+from lingvo.core import optimizer
 from lingvo.core import py_utils
 from lingvo.core import task_scheduler
 from lingvo.core import test_utils
@@ -300,6 +301,79 @@ class DistillationTaskTest(test_utils.TestCase):
           self.assertNotAlmostEqual(values_before_training[child][k], v)
 
 
+class RegressionInputGenerator(base_input_generator.BaseInputGenerator):
+
+  def InfeedBatchSize(self):
+    return 6
+
+  def _InputBatch(self):
+    return py_utils.NestedMap(
+        x=tf.constant([1., 2., 3., 4., 5., 6.]),
+        y=tf.constant([2., 3., 5., 9., 10., 13.]))
+
+
+class RegressionTask(base_model.BaseTask):
+  """Fits y = w * x, weighting the loss by the batch size."""
+
+  def _CreateLayerVariables(self):
+    super()._CreateLayerVariables()
+    self.CreateVariable(
+        'w',
+        py_utils.WeightParams(shape=[], init=py_utils.WeightInit.Constant(1.)))
+
+  def ComputePredictions(self, theta, input_batch):
+    return input_batch.x * theta.w
+
+  def ComputeLoss(self, theta, predictions, input_batch):
+    loss = tf.reduce_mean(tf.square(predictions - input_batch.y))
+    weight = tf.cast(tf.size(input_batch.y), tf.float32)
+    return {'loss': (loss, weight)}, {'x': input_batch.x}
+
+
+class MicroBatchTest(test_utils.TestCase):
+
+  def _Train(self, num_micro_batches):
+    with self.session(graph=tf.Graph()):
+      p = RegressionTask.Params().Set(name='regression')
+      p.input = RegressionInputGenerator.Params()
+      p.train.learner = learner.Learner.Params().Set(
+          name='loss',
+          learning_rate=0.01,
+          optimizer=optimizer.SGD.Params(),
+          num_micro_batches=num_micro_batches)
+      task = p.Instantiate()
+      _, per_example = task.FPropDefaultTheta()
+      task.BProp()
+      self.evaluate(
+          [tf.global_variables_initializer(),
+           tf.local_variables_initializer()])
+      losses = []
+      for _ in range(3):
+        loss, x, _ = self.evaluate([task.loss, per_example['x'], task.train_op])
+        losses.append(loss)
+      # Per-example tensors are concatenated across micro-batches.
+      self.assertAllEqual([1., 2., 3., 4., 5., 6.], x)
+      return losses, self.evaluate(task.vars.w)
+
+  def testMicroBatchesMatchBatch(self):
+    expected_losses, expected_w = self._Train(num_micro_batches=1)
+    losses, w = self._Train(num_micro_batches=3)
+    self.assertAllClose(expected_losses, losses)
+    self.assertAllClose(expected_w, w)
+    self.assertNotAllClose(1., w)
+
+  def testMicroBatchesRaisesIfLearnersDiffer(self):
+    p = RegressionTask.Params().Set(name='regression')
+    p.input = RegressionInputGenerator.Params()
+    p.train.learner = [
+        learner.Learner.Params().Set(name='loss', num_micro_batches=2),
+        learner.Learner.Params().Set(name='loss2', num_micro_batches=3),
+    ]
+    task = p.Instantiate()
+    with self.assertRaisesRegex(ValueError, 'same num_micro_batches'):
+      task.FPropDefaultTheta()
+
+
 class SingleTaskModelTest(test_utils.TestCase):
 
   def testInit(self):
@@ -245,12 +245,27 @@ class MultiHeadedAttention(base_layer.BaseLayer):
     p.Define('packed_input', False, 'Whether there is packed input.')
     p.Define('use_bias', True, 'Whether to use bias for projection layers.')
     p.Define('xla_num_partitions', None, 'Number of SPMD partitions.')
+    p.Define(
+        'atten_block_size', None,
+        'If set, attends to keys/values in blocks of this many source steps '
+        'with an online softmax, so that the [B, N, T, S] attention '
+        'probabilities are never materialized in either the forward or the '
+        'backward pass. Requires atten_dropout_prob == 0. In this mode FProp '
+        'returns None for atten_probs.')
     return p
 
   def __init__(self, params):
     """Constructs a _MultiHeadedAttention object."""
     super().__init__(params)
     p = self.params
+    if p.atten_block_size:
+      if p.atten_dropout_prob:
+        raise ValueError('atten_block_size does not support attention dropout.')
+      if (type(self)._AttenLogits is not MultiHeadedAttention._AttenLogits or
+          type(self).AttenProbs is not MultiHeadedAttention.AttenProbs):
+        raise ValueError('atten_block_size is only supported with the default '
+                         'dot-product attention logits of '
+                         'MultiHeadedAttention, not %s.' % type(self).__name__)
     assert p.input_dim, 'input_dim is {}'.format(p.input_dim)
     assert p.hidden_dim, 'hidden_dim is {}'.format(p.hidden_dim)
     assert symbolic.IsExpr(
@@ -439,6 +454,12 @@ class MultiHeadedAttention(base_layer.BaseLayer):
     else:
       query *= (p.hidden_dim // p.num_heads)**-0.5
 
+    if p.atten_block_size:
+      with tf.name_scope('blockwise'):
+        encoded = self._BlockwiseDotAtten(theta, query, key, value, paddings,
+                                          segment_mask, per_step_padding)
+      return encoded, None
+
     # Compute prob with shape [batch, heads, target_time, source_time].
     with tf.name_scope('probs'):
       unscaled_probs, probs_sum = self.AttenProbs(theta, query, key, paddings,
@@ -456,6 +477,196 @@ class MultiHeadedAttention(base_layer.BaseLayer):
 
     return encoded, unscaled_probs
 
+  def _BlockwiseDotAtten(self,
+                         theta,
+                         query,
+                         key,
+                         value,
+                         paddings,
+                         segment_mask,
+                         per_step_padding=None):
+    """Memory-efficient attention over blocks of p.atten_block_size keys.
+
+    Computes the same result as the dense path of _DotAtten (without dropout),
+    but loops over blocks of the source with a running max and sum of the
+    softmax ("online softmax"), so the peak activation memory is
+    O(B * N * T * atten_block_size) instead of O(B * N * T * S). The backward
+    pass is a custom gradient that recomputes each block's probabilities from
+    the saved log-sum-exp instead of storing them.
+
+    Args:
+      theta: A `.NestedMap` object containing weights' values of this layer and
+        its children layers.
+      query:    [B, T, N, H], already scaled.
+      key:      [B, S, N, H].
+      value:    [B, S, N, H].
+      paddings: [B, S].
+      segment_mask: [B, 1, T, S]: A mask that is applied to prevent
+        attention between different segments. This is already been
+        converted into large negative logits. Only applied if
+        packed_input = True.
+      per_step_padding: A mask used by decoder self-attention to prevent
+        information flow from future (causal padding). It has shape [B, T, S] if
+        not None.
+
+    Returns:
+      encoded: [B, T, N, H].
+    """
+    p = self.params
+    block_size = p.atten_block_size
+    key = py_utils.HasRank(key, 4)
+    b, s, n, h = py_utils.GetShape(key, 4)
+    query = py_utils.HasShape(query, [b, -1, n, h])
+    value = py_utils.HasShape(value, [b, s, n, -1])
+    t = py_utils.GetShape(query)[1]
+
+    xs = py_utils.NestedMap(query=query, key=key, value=value)
+    if p.packed_input and segment_mask is not None:
+      # Paddings have been included in segment_mask.
+      xs.segment_mask = py_utils.HasShape(segment_mask, [b, 1, t, s])
+    else:
+      xs.paddings = py_utils.HasShape(paddings, [b, s])
+      if per_step_padding is not None:
+        xs.per_step_padding = py_utils.HasShape(per_step_padding, [b, t, s])
+
+    # Logits of masked positions, as in AttenProbs, and of the positions that
+    # only pad the source up to a multiple of block_size. The latter must be
+    # smaller, so that fully masked rows still attend uniformly to the real
+    # source positions only.
+    masked_logit = tf.float32.max * -0.7
+    out_of_range_logit = tf.float32.max * -0.9
+
+    def _ToBlocks(xs):
+      """Splits the source dim of xs into [num_blocks, ...] float32 blocks."""
+      s = py_utils.GetShape(xs.key)[1]
+      num_blocks = (s + block_size - 1) // block_size
+      pad = num_blocks * block_size - s
+
+      def _Split(x, axis):
+        # Moves the blocks to the leading dim: [..., S, ...] ->
+        # [num_blocks, ..., block_size, ...].
+        x = tf.cast(x, tf.float32)
+        rank = len(x.shape)
+        x = tf.pad(x, [[0, pad] if i == axis else [0, 0] for i in range(rank)])
+        shape = py_utils.GetShape(x, rank)
+        x = tf.reshape(
+            x, shape[:axis] + [num_blocks, block_size] + shape[axis + 1:])
+        perm = [axis] + [i for i in range(rank + 1) if i != axis]
+        return tf.transpose(x, perm)
+
+      blocks = py_utils.NestedMap(
+          num_blocks=num_blocks,
+          key=_Split(xs.key, 1),
+          value=_Split(xs.value, 1),
+          in_range=tf.reshape(
+              tf.cast(tf.range(num_blocks * block_size) < s, tf.float32),
+              [num_blocks, block_size]))
+      if 'segment_mask' in xs:
+        blocks.segment_mask = _Split(xs.segment_mask, 3)
+      else:
+        blocks.paddings = _Split(xs.paddings, 1)
+        if 'per_step_padding' in xs:
+          blocks.per_step_padding = _Split(xs.per_step_padding, 2)
+      return blocks
+
+    def _FromBlocks(x, s):
+      """Inverse of _Split for [num_blocks, B, block_size, N, H] tensors."""
+      x = tf.transpose(x, [1, 0, 2, 3, 4])
+      nb, bsz, k, heads, dim = py_utils.GetShape(x, 5)
+      return tf.reshape(x, [bsz, nb * k, heads, dim])[:, :s]
+
+    def _BlockLogits(blocks, q, j):
+      """Returns the masked logits of block j and their gradient mask.
+
+      Args:
+        blocks: The output of _ToBlocks.
+        q: [B, T, N, H] float32 query.
+        j: Block index.
+
+      Returns:
+        logits: [B, N, T, block_size].
+        grad_mask: Broadcastable to logits, 0 where the gradient of the dense
+          path w.r.t. logits is blocked.
+      """
+      logits = tf.einsum('BTNH,BSNH->BNTS', q, tf.gather(blocks.key, j))
+      if 'segment_mask' in blocks:
+        logits += tf.gather(blocks.segment_mask, j)
+        grad_mask = tf.ones([], tf.float32)
+      else:
+        pad = tf.reshape(tf.gather(blocks.paddings, j), [-1, 1, 1, block_size])
+        if 'per_step_padding' in blocks:
+          pad += tf.expand_dims(tf.gather(blocks.per_step_padding, j), 1)
+        grad_mask = tf.cast(pad <= 0.0, tf.float32)
+        logits = logits * grad_mask + masked_logit * (1.0 - grad_mask)
+      in_range = tf.reshape(tf.gather(blocks.in_range, j), [1, 1, 1, -1])
+      logits = logits * in_range + out_of_range_logit * (1.0 - in_range)
+      return logits, grad_mask * in_range
+
+    def _Fwd(xs):
+      """Online softmax attention over all blocks."""
+      blocks = _ToBlocks(xs)
+      q = tf.cast(xs.query, tf.float32)
+      bsz, tlen, heads, _ = py_utils.GetShape(q, 4)
+      dim = py_utils.GetShape(xs.value)[3]
+
+      def _Body(j, m, l, acc):
+        logits, _ = _BlockLogits(blocks, q, j)
+        new_m = tf.maximum(m, tf.reduce_max(logits, -1, keepdims=True))
+        scale = tf.exp(m - new_m)
+        probs = tf.exp(logits - new_m)
+        l = l * scale + tf.reduce_sum(probs, -1, keepdims=True)
+        acc = acc * scale + tf.einsum('BNTS,BSNH->BNTH', probs,
+                                      tf.gather(blocks.value, j))
+        return j + 1, new_m, l, acc
+
+      _, m, l, acc = tf.while_loop(
+          lambda j, *_: j < blocks.num_blocks,
+          _Body,
+          loop_vars=(tf.constant(0),
+                     tf.fill([bsz, heads, tlen, 1], -tf.float32.max),
+                     tf.zeros([bsz, heads, tlen, 1], tf.float32),
+                     tf.zeros([bsz, heads, tlen, dim], tf.float32)))
+      encoded = tf.transpose(acc / l, [0, 2, 1, 3])
+      return py_utils.NestedMap(
+          encoded=tf.cast(encoded, xs.query.dtype), lse=m + tf.math.log(l))
+
+    def _Bak(xs, ys, dys):
+      """Recomputes the probabilities of each block from ys.lse."""
+      blocks = _ToBlocks(xs)
+      q = tf.cast(xs.query, tf.float32)
+      # [B, N, T, H]
+      d_encoded = tf.transpose(tf.cast(dys.encoded, tf.float32), [0, 2, 1, 3])
+      encoded = tf.transpose(tf.cast(ys.encoded, tf.float32), [0, 2, 1, 3])
+      # d(loss)/d(logits) = probs * (d(loss)/d(probs) - delta).
+      delta = tf.reduce_sum(d_encoded * encoded, -1, keepdims=True)
+
+      def _Body(j, dq, dk, dv):
+        logits, grad_mask = _BlockLogits(blocks, q, j)
+        probs = tf.exp(logits - ys.lse)
+        dv = dv.write(j, tf.einsum('BNTS,BNTH->BSNH', probs, d_encoded))
+        d_probs = tf.einsum('BNTH,BSNH->BNTS', d_encoded,
+                            tf.gather(blocks.value, j))
+        d_logits = probs * (d_probs - delta) * grad_mask
+        dq += tf.einsum('BNTS,BSNH->BTNH', d_logits, tf.gather(blocks.key, j))
+        dk = dk.write(j, tf.einsum('BNTS,BTNH->BSNH', d_logits, q))
+        return j + 1, dq, dk, dv
+
+      _, dq, dk, dv = tf.while_loop(
+          lambda j, *_: j < blocks.num_blocks,
+          _Body,
+          loop_vars=(tf.constant(0), tf.zeros_like(q),
+                     tf.TensorArray(tf.float32, size=blocks.num_blocks),
+                     tf.TensorArray(tf.float32, size=blocks.num_blocks)))
+      s = py_utils.GetShape(xs.key)[1]
+      # Masks are not differentiable.
+      dxs = xs.Transform(tf.zeros_like)
+      dxs.query = tf.cast(dq, xs.query.dtype)
+      dxs.key = tf.cast(_FromBlocks(dk.stack(), s), xs.key.dtype)
+      dxs.value = tf.cast(_FromBlocks(dv.stack(), s), xs.value.dtype)
+      return dxs
+
+    return py_utils.CallDefun(_Fwd, xs, bak=_Bak).encoded
+
   def _DotAttenOneStep(self,
                        theta,
                        query,
@@ -1894,13 +2105,14 @@ class TransformerLayer(base_layer.BaseLayer):
             aux_vec,
             aux_paddings,
             segment_mask=aux_segment_mask)
-        num_heads = py_utils.GetShape(atten_probs)[1]
-        atten_probs = tf.reshape(
-            atten_probs,
-            [source_batch, -1, num_heads, target_time, source_time])
-        atten_probs = tf.transpose(atten_probs, [1, 0, 2, 3, 4])
-        atten_probs = tf.reshape(
-            atten_probs, [target_batch, num_heads, target_time, source_time])
+        if atten_probs is not None:
+          num_heads = py_utils.GetShape(atten_probs)[1]
+          atten_probs = tf.reshape(
+              atten_probs,
+              [source_batch, -1, num_heads, target_time, source_time])
+          atten_probs = tf.transpose(atten_probs, [1, 0, 2, 3, 4])
+          atten_probs = tf.reshape(
+              atten_probs, [target_batch, num_heads, target_time, source_time])
         atten_vec = tf.reshape(atten_vec, [source_batch, -1, target_time, dim])
         atten_vec = tf.transpose(atten_vec, [1, 0, 2, 3])
         atten_vec = tf.reshape(atten_vec, [target_batch, target_time, dim])
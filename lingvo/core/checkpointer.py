@@ -21,6 +21,7 @@ import time
 import lingvo.compat as tf
 from lingvo.core import cluster_factory
 from lingvo.core import py_utils
+from lingvo.core import restore_planner
 import six
 
 
@@ -72,6 +73,8 @@ class Checkpointer:
     self._next_checkpoint_seconds = 0
     self._save_interval_seconds = self._train_params.save_interval_seconds
     self._saver = self._GetSaver()
+    # Shared by all the warm starts, to only restore the changed variables.
+    self._restore_planner = restore_planner.RestorePlanner()
 
     self._uninitialized_vars = tf.report_uninitialized_variables(
         tf.global_variables())
@@ -184,13 +187,15 @@ class Checkpointer:
       if tp.init_from_checkpoint_rules:
         rules = _ResolveCkptPath(tp.init_from_checkpoint_rules)
         tf.logging.info('OverrideVarsFromCheckpoints %s', rules)
-        py_utils.OverrideVarsFromCheckpoints(sess, tf.global_variables(), rules)
+        py_utils.OverrideVarsFromCheckpoints(
+            sess, tf.global_variables(), rules, self._restore_planner)
 
     if self._params.train.init_from_checkpoint_rules:
       tp = self._params.train
       rules = _ResolveCkptPath(tp.init_from_checkpoint_rules)
       tf.logging.info('OverrideVarsFromCheckpoints %s', rules)
-      py_utils.OverrideVarsFromCheckpoints(sess, tf.global_variables(), rules)
+      py_utils.OverrideVarsFromCheckpoints(sess, tf.global_variables(), rules,
+                                           self._restore_planner)
 
   def RestoreIfNeeded(self, sess):
     """If vars are not initialized, restore from checkpoint."""
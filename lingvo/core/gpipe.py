@@ -182,6 +182,8 @@ def PartitionSequentialLayers(params, num_partitions, *shapes):
 
   This routine strives to partition layers so that each partition costs roughly
   the same flops given the input shapes.
+  `gpipe_planner.PlanPartitions` instead minimizes the cost of the slowest
+  partition, including the backward pass, under a memory limit.
 
   Args:
     params: A layer param or a list of layer param.
@@ -0,0 +1,288 @@
+# Lint as: python3
+# Copyright 2020 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Plans balanced partitions of sequential layers into GPipe stages.
+
+A GPipe step is as slow as its slowest stage, so stages split evenly by layer
+count leave the other devices idle for most of the step. The planner gets the
+forward and backward cost and the memory of each layer for one micro-batch,
+either estimated with `FPropMeta` or measured by running each layer on the
+local device, and chooses the split points that minimize the cost of the
+slowest stage under a per-device memory limit. It then simulates the GPipe
+schedule of the chosen stages to predict the fraction of device time lost to
+the pipeline bubble.
+
+Only `ProfileLayerCosts` runs TensorFlow ops, on whatever device is local, so
+plans for a pipeline of accelerators can be made on a CPU-only host, e.g.::
+
+    costs = gpipe_planner.EstimateLayerCosts(layer_params, input_shape)
+    plan = gpipe_planner.PlanPartitions(
+        costs, num_partitions=4, num_micro_batches=8, memory_limit=16 * 2**30)
+    p.splits = plan.splits
+"""
+
+import collections
+import time
+
+import lingvo.compat as tf
+from lingvo.core import gpipe
+from lingvo.core import py_utils
+import numpy as np
+
+# The cost of a layer for one micro-batch. fprop and bprop are in the same,
+# arbitrary units, e.g. flops or seconds. activation_bytes is the size of the
+# outputs of the layer, which are kept for the backward pass of the next one.
+LayerCost = collections.namedtuple(
+    'LayerCost', ['name', 'fprop', 'bprop', 'activation_bytes', 'param_bytes'])
+
+
+def _ParamBytes(layer):
+  """Returns the size of the variables of `layer`."""
+  return sum(
+      v.shape.num_elements() * v.dtype.base_dtype.size
+      for v in layer.vars.Flatten())
+
+
+def EstimateLayerCosts(params_list, *shapes, dtype=tf.float32):
+  """Estimates the costs of sequential layers with their `FPropMeta`.
+
+  The backward pass of a layer is estimated to cost twice its forward pass.
+
+  Args:
+    params_list: A list of layer params, the output of each layer being the
+      input of the next one.
+    *shapes: tshape.Shape of the inputs to the first layer for one
+      micro-batch.
+    dtype: The dtype of the activations.
+
+  Returns:
+    A list of `LayerCost`, one for each layer, in flops.
+  """
+  costs = []
+  for p in params_list:
+    with tf.Graph().as_default():  # throw-away graph.
+      param_bytes = _ParamBytes(p.Instantiate())
+    meta = p.cls.FPropMeta(p, *shapes)
+    shapes = meta.out_shapes
+    num_elements = sum(
+        int(s.num_elements()) for s in tf.nest.flatten(shapes) if s is not None)
+    costs.append(
+        LayerCost(
+            name=p.name,
+            fprop=float(meta.flops),
+            bprop=2. * float(meta.flops),
+            activation_bytes=num_elements * dtype.size,
+            param_bytes=param_bytes))
+  return costs
+
+
+def _MedianSecs(sess, fetch, num_iters):
+  sess.run(fetch)  # Warm up.
+  secs = []
+  for _ in range(num_iters):
+    start = time.time()
+    sess.run(fetch)
+    secs.append(time.time() - start)
+  return float(np.median(secs))
+
+
+def ProfileLayerCosts(params_list, *inputs, num_iters=10):
+  """Measures the costs of sequential layers on the local device.
+
+  Each layer is run alone in its own graph, on the values its predecessor
+  computed, so that layers whose combined activations would not fit in memory
+  can still be profiled one by one.
+
+  Args:
+    params_list: A list of layer params, the output of each layer being the
+      input of the next one.
+    *inputs: Numpy arrays, or nested structures of them, of the inputs to the
+      first layer for one micro-batch.
+    num_iters: The number of timed runs of each layer.
+
+  Returns:
+    A list of `LayerCost`, one for each layer, in seconds.
+  """
+  costs = []
+  for p in params_list:
+    with tf.Graph().as_default(), tf.Session() as sess:
+      layer = p.Instantiate()
+      args = tf.nest.map_structure(
+          lambda x: None if x is None else tf.constant(x), inputs)
+      outputs = layer.FPropDefaultTheta(*args)
+      if not isinstance(outputs, tuple):
+        outputs = (outputs,)
+      flat_outputs = [x for x in tf.nest.flatten(outputs) if x is not None]
+      xs = layer.vars.Flatten() + [
+          x for x in tf.nest.flatten(args)
+          if x is not None and x.dtype.is_floating
+      ]
+      sess.run(tf.global_variables_initializer())
+      fprop_secs = _MedianSecs(sess, tf.group(*flat_outputs), num_iters)
+      bprop_secs = 0.
+      loss = [tf.reduce_sum(x) for x in flat_outputs if x.dtype.is_floating]
+      if loss and xs:
+        grads = [g for g in tf.gradients(tf.add_n(loss), xs) if g is not None]
+        if grads:
+          fprop_bprop_secs = _MedianSecs(sess, tf.group(*grads), num_iters)
+          bprop_secs = max(fprop_bprop_secs - fprop_secs, 0.)
+      values = iter(sess.run(flat_outputs))
+      inputs = tf.nest.pack_sequence_as(outputs, [
+          None if x is None else next(values)
+          for x in tf.nest.flatten(outputs)
+      ])
+      costs.append(
+          LayerCost(
+              name=p.name,
+              fprop=fprop_secs,
+              bprop=bprop_secs,
+              activation_bytes=sum(
+                  x.nbytes for x in tf.nest.flatten(inputs) if x is not None),
+              param_bytes=_ParamBytes(layer)))
+    tf.logging.info('Profiled %s: %s', p.name, costs[-1])
+  return costs
+
+
+def SimulateGPipe(stage_fprop, stage_bprop, num_micro_batches):
+  """Returns the cost of a GPipe step with the given stage costs.
+
+  Every stage runs the forward pass of the micro-batches in order, each after
+  the previous stage is done with it. Once the last stage has run all the
+  forward passes, the backward passes run in reverse order of the
+  micro-batches and the stages.
+
+  Args:
+    stage_fprop: The forward cost of each stage for one micro-batch.
+    stage_bprop: The backward cost of each stage for one micro-batch.
+    num_micro_batches: The number of micro-batches of a step.
+  """
+  num_stages = len(stage_fprop)
+  # done[j] is the time stage j finished its last micro-batch.
+  done = [0.] * num_stages
+  for _ in range(num_micro_batches):
+    prev_stage_done = 0.
+    for j in range(num_stages):
+      done[j] = max(done[j], prev_stage_done) + stage_fprop[j]
+      prev_stage_done = done[j]
+  last_fprop_done = done[-1]
+  for _ in range(num_micro_batches):
+    next_stage_done = last_fprop_done
+    for j in reversed(range(num_stages)):
+      done[j] = max(done[j], next_stage_done) + stage_bprop[j]
+      next_stage_done = done[j]
+  return max(done)
+
+
+def PlanPartitions(layer_costs,
+                   num_partitions,
+                   num_micro_batches,
+                   memory_limit=None,
+                   param_copies=4):
+  """Partitions sequential layers into stages minimizing the slowest one.
+
+  The memory of a stage is the memory of its variables times `param_copies`,
+  plus the activations of all the micro-batches, which GPipe keeps for the
+  backward pass.
+
+  Args:
+    layer_costs: A list of `LayerCost`, as returned by `EstimateLayerCosts` or
+      `ProfileLayerCosts`.
+    num_partitions: The number of stages.
+    num_micro_batches: The number of micro-batches of a step.
+    memory_limit: If set, the maximum memory of a stage in bytes.
+    param_copies: The number of copies of each variable a stage keeps, e.g. 4
+      for the variable, its gradient and the two slots of Adam.
+
+  Returns:
+    A `.NestedMap` with
+
+    - splits: The index of the end of each stage in `layer_costs`, in
+      ascending order, as in `GPipeTransformerStack.splits`.
+    - stage_costs: The forward and backward cost of each stage for one
+      micro-batch.
+    - stage_memory: The memory of each stage in bytes.
+    - step_cost: The simulated cost of a step, see `SimulateGPipe`.
+    - bubble_fraction: The fraction of the time of the devices they are idle
+      in a step.
+
+  Raises:
+    ValueError: if the layers cannot be partitioned under `memory_limit`.
+  """
+  num_layers = len(layer_costs)
+  if not 0 < num_partitions <= num_layers:
+    raise ValueError('Cannot partition %d layers into %d stages.' %
+                     (num_layers, num_partitions))
+  cum_fprop = np.cumsum([0.] + [c.fprop for c in layer_costs])
+  cum_bprop = np.cumsum([0.] + [c.bprop for c in layer_costs])
+  cum_memory = np.cumsum([0] + [
+      param_copies * c.param_bytes + num_micro_batches * c.activation_bytes
+      for c in layer_costs
+  ])
+
+  def _Cost(i, j):
+    return cum_fprop[j] - cum_fprop[i] + cum_bprop[j] - cum_bprop[i]
+
+  def _Fits(i, j):
+    return memory_limit is None or cum_memory[j] - cum_memory[i] <= memory_limit
+
+  # best[k][j] is the minimal cost of the slowest stage when partitioning the
+  # first j layers into k stages, and start[k][j] the first layer of the last
+  # of these stages.
+  best = np.full([num_partitions + 1, num_layers + 1], np.inf)
+  start = np.zeros([num_partitions + 1, num_layers + 1], np.int64)
+  best[0][0] = 0.
+  for k in range(1, num_partitions + 1):
+    for j in range(k, num_layers + 1):
+      for i in range(k - 1, j):
+        if best[k - 1][i] == np.inf or not _Fits(i, j):
+          continue
+        cost = max(best[k - 1][i], _Cost(i, j))
+        if cost < best[k][j]:
+          best[k][j] = cost
+          start[k][j] = i
+  if best[num_partitions][num_layers] == np.inf:
+    raise ValueError(
+        'Cannot partition %d layers into %d stages of at most %s bytes.' %
+        (num_layers, num_partitions, memory_limit))
+
+  splits = [num_layers]
+  for k in range(num_partitions, 1, -1):
+    splits.insert(0, int(start[k][splits[0]]))
+  bounds = list(zip([0] + splits[:-1], splits))
+  stage_fprop = [cum_fprop[j] - cum_fprop[i] for i, j in bounds]
+  stage_bprop = [cum_bprop[j] - cum_bprop[i] for i, j in bounds]
+  step_cost = SimulateGPipe(stage_fprop, stage_bprop, num_micro_batches)
+  busy = num_micro_batches * (cum_fprop[-1] + cum_bprop[-1])
+  plan = py_utils.NestedMap(
+      splits=splits,
+      stage_costs=[float(_Cost(i, j)) for i, j in bounds],
+      stage_memory=[int(cum_memory[j] - cum_memory[i]) for i, j in bounds],
+      step_cost=step_cost,
+      bubble_fraction=(1. - busy / (num_partitions * step_cost)
+                       if step_cost else 0.))
+  tf.logging.info(
+      'GPipe plan: splits %s, stage costs %s, stage memory %s, '
+      'bubble fraction %.3f', plan.splits, plan.stage_costs, plan.stage_memory,
+      plan.bubble_fraction)
+  return plan
+
+
+def SplitLayers(params_list, splits):
+  """Returns a FeatureExtractionLayer params for each stage of `splits`."""
+  return [
+      gpipe.FeatureExtractionLayer.Params().Set(
+          name='d%d' % i, sub=[p.Copy() for p in params_list[begin:end]])
+      for i, (begin, end) in enumerate(zip([0] + splits[:-1], splits))
+  ]
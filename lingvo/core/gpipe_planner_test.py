@@ -0,0 +1,112 @@
+# Lint as: python3
+# Copyright 2020 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for gpipe_planner."""
+
+import lingvo.compat as tf
+from lingvo.core import gpipe
+from lingvo.core import gpipe_planner
+from lingvo.core import layers
+from lingvo.core import test_utils
+from lingvo.core import tshape
+import numpy as np
+
+
+def _Cost(fprop, activation_bytes=0, param_bytes=0):
+  return gpipe_planner.LayerCost('layer', fprop, 2. * fprop, activation_bytes,
+                                 param_bytes)
+
+
+def _FCLayers(dims):
+  return [
+      layers.FCLayer.Params().Set(
+          name='fc%d' % i, input_dim=input_dim, output_dim=output_dim)
+      for i, (input_dim, output_dim) in enumerate(zip(dims[:-1], dims[1:]))
+  ]
+
+
+class GPipePlannerTest(test_utils.TestCase):
+
+  def testPlanPartitionsBalancesCosts(self):
+    costs = [_Cost(1.)] * 4 + [_Cost(4.)] + [_Cost(1.)] * 3
+    plan = gpipe_planner.PlanPartitions(
+        costs, num_partitions=3, num_micro_batches=4)
+    self.assertEqual([4, 5, 8], plan.splits)
+    self.assertAllClose([12., 12., 9.], plan.stage_costs)
+
+  def testPlanPartitionsUnderMemoryLimit(self):
+    costs = [_Cost(4.)] + [_Cost(1., activation_bytes=10, param_bytes=1)] * 4
+    plan = gpipe_planner.PlanPartitions(
+        costs, num_partitions=2, num_micro_batches=1)
+    self.assertEqual([1, 5], plan.splits)
+    self.assertEqual([0, 56], plan.stage_memory)
+    # The activations of both micro-batches are kept.
+    plan = gpipe_planner.PlanPartitions(
+        costs,
+        num_partitions=2,
+        num_micro_batches=2,
+        memory_limit=70,
+        param_copies=1)
+    self.assertEqual([2, 5], plan.splits)
+    self.assertEqual([21, 63], plan.stage_memory)
+    with self.assertRaisesRegex(ValueError, 'at most 20 bytes'):
+      gpipe_planner.PlanPartitions(
+          costs, num_partitions=2, num_micro_batches=1, memory_limit=20)
+
+  def testBubbleFractionOfBalancedStages(self):
+    plan = gpipe_planner.PlanPartitions([_Cost(1.)] * 8,
+                                        num_partitions=4,
+                                        num_micro_batches=8)
+    self.assertEqual([2, 4, 6, 8], plan.splits)
+    # (num_partitions - 1) / (num_micro_batches + num_partitions - 1).
+    self.assertAllClose(3. / 11., plan.bubble_fraction)
+    self.assertAllClose(11. * 6., plan.step_cost)
+
+  def testEstimateLayerCosts(self):
+    params_list = _FCLayers([8, 16, 16, 4])
+    costs = gpipe_planner.EstimateLayerCosts(params_list, tshape.Shape([2, 8]))
+    self.assertEqual(['fc0', 'fc1', 'fc2'], [c.name for c in costs])
+    self.assertEqual([(8 * 16 + 16) * 4, (16 * 16 + 16) * 4, (16 * 4 + 4) * 4],
+                     [c.param_bytes for c in costs])
+    self.assertEqual([2 * 16 * 4, 2 * 16 * 4, 2 * 4 * 4],
+                     [c.activation_bytes for c in costs])
+    meta = params_list[0].cls.FPropMeta(params_list[0], tshape.Shape([2, 8]))
+    self.assertEqual(meta.flops, costs[0].fprop)
+    self.assertEqual(2. * meta.flops, costs[0].bprop)
+
+  def testProfileLayerCosts(self):
+    params_list = _FCLayers([8, 16, 16, 4])
+    costs = gpipe_planner.ProfileLayerCosts(
+        params_list, np.random.uniform(size=[2, 8]).astype(np.float32),
+        num_iters=2)
+    estimates = gpipe_planner.EstimateLayerCosts(params_list,
+                                                 tshape.Shape([2, 8]))
+    for cost, estimate in zip(costs, estimates):
+      self.assertEqual(estimate.name, cost.name)
+      self.assertEqual(estimate.activation_bytes, cost.activation_bytes)
+      self.assertEqual(estimate.param_bytes, cost.param_bytes)
+      self.assertGreater(cost.fprop, 0.)
+    plan = gpipe_planner.PlanPartitions(
+        costs, num_partitions=2, num_micro_batches=4)
+    seqs = gpipe_planner.SplitLayers(params_list, plan.splits)
+    self.assertLen(seqs, 2)
+    self.assertEqual(['fc0', 'fc1', 'fc2'],
+                     [p.name for seq in seqs for p in seq.sub])
+    self.assertTrue(
+        all(seq.cls == gpipe.FeatureExtractionLayer for seq in seqs))
+
+
+if __name__ == '__main__':
+  tf.test.main()
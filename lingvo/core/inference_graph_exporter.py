@@ -19,13 +19,20 @@ import collections
 import contextlib
 import re
 import lingvo.compat as tf
+from lingvo.core import attention
 from lingvo.core import base_model
+from lingvo.core import batch_major_attention
 from lingvo.core import bfloat16_variables
 from lingvo.core import inference_graph_pb2
+from lingvo.core import layers
 from lingvo.core import py_utils
+import numpy as np
 import six
 
 from google.protobuf import text_format
+from tensorflow.core.protobuf import meta_graph_pb2
+from tensorflow.core.protobuf import rewriter_config_pb2
+from tensorflow.python.grappler import tf_optimizer  # pylint: disable=g-direct-tensorflow-import
 
 FLAGS = tf.flags.FLAGS
 
@@ -286,6 +293,244 @@ def _FreezeDefaults(graph, output_op_names):
                                                         output_op_names)
 
 
+# Ops used to initialize and restore inference graphs, kept by
+# OptimizeInferenceGraph() when present.
+_SERVING_OPS = [
+    'init_all_tables', 'init_all_variables', 'tpu_init_op',
+    'save/control_dependency', 'save/restore_all'
+]
+
+# Ops that hold variables, whose presence means that a graph is not frozen.
+_VARIABLE_OPS = frozenset(
+    ['Variable', 'VariableV2', 'VarHandleOp', 'AutoReloadVariable'])
+
+
+def _StripAsserts(graph_def):
+  """Returns a copy of graph_def without Assert ops and control edges to them."""
+  assert_names = set(node.name for node in graph_def.node if node.op == 'Assert')
+  stripped = tf.GraphDef()
+  stripped.CopyFrom(graph_def)
+  if not assert_names:
+    return stripped
+  del stripped.node[:]
+  for node in graph_def.node:
+    if node.name in assert_names:
+      continue
+    new_node = stripped.node.add()
+    new_node.CopyFrom(node)
+    del new_node.input[:]
+    new_node.input.extend([
+        i for i in node.input
+        if not (i.startswith('^') and i[1:] in assert_names)
+    ])
+  tf.logging.info('Stripped %d Assert ops.', len(assert_names))
+  return stripped
+
+
+def _FoldConstants(graph_def, output_op_names):
+  """Folds the parts of graph_def that only depend on constants.
+
+  Args:
+    graph_def: A tf.GraphDef.
+    output_op_names: Names of the ops to preserve.
+
+  Returns:
+    The optimized tf.GraphDef.
+  """
+  graph = tf.Graph()
+  with graph.as_default():
+    tf.import_graph_def(graph_def, name='')
+  meta_graph = tf.train.export_meta_graph(graph_def=graph_def, graph=graph)
+  # Grappler preserves the nodes in the 'train_op' collection.
+  fetch_collection = meta_graph_pb2.CollectionDef()
+  fetch_collection.node_list.value.extend(output_op_names)
+  meta_graph.collection_def['train_op'].CopyFrom(fetch_collection)
+
+  config = tf.config_pb2.ConfigProto()
+  rewrite_options = config.graph_options.rewrite_options
+  rewrite_options.optimizers.append('constfold')
+  rewrite_options.meta_optimizer_iterations = (
+      rewriter_config_pb2.RewriterConfig.ONE)
+  return tf_optimizer.OptimizeGraph(config, meta_graph)
+
+
+# Suffixes of the nodes that QuantizeWeightsToInt8() adds for each weight.
+_INT8_SUFFIX = '/int8'
+_INT8_SCALE_SUFFIX = '/int8_scale'
+_INT8_CAST_SUFFIX = '/int8_cast'
+
+
+def _Int8WeightAxes(layer):
+  """Returns {var name: reduction axes} of the layer's int8 quantized weights.
+
+  Each weight gets one scale per slice along the axes that are not reduced,
+  i.e. per output channel of a projection, or per row of an embedding.
+
+  Args:
+    layer: A BaseLayer.
+
+  Returns:
+    A dict from the names of the layer's own variables to the axes over which
+    their scales are computed.
+  """
+  if isinstance(layer, layers.ProjectionLayer):
+    # This includes the projections of FeedForwardNet.
+    return {'w': (0,)}
+  if isinstance(layer, layers.SimpleEmbeddingLayer):
+    return {'wm': (1,)}
+  if isinstance(layer, attention.MultiHeadedAttention):
+    return {
+        name: (0,) for name in ('source_proj', 'query_proj', 'ctx_proj',
+                                'ctx_post_proj') if name in layer.vars
+    }
+  if isinstance(layer, batch_major_attention.MultiHeadedProjectionLayer):
+    # [input_dim, num_heads, dim_per_head]
+    return {'w': (1, 2) if layer.params.is_output_projection else (0,)}
+  return {}
+
+
+def Int8QuantizableWeights(layer):
+  """Returns the weights under layer that support int8 quantization.
+
+  Args:
+    layer: A BaseLayer, typically a task.
+
+  Returns:
+    A dict from variable names, which are the names of the Const nodes of the
+    frozen graph, to the reduction axes for QuantizeWeightsToInt8().
+  """
+  weights = {}
+  for name, axes in _Int8WeightAxes(layer).items():
+    weights[_GetVarName(layer.vars[name])] = axes
+  for child in layer.children.Flatten():
+    weights.update(Int8QuantizableWeights(child))
+  return weights
+
+
+def QuantizeWeightsToInt8(graph_def, weights):
+  """Returns a copy of a frozen graph_def storing weights in int8.
+
+  Each float32 Const node `w` in `weights` is replaced by the int8 Const
+  `w/int8` and the float32 Const `w/int8_scale`, which hold the symmetric
+  quantization of `w` with one scale per slice, and by ops computing
+  `w = float(w/int8) * w/int8_scale`.
+
+  This is storage-only quantization: there is no int8 arithmetic. The weights
+  are dequantized to float32 on every run and all matmuls and lookups stay in
+  float32, so that the graph runs on any device. The graph is 4x smaller and
+  loads faster, but does not run faster: each run also pays for the Cast and
+  the Mul of every dequantized weight. quant_calibration.CompareInferenceGraphs
+  measures the error and the latency against the float export.
+
+  Args:
+    graph_def: A frozen tf.GraphDef.
+    weights: A dict from Const node names to the reduction axes of their
+      scales, e.g. from Int8QuantizableWeights().
+
+  Returns:
+    The quantized tf.GraphDef.
+  """
+  quantized = tf.GraphDef()
+  quantized.CopyFrom(graph_def)
+  del quantized.node[:]
+  float_bytes = 0
+  for node in graph_def.node:
+    if (node.name not in weights or node.op != 'Const' or
+        node.attr['dtype'].type != tf.float32.as_datatype_enum):
+      quantized.node.add().CopyFrom(node)
+      continue
+    w = tf.make_ndarray(node.attr['value'].tensor)
+    float_bytes += w.nbytes
+    scale = np.max(np.abs(w), axis=weights[node.name], keepdims=True) / 127.
+    scale = np.where(scale > 0., scale, 1.).astype(np.float32)
+    w_int8 = np.clip(np.round(w / scale), -127, 127).astype(np.int8)
+
+    for suffix, value in ((_INT8_SUFFIX, w_int8), (_INT8_SCALE_SUFFIX, scale)):
+      const = quantized.node.add()
+      const.name = node.name + suffix
+      const.op = 'Const'
+      const.device = node.device
+      const.attr['dtype'].type = tf.as_dtype(value.dtype).as_datatype_enum
+      const.attr['value'].tensor.CopyFrom(tf.make_tensor_proto(value))
+    cast = quantized.node.add()
+    cast.name = node.name + _INT8_CAST_SUFFIX
+    cast.op = 'Cast'
+    cast.device = node.device
+    cast.input.append(node.name + _INT8_SUFFIX)
+    cast.attr['SrcT'].type = tf.int8.as_datatype_enum
+    cast.attr['DstT'].type = tf.float32.as_datatype_enum
+    cast.attr['Truncate'].b = False
+    # Keeps the name of the weight, so that its consumers are unchanged.
+    dequantized = quantized.node.add()
+    dequantized.name = node.name
+    dequantized.op = 'Mul'
+    dequantized.device = node.device
+    dequantized.input.extend(
+        [node.name + _INT8_CAST_SUFFIX, node.name + _INT8_SCALE_SUFFIX])
+    dequantized.attr['T'].type = tf.float32.as_datatype_enum
+  tf.logging.info('Quantized %d bytes of float weights to int8.', float_bytes)
+  return quantized
+
+
+def _Int8DequantizationOps(graph_def):
+  """Returns the names of the ops dequantizing QuantizeWeightsToInt8() weights.
+
+  These must not be constant folded, or the weights are stored in float again.
+
+  Args:
+    graph_def: A tf.GraphDef.
+
+  Returns:
+    A sorted list of op names.
+  """
+  node_names = set(node.name for node in graph_def.node)
+  op_names = []
+  for name in node_names:
+    if name + _INT8_CAST_SUFFIX in node_names:
+      op_names.extend([name, name + _INT8_CAST_SUFFIX])
+  return sorted(op_names)
+
+
+def OptimizeInferenceGraph(inference_graph_proto):
+  """Returns a copy of an InferenceGraph optimized for loading and serving.
+
+  The optimizations are:
+
+  - Assert ops are stripped.
+  - Nodes that no subgraph needs are pruned. The ops that initialize and
+    restore the graph are kept.
+  - If the graph is frozen, the computations that only depend on constants,
+    e.g. casts or transposes of the frozen weights, are folded. Weights
+    quantized by QuantizeWeightsToInt8() are kept in int8.
+
+  Args:
+    inference_graph_proto: an InferenceGraph proto.
+
+  Returns:
+    The optimized InferenceGraph proto.
+  """
+  optimized = inference_graph_pb2.InferenceGraph()
+  optimized.CopyFrom(inference_graph_proto)
+  graph_def = _StripAsserts(inference_graph_proto.graph_def)
+
+  graph = tf.Graph()
+  with graph.as_default():
+    tf.import_graph_def(graph_def, name='')
+  output_op_names = GetOutputOpNames(
+      graph, optimized, preserve_extra_ops=_SERVING_OPS)
+  graph_def = tf.graph_util.extract_sub_graph(graph_def, output_op_names)
+
+  if not any(node.op in _VARIABLE_OPS for node in graph_def.node):
+    graph_def = _FoldConstants(
+        graph_def, output_op_names + _Int8DequantizationOps(graph_def))
+
+  tf.logging.info('Optimized inference graph from %d to %d nodes.',
+                  len(inference_graph_proto.graph_def.node),
+                  len(graph_def.node))
+  optimized.graph_def.CopyFrom(graph_def)
+  return optimized
+
+
 class InferenceGraphExporter:
   """Class for exporting inference graphs."""
 
@@ -302,9 +547,11 @@ class InferenceGraphExporter:
              freeze_checkpoint=None,
              freeze_defaults=False,
              export_path=None,
+             export_binary_path=None,
              subgraph_filter=None,
              random_seed=None,
-             disable_packed_input=True):
+             disable_packed_input=True,
+             int8_weights=False):
     """Exports a InferenceGraph proto with piecewise subgraphs.
 
     Sets FLAGS.enable_asserts to False unless user explicitly sets it to True.
@@ -320,10 +567,18 @@ class InferenceGraphExporter:
       freeze_defaults: Default initializes the graph and freeze. Useful for
         early testing of downstream tools without having a checkpoint.
       export_path: If not None, write the inference graph in ASCII to this path.
+      export_binary_path: If not None, write the inference graph optimized by
+        OptimizeInferenceGraph() in binary to this path. Predictor loads this
+        faster than the ASCII one, and prefers it when it is next to it.
       subgraph_filter: A list of subgraph names. If not None or empty, export
         only this list of inference subgraphs.
       random_seed: Fixes the random seed in the exported inference graph.
       disable_packed_input: Disable packed input for inference writing purposes.
+      int8_weights: If True, stores the weights of projections, attention
+        projections and embeddings in int8 with float scales, see
+        QuantizeWeightsToInt8(). This only shrinks the stored graph, the
+        weights are dequantized and the computation stays in float. Requires
+        freeze_checkpoint or freeze_defaults.
 
     Returns:
       InferenceGraph proto.
@@ -332,6 +587,8 @@ class InferenceGraphExporter:
       ValueError: if the model does not support the listed subgraphs.
     """
     assert issubclass(model_cfg.cls, base_model.BaseModel)
+    if int8_weights and not (freeze_checkpoint or freeze_defaults):
+      raise ValueError('int8_weights requires a frozen graph.')
 
     # Disable assertions unless user explicitly enables it.
     if FLAGS['enable_asserts'].using_default_value:
@@ -412,6 +669,8 @@ class InferenceGraphExporter:
             saver_var_spec = variables_to_restore
 
           saver = tf.train.Saver(saver_var_spec)
+          if int8_weights:
+            int8_quantizable_weights = Int8QuantizableWeights(task)
           tf.variables_initializer(
               tf.global_variables(), name='init_all_variables')
           if IsTpu(device_options) and device_options.gen_init_op:
@@ -454,6 +713,8 @@ class InferenceGraphExporter:
       elif freeze_defaults:
         tf.logging.info('Default initializing graph and freezing.')
         graph_def = _FreezeDefaults(graph, output_op_names)
+      if int8_weights:
+        graph_def = QuantizeWeightsToInt8(graph_def, int8_quantizable_weights)
     else:
       output_op_names = GetOutputOpNames(graph, inference_graph_proto)
 
@@ -484,6 +745,10 @@ class InferenceGraphExporter:
     if export_path:
       with tf.io.gfile.GFile(export_path, 'w') as f:
         f.write(text_format.MessageToString(inference_graph_proto))
+    if export_binary_path:
+      optimized_proto = OptimizeInferenceGraph(inference_graph_proto)
+      with tf.io.gfile.GFile(export_binary_path, 'wb') as f:
+        f.write(optimized_proto.SerializeToString())
     return inference_graph_proto
 
   @classmethod
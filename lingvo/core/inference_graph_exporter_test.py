@@ -15,6 +15,8 @@
 # ==============================================================================
 """Tests for inference_graph_exporter."""
 
+import os
+
 from lingvo import model_registry
 import lingvo.compat as tf
 from lingvo.core import base_input_generator
@@ -277,6 +279,43 @@ class InferenceGraphExporterLinearModelTest(test_utils.TestCase):
     with tf.Graph().as_default():
       tf.import_graph_def(inference_graph.graph_def)
 
+  def testExportBinaryOptimized(self):
+    """Test exporting an optimized binary graph next to the text one."""
+    params = model_registry.GetParams('test.LinearModelParams', 'Test')
+    export_dir = self.get_temp_dir()
+    text_path = os.path.join(export_dir, 'inference.pbtxt')
+    binary_path = os.path.join(export_dir, 'inference.pb')
+    inference_graph = inference_graph_exporter.InferenceGraphExporter.Export(
+        params,
+        freeze_defaults=True,
+        export_path=text_path,
+        export_binary_path=binary_path,
+        subgraph_filter=['default'],
+        random_seed=1234)
+
+    binary_graph = predictor.LoadInferenceGraph(binary_path)
+    self.assertEqual(inference_graph.subgraphs, binary_graph.subgraphs)
+    self.assertLess(
+        len(binary_graph.graph_def.node), len(inference_graph.graph_def.node))
+    self.assertNotIn('Assert', [n.op for n in binary_graph.graph_def.node])
+    text_pred = predictor.Predictor(
+        predictor.LoadInferenceGraph(text_path, prefer_binary=False))
+    binary_pred = predictor.Predictor(binary_graph)
+    self.assertAllClose(
+        text_pred.Run(['output'], input=3), binary_pred.Run(['output'],
+                                                            input=3))
+
+  def testOptimizeInferenceGraphKeepsRestoreOps(self):
+    params = model_registry.GetParams('test.LinearModelParams', 'Test')
+    inference_graph = inference_graph_exporter.InferenceGraphExporter.Export(
+        params, subgraph_filter=['default'])
+    optimized = inference_graph_exporter.OptimizeInferenceGraph(inference_graph)
+    node_names = [n.name for n in optimized.graph_def.node]
+    for op_name in ['init_all_tables', 'init_all_variables', 'save/restore_all']:
+      self.assertIn(op_name, node_names)
+    # The graph is not frozen, so the weights stay variables.
+    self.assertIn('VarHandleOp', [n.op for n in optimized.graph_def.node])
+
   def testTpuBfloat16OverrideExport(self):
     """Test that we can export with tf.bfloat16 dtype."""
     params = model_registry.GetParams('test.LinearModelTpuParams', 'Test')
@@ -3020,8 +3020,10 @@ class SoftmaxLayer(quant_utils.QuantizableLayer):
                               class_probabilities)
 
     # Reshapes xent_loss fields according to the inputs' shape.
-    xent_loss.logits = tf.reshape(
-        xent_loss.logits, tf.concat([[-1], shape_mid, [p.num_classes]], axis=0))
+    if 'logits' in xent_loss:
+      xent_loss.logits = tf.reshape(
+          xent_loss.logits, tf.concat([[-1], shape_mid, [p.num_classes]],
+                                      axis=0))
     per_example_shape = tf.concat([[-1], shape_mid], axis=0)
     xent_loss.per_example_argmax = tf.reshape(xent_loss.per_example_argmax,
                                               per_example_shape)
@@ -3585,6 +3587,301 @@ class SingleShardFullSoftmax(SoftmaxLayer):
     return output_nmap
 
 
+def AdaptiveSoftmaxCutoffs(class_counts, coverages=(0.8, 0.9, 0.95)):
+  """Computes AdaptiveSoftmax.cutoffs from per-class counts.
+
+  Class ids are expected to be sorted by decreasing frequency, as in the
+  vocabularies generated by lingvo/tasks/lm/tools:download_lm1b. Each cluster
+  then covers a contiguous id range.
+
+  Args:
+    class_counts: A 1-D sequence with the training count of each class id.
+    coverages: An increasing sequence of fractions of the total count. The head
+      cluster is the smallest id prefix that covers coverages[0] of the counts,
+      the i-th tail cluster extends it to cover coverages[i + 1], and the last
+      tail cluster holds the remaining classes.
+
+  Returns:
+    A list of strictly increasing cutoffs whose last element is
+    len(class_counts).
+  """
+  counts = np.asarray(class_counts, dtype=np.float64)
+  num_classes = counts.shape[0]
+  cumulative = np.cumsum(counts) / max(counts.sum(), 1.0)
+  cutoffs = []
+  for coverage in coverages:
+    cutoff = int(np.searchsorted(cumulative, coverage, side='left')) + 1
+    if cutoff >= num_classes:
+      break
+    if not cutoffs or cutoff > cutoffs[-1]:
+      cutoffs.append(cutoff)
+  return cutoffs + [num_classes]
+
+
+class AdaptiveSoftmax(SoftmaxLayer):
+  """Adaptive softmax, https://arxiv.org/abs/1609.04309.
+
+  Classes are split by p.cutoffs into a head cluster [0, cutoffs[0]) and tail
+  clusters [cutoffs[i], cutoffs[i + 1]). The head softmax predicts the head
+  classes plus one class per tail cluster; the softmax of a tail cluster, on a
+  down-projected input, predicts the classes within the cluster. Log-probs are
+  exact: log p(y) = log p_head(cluster(y)) + log p_tail(y).
+
+  FProp with class_ids only evaluates a tail cluster for the rows whose target
+  is in it (all rows on TPU, to keep shapes static), and never materializes
+  [batch, num_classes] logits. Logits() returns the full log-probs for callers
+  that need the whole distribution, and TopK() finds the exact top-k classes
+  while only expanding the tail clusters that can contain one of them.
+  """
+
+  @classmethod
+  def Params(cls):
+    """Params for AdaptiveSoftmax."""
+    p = super().Params()
+    p.Define(
+        'cutoffs', [], 'Exclusive upper bounds of the class ids of the head '
+        'and each tail cluster; the last one must be num_classes. See '
+        'AdaptiveSoftmaxCutoffs().')
+    p.Define(
+        'tail_dim_factor', 4, 'The input of the i-th tail cluster is '
+        'projected to input_dim // tail_dim_factor**(i + 1) dims.')
+    return p
+
+  def __init__(self, params):
+    """Constructs an AdaptiveSoftmax layer."""
+    super().__init__(params)
+    p = self.params
+    assert p.name
+    if not p.cutoffs or p.cutoffs[-1] != p.num_classes:
+      raise ValueError('cutoffs must end with num_classes: %s vs %d' %
+                       (p.cutoffs, p.num_classes))
+    if any(a >= b for a, b in zip(p.cutoffs[:-1], p.cutoffs[1:])):
+      raise ValueError('cutoffs must be strictly increasing: %s' % p.cutoffs)
+    if p.chunk_size:
+      raise ValueError('AdaptiveSoftmax does not support chunk_size.')
+
+  @property
+  def _num_tails(self):
+    return len(self.params.cutoffs) - 1
+
+  def _TailDim(self, i):
+    p = self.params
+    return max(1, p.input_dim // p.tail_dim_factor**(i + 1))
+
+  def _CreateLayerVariables(self):
+    super()._CreateLayerVariables()
+    p = self.params
+    collections = [self.__class__.__name__ + '_vars']
+
+    def _Create(name, shape, init):
+      pc = py_utils.WeightParams(
+          shape=shape, init=init, dtype=p.dtype, collections=collections)
+      self.CreateVariable(name, pc, self.AddGlobalVN)
+
+    zeros = py_utils.WeightInit.Constant(0.0)
+    head_size = p.cutoffs[0] + self._num_tails
+    _Create('head_weight', [p.input_dim, head_size], p.params_init)
+    _Create('head_bias', [head_size], zeros)
+    for i in range(self._num_tails):
+      tail_size = p.cutoffs[i + 1] - p.cutoffs[i]
+      _Create('tail_proj_%d' % i, [p.input_dim, self._TailDim(i)],
+              p.params_init)
+      _Create('tail_weight_%d' % i, [self._TailDim(i), tail_size],
+              p.params_init)
+      _Create('tail_bias_%d' % i, [tail_size], zeros)
+
+  def _ClipLogits(self, logits):
+    p = self.params
+    abs_max = p.logits_abs_max
+    if abs_max is not None and not p.is_inference:
+      abs_min = -abs_max  # pylint: disable=invalid-unary-operand-type
+      logits = py_utils.clip_by_value(logits, abs_min, abs_max)
+    return logits
+
+  def _HeadLogProbs(self, theta, inputs):
+    """Returns [N, cutoffs[0] + num_tails] head log-probs."""
+    logits = tf.nn.bias_add(
+        py_utils.Matmul(inputs, theta.head_weight), theta.head_bias)
+    return tf.nn.log_softmax(self._ClipLogits(logits))
+
+  def _TailLogProbs(self, theta, i, inputs):
+    """Returns [N, cluster size] log-probs within the i-th tail cluster."""
+    proj = py_utils.Matmul(inputs, theta['tail_proj_%d' % i])
+    logits = tf.nn.bias_add(
+        py_utils.Matmul(proj, theta['tail_weight_%d' % i]),
+        theta['tail_bias_%d' % i])
+    return tf.nn.log_softmax(self._ClipLogits(logits))
+
+  def _ApplyToRows(self, fn, rows_mask, default_values, *row_inputs):
+    """Computes fn(*row_inputs) only for the rows where rows_mask is True.
+
+    Args:
+      fn: A callable mapping tensors of shape [M, ...] to a list of [M, K]
+        tensors.
+      rows_mask: [N] bool.
+      default_values: A list with the value of each output of fn in the rows
+        where rows_mask is False.
+      *row_inputs: Tensors of shape [N, ...].
+
+    Returns:
+      A list of [N, K] tensors.
+    """
+    if py_utils.use_tpu():
+      # Keeps shapes static on TPU.
+      rows_outputs = fn(*row_inputs)
+    else:
+      rows = tf.where(rows_mask)
+      rows_outputs = fn(*[tf.gather_nd(x, rows) for x in row_inputs])
+    outputs = []
+    for x, default_value in zip(rows_outputs, default_values):
+      if not py_utils.use_tpu():
+        shape = tf.concat([tf.shape(rows_mask), tf.shape(x)[1:]], axis=0)
+        x = tf.scatter_nd(rows, x, tf.cast(shape, rows.dtype))
+      outputs.append(
+          tf.where(rows_mask, x,
+                   tf.fill(tf.shape(x), tf.cast(default_value, x.dtype))))
+    return outputs
+
+  def Logits(self, theta, inputs):
+    """Returns the log-probs of all classes.
+
+    The log-probs are valid logits, i.e. softmax(Logits()) == probs. This
+    evaluates every tail cluster; prefer FProp() or TopK() when possible.
+
+    Args:
+      theta: A `.NestedMap` object containing weights' values of this layer and
+        its children layers.
+      inputs: a list of a single tensor, or a single tensor with the shape [N,
+        input_dim].
+
+    Returns:
+      logits [batch, num_classes]
+    """
+    p = self.params
+    if isinstance(inputs, list):
+      assert len(inputs) == 1
+      inputs = inputs[0]
+    head = self._HeadLogProbs(theta, inputs)
+    log_probs = [head[:, :p.cutoffs[0]]]
+    for i in range(self._num_tails):
+      cluster = head[:, p.cutoffs[0] + i:p.cutoffs[0] + i + 1]
+      log_probs.append(cluster + self._TailLogProbs(theta, i, inputs))
+    return tf.concat(log_probs, axis=1)
+
+  def LogProbs(self, theta, inputs, class_ids):
+    """Returns the exact log-prob of class_ids.
+
+    Args:
+      theta: A `.NestedMap` object containing weights' values of this layer and
+        its children layers.
+      inputs: [N, input_dim].
+      class_ids: [N] or [N, 1] int class ids.
+
+    Returns:
+      [N] log p(class_ids | inputs).
+    """
+    p = self.params
+    class_ids = tf.cast(tf.reshape(class_ids, [-1]), tf.int32)
+    head_size = p.cutoffs[0]
+    head = self._HeadLogProbs(theta, inputs)
+    # 0 for the head cluster, i + 1 for the i-th tail cluster.
+    cluster = tf.add_n([tf.zeros_like(class_ids)] + [
+        tf.cast(class_ids >= cutoff, tf.int32) for cutoff in p.cutoffs[:-1]
+    ])
+    head_ids = tf.where(cluster > 0, head_size + cluster - 1, class_ids)
+    log_probs = tf.gather(head, head_ids[:, tf.newaxis], batch_dims=1)[:, 0]
+    for i in range(self._num_tails):
+      in_tail = tf.equal(cluster, i + 1)
+      tail_ids = tf.clip_by_value(class_ids - p.cutoffs[i], 0,
+                                  p.cutoffs[i + 1] - p.cutoffs[i] - 1)
+
+      def _TailLogProb(x, ids, i=i):
+        tail = self._TailLogProbs(theta, i, x)
+        return [tf.gather(tail, ids[:, tf.newaxis], batch_dims=1)[:, 0]]
+
+      log_probs += self._ApplyToRows(_TailLogProb, in_tail, [0.0], inputs,
+                                     tail_ids)[0]
+    return log_probs
+
+  def TopK(self, theta, inputs, k):
+    """Returns the exact top-k classes.
+
+    A tail class can not be more likely than its cluster, so a tail cluster is
+    only evaluated for the rows where the cluster is more likely than the k-th
+    best head class.
+
+    Args:
+      theta: A `.NestedMap` object containing weights' values of this layer and
+        its children layers.
+      inputs: [N, input_dim].
+      k: The number of classes to return. Must be <= cutoffs[0].
+
+    Returns:
+      (log_probs, class_ids), both of shape [N, k], sorted by decreasing
+      log-prob.
+    """
+    p = self.params
+    head_size = p.cutoffs[0]
+    assert k <= head_size, (k, head_size)
+    head = self._HeadLogProbs(theta, inputs)
+    values, ids = tf.math.top_k(head[:, :head_size], k)
+    all_values, all_ids = [values], [ids]
+    for i in range(self._num_tails):
+      cluster = head[:, head_size + i:head_size + i + 1]
+      expand = cluster[:, 0] > values[:, k - 1]
+      tail_k = min(k, p.cutoffs[i + 1] - p.cutoffs[i])
+
+      def _TailTopK(x, cluster, i=i, tail_k=tail_k):
+        tail_values, tail_ids = tf.math.top_k(
+            self._TailLogProbs(theta, i, x), tail_k)
+        return [cluster + tail_values, tail_ids]
+
+      tail_values, tail_ids = self._ApplyToRows(_TailTopK, expand,
+                                                [head.dtype.min, 0], inputs,
+                                                cluster)
+      all_values.append(tail_values)
+      all_ids.append(tail_ids + p.cutoffs[i])
+    values, indices = tf.math.top_k(tf.concat(all_values, axis=1), k)
+    ids = tf.gather(tf.concat(all_ids, axis=1), indices, batch_dims=1)
+    return values, ids
+
+  def _FProp2D(self,
+               theta,
+               inputs,
+               class_weights,
+               class_ids=None,
+               class_probabilities=None):
+    """Computes xent loss and argmax."""
+    p = self.params
+    if isinstance(inputs, list):
+      assert len(inputs) == 1
+      inputs = inputs[0]
+    xent_loss = py_utils.NestedMap()
+    if class_probabilities is not None:
+      logits = self.Logits(theta, inputs)
+      per_example_xent = -tf.reduce_sum(class_probabilities * logits, -1)
+      per_example_argmax = py_utils.ArgMax(logits)
+      xent_loss.logits = logits
+      xent_loss.log_probs = logits
+    else:
+      per_example_xent = -self.LogProbs(theta, inputs, class_ids)
+      _, top1 = self.TopK(theta, tf.stop_gradient(inputs), 1)
+      per_example_argmax = tf.stop_gradient(top1[:, 0])
+
+    label_weights = tf.reshape(
+        tf.cast(class_weights, py_utils.FPropDtype(p)), [-1])
+    total_xent = tf.reduce_sum(per_example_xent * label_weights)
+    total_weights = tf.reduce_sum(label_weights)
+    xent_loss.update(
+        per_example_argmax=per_example_argmax,
+        per_example_xent=per_example_xent,
+        per_example_weight=label_weights,
+        total_xent=total_xent,
+        total_weight=total_weights,
+        avg_xent=total_xent / total_weights)
+    return xent_loss
+
+
 class ConvSoftmax(quant_utils.QuantizableLayer):
   """A softmax implementation based on 1x1 convolution.
 
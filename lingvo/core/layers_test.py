@@ -3702,6 +3702,97 @@ class SharedSoftmaxLayerTest(SoftmaxLayerTest):
     self._testSharedSoftmaxLayerEmbLookup(True)
 
 
+class AdaptiveSoftmaxTest(test_utils.TestCase):
+
+  def _Softmax(self, cutoffs=(4, 12, 32)):
+    p = layers.AdaptiveSoftmax.Params().Set(
+        name='softmax',
+        input_dim=16,
+        num_classes=32,
+        cutoffs=list(cutoffs),
+        params_init=py_utils.WeightInit.Gaussian(0.5, 123456))
+    p.vn.global_vn = False
+    return p.Instantiate()
+
+  def _Inputs(self):
+    np.random.seed(12345)
+    return tf.constant(3.0 * np.random.normal(size=[20, 16]), tf.float32)
+
+  def testCutoffs(self):
+    counts = [50, 20, 10, 10, 5, 3, 1, 1]
+    self.assertEqual([2, 4, 5, 8],
+                     layers.AdaptiveSoftmaxCutoffs(counts, (0.7, 0.9, 0.95)))
+    # Coverages that fall into the same cluster are merged.
+    self.assertEqual([1, 8], layers.AdaptiveSoftmaxCutoffs(counts, (0.3, 0.4)))
+
+  def testInvalidCutoffs(self):
+    with self.assertRaises(ValueError):
+      self._Softmax(cutoffs=(4, 12))
+    with self.assertRaises(ValueError):
+      self._Softmax(cutoffs=(12, 4, 32))
+
+  def testLogitsAreNormalizedLogProbs(self):
+    with self.session(use_gpu=False):
+      softmax = self._Softmax()
+      logits = softmax.Logits(softmax.theta, self._Inputs())
+      self.evaluate(tf.global_variables_initializer())
+      logits = self.evaluate(logits)
+    self.assertEqual((20, 32), logits.shape)
+    self.assertAllClose(np.ones([20]), np.sum(np.exp(logits), axis=-1))
+
+  def testFPropMatchesLogits(self):
+    with self.session(use_gpu=False):
+      softmax = self._Softmax()
+      inputs = self._Inputs()
+      class_ids = tf.constant(np.arange(20)[:, np.newaxis] * 3 % 32, tf.int32)
+      class_weights = tf.ones([20])
+      xent = softmax.FProp(
+          softmax.theta, [inputs], class_weights, class_ids=class_ids)
+      logits = softmax.Logits(softmax.theta, inputs)
+      grads = tf.gradients(xent.avg_xent, softmax.vars.Flatten())
+      self.evaluate(tf.global_variables_initializer())
+      xent, logits, class_ids, grads = self.evaluate(
+          [xent, logits, class_ids, grads])
+    self.assertNotIn('logits', xent)
+    self.assertAllClose(
+        -np.take_along_axis(logits, class_ids, axis=1)[:, 0],
+        xent.per_example_xent)
+    self.assertAllEqual(np.argmax(logits, axis=-1), xent.per_example_argmax)
+    for g in grads:
+      self.assertTrue(np.all(np.isfinite(g)))
+      self.assertGreater(np.sum(np.abs(g)), 0.0)
+
+  def testFPropDistributions(self):
+    with self.session(use_gpu=False):
+      softmax = self._Softmax()
+      inputs = self._Inputs()
+      np.random.seed(123)
+      class_probabilities = np.random.uniform(size=[20, 32])
+      class_probabilities /= np.sum(class_probabilities, -1, keepdims=True)
+      xent = softmax.FProp(
+          softmax.theta, [inputs],
+          tf.ones([20]),
+          class_probabilities=tf.constant(class_probabilities, tf.float32))
+      self.evaluate(tf.global_variables_initializer())
+      xent = self.evaluate(xent)
+    self.assertAllClose(-np.sum(class_probabilities * xent.logits, -1),
+                        xent.per_example_xent)
+
+  def testTopK(self):
+    with self.session(use_gpu=False):
+      softmax = self._Softmax()
+      inputs = self._Inputs()
+      values, ids = softmax.TopK(softmax.theta, inputs, 3)
+      logits = softmax.Logits(softmax.theta, inputs)
+      self.evaluate(tf.global_variables_initializer())
+      values, ids, logits = self.evaluate([values, ids, logits])
+    expected_ids = np.argsort(-logits, axis=-1)[:, :3]
+    self.assertAllEqual(expected_ids, ids)
+    self.assertAllClose(np.take_along_axis(logits, expected_ids, axis=1), values)
+    # Some of the top classes come from the tail clusters.
+    self.assertGreater(np.sum(ids >= 4), 0)
+
+
 class FeedForwardNetTest(test_utils.TestCase):
 
   def testFeedForwardNetConstruction(self):
@@ -590,7 +590,8 @@ class GPipeTransformerStack(PipeliningLayer):
     p.Define(
         'splits', 1,
         'Number of splits, or list of integers specifying the ending index for '
-        'each split in ascending order. Last index should be num_layers.')
+        'each split in ascending order. Last index should be num_layers. '
+        'gpipe_planner.PlanPartitions can choose them from layer costs.')
 
     # Transformer related
     p.Define('model_dim', 1024, 'Characteristic depth (dimension).')
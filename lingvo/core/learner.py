@@ -94,6 +94,21 @@ class Learner(base_layer.BaseLayer):
         '"weight": skip if the individual weight gradients are almost zero.')
     p.Define('scale_gradients', True,
              'Whether to apply gradients adjustment and scaling.')
+    p.Define(
+        'deduplicate_sparse_gradients', False,
+        'If True, sums the rows of sparse (tf.IndexedSlices) gradients, e.g. '
+        'of embedding lookups, with the same index before adjusting them. '
+        'Their norms and clipping are then exact without densifying them, '
+        'and the optimizer updates each row once. The var norms of these '
+        'variables, e.g. var_norm/all, only cover their updated rows. Not '
+        'supported on TPU.')
+    p.Define(
+        'num_micro_batches', 1,
+        'If > 1, the task splits each training batch into this many '
+        'micro-batches, computes the gradients of one micro-batch after the '
+        'other and accumulates them, and then applies them once. Trades step '
+        'time for the memory of the activations of the whole batch. All the '
+        'learners of a task must use the same value. Not supported on TPU.')
     return p
 
   def __init__(self, params):
@@ -102,6 +117,12 @@ class Learner(base_layer.BaseLayer):
 
     self._var_grads = None
     self._eval_metrics = {}
+    # The accumulated weighted gradients of the micro-batches, the local
+    # variables summing the dense ones, and the sum of the weights, see
+    # AccumulateMicroBatchGradients().
+    self._micro_batch_var_grads = None
+    self._micro_batch_accumulators = None
+    self._micro_batch_weight = None
     if p.grad_norm_tracker:
       self.CreateChild('grad_norm_tracker', p.grad_norm_tracker)
     self.CreateChild('lr_schedule', p.lr_schedule)
@@ -164,7 +185,9 @@ class Learner(base_layer.BaseLayer):
     TODO(rpang): explore merging gradient_mask and gradient_adjuster.
 
     Args:
-      loss: A scalar Tensor.
+      loss: A scalar Tensor. If `AccumulateMicroBatchGradients` was called,
+        the accumulated gradients are applied instead of the gradients of
+        `loss`.
       vmap: A `.NestedMap` object containing variables to optimize.
       gradient_mask: if not None, a dict mapping variable names to a 0/1 scalar.
       gradient_adjuster: if not None, a function that mutates a given var_grads.
@@ -174,6 +197,25 @@ class Learner(base_layer.BaseLayer):
     """
     # We apply gradients outside the name_scope to maintain backwards
     # compatibility on variables created by self.optimizer.Apply().
+    if self._micro_batch_var_grads is not None:
+      var_grads = self._GetMicroBatchVarGrads(vmap)
+    else:
+      var_grads = self._ComputeGradients(loss, vmap)
+
+    var_grads, stats = self.AdjustGradients(
+        var_grads,
+        gradient_mask=gradient_mask,
+        gradient_adjuster=gradient_adjuster)
+    self._var_grads = var_grads
+
+    assert self.theta.global_step is not None, self.theta
+    lr = self.LearningRate(self.theta.global_step)
+
+    var_update_op = self.optimizer.Apply(lr, var_grads)
+    return var_update_op, stats
+
+  def _ComputeGradients(self, loss, vmap):
+    """Returns the gradients of `loss` w.r.t. the trainable vars of `vmap`."""
     p = self.params
 
     vmap = self.GetTrainableVariables(vmap)
@@ -181,8 +223,7 @@ class Learner(base_layer.BaseLayer):
     for v in vmap.Flatten():
       tf.logging.info('%s: bprop variable: %s', p.name, v.name)
 
-    # Compute gradients.
-    var_grads = self.optimizer.ComputeGradients(
+    return self.optimizer.ComputeGradients(
         loss,
         vmap,
         p.grad_aggregation_method,
@@ -191,17 +232,93 @@ class Learner(base_layer.BaseLayer):
         compute_gradients_fn=None,
         skip_zero_gradients=p.skip_zero_gradients)
 
-    var_grads, stats = self.AdjustGradients(
-        var_grads,
-        gradient_mask=gradient_mask,
-        gradient_adjuster=gradient_adjuster)
-    self._var_grads = var_grads
+  def AccumulateMicroBatchGradients(self, loss, weight, vmap):
+    """Accumulates the gradients of the loss of a micro-batch.
 
-    assert self.theta.global_step is not None, self.theta
-    lr = self.LearningRate(self.theta.global_step)
+    The gradients of `loss` are weighted by `weight` and summed across the
+    micro-batches of a step. Dense gradients are summed in local variables,
+    sparse (tf.IndexedSlices) gradients are concatenated. `Apply` then uses the
+    sum divided by the sum of the weights, i.e. the gradients of the weighted
+    average of the losses of the micro-batches, instead of computing the
+    gradients of its loss.
 
-    var_update_op = self.optimizer.Apply(lr, var_grads)
-    return var_update_op, stats
+    Args:
+      loss: The scalar loss of a micro-batch.
+      weight: The scalar weight of `loss`, e.g. its number of predictions.
+      vmap: A `.NestedMap` object containing variables to optimize.
+
+    Returns:
+      A list of tensors, the accumulated gradients. The computations of the
+      next micro-batch should depend on them.
+
+    Raises:
+      ValueError: if the micro-batches do not have gradients for the same
+        variables.
+    """
+    p = self.params
+    var_grads = py_utils.ApplyGradMultiplier(
+        self._ComputeGradients(loss, vmap), weight)
+
+    def _CreateAccumulator(vg):
+      """Returns a local variable summing the dense gradients of vg.var."""
+      var, grad = vg
+      if isinstance(grad, tf.IndexedSlices):
+        return None
+      with tf.variable_scope(var.op.name):
+        return py_utils.CreateVariable(
+            '%s_micro_batch_grad' % p.name,
+            py_utils.WeightParams(var.get_shape(),
+                                  py_utils.WeightInit.Constant(0.0),
+                                  grad.dtype),
+            trainable=False,
+            collections=[tf.GraphKeys.LOCAL_VARIABLES])
+
+    def _Accumulate(accumulator, accumulated, vg):
+      """Adds vg.grad to `accumulated`, the sum of the previous ones."""
+      var, grad = vg
+      if isinstance(grad, tf.IndexedSlices):
+        if accumulated is not None:
+          grad = tf.IndexedSlices(
+              tf.concat([accumulated.grad.values, grad.values], 0),
+              tf.concat([accumulated.grad.indices, grad.indices], 0),
+              grad.dense_shape)
+        return py_utils.VarGrad(var, grad)
+      with tf.device(var.device):
+        if accumulated is None:
+          return py_utils.VarGrad(var, tf.assign(accumulator, grad))
+        return py_utils.VarGrad(var, tf.assign_add(accumulator, grad))
+
+    if self._micro_batch_var_grads is None:
+      self._micro_batch_accumulators = [
+          _CreateAccumulator(vg) for vg in var_grads.Flatten()
+      ]
+      accumulated = [None] * len(self._micro_batch_accumulators)
+      self._micro_batch_weight = weight
+    else:
+      if not self._micro_batch_var_grads.IsCompatible(var_grads):
+        raise ValueError(
+            'Micro-batches have gradients for different variables: %s vs %s' %
+            (self._micro_batch_var_grads, var_grads))
+      accumulated = self._micro_batch_var_grads.Flatten()
+      self._micro_batch_weight += weight
+    self._micro_batch_var_grads = var_grads.Pack([
+        _Accumulate(*args) for args in zip(self._micro_batch_accumulators,
+                                           accumulated, var_grads.Flatten())
+    ])
+    return [
+        grad.values if isinstance(grad, tf.IndexedSlices) else grad
+        for _, grad in self._micro_batch_var_grads.Flatten()
+    ]
+
+  def _GetMicroBatchVarGrads(self, vmap):
+    """Returns the accumulated gradients of the trainable vars of `vmap`."""
+    var_refs = set(
+        v.experimental_ref()
+        for v in self.GetTrainableVariables(vmap).Flatten())
+    var_grads = self._micro_batch_var_grads.Filter(
+        lambda vg: vg.var.experimental_ref() in var_refs)
+    return py_utils.ApplyGradMultiplier(
+        var_grads, tf.math.divide_no_nan(1.0, self._micro_batch_weight))
 
   def AdjustGradients(self,
                       var_grads,
@@ -219,6 +336,9 @@ class Learner(base_layer.BaseLayer):
       (var, grad) pairs representing adjusted gradients.
     """
     p = self.params
+    if p.deduplicate_sparse_gradients:
+      var_grads = py_utils.DeduplicateSparseGradients(var_grads)
+
     # L2 regularizer.
     if p.l2_regularizer_weight is not None:
       l2_loss, var_grads = py_utils.AdjustGradientsWithLpLoss(
@@ -302,10 +422,15 @@ class Learner(base_layer.BaseLayer):
 
     # Computes gradients' norm and adds their summaries. Note that all_grad_norm
     # may be nan, which may cause grad_scale to be nan.
-    for name, vg in var_grads.FlattenItems():
+    norm_var_grads = var_grads
+    if p.deduplicate_sparse_gradients:
+      # The var norms of sparse gradients only read their updated rows, not
+      # whole embedding tables.
+      norm_var_grads = py_utils.GatherSparseGradientRows(var_grads)
+    for name, vg in norm_var_grads.FlattenItems():
       summary_utils.AddNormSummary(
           py_utils.SanitizeScopeKey(name) + '/' + p.name, vg)
-    flatten = py_utils.Flatten(var_grads)
+    flatten = py_utils.Flatten(norm_var_grads)
     all_grad_norm = tf.sqrt(py_utils.SumSquared([g for (_, g) in flatten]))
     all_var_norm = tf.sqrt(py_utils.SumSquared([v for (v, _) in flatten]))
     grad_norm_is_nan_or_inf = tf.math.logical_or(
@@ -17,10 +17,12 @@
 
 import lingvo.compat as tf
 from lingvo.core import base_layer
+from lingvo.core import layers
 from lingvo.core import learner
 from lingvo.core import optimizer
 from lingvo.core import py_utils
 from lingvo.core import test_utils
+import numpy as np
 
 
 class TestLayer(base_layer.BaseLayer):
@@ -72,6 +74,97 @@ class LearnerTest(test_utils.TestCase):
     self.assertAllClose(var_grads, {'world': (0., -2.)})
     self.assertAllClose(updated_vars, {'hello': 0., 'world': 0.2})
 
+  def testDeduplicateSparseGradients(self):
+    learner_p = learner.Learner.Params().Set(
+        name='learner',
+        learning_rate=.1,
+        optimizer=optimizer.SGD.Params(),
+        clip_gradient_norm_to_value=1.,
+        deduplicate_sparse_gradients=True)
+    tf.train.get_or_create_global_step()  # needed for lr_schedule
+    lrnr = learner_p.Instantiate()
+    emb = layers.SimpleEmbeddingLayer.Params().Set(
+        name='emb', vocab_size=10, embedding_dim=2).Instantiate()
+    embs = emb.FProp(emb.theta, tf.constant([2, 5, 2, 2, 7]))
+    loss = tf.reduce_sum(embs * tf.constant([[1.], [2.], [3.], [4.], [5.]]))
+    update_op, eval_metrics = lrnr.Apply(loss, emb.vars)
+    grad = lrnr.GetVarGrads().wm.grad
+    self.assertIsInstance(grad, tf.IndexedSlices)
+    with self.session():
+      self.evaluate(tf.global_variables_initializer())
+      initial_wm = self.evaluate(emb.vars.wm)
+      grad_norm, var_norm, indices = self.evaluate([
+          eval_metrics['grad_norm/all'][0], eval_metrics['var_norm/all'][0],
+          grad.indices
+      ])
+      update_op.run()
+      updated_wm = self.evaluate(emb.vars.wm)
+    self.assertCountEqual([2, 5, 7], indices)
+    dense_grad = np.zeros([10, 2])
+    dense_grad[[2, 5, 7]] = [[8., 8.], [2., 2.], [5., 5.]]
+    self.assertAllClose(np.linalg.norm(dense_grad), grad_norm)
+    # The var norm only covers the updated rows.
+    self.assertAllClose(np.linalg.norm(initial_wm[[2, 5, 7]]), var_norm)
+    self.assertAllClose(initial_wm - 0.1 * dense_grad / grad_norm, updated_wm)
+
+  def testDeduplicateSparseGradientsNoFullTableReduction(self):
+    vocab_size, embedding_dim = 1000, 16
+    learner_p = learner.Learner.Params().Set(
+        name='learner',
+        learning_rate=.1,
+        optimizer=optimizer.SGD.Params(),
+        clip_gradient_norm_to_value=1.,
+        deduplicate_sparse_gradients=True)
+    tf.train.get_or_create_global_step()  # needed for lr_schedule
+    lrnr = learner_p.Instantiate()
+    emb = layers.SimpleEmbeddingLayer.Params().Set(
+        name='emb', vocab_size=vocab_size,
+        embedding_dim=embedding_dim).Instantiate()
+    embs = emb.FProp(emb.theta, tf.constant([2, 5, 2, 2, 7]))
+    lrnr.Apply(tf.reduce_sum(tf.square(embs)), emb.vars)
+    # Neither the norms nor the summaries of the step read the whole table.
+    table_shape = [vocab_size, embedding_dim]
+    for op in tf.get_default_graph().get_operations():
+      if op.type not in ('Abs', 'Pow', 'Square', 'Sum', 'L2Loss', 'Max',
+                         'Mean'):
+        continue
+      for t in op.inputs:
+        if t.shape.rank is not None:
+          self.assertNotEqual(table_shape, t.shape.as_list(), msg=op.name)
+
+  def testAccumulateMicroBatchGradients(self):
+    learner_p = learner.Learner.Params().Set(
+        name='learner', learning_rate=1., optimizer=optimizer.SGD.Params())
+    tf.train.get_or_create_global_step()  # needed for lr_schedule
+    lrnr = learner_p.Instantiate()
+    layer = TestLayer.Params().Set(name='test').Instantiate()
+    emb = layers.SimpleEmbeddingLayer.Params().Set(
+        name='emb', vocab_size=10, embedding_dim=2).Instantiate()
+    vmap = py_utils.NestedMap(test=layer.vars, emb=emb.vars)
+    loss1 = tf.reduce_sum(emb.FProp(emb.theta, tf.constant([2, 5])))
+    loss1 += layer.theta.hello
+    accumulated_grads = lrnr.AccumulateMicroBatchGradients(
+        loss1, tf.constant(1.), vmap)
+    # The second micro-batch runs after the first one is accumulated.
+    with tf.control_dependencies(accumulated_grads):
+      loss2 = tf.reduce_sum(emb.FProp(emb.theta, tf.constant([5, 7])))
+      loss2 += 3. * layer.theta.hello
+      lrnr.AccumulateMicroBatchGradients(loss2, tf.constant(3.), vmap)
+    update_op, _ = lrnr.Apply(loss2, vmap)
+    with self.session():
+      self.evaluate(
+          [tf.global_variables_initializer(),
+           tf.local_variables_initializer()])
+      initial_wm = self.evaluate(emb.vars.wm)
+      update_op.run()
+      updated_vars = self.evaluate(
+          py_utils.NestedMap(test=layer.vars, emb=emb.vars))
+    # The gradients of (1 * loss1 + 3 * loss2) / 4.
+    self.assertAllClose({'hello': -2.5, 'world': 0.}, updated_vars.test)
+    expected_wm = initial_wm
+    expected_wm[[2, 5, 7]] -= [[.25, .25], [1., 1.], [.75, .75]]
+    self.assertAllClose(expected_wm, updated_vars.emb.wm)
+
   def _testLearner(self, learner_p):
     tf.train.get_or_create_global_step()  # needed for lr_schedule
     lrnr = learner_p.Instantiate()
@@ -86,5 +179,49 @@ class LearnerTest(test_utils.TestCase):
       return var_grads, updated_vars, eval_metrics
 
 
+class SparseEmbeddingLearnerBenchmark(tf.test.Benchmark):
+  """Benchmarks a training step of a large embedding table.
+
+  Reports the wall time and the peak memory of a step with dense moment
+  updates against a step with deduplicated gradients and lazy Adam updates.
+
+  Run with::
+
+    bazel run -c opt lingvo/core:learner_test -- --benchmarks=.
+  """
+
+  def _Benchmark(self, name, sparse, vocab_size=1000000, embedding_dim=512):
+    with tf.Graph().as_default(), tf.device('/cpu:0'):
+      tf.train.get_or_create_global_step()
+      lrnr = learner.Learner.Params().Set(
+          name='learner',
+          learning_rate=.1,
+          clip_gradient_norm_to_value=1.,
+          deduplicate_sparse_gradients=sparse,
+          optimizer=optimizer.Adam.Params().Set(
+              lazy_sparse_updates=sparse)).Instantiate()
+      emb = layers.SimpleEmbeddingLayer.Params().Set(
+          name='emb', vocab_size=vocab_size,
+          embedding_dim=embedding_dim).Instantiate()
+      # A Zipfian batch of ids, with many repeated frequent ids.
+      ids = tf.math.minimum(
+          tf.cast(
+              tf.math.exp(
+                  tf.random.uniform([4096], maxval=np.log(vocab_size))),
+              tf.int32) - 1, vocab_size - 1)
+      loss = tf.reduce_sum(tf.square(emb.FProp(emb.theta, ids)))
+      update_op, _ = lrnr.Apply(loss, emb.vars)
+      with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        self.run_op_benchmark(
+            sess, update_op, min_iters=5, store_memory_usage=True, name=name)
+
+  def benchmarkDenseAdam(self):
+    self._Benchmark('dense_adam', sparse=False)
+
+  def benchmarkSparseAdam(self):
+    self._Benchmark('sparse_adam', sparse=True)
+
+
 if __name__ == '__main__':
   tf.test.main()
@@ -384,3 +384,238 @@ class CorrelationMetric(BaseMetric):
       return scipy.stats.spearmanr(self._target, self._pred)[0]
     else:
       return scipy.stats.kendalltau(self._target, self._pred)[0]
+
+
+class StreamingAUCMetric(BaseMetric):
+  """Bounded-memory AUC for binary classification.
+
+  Unlike `AUCMetric`, which keeps every (label, prob, weight) triple seen and
+  reruns sklearn over all of them, this metric accumulates weighted histograms
+  of the scores of positive and negative examples over `num_buckets` equally
+  sized buckets in [0, 1]. Memory and the cost of computing `value` are
+  O(num_buckets) regardless of the number of points seen. The result equals
+  the exact AUC when no two examples with different scores share a bucket.
+  """
+
+  def __init__(self, mode='roc', num_buckets=10000):
+    """Constructor of the class.
+
+    Args:
+      mode: Possible values: 'roc' or 'pr'.
+      num_buckets: The number of score histogram buckets.
+    """
+    if mode == 'roc':
+      self._plot_labels = ['False Positive Rate', 'True Positive Rate']
+    elif mode == 'pr':
+      self._plot_labels = ['Recall', 'Precision']
+    else:
+      raise ValueError('mode in StreamingAUCMetric must be one of "roc" or '
+                       '"pr".')
+    self._mode = mode
+    self._num_buckets = num_buckets
+    self._pos_hist = np.zeros([num_buckets], dtype=np.float64)
+    self._neg_hist = np.zeros([num_buckets], dtype=np.float64)
+
+  def Update(self, label, prob, weight=None):
+    """Updates the metrics.
+
+    Args:
+      label: An array to specify the groundtruth binary labels. Values must be
+        either 0 or 1.
+      prob: An array to specify the prediction probabilities. Values must be
+        within [0, 1.0].
+      weight: An optional array to specify the sample weight for the auc
+        computation.
+    """
+    label = np.asarray(label, dtype=np.float64).reshape([-1])
+    prob = np.asarray(prob, dtype=np.float64).reshape([-1])
+    if weight is None:
+      weight = np.ones_like(label)
+    else:
+      weight = np.asarray(weight, dtype=np.float64).reshape([-1])
+    buckets = np.clip((prob * self._num_buckets).astype(np.int64), 0,
+                      self._num_buckets - 1)
+    self._pos_hist += np.bincount(
+        buckets, weights=weight * label, minlength=self._num_buckets)
+    self._neg_hist += np.bincount(
+        buckets, weights=weight * (1. - label), minlength=self._num_buckets)
+
+  def Merge(self, other):
+    """Merges the statistics of another StreamingAUCMetric into this one."""
+    if other._mode != self._mode or other._num_buckets != self._num_buckets:  # pylint: disable=protected-access
+      raise ValueError('Can only merge StreamingAUCMetrics with the same mode '
+                       'and num_buckets.')
+    self._pos_hist += other._pos_hist  # pylint: disable=protected-access
+    self._neg_hist += other._neg_hist  # pylint: disable=protected-access
+
+  def _Curve(self):
+    """Returns (xs, ys) of the curve, sweeping the threshold from 1 to 0."""
+    tps = np.cumsum(self._pos_hist[::-1])
+    fps = np.cumsum(self._neg_hist[::-1])
+    if self._mode == 'roc':
+      tpr = np.concatenate([[0.], tps / max(tps[-1], 1e-30)])
+      fpr = np.concatenate([[0.], fps / max(fps[-1], 1e-30)])
+      return fpr, tpr
+    # Only thresholds which change the predictions are points on the curve.
+    nonempty = (self._pos_hist + self._neg_hist)[::-1] > 0
+    tps = tps[nonempty]
+    fps = fps[nonempty]
+    precision = tps / np.maximum(tps + fps, 1e-30)
+    recall = tps / max(tps[-1] if tps.size else 0., 1e-30)
+    return recall, precision
+
+  @property
+  def value(self):
+    xs, ys = self._Curve()
+    if self._mode == 'roc':
+      return float(np.trapz(ys, xs))
+    # Average precision as in sklearn.metrics.average_precision_score:
+    # sum_n (R_n - R_{n-1}) P_n.
+    return float(np.sum(np.diff(xs, prepend=0.) * ys))
+
+  def Summary(self, name):
+
+    def _Setter(fig, axes):
+      # 20 ticks betweein 0 and 1.
+      ticks = np.arange(0, 1.05, 0.05)
+      axes.grid(b=True)
+      axes.set_xlabel(self._plot_labels[0])
+      axes.set_xticks(ticks)
+      axes.set_ylabel(self._plot_labels[1])
+      axes.set_yticks(ticks)
+      fig.tight_layout()
+
+    xs, ys = self._Curve()
+    ret = plot.Curve(name=name, figsize=(12, 12), xs=xs, ys=ys, setter=_Setter)
+    ret.value.add(tag=name, simple_value=self.value)
+    return ret
+
+
+class _MergeableReservoir:
+  """A uniform reservoir sample of rows which can be merged across shards.
+
+  Every row is assigned an independent uniform random priority and the
+  `num_samples` rows with the lowest priorities are kept. The union of two
+  reservoirs, truncated the same way, is then a uniform sample of the union of
+  their inputs.
+  """
+
+  def __init__(self, num_samples, num_columns):
+    assert num_samples > 0
+    self._num_samples = num_samples
+    self._rows = np.zeros([0, num_columns], dtype=np.float64)
+    self._priorities = np.zeros([0], dtype=np.float64)
+
+  def _Keep(self, rows, priorities):
+    if priorities.shape[0] > self._num_samples:
+      keep = np.argpartition(priorities, self._num_samples - 1)
+      keep = keep[:self._num_samples]
+      rows = rows[keep]
+      priorities = priorities[keep]
+    self._rows = rows
+    self._priorities = priorities
+
+  def Add(self, rows):
+    """Adds a [N, num_columns] array of rows."""
+    rows = np.asarray(rows, dtype=np.float64)
+    self._Keep(
+        np.concatenate([self._rows, rows]),
+        np.concatenate([self._priorities,
+                        np.random.uniform(size=rows.shape[0])]))
+
+  def Merge(self, other):
+    self._Keep(
+        np.concatenate([self._rows, other._rows]),  # pylint: disable=protected-access
+        np.concatenate([self._priorities, other._priorities]))  # pylint: disable=protected-access
+
+  @property
+  def samples(self):
+    return self._rows
+
+
+class StreamingCorrelationMetric(BaseMetric):
+  """Bounded-memory correlation.
+
+  Pearson correlation is computed exactly from running first and second
+  moments. Rank correlations ('spearman', 'kendalltau') cannot be computed
+  from moments and are estimated with scipy from a uniform reservoir sample of
+  at most `num_samples` (target, pred) pairs.
+  """
+
+  def __init__(self, mode='pearson', num_samples=10000):
+    """Constructor of the class.
+
+    Args:
+      mode: Possible values: 'pearson', 'spearman', 'kendalltau'.
+      num_samples: The reservoir size for 'spearman' and 'kendalltau'.
+
+    Raises:
+      ImportError: If mode is a rank correlation and the user has not installed
+        scipy.stats, raise an ImportError.
+    """
+    assert mode in ['pearson', 'spearman', 'kendalltau']
+    if mode != 'pearson' and not HAS_SCIPY_STATS:
+      raise ImportError('StreamingCorrelationMetric depends on scipy.stats '
+                        'for mode %s.' % mode)
+    self._mode = mode
+    self._count = 0
+    self._mean = np.zeros([2], dtype=np.float64)
+    # Co-moment matrix sum((x - mean_x) * (y - mean_y)) of (target, pred).
+    self._comoment = np.zeros([2, 2], dtype=np.float64)
+    self._reservoir = None
+    if mode != 'pearson':
+      self._reservoir = _MergeableReservoir(num_samples, 2)
+
+  def _MergeMoments(self, count, mean, comoment):
+    """Merges moments with Chan et al.'s parallel algorithm."""
+    total = self._count + count
+    if total == 0:
+      return
+    delta = mean - self._mean
+    self._comoment += comoment + np.outer(delta,
+                                          delta) * self._count * count / total
+    self._mean += delta * count / total
+    self._count = total
+
+  def Update(self, target, pred):
+    """Updates the metrics.
+
+    Args:
+      target: An array to specify the groundtruth float target.
+      pred: An array to specify the prediction.
+    """
+    rows = np.stack([
+        np.asarray(target, dtype=np.float64).reshape([-1]),
+        np.asarray(pred, dtype=np.float64).reshape([-1])
+    ],
+                    axis=1)
+    if rows.shape[0] == 0:
+      return
+    if self._reservoir is not None:
+      self._reservoir.Add(rows)
+      return
+    mean = np.mean(rows, axis=0)
+    centered = rows - mean
+    self._MergeMoments(rows.shape[0], mean, np.matmul(centered.T, centered))
+
+  def Merge(self, other):
+    """Merges the statistics of another StreamingCorrelationMetric."""
+    if other._mode != self._mode:  # pylint: disable=protected-access
+      raise ValueError('Can only merge StreamingCorrelationMetrics with the '
+                       'same mode.')
+    if self._reservoir is not None:
+      self._reservoir.Merge(other._reservoir)  # pylint: disable=protected-access
+    else:
+      self._MergeMoments(other._count, other._mean, other._comoment)  # pylint: disable=protected-access
+
+  @property
+  def value(self):
+    if self._mode == 'pearson':
+      return self._comoment[0, 1] / np.sqrt(
+          self._comoment[0, 0] * self._comoment[1, 1])
+    samples = self._reservoir.samples
+    # only use the correlation, p-value is ignored.
+    if self._mode == 'spearman':
+      return scipy.stats.spearmanr(samples[:, 0], samples[:, 1])[0]
+    else:
+      return scipy.stats.kendalltau(samples[:, 0], samples[:, 1])[0]
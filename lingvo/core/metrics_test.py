@@ -18,6 +18,7 @@
 import lingvo.compat as tf
 from lingvo.core import metrics
 from lingvo.core import test_utils
+import numpy as np
 
 
 class MetricsTest(test_utils.TestCase):
@@ -76,6 +77,75 @@ class MetricsTest(test_utils.TestCase):
     m.Update([1.0, 2.0, 3.0], [0.1, 0.2, 0.3])
     self.assertEqual(1.0, m.value)
 
+  def _RandomAUCData(self, num_points, num_buckets):
+    label = np.random.randint(0, 2, size=[num_points])
+    prob = np.random.uniform(size=[num_points])
+    prob = np.where(label > 0, np.sqrt(prob), prob)
+    # Scores at bucket centers so that histogram AUC is exact.
+    prob = (np.floor(prob * num_buckets) + 0.5) / num_buckets
+    weight = np.random.uniform(0.5, 2., size=[num_points])
+    return label, prob, weight
+
+  def testStreamingAUCMetric(self):
+    np.random.seed(12345)
+    for mode in ('roc', 'pr'):
+      label, prob, weight = self._RandomAUCData(1000, 100)
+      expected = metrics.AUCMetric(mode=mode)
+      expected.Update(list(label), list(prob), list(weight))
+      m = metrics.StreamingAUCMetric(mode=mode, num_buckets=100)
+      m.Update(label[:400], prob[:400], weight[:400])
+      m.Update(label[400:], prob[400:], weight[400:])
+      self.assertAllClose(expected.value, m.value)
+      summary = m.Summary('auc')
+      self.assertAllClose(expected.value, summary.value[-1].simple_value)
+
+  def testStreamingAUCMetricMerge(self):
+    np.random.seed(12345)
+    label, prob, _ = self._RandomAUCData(1000, 50)
+    m = metrics.StreamingAUCMetric(num_buckets=50)
+    m.Update(label, prob)
+    shard0 = metrics.StreamingAUCMetric(num_buckets=50)
+    shard1 = metrics.StreamingAUCMetric(num_buckets=50)
+    shard0.Update(label[:300], prob[:300])
+    shard1.Update(label[300:], prob[300:])
+    shard0.Merge(shard1)
+    self.assertAllClose(m.value, shard0.value)
+    with self.assertRaises(ValueError):
+      shard0.Merge(metrics.StreamingAUCMetric(mode='pr', num_buckets=50))
+
+  def testStreamingCorrelationMetricPearson(self):
+    np.random.seed(12345)
+    target = np.random.normal(size=[1000])
+    pred = target + np.random.normal(size=[1000])
+    expected = metrics.CorrelationMetric()
+    expected.Update(list(target), list(pred))
+    m = metrics.StreamingCorrelationMetric()
+    m.Update(target[:10], pred[:10])
+    shard = metrics.StreamingCorrelationMetric()
+    shard.Update(target[10:500], pred[10:500])
+    shard.Update(target[500:], pred[500:])
+    m.Merge(shard)
+    self.assertAllClose(expected.value, m.value)
+
+  def testStreamingCorrelationMetricRank(self):
+    np.random.seed(12345)
+    target = np.random.normal(size=[1000])
+    pred = target + np.random.normal(size=[1000])
+    for mode in ('spearman', 'kendalltau'):
+      expected = metrics.CorrelationMetric(mode=mode)
+      expected.Update(list(target), list(pred))
+      # The reservoir is large enough to hold every point.
+      m = metrics.StreamingCorrelationMetric(mode=mode, num_samples=1000)
+      shard = metrics.StreamingCorrelationMetric(mode=mode, num_samples=1000)
+      m.Update(target[:600], pred[:600])
+      shard.Update(target[600:], pred[600:])
+      m.Merge(shard)
+      self.assertAllClose(expected.value, m.value)
+      # A smaller reservoir estimates the correlation from a subsample.
+      m = metrics.StreamingCorrelationMetric(mode=mode, num_samples=200)
+      m.Update(target, pred)
+      self.assertNear(expected.value, m.value, 0.15)
+
 
 if __name__ == '__main__':
   tf.test.main()
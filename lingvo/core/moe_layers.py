@@ -463,6 +463,26 @@ class SharedEmbeddingSoftmaxLayer(base_layer.BaseLayer):
     }, per_example_loss
 
 
+def _ExpertCapacity(logits, experts_dim, expert_capacity_dim, capacity_factor):
+  """Returns expert_capacity_dim, increased according to capacity_factor."""
+  if capacity_factor is not None:
+    # Determine expert capacity automatically depedning on the input size.
+    group_size_dim = int(logits.shape[1])
+    auto_expert_capacity = int((group_size_dim * capacity_factor) / experts_dim)
+    if expert_capacity_dim < auto_expert_capacity:
+      expert_capacity_dim = auto_expert_capacity
+      # Round up to a multiple of 4 to avoid possible padding.
+      while expert_capacity_dim % 4:
+        expert_capacity_dim += 1
+      tf.logging.info(
+          'Setting expert_capacity_dim=%r (capacity_factor=%r '
+          'group_size_dim=%r experts_dim=%r name_scope=%r)',
+          expert_capacity_dim, capacity_factor, group_size_dim, experts_dim,
+          tf.get_default_graph().get_name_scope())
+    tpu_summary.scalar('expert_capacity', expert_capacity_dim)
+  return expert_capacity_dim
+
+
 def Top2GatingOnLogits(inputs,
                        paddings,
                        logits,
@@ -543,21 +563,8 @@ def Top2GatingOnLogits(inputs,
   del inputs  # inputs is currently not used.
   raw_gates = tf.nn.softmax(logits)  # along E dim
 
-  if capacity_factor is not None:
-    # Determine expert capacity automatically depedning on the input size.
-    group_size_dim = int(logits.shape[1])
-    auto_expert_capacity = int((group_size_dim * capacity_factor) / experts_dim)
-    if expert_capacity_dim < auto_expert_capacity:
-      expert_capacity_dim = auto_expert_capacity
-      # Round up to a multiple of 4 to avoid possible padding.
-      while expert_capacity_dim % 4:
-        expert_capacity_dim += 1
-      tf.logging.info(
-          'Setting expert_capacity_dim=%r (capacity_factor=%r '
-          'group_size_dim=%r experts_dim=%r name_scope=%r)',
-          expert_capacity_dim, capacity_factor, group_size_dim, experts_dim,
-          tf.get_default_graph().get_name_scope())
-    tpu_summary.scalar('expert_capacity', expert_capacity_dim)
+  expert_capacity_dim = _ExpertCapacity(logits, experts_dim,
+                                        expert_capacity_dim, capacity_factor)
 
   # top first and second gate value and expert index for each input
   #
@@ -817,6 +824,268 @@ def Top2GatingOnLogits(inputs,
   return aux_loss, combine_tensor, dispatch_tensor
 
 
+def _AddRatioSummary(name, numerator, denominator):
+  """Adds a scalar summary of numerator / denominator, 0 if it is 0."""
+  ratio = tf.math.divide_no_nan(
+      tf.cast(numerator, tf.float32), tf.cast(denominator, tf.float32))
+  py_utils.AddTpuSummaryTensor(name, ratio)
+  tpu_summary.scalar(name, ratio, while_loop_reduce='mean')
+
+
+def _PositionInExpert(expert_index, routed, experts_dim, expert_load=None):
+  """Computes the position of token-to-expert assignments in their expert.
+
+  The assignments of a group are stably sorted by expert in priority order:
+  the first choices of all the tokens in token order, then their second
+  choices, etc. The position of an assignment is its offset from the start of
+  the segment of its expert in the sorted order, which is the position
+  Top2GatingOnLogits computes with cumsums of GSE one-hot masks.
+
+  Args:
+    expert_index: GSK int32 Tensor, the expert of each assignment.
+    routed: GSK bool Tensor, whether each assignment is routed at all.
+    experts_dim: number of experts.
+    expert_load: optional GE int32 Tensor, the number of slots of each expert
+      already taken, added to the positions.
+
+  Returns:
+    A tuple (position_in_expert, expert_count).
+
+    - position_in_expert: GSK int32 Tensor, the position of each routed
+      assignment. Positions of assignments not routed are meaningless.
+    - expert_count: GE int32 Tensor, the number of routed assignments to each
+      expert.
+  """
+  g, s, k = py_utils.GetShape(expert_index, 3)
+  # Assignments not routed go to an extra segment after the experts.
+  num_segments = experts_dim + 1
+  # GKS, in priority order.
+  segment = tf.transpose(
+      tf.where(routed, expert_index, tf.fill([g, s, k], experts_dim)),
+      [0, 2, 1])
+  segment = tf.reshape(
+      segment + num_segments * tf.range(g)[:, tf.newaxis, tf.newaxis], [-1])
+  order = tf.argsort(segment, stable=True)
+  count = tf.math.unsorted_segment_sum(
+      tf.ones_like(segment), segment, g * num_segments)
+  start = tf.cumsum(count, exclusive=True)
+  sorted_position = tf.range(g * k * s) - tf.gather(start,
+                                                     tf.gather(segment, order))
+  # Inverts the permutation of the sort.
+  position_in_expert = tf.scatter_nd(order[:, tf.newaxis], sorted_position,
+                                     [g * k * s])
+  position_in_expert = tf.transpose(
+      tf.reshape(position_in_expert, [g, k, s]), [0, 2, 1])
+  if expert_load is not None:
+    position_in_expert += tf.gather(expert_load, expert_index, batch_dims=1)
+  expert_count = tf.reshape(count, [g, num_segments])[:, :experts_dim]
+  return position_in_expert, expert_count
+
+
+def Top2GatingOnLogitsSparse(paddings,
+                             logits,
+                             experts_dim,
+                             expert_capacity_dim,
+                             fprop_dtype,
+                             second_expert_policy='all',
+                             second_expert_threshold=0.0,
+                             legacy_mtf_behavior=True,
+                             capacity_factor=None,
+                             reroute_dropped=False):
+  """Computes Top-2 gating for Mixture-of-Experts as sparse assignments.
+
+  Same gating as Top2GatingOnLogits, but instead of G`SEC combine and dispatch
+  tensors, whose size grows with the square of the group size, it returns for
+  each of the K=2 assignments of every token the slot of the expert it is
+  dispatched to and its combine weight. Positions in the experts are computed
+  by sorting the assignments by expert, see _PositionInExpert, so that
+  without reroute_dropped the same assignments as Top2GatingOnLogits are kept.
+
+  The ratio of the assignments of each choice over capacity, of the tokens
+  dropped altogether and, with reroute_dropped, of the dropped assignments
+  re-routed, are added as summaries, as well as the load of each expert
+  relative to its capacity.
+
+  The sparse dispatch does not annotate xla sharding.
+
+  Args:
+    paddings: G`S Tensor.
+    logits: G`SE Tensor.
+    experts_dim: number of experts.
+    expert_capacity_dim: number of examples per minibatch(group) per expert.
+    fprop_dtype: activations datatype to use.
+    second_expert_policy: 'all', 'sampling' or 'random', see
+      Top2GatingOnLogits.
+    second_expert_threshold: threshold for probability normalization for
+      second_expert_policy == 'random'.
+    legacy_mtf_behavior: bool, True if to match legacy mtf behavior exactly.
+    capacity_factor: if set, increases expert_capacity_dim to at least
+      (group_size * capacity_factor) / experts_dim.
+    reroute_dropped: bool, if True the first and second choice assignments
+      dropped because their expert is over capacity are re-routed to the third
+      and fourth best experts of their token respectively, if these have
+      capacity left after all the first and second choices. Re-routed
+      assignments keep the combine weight of the assignment they replace.
+
+  Returns:
+    A NestedMap with
+
+    - aux_loss: auxiliary loss, for equalizing the expert assignment ratios.
+    - dispatch_index: GSK int32 Tensor, the index of the slot of each
+      assignment in the E * slots_per_expert slots of the experts, or -1 if
+      the assignment is dropped.
+    - combine_weight: GSK Tensor, the weight of each assignment for combining
+      expert outputs, 0 if the assignment is dropped.
+    - slots_per_expert: int, G * expert_capacity_dim.
+
+  Raises:
+    ValueError: if reroute_dropped is set with fewer than 4 experts.
+  """
+  if reroute_dropped and experts_dim < 4:
+    raise ValueError('reroute_dropped needs at least 4 experts, got %d.' %
+                     experts_dim)
+  raw_gates = tf.nn.softmax(logits)  # along E dim
+  expert_capacity_dim = _ExpertCapacity(logits, experts_dim,
+                                        expert_capacity_dim, capacity_factor)
+  g, _, _ = py_utils.GetShape(logits, 3)
+
+  importance = tf.ones_like(raw_gates[:, :, 0])
+  if paddings is not None:
+    importance = 1.0 - paddings
+  non_padding = importance > 0.0
+
+  # GS
+  index_1 = tf.math.argmax(raw_gates, axis=-1, output_type=tf.int32)
+  # GSE
+  mask_1 = tf.one_hot(index_1, experts_dim, dtype=fprop_dtype)
+  mask_1 *= tf.expand_dims(importance, -1)
+  gate_1 = tf.einsum('GSE,GSE->GS', raw_gates, mask_1)
+  gates_without_top_1 = raw_gates * (1.0 - mask_1)
+
+  if second_expert_policy == 'sampling':
+    # Samples the 2nd expert from the softmax without the 1st expert, with the
+    # Gumbel max trick as in Top2GatingOnLogits.
+    noise = -tf.math.log(
+        -tf.math.log(tf.random.uniform(logits.shape, dtype=logits.dtype)))
+    very_negative_logits = (
+        tf.ones_like(logits) * logits.dtype.max *
+        tf.constant(-0.7, dtype=logits.dtype))
+    updated_logits = tf.where(mask_1 > 0.0, very_negative_logits, logits)
+    index_2 = tf.math.argmax(
+        updated_logits + noise, axis=-1, output_type=tf.int32)
+  else:
+    index_2 = tf.math.argmax(gates_without_top_1, axis=-1, output_type=tf.int32)
+  mask_2 = tf.one_hot(index_2, experts_dim, dtype=fprop_dtype)
+  mask_2 *= tf.expand_dims(importance, -1)
+  gate_2 = tf.einsum('GSE,GSE->GS', gates_without_top_1, mask_2)
+
+  if legacy_mtf_behavior:
+    # See Top2GatingOnLogits.
+    denom = gate_1 + gate_2 + 1e-9
+    gate_1 /= denom
+    gate_2 /= denom
+
+  # Same aux_loss as Top2GatingOnLogits.
+  if legacy_mtf_behavior:
+    density_denom = 1.0
+  else:
+    density_denom = tf.reduce_mean(importance, axis=1)[:, tf.newaxis] + 1e-6
+  density_1 = tf.reduce_mean(mask_1, axis=1) / density_denom
+  density_1_proxy = tf.reduce_mean(
+      raw_gates * tf.expand_dims(importance, -1), axis=1) / density_denom
+  aux_loss = tf.reduce_mean(density_1_proxy * density_1)
+  aux_loss *= experts_dim * experts_dim
+
+  routed_2 = non_padding
+  if second_expert_policy == 'all' or second_expert_policy == 'sampling':
+    pass
+  elif second_expert_policy == 'random':
+    sampled_2 = tf.less(
+        tf.random.uniform(gate_2.shape, dtype=gate_2.dtype),
+        (gate_2 / max(second_expert_threshold, 1e-9)))
+    gate_2 *= tf.cast(sampled_2, gate_2.dtype)
+    routed_2 = tf.logical_and(routed_2, sampled_2)
+  else:
+    raise ValueError(second_expert_policy)
+
+  # GSK Tensors, K=2
+  expert_index = tf.stack([index_1, index_2], axis=-1)
+  gates = tf.stack([gate_1, gate_2], axis=-1)
+  routed = tf.stack([non_padding, routed_2], axis=-1)
+  position_in_expert, expert_count = _PositionInExpert(expert_index, routed,
+                                                       experts_dim)
+  kept = tf.logical_and(routed,
+                        tf.less(position_in_expert, expert_capacity_dim))
+  dropped = tf.logical_and(routed, tf.logical_not(kept))
+
+  def _Count(x, axis=None):
+    return tf.reduce_sum(tf.cast(x, tf.int32), axis=axis)
+
+  _AddRatioSummary('over_capacity_1_ratio', _Count(dropped[:, :, 0]),
+                   _Count(routed[:, :, 0]))
+  _AddRatioSummary('over_capacity_2_ratio', _Count(dropped[:, :, 1]),
+                   _Count(routed[:, :, 1]))
+  # E Tensor, the mean number of assignments to each expert relative to its
+  # capacity. Loads above 1 overflow.
+  expert_load = tf.reduce_mean(
+      tf.cast(expert_count, tf.float32), axis=0) / expert_capacity_dim
+  tpu_summary.tensor('expert_load', expert_load)
+  py_utils.AddTpuSummaryTensor('max_expert_load', tf.reduce_max(expert_load))
+  tpu_summary.scalar('max_expert_load', tf.reduce_max(expert_load))
+
+  if reroute_dropped:
+    # GSE Tensor, non-zero for the first and second choices.
+    chosen = (
+        tf.one_hot(index_1, experts_dim, dtype=raw_gates.dtype) +
+        tf.one_hot(index_2, experts_dim, dtype=raw_gates.dtype))
+    gates_without_top_2 = raw_gates * tf.cast(
+        tf.equal(chosen, 0.0), raw_gates.dtype)
+    index_3 = tf.math.argmax(gates_without_top_2, axis=-1, output_type=tf.int32)
+    index_4 = tf.math.argmax(
+        gates_without_top_2 *
+        (1.0 - tf.one_hot(index_3, experts_dim, dtype=raw_gates.dtype)),
+        axis=-1,
+        output_type=tf.int32)
+    reroute_index = tf.stack([index_3, index_4], axis=-1)
+    # Kept assignments take the first slots of each expert.
+    reroute_position, _ = _PositionInExpert(
+        reroute_index,
+        dropped,
+        experts_dim,
+        expert_load=tf.minimum(expert_count, expert_capacity_dim))
+    rerouted = tf.logical_and(
+        dropped, tf.less(reroute_position, expert_capacity_dim))
+    _AddRatioSummary('rerouted_ratio', _Count(rerouted), _Count(dropped))
+    expert_index = tf.where(rerouted, reroute_index, expert_index)
+    position_in_expert = tf.where(rerouted, reroute_position,
+                                  position_in_expert)
+    kept = tf.logical_or(kept, rerouted)
+
+  _AddRatioSummary(
+      'dropped_token_ratio',
+      _Count(tf.logical_and(non_padding,
+                            tf.logical_not(tf.reduce_any(kept, axis=-1)))),
+      _Count(non_padding))
+
+  gates *= tf.cast(kept, gates.dtype)
+  if not legacy_mtf_behavior:
+    denom = tf.reduce_sum(gates, axis=-1, keepdims=True)
+    # To avoid divide by 0.
+    denom = tf.where(denom > 0, denom, tf.ones_like(denom))
+    gates /= denom
+
+  # Slots are laid out as [E, G, C], as the EGCM expert inputs of the dense
+  # dispatch.
+  group = tf.range(g)[:, tf.newaxis, tf.newaxis]
+  slot = (expert_index * g + group) * expert_capacity_dim + position_in_expert
+  dispatch_index = tf.where(kept, slot, -tf.ones_like(slot))
+  return py_utils.NestedMap(
+      aux_loss=aux_loss,
+      dispatch_index=dispatch_index,
+      combine_weight=tf.cast(gates, fprop_dtype),
+      slots_per_expert=g * expert_capacity_dim)
+
+
 def Top2Gating(w,
                inputs,
                paddings,
@@ -829,10 +1098,13 @@ def Top2Gating(w,
                second_expert_policy='all',
                second_expert_threshold=0.0,
                legacy_mtf_behavior=True,
-               capacity_factor=None):
+               capacity_factor=None,
+               sparse_dispatch=False,
+               reroute_dropped=False):
   """Computes Top-2 gating for Mixture-of-Experts.
 
-  See Top2GatingOnLogits for more details.
+  See Top2GatingOnLogits for more details, and Top2GatingOnLogitsSparse for
+  sparse_dispatch.
 
   Note that for local_dispatch original batch BLM is reshaped into GSM, each
   group `g = 0...G-1` is being dispatched independently.
@@ -861,16 +1133,29 @@ def Top2Gating(w,
       `(group_size * capacity_factor) / experts_dim`
       where `group_size` is the size of G dimension of `inputs`. If the
       value of expert_capacity_dim is already big enough no change is made.
+    sparse_dispatch: bool, if True returns the sparse assignments of
+      Top2GatingOnLogitsSparse, to be used with
+      FeedForwardNetworksApplySparseGating, instead of G`SEC tensors.
+    reroute_dropped: bool, re-routes the assignments dropped because their
+      expert is over capacity. Needs sparse_dispatch.
 
   Returns:
-    A tuple (dispatch_tensor, combine_tensor, aux_loss).
+    A NestedMap with
 
     - dispatch_tensor: G`SEC Tensor, scattering/dispatching inputs to
       experts.
     - combine_tensor: G`SEC Tensor.
       combining expert outputs.
     - aux_loss: auxiliary loss, equalizing the expert assignment ratios.
+
+    or with sparse_dispatch, the NestedMap of Top2GatingOnLogitsSparse, its
+    GSK tensors having the G`S dims of `inputs`.
+
+  Raises:
+    ValueError: if reroute_dropped is set without sparse_dispatch.
   """
+  if reroute_dropped and not sparse_dispatch:
+    raise ValueError('reroute_dropped needs sparse_dispatch.')
   orig_inputs = inputs
   if not local_dispatch:
     inputs = tf.reshape(inputs, [1, inputs.shape[0] * inputs.shape[1], -1])
@@ -883,6 +1168,19 @@ def Top2Gating(w,
 
   tpu_summary.tensor('top1_expert', top1_expert_per_example)
 
+  if sparse_dispatch:
+    gating = Top2GatingOnLogitsSparse(paddings, logits, experts_dim,
+                                      expert_capacity_dim, fprop_dtype,
+                                      second_expert_policy,
+                                      second_expert_threshold,
+                                      legacy_mtf_behavior, capacity_factor,
+                                      reroute_dropped)
+    if not local_dispatch:
+      gsk_shape = py_utils.GetShape(orig_inputs)[:2] + [-1]
+      gating.dispatch_index = tf.reshape(gating.dispatch_index, gsk_shape)
+      gating.combine_weight = tf.reshape(gating.combine_weight, gsk_shape)
+    return gating
+
   aux_loss, combine_tensor, dispatch_tensor = Top2GatingOnLogits(
       inputs, paddings, logits, num_devices, experts_dim, expert_capacity_dim,
       fprop_dtype, use_xla_sharding, second_expert_policy,
@@ -992,6 +1290,75 @@ def FeedForwardNetworksApplyGating(gating,
   return outputs, aux_loss
 
 
+def FeedForwardNetworksApplySparseGating(gating,
+                                         inputs,
+                                         reshaped_inputs,
+                                         wi_split,
+                                         wo_split,
+                                         bi_split=None,
+                                         bo_split=None,
+                                         dropout_rate=0.0):
+  """Apply sparse top_2 gating to feedforward networks.
+
+  Counterpart of FeedForwardNetworksApplyGating for the gating of
+  Top2GatingOnLogitsSparse: each expert slot gathers the token dispatched to
+  it, and each token gathers the outputs of its slots, so that no G`SEC
+  tensor is built.
+
+  Args:
+    gating: returns from Top2Gating with sparse_dispatch consisting of:
+      dispatch_index, G`SK int32 Tensor, the expert slot of each assignment or
+      -1. combine_weight, G`SK Tensor, combining expert outputs.
+      slots_per_expert, number of slots of each expert. aux_loss. auxiliary
+      loss, equalizing the expert assignment ratios.
+    inputs: G`SM Tensor.
+    reshaped_inputs: G`SM Tensor, with the G`S dims of gating.
+    wi_split: First projection weights [E, M, H] of the feedforward networks.
+    wo_split: Last projection weights [E, H, M] of the feedforward networks.
+    bi_split: First projection bias [E, 1, H] of the feedforward networks.
+    bo_split: Last projection bias [E, 1, M] of the feedforward networks.
+    dropout_rate: Dropout rate.
+
+  Returns:
+    outputs: G`SM Tensor.
+    aux_loss: scalar auxilliar loss.
+  """
+  # pylint: disable=invalid-name
+  M = py_utils.GetShape(reshaped_inputs)[-1]
+  E = py_utils.GetShape(wi_split)[0]
+  A = gating.slots_per_expert
+  K = py_utils.GetShape(gating.dispatch_index)[-1]
+  # pylint: enable=invalid-name
+  flat_inputs = tf.reshape(reshaped_inputs, [-1, M])
+  dispatch_index = tf.reshape(gating.dispatch_index, [-1])
+  token = tf.range(tf.size(dispatch_index)) // K
+  # The token dispatched to each slot, negative for empty slots. Dropped
+  # assignments have a negative index, which segment ops ignore.
+  slot_token = tf.math.unsorted_segment_max(token, dispatch_index, E * A)
+  expert_inputs = tf.gather(flat_inputs, tf.maximum(slot_token, 0))
+  expert_inputs *= tf.cast(slot_token >= 0, expert_inputs.dtype)[:, tf.newaxis]
+  expert_inputs = tf.reshape(expert_inputs, [E, A, M])
+
+  h = tf.einsum('EAM,EMH->EAH', expert_inputs, wi_split)
+  if bi_split is not None:
+    h += bi_split
+  h = tf.nn.relu(h)
+  if dropout_rate:
+    h = tf.nn.dropout(h, dropout_rate)
+  expert_outputs = tf.einsum('EAH,EHM->EAM', h, wo_split)
+  if bo_split is not None:
+    expert_outputs += bo_split
+  expert_outputs = tf.reshape(expert_outputs, [E * A, M])
+
+  # [G*S, K, M], the outputs of dropped assignments have a 0 combine weight.
+  token_outputs = tf.reshape(
+      tf.gather(expert_outputs, tf.maximum(dispatch_index, 0)), [-1, K, M])
+  combine_weight = tf.reshape(gating.combine_weight, [-1, K])
+  outputs = tf.einsum('TK,TKM->TM', combine_weight, token_outputs)
+  outputs = tf.reshape(outputs, inputs.shape)
+  return outputs, gating.aux_loss
+
+
 def GatherK(selected_pos, values, k, num_devices=1):
   """Gather up to k elements from given tensors at selected pos under SPMD.
 
@@ -0,0 +1,183 @@
+# Lint as: python3
+# Copyright 2020 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for moe_layers."""
+
+from absl.testing import parameterized
+import lingvo.compat as tf
+from lingvo.core import moe_layers
+from lingvo.core import test_utils
+from lingvo.core import tpu_summary
+import numpy as np
+
+
+def _MoE(inputs, paddings, sparse_dispatch, experts_dim, expert_capacity_dim,
+         hidden_dim, **kwargs):
+  """Returns the outputs and aux_loss of a MoE layer with fixed weights."""
+  num_groups, _, model_dim = inputs.shape.as_list()
+  np.random.seed(12345)
+  w = tf.constant(
+      np.random.normal(size=[model_dim, experts_dim]).astype(np.float32))
+  wi = tf.constant(
+      np.random.normal(size=[experts_dim, model_dim, hidden_dim]).astype(
+          np.float32))
+  wo = tf.constant(
+      np.random.normal(size=[experts_dim, hidden_dim, model_dim]).astype(
+          np.float32))
+  gating = moe_layers.Top2Gating(
+      w,
+      inputs,
+      paddings,
+      num_devices=1,
+      experts_dim=experts_dim,
+      expert_capacity_dim=expert_capacity_dim,
+      fprop_dtype=tf.float32,
+      use_xla_sharding=False,
+      sparse_dispatch=sparse_dispatch,
+      **kwargs)
+  if sparse_dispatch:
+    return moe_layers.FeedForwardNetworksApplySparseGating(
+        gating, inputs, inputs, wi, wo)
+  return moe_layers.FeedForwardNetworksApplyGating(
+      gating, inputs, inputs, wi, wo, num_devices=1, num_groups=num_groups)
+
+
+class MoELayersTest(test_utils.TestCase, parameterized.TestCase):
+
+  @parameterized.named_parameters(
+      ('Legacy', True, True),
+      ('NotLegacy', False, True),
+      ('NotLocalDispatch', True, False),
+  )
+  def testSparseDispatchMatchesDense(self, legacy_mtf_behavior,
+                                     local_dispatch):
+    with self.session():
+      inputs = tf.constant(
+          np.random.normal(size=[2, 16, 8]).astype(np.float32))
+      paddings = tf.constant([[0.] * 12 + [1.] * 4, [0.] * 16])
+      outputs = {}
+      for sparse_dispatch in (False, True):
+        y, aux_loss = _MoE(
+            inputs,
+            paddings,
+            sparse_dispatch,
+            experts_dim=4,
+            expert_capacity_dim=3,
+            hidden_dim=16,
+            local_dispatch=local_dispatch,
+            legacy_mtf_behavior=legacy_mtf_behavior)
+        dy_dx, = tf.gradients(tf.reduce_sum(tf.square(y)), [inputs])
+        outputs[sparse_dispatch] = self.evaluate([y, aux_loss, dy_dx])
+      for dense, sparse in zip(outputs[False], outputs[True]):
+        self.assertAllClose(dense, sparse, rtol=1e-5, atol=1e-5)
+
+  def _SparseGating(self, reroute_dropped):
+    # All the tokens prefer expert 0, then 1, 2 and 3.
+    logits = tf.constant([[[3., 2., 1., 0.]] * 6])
+    with tpu_summary.context():
+      gating = moe_layers.Top2GatingOnLogitsSparse(
+          paddings=None,
+          logits=logits,
+          experts_dim=4,
+          expert_capacity_dim=2,
+          fprop_dtype=tf.float32,
+          reroute_dropped=reroute_dropped)
+      summaries = tpu_summary.merge_all()
+    return self.evaluate(
+        [gating.dispatch_index, gating.combine_weight,
+         summaries['dropped_token_ratio/']])
+
+  def testSparseGatingDropsOverflow(self):
+    with self.session():
+      dispatch_index, combine_weight, dropped_ratio = self._SparseGating(
+          reroute_dropped=False)
+    # Slots are [E, G, C]: expert 1 starts at slot 2.
+    self.assertAllEqual([[[0, 2], [1, 3]] + [[-1, -1]] * 4], dispatch_index)
+    self.assertAllEqual(np.zeros([4, 2]), combine_weight[0, 2:])
+    self.assertAllClose(1., np.sum(combine_weight[0, 0]))
+    self.assertAllClose(4. / 6., dropped_ratio)
+
+  def testSparseGatingReroutesToIdleExperts(self):
+    with self.session():
+      dispatch_index, combine_weight, dropped_ratio = self._SparseGating(
+          reroute_dropped=True)
+    # Tokens 2 and 3 fill the capacity of experts 2 and 3.
+    self.assertAllEqual(
+        [[[0, 2], [1, 3], [4, 6], [5, 7]] + [[-1, -1]] * 2], dispatch_index)
+    # Re-routed assignments keep the combine weights of the dropped ones.
+    self.assertAllClose(combine_weight[0, 0], combine_weight[0, 2])
+    self.assertAllEqual(np.zeros([2, 2]), combine_weight[0, 4:])
+    self.assertAllClose(2. / 6., dropped_ratio)
+
+  def testRerouteDroppedNeedsSparseDispatch(self):
+    with self.assertRaisesRegex(ValueError, 'needs sparse_dispatch'):
+      moe_layers.Top2Gating(
+          tf.zeros([8, 4]),
+          tf.zeros([1, 4, 8]),
+          None,
+          num_devices=1,
+          experts_dim=4,
+          expert_capacity_dim=2,
+          local_dispatch=True,
+          fprop_dtype=tf.float32,
+          reroute_dropped=True)
+
+
+class MoEDispatchBenchmark(tf.test.Benchmark):
+  """Benchmarks the dense and the sparse dispatch of a MoE layer on CPU.
+
+  Reports the wall time and the peak memory of the forward and backward pass
+  of a MoE layer for 8 to 64 experts, with the dense G`SEC dispatch and combine
+  tensors against the sparse dispatch of Top2GatingOnLogitsSparse.
+
+  Run with::
+
+    bazel run -c opt lingvo/core:moe_layers_test -- --benchmarks=.
+  """
+
+  def _Benchmark(self, sparse_dispatch, experts_dim, num_groups=8,
+                 group_size=1024, model_dim=256, hidden_dim=512):
+    with tf.Graph().as_default(), tf.device('/cpu:0'):
+      inputs = tf.random.normal([num_groups, group_size, model_dim])
+      outputs, aux_loss = _MoE(
+          inputs,
+          None,
+          sparse_dispatch,
+          experts_dim=experts_dim,
+          expert_capacity_dim=2 * group_size // experts_dim,
+          hidden_dim=hidden_dim,
+          local_dispatch=True)
+      loss = tf.reduce_mean(tf.square(outputs)) + aux_loss
+      grads = tf.gradients(loss, [inputs])
+      with tf.Session() as sess:
+        self.run_op_benchmark(
+            sess,
+            tf.group(grads),
+            min_iters=5,
+            store_memory_usage=True,
+            name='%s_%d_experts' %
+            ('sparse' if sparse_dispatch else 'dense', experts_dim))
+
+  def benchmarkDenseDispatch(self):
+    for experts_dim in (8, 16, 32, 64):
+      self._Benchmark(False, experts_dim)
+
+  def benchmarkSparseDispatch(self):
+    for experts_dim in (8, 16, 32, 64):
+      self._Benchmark(True, experts_dim)
+
+
+if __name__ == '__main__':
+  tf.test.main()
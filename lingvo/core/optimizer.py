@@ -340,6 +340,49 @@ class AdaDelta(Base):
     summary_utils.scalar('adadelta_lr', lr)
 
 
+class _LazyAdamOptimizer(tf.train.AdamOptimizer):
+  """tf.train.AdamOptimizer only updating the rows of sparse gradients.
+
+  The moments of the rows without gradient do not decay, and these rows are
+  not updated, as in tf.contrib.opt.LazyAdamOptimizer. Dense gradients are
+  applied as by tf.train.AdamOptimizer.
+  """
+
+  def _ApplySparseRows(self, values, var, indices):
+    """Applies the gradient `values` of the unique rows `indices` of `var`."""
+    dtype = var.dtype.base_dtype
+    beta1_power, beta2_power = self._get_beta_accumulators()
+    beta1_power = tf.cast(beta1_power, dtype)
+    beta2_power = tf.cast(beta2_power, dtype)
+    beta1 = tf.cast(self._beta1_t, dtype)
+    beta2 = tf.cast(self._beta2_t, dtype)
+    epsilon = tf.cast(self._epsilon_t, dtype)
+    lr = (
+        tf.cast(self._lr_t, dtype) * tf.sqrt(1 - beta2_power) /
+        (1 - beta1_power))
+
+    m = self.get_slot(var, 'm')
+    m_rows = beta1 * tf.gather(m, indices) + (1 - beta1) * values
+    v = self.get_slot(var, 'v')
+    v_rows = beta2 * tf.gather(v, indices) + (1 - beta2) * tf.square(values)
+    m_update = tf.scatter_update(
+        m, indices, m_rows, use_locking=self._use_locking)
+    v_update = tf.scatter_update(
+        v, indices, v_rows, use_locking=self._use_locking)
+    var_update = tf.scatter_sub(
+        var,
+        indices,
+        lr * m_rows / (tf.sqrt(v_rows) + epsilon),
+        use_locking=self._use_locking)
+    return tf.group(var_update, m_update, v_update)
+
+  def _apply_sparse(self, grad, var):
+    return self._ApplySparseRows(grad.values, var, grad.indices)
+
+  def _resource_apply_sparse(self, grad, var, indices):
+    return self._ApplySparseRows(grad, var, indices)
+
+
 class Adam(Base):
   """Adam."""
 
@@ -349,6 +392,12 @@ class Adam(Base):
     p.Define('beta1', 0.9, 'Beta1 for Adam.')
     p.Define('beta2', 0.999, 'Beta2 for Adam.')
     p.Define('epsilon', 1e-6, 'Epsilon for Adam.')
+    p.Define(
+        'lazy_sparse_updates', False,
+        'If True, sparse gradients, e.g. of embedding lookups, only update '
+        'the moments and values of the rows they touch, instead of decaying '
+        'the moments of every row. Cheaper for large embedding tables, but '
+        'not equivalent to Adam for the rows that are not looked up.')
     p.name = 'Adam'
     return p
 
@@ -364,7 +413,9 @@ class Adam(Base):
 
   def GetOptimizer(self, lr):
     p = self.params
-    return tf.train.AdamOptimizer(
+    optimizer_cls = (
+        _LazyAdamOptimizer if p.lazy_sparse_updates else tf.train.AdamOptimizer)
+    return optimizer_cls(
         learning_rate=lr,
         beta1=p.beta1,
         beta2=p.beta2,
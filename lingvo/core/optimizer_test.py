@@ -210,6 +210,39 @@ class OptimizerTest(test_utils.TestCase):
     self.assertAllClose(vars2, vars2_intermediate)
     self.assertAllClose(vars1_1, vars2_1)
 
+  def testAdamLazySparseUpdates(self):
+    with self.session(use_gpu=False):
+      init = np.random.normal(size=[10, 3]).astype(np.float32)
+      emb = tf.get_variable('emb', initializer=tf.constant(init))
+      lazy_emb = tf.get_variable('lazy_emb', initializer=tf.constant(init))
+      ids = tf.placeholder(tf.int32, shape=[None])
+
+      def _Update(opt_params, var):
+        loss = tf.reduce_sum(tf.square(tf.gather(var, ids)))
+        var_grads = py_utils.ComputeGradients(loss,
+                                              py_utils.NestedMap(var=var))
+        return opt_params.Instantiate().Apply(0.1, var_grads)
+
+      update = _Update(optimizer.Adam.Params().Set(name='adam'), emb)
+      lazy_update = _Update(
+          optimizer.Adam.Params().Set(name='lazy_adam',
+                                      lazy_sparse_updates=True), lazy_emb)
+      self.evaluate(tf.global_variables_initializer())
+
+      # On the first step, rows without gradient have zero moments, so both
+      # only update the looked up rows.
+      self.evaluate([update, lazy_update], feed_dict={ids: [1, 3, 3]})
+      emb_1, lazy_emb_1 = self.evaluate([emb, lazy_emb])
+      self.assertAllClose(emb_1, lazy_emb_1)
+      self.assertAllClose(init[[0, 2, 4]], lazy_emb_1[[0, 2, 4]])
+
+      # Rows 1 and 3 still move with Adam, but not with lazy updates.
+      self.evaluate([update, lazy_update], feed_dict={ids: [0, 2]})
+      emb_2, lazy_emb_2 = self.evaluate([emb, lazy_emb])
+      self.assertAllClose(emb_2[[0, 2]], lazy_emb_2[[0, 2]])
+      self.assertNotAllClose(emb_1[[1, 3]], emb_2[[1, 3]])
+      self.assertAllClose(lazy_emb_1[[1, 3]], lazy_emb_2[[1, 3]])
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -16,15 +16,18 @@
 """Utilities for generating image summaries using matplotlib."""
 
 import collections
+import concurrent.futures
 import functools
 import traceback
 
 import lingvo.compat as tf
 from lingvo.core import py_utils
+import matplotlib
 from matplotlib.backends import backend_agg
 import matplotlib.gridspec as gridspec
 import matplotlib.pyplot as plt
 import numpy as np
+import PIL.Image
 import six
 
 
@@ -161,7 +164,8 @@ class MatplotlibFigureSummary:
                subplot_grid_shape=None,
                gridspec_kwargs=None,
                plot_func=AddImage,
-               shared_subplot_kwargs=None):
+               shared_subplot_kwargs=None,
+               num_render_threads=1):
     """Creates a new MatplotlibFigureSummary object.
 
     Args:
@@ -179,6 +183,9 @@ class MatplotlibFigureSummary:
       shared_subplot_kwargs: A dict of extra keyword args to pass to the plot
         function for all subplots.  This is useful for specifying properties
         such as 'clim' which should be consistent across all subplots.
+      num_render_threads: If > 1, examples in the batch are rendered on a
+        pool of this many threads. Each thread reuses a single prebuilt figure
+        for all the examples assigned to it.
     """
     self._name = name
     self._figsize = figsize
@@ -188,6 +195,7 @@ class MatplotlibFigureSummary:
     self._plot_func = plot_func
     self._shared_subplot_kwargs = (
         shared_subplot_kwargs if shared_subplot_kwargs else {})
+    self._num_render_threads = num_render_threads
     self._subplots = []
 
   def __enter__(self):
@@ -234,16 +242,23 @@ class MatplotlibFigureSummary:
       subplot_slices.append((start, start + len(subplot.tensor_list)))
       flattened_tensors.extend(subplot.tensor_list)
 
-    def PlotFunc(fig, *numpy_data_list):
+    def LayoutFunc(fig):
       gs = gridspec.GridSpec(*subplot_grid_shape, **self._gridspec_kwargs)
+      return [fig.add_subplot(gs[n]) for n in range(len(self._subplots))]
+
+    def PlotFunc(fig, axes_list, *numpy_data_list):
       for n, subplot in enumerate(self._subplots):
-        axes = fig.add_subplot(gs[n])
         start, end = subplot_slices[n]
         subplot_data = numpy_data_list[start:end]
-        subplot.plot_func(fig, axes, *subplot_data)
-
-    func = functools.partial(_RenderMatplotlibFigures, self._figsize,
-                             self._max_outputs, PlotFunc)
+        subplot.plot_func(fig, axes_list[n], *subplot_data)
+
+    func = functools.partial(
+        _RenderMatplotlibFigures,
+        self._figsize,
+        self._max_outputs,
+        PlotFunc,
+        layout_func=LayoutFunc,
+        num_threads=self._num_render_threads)
     batch_sizes = [tf.shape(t)[0] for t in flattened_tensors]
     num_tensors = len(flattened_tensors)
     with tf.control_dependencies([
@@ -259,16 +274,170 @@ class MatplotlibFigureSummary:
     return tf.summary.image(self._name, rendered, max_outputs=self._max_outputs)
 
 
-def _RenderOneMatplotlibFigure(fig, plot_func, *numpy_data_list):
-  fig.clear()
-  plot_func(fig, *numpy_data_list)
-  fig.canvas.draw()
-  ncols, nrows = fig.canvas.get_width_height()
-  image = np.frombuffer(fig.canvas.tostring_rgb(), dtype=np.uint8)
-  return image.reshape(nrows, ncols, 3)
+class _FigureTemplate:
+  """A reusable figure, canvas and (optionally) prebuilt axes layout.
+
+  Creating a figure and laying out its axes is a significant fraction of the
+  cost of rendering small plots. A template builds them once and only clears
+  the contents of the axes between examples. If the previous example added
+  extra axes (e.g. colorbars, which also steal space from their parent axes),
+  the figure is rebuilt from scratch so every example renders identically.
+  """
+
+  def __init__(self, figsize, layout_func=None):
+    """Constructor.
+
+    Args:
+      figsize: A 2D tuple containing the overall figure (width, height)
+        dimensions in inches.
+      layout_func: An optional function f(fig) returning the list of axes to
+        plot into. If None, the figure is cleared before each example and the
+        plot function is responsible for creating its own axes.
+    """
+    # Use plt.Figure instead of plt.figure to avoid a memory leak (matplotlib
+    # keeps global references to every figure created with plt.figure). When
+    # not using plt.figure we have to create a canvas manually.
+    self._fig = plt.Figure(figsize=figsize, dpi=100, facecolor='white')
+    backend_agg.FigureCanvasAgg(self._fig)
+    self._layout_func = layout_func
+    self._axes_list = None
+
+  def _CanReuseAxes(self):
+    """Whether the previous example left the figure layout untouched."""
+    fig = self._fig
+    return (self._axes_list is not None and
+            len(fig.axes) == len(self._axes_list) and not fig.texts and
+            not fig.legends and not fig.images and not fig.patches and
+            not fig.lines)
+
+  def _ResetAxes(self):
+    """Returns the template axes, cleared and ready for a new example."""
+    if self._CanReuseAxes():
+      for axes in self._axes_list:
+        axes.clear()
+      return self._axes_list
+    self._fig.clear()
+    self._axes_list = self._layout_func(self._fig)
+    return self._axes_list
+
+  def Plot(self, plot_func, *numpy_data_list):
+    """Plots one example into the figure.
+
+    Args:
+      plot_func: A function with signature f(fig, data1, ..., datan) if the
+        template has no layout_func, or f(fig, axes_list, data1, ..., datan)
+        otherwise.
+      *numpy_data_list: The data of one example.
+    """
+    if self._layout_func is None:
+      self._fig.clear()
+      plot_func(self._fig, *numpy_data_list)
+    else:
+      plot_func(self._fig, self._ResetAxes(), *numpy_data_list)
+
+  def ToArray(self):
+    """Draws the figure and returns it as an [height, width, 3] uint8 array."""
+    self._fig.canvas.draw()
+    ncols, nrows = self._fig.canvas.get_width_height()
+    image = np.frombuffer(self._fig.canvas.tostring_rgb(), dtype=np.uint8)
+    return image.reshape(nrows, ncols, 3)
+
+  def ToPng(self):
+    """Draws the figure and returns (height, width, encoded png bytes)."""
+    self._fig.canvas.draw()
+    ncols, nrows = self._fig.canvas.get_width_height()
+    png_file = six.BytesIO()
+    self._fig.canvas.print_figure(png_file)
+    return nrows, ncols, png_file.getvalue()
+
+  def Close(self):
+    # The figure is not managed by pyplot, so this only drops its artists.
+    self._fig.clear()
+
+
+def _RenderExamples(figsize, layout_func, example_fns, encode_png, indices):
+  """Renders example_fns[i] for i in indices on one reused figure template.
+
+  Args:
+    figsize: A 2D tuple containing the overall figure (width, height)
+      dimensions in inches.
+    layout_func: Optional layout function, see `_FigureTemplate`.
+    example_fns: A list of functions f(template) which plot one example each.
+    encode_png: If True, returns the output of `_FigureTemplate.ToPng`,
+      otherwise the output of `_FigureTemplate.ToArray`.
+    indices: The indices into example_fns to render.
+
+  Returns:
+    A list of (index, rendered) tuples. rendered is None if the example
+    could not be rendered.
+  """
+  template = _FigureTemplate(figsize, layout_func)
+  results = []
+  for i in indices:
+    try:
+      example_fns[i](template)
+      rendered = template.ToPng() if encode_png else template.ToArray()
+    except Exception as e:  # pylint: disable=broad-except
+      tf.logging.warning('Error rendering example %d using matplotlib: %s\n%s',
+                         i, e, traceback.format_exc())
+      rendered = None
+    results.append((i, rendered))
+  template.Close()
+  return results
+
+
+def _RenderFigures(figsize,
+                   example_fns,
+                   layout_func=None,
+                   num_threads=1,
+                   encode_png=False):
+  """Renders a list of examples, optionally on a pool of threads.
+
+  This runs inside tf.py_func, in a multi-threaded process which must not be
+  forked, and the plot functions are usually closures which cannot be pickled
+  to spawned processes. Threads are safe since each of them renders on its own
+  figure and Agg canvas, without pyplot's global state.
 
+  Args:
+    figsize: A 2D tuple containing the overall figure (width, height)
+      dimensions in inches.
+    example_fns: A list of functions f(template) which plot one example each
+      into a `_FigureTemplate`.
+    layout_func: Optional layout function, see `_FigureTemplate`.
+    num_threads: The number of threads to render with. Rendering happens in
+      the calling thread if this is <= 1 or if there is only one example.
+    encode_png: Whether to return encoded png images instead of arrays.
 
-def _RenderMatplotlibFigures(figsize, max_outputs, plot_func, *numpy_data_list):
+  Returns:
+    A list with the rendered output for each example, or None for examples
+    which could not be rendered.
+  """
+  num_threads = min(num_threads, len(example_fns))
+  render_fn = functools.partial(_RenderExamples, figsize, layout_func,
+                                example_fns, encode_png)
+  if num_threads <= 1:
+    results = render_fn(range(len(example_fns)))
+  else:
+    # Round-robin assignment of examples to threads so that each thread
+    # renders several examples on the same figure template.
+    chunks = [
+        list(range(len(example_fns)))[i::num_threads]
+        for i in range(num_threads)
+    ]
+    with concurrent.futures.ThreadPoolExecutor(num_threads) as pool:
+      results = sum(pool.map(render_fn, chunks), [])
+  rendered = [None] * len(example_fns)
+  for i, output in results:
+    rendered[i] = output
+  return rendered
+
+
+def _RenderMatplotlibFigures(figsize,
+                             max_outputs,
+                             plot_func,
+                             *numpy_data_list,
+                             layout_func=None,
+                             num_threads=1):
   r"""Renders a figure containing several subplots using matplotlib.
 
   This is an internal implementation detail of MatplotlibFigureSummary.Finalize
@@ -282,9 +451,13 @@ def _RenderMatplotlibFigures(figsize, max_outputs, plot_func, *numpy_data_list):
       in inches.
     max_outputs: The maximum number of images to generate.
     plot_func: A function with signature f(fig, data1, data2, ..., datan) that
-      will be called with \*numpy_data_list to plot data in fig.
+      will be called with \*numpy_data_list to plot data in fig. If layout_func
+      is set, the signature is f(fig, axes_list, data1, data2, ..., datan).
     *numpy_data_list: A list of numpy matrices to plot specified as separate
       arguments.
+    layout_func: Optional function f(fig) returning the list of axes passed to
+      plot_func. The axes are created once and reused across examples.
+    num_threads: Number of threads to render the examples with.
 
   Returns:
     A numpy 4D array of type np.uint8 which can be used to generate a
@@ -292,25 +465,17 @@ def _RenderMatplotlibFigures(figsize, max_outputs, plot_func, *numpy_data_list):
   """
   batch_size = numpy_data_list[0].shape[0]
   max_outputs = min(max_outputs, batch_size)
-  images = []
 
-  # Use plt.Figure instead of plt.figure to avoid a memory leak (matplotlib
-  # keeps global references to every figure created with plt.figure). When not
-  # using plt.figure we have to create a canvas manually.
-  fig = plt.Figure(figsize=figsize, dpi=100, facecolor='white')
-  backend_agg.FigureCanvasAgg(fig)
+  def _PlotExample(b, template):
+    template.Plot(plot_func, *[numpy_data[b] for numpy_data in numpy_data_list])
 
-  for b in range(max_outputs):
-    data = [numpy_data[b] for numpy_data in numpy_data_list]
-    try:
-      images.append(_RenderOneMatplotlibFigure(fig, plot_func, *data))
-    except Exception as e:  # pylint: disable=broad-except
-      tf.logging.warning(
-          'Error rendering example %d using matplotlib: %s\n%s', b, e,
-          traceback.format_exc())
-    if len(images) == max_outputs:
-      break
-  plt.close(fig)
+  example_fns = [functools.partial(_PlotExample, b) for b in range(max_outputs)]
+  rendered = _RenderFigures(
+      figsize,
+      example_fns,
+      layout_func=layout_func,
+      num_threads=num_threads)
+  images = [image for image in rendered if image is not None]
 
   # Pad with dummy black images in case there were too many rendering errors.
   while len(images) < max_outputs:
@@ -322,6 +487,18 @@ def _RenderMatplotlibFigures(figsize, max_outputs, plot_func, *numpy_data_list):
   return np.array(images)
 
 
+def _ImageSummary(name, height, width, png_str):
+  return tf.Summary(value=[
+      tf.Summary.Value(
+          tag='%s/image' % name,
+          image=tf.Summary.Image(
+              height=height,
+              width=width,
+              colorspace=3,
+              encoded_image_string=png_str))
+  ])
+
+
 def FigureToSummary(name, fig):
   """Create tf.Summary proto from matplotlib.figure.Figure.
 
@@ -338,15 +515,7 @@ def FigureToSummary(name, fig):
   png_file = six.BytesIO()
   canvas.print_figure(png_file)
   png_str = png_file.getvalue()
-  return tf.Summary(value=[
-      tf.Summary.Value(
-          tag='%s/image' % name,
-          image=tf.Summary.Image(
-              height=nrows,
-              width=ncols,
-              colorspace=3,
-              encoded_image_string=png_str))
-  ])
+  return _ImageSummary(name, nrows, ncols, png_str)
 
 
 def Image(name, figsize, image, setter=None, **kwargs):
@@ -367,15 +536,125 @@ def Image(name, figsize, image, setter=None, **kwargs):
   assert image.ndim in (2, 3), '%s' % image.shape
   fig = plt.Figure(figsize=figsize, dpi=100, facecolor='white')
   axes = fig.add_subplot(1, 1, 1)
+  _PlotImage(fig, [axes], image, setter, **kwargs)
+  return FigureToSummary(name, fig)
+
+
+def _SingleAxesLayout(fig):
+  return [fig.add_subplot(1, 1, 1)]
+
+
+def _PlotImage(fig, axes_list, image, setter=None, **kwargs):
+  """Plots image on axes_list[0] with the defaults of `Image`."""
   # Default show_colorbar to False if not explicitly specified.
   show_colorbar = kwargs.pop('show_colorbar', False)
   # Default origin to 'upper' if not explicitly specified.
   origin = kwargs.pop('origin', 'upper')
   AddImage(
-      fig, axes, image, origin=origin, show_colorbar=show_colorbar, **kwargs)
+      fig,
+      axes_list[0],
+      image,
+      origin=origin,
+      show_colorbar=show_colorbar,
+      **kwargs)
   if setter:
-    setter(fig, axes)
-  return FigureToSummary(name, fig)
+    setter(fig, axes_list[0])
+
+
+def Images(names, figsize, images, setters=None, num_threads=1, **kwargs):
+  """Plots several images and generates one tf.Summary proto for all of them.
+
+  This is equivalent to calling `Image` for each image and merging the
+  results, but reuses one figure for all images and can render them on a pool
+  of threads.
+
+  Args:
+    names: A list of image summary names.
+    figsize: A 2D tuple containing the overall figure (width, height) dimensions
+      in inches.
+    images: A list of 2D/3D numpy arrays in the format accepted by
+      pyplot.imshow, of the same length as names.
+    setters: An optional list of callables taking (fig, axes), one per image.
+    num_threads: The number of threads to render the images with.
+    **kwargs: Additional arguments to AddImage, shared by all images.
+
+  Returns:
+    A `tf.Summary` proto containing one value per successfully rendered image.
+  """
+  assert len(names) == len(images), (len(names), len(images))
+  if setters is None:
+    setters = [None] * len(images)
+  assert len(setters) == len(images), (len(setters), len(images))
+
+  def _PlotExample(image, setter, template):
+    assert image.ndim in (2, 3), '%s' % image.shape
+    template.Plot(
+        functools.partial(_PlotImage, setter=setter, **kwargs), image)
+
+  example_fns = [
+      functools.partial(_PlotExample, image, setter)
+      for image, setter in zip(images, setters)
+  ]
+  rendered = _RenderFigures(
+      figsize,
+      example_fns,
+      layout_func=_SingleAxesLayout,
+      num_threads=num_threads,
+      encode_png=True)
+  ret = tf.Summary()
+  for name, output in zip(names, rendered):
+    if output is not None:
+      ret.value.extend(_ImageSummary(name, *output).value)
+  return ret
+
+
+@functools.lru_cache(maxsize=None)
+def _ColormapLookupTable(cmap):
+  """Returns the [256, 3] uint8 RGB lookup table of a matplotlib colormap."""
+  return matplotlib.colormaps[cmap](np.arange(256), bytes=True)[:, :3]
+
+
+def RawImage(name, image, cmap=None, vmin=None, vmax=None, origin='upper'):
+  """Generates a tf.Summary proto for a numpy image without matplotlib.
+
+  This is a fast path for pure image summaries which do not need axes, titles
+  or annotations: pixels are colormapped with numpy and encoded with PIL, one
+  summary pixel per image pixel.
+
+  Args:
+    name: Image summary name.
+    image: A [height, width] numpy array, or a [height, width, 3] RGB numpy
+      array which is either uint8 or float in [0, 1].
+    cmap: Name of the matplotlib colormap for 2D images. Defaults to grayscale.
+    vmin: The data value mapped to the lowest colormap value of 2D images.
+      Defaults to the minimum of image.
+    vmax: The data value mapped to the highest colormap value of 2D images.
+      Defaults to the maximum of image.
+    origin: 'upper' or 'lower', with the same meaning as in pyplot.imshow.
+
+  Returns:
+    A `tf.Summary` proto contains one image visualizing 'image'.
+  """
+  assert image.ndim in (2, 3), '%s' % image.shape
+  assert origin in ('upper', 'lower'), origin
+  if image.ndim == 2:
+    image = image.astype(np.float32)
+    vmin = np.min(image) if vmin is None else vmin
+    vmax = np.max(image) if vmax is None else vmax
+    scaled = (image - vmin) / max(vmax - vmin, np.finfo(np.float32).tiny)
+    indices = np.clip(scaled * 255. + 0.5, 0, 255).astype(np.uint8)
+    if cmap is None:
+      image = np.stack([indices] * 3, axis=-1)
+    else:
+      image = _ColormapLookupTable(cmap)[indices]
+  elif image.dtype != np.uint8:
+    image = np.clip(image * 255. + 0.5, 0, 255).astype(np.uint8)
+  if origin == 'lower':
+    image = image[::-1]
+  height, width = image.shape[:2]
+  png_file = six.BytesIO()
+  PIL.Image.fromarray(np.ascontiguousarray(image)).save(png_file, format='PNG')
+  return _ImageSummary(name, height, width, png_file.getvalue())
 
 
 def Scatter(name, figsize, xs, ys, setter=None, **kwargs):
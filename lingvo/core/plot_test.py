@@ -45,6 +45,48 @@ class PlotTest(test_utils.TestCase):
     self.assertGreater(value.image.width, 0)
     self.assertGreater(value.image.height, 0)
 
+  def testImagesMatchesImage(self):
+    images = [np.random.rand(10, 10), np.random.rand(5, 8, 3)]
+    names = ['image0', 'image1']
+    for num_threads in (1, 2):
+      summary = plot.Images(
+          names, (4, 4), images, num_threads=num_threads, aspect='equal')
+      self.assertEqual(len(summary.value), 2)
+      for name, image, value in zip(names, images, summary.value):
+        expected = plot.Image(name, (4, 4), image, aspect='equal').value[0]
+        self.assertEqual(value.tag, expected.tag)
+        self.assertEqual(value.image.width, expected.image.width)
+        self.assertEqual(value.image.height, expected.image.height)
+
+  def testImagesSkipsFailedImages(self):
+    summary = plot.Images(['bad', 'good'], (4, 4),
+                          [np.random.rand(10), np.random.rand(10, 10)])
+    self.assertEqual(len(summary.value), 1)
+    self.assertEqual(summary.value[0].tag, 'good/image')
+
+  def testRawImage(self):
+    image = np.arange(12, dtype=np.float32).reshape(3, 4)
+    summary = plot.RawImage('raw', image, cmap='bone_r')
+    self.assertEqual(len(summary.value), 1)
+    value = summary.value[0]
+    self.assertEqual(value.tag, 'raw/image')
+    self.assertEqual(value.image.width, 4)
+    self.assertEqual(value.image.height, 3)
+    self.assertEqual(value.image.colorspace, 3)
+    with self.session():
+      decoded = self.evaluate(
+          tf.image.decode_png(value.image.encoded_image_string))
+    self.assertAllEqual(decoded.shape, [3, 4, 3])
+
+  def testRawImageGrayscaleAndOrigin(self):
+    image = np.array([[0., 1.], [0.5, 1.]])
+    summary = plot.RawImage('raw', image, origin='lower')
+    with self.session():
+      decoded = self.evaluate(
+          tf.image.decode_png(summary.value[0].image.encoded_image_string))
+    self.assertAllEqual(decoded[..., 0], [[128, 255], [0, 255]])
+    self.assertAllEqual(decoded[..., 0], decoded[..., 1])
+
 
 class MatplotlibFigureSummaryTest(test_utils.TestCase):
 
@@ -80,6 +122,46 @@ class MatplotlibFigureSummaryTest(test_utils.TestCase):
     self.assertEqual(value.image.encoded_image_string,
                      self.default_encoded_image)
 
+  def testMultipleRenderThreads(self):
+    batch_size = 4
+    data = tf.tile(tf.expand_dims(self.DEFAULT_DATA, 0), [batch_size, 1, 1])
+    with self.session() as s:
+      fig = plot.MatplotlibFigureSummary(
+          'parallel_figure',
+          self.FIGSIZE,
+          max_outputs=batch_size,
+          num_render_threads=2)
+      fig.AddSubplot([data])
+      im = fig.Finalize()
+      summary_str = s.run(im)
+    summary = tf.summary.Summary.FromString(summary_str)
+    self.assertEqual(len(summary.value), batch_size)
+    for n, value in enumerate(summary.value):
+      self.assertEqual(value.tag, 'parallel_figure/image/%d' % n)
+      self.assertEqual(value.image.encoded_image_string,
+                       self.default_encoded_image)
+
+  def testReusesAxesTemplate(self):
+    batch_size = 3
+    data = tf.tile(tf.expand_dims(self.DEFAULT_DATA, 0), [batch_size, 1, 1])
+    with self.session() as s:
+      fig = plot.MatplotlibFigureSummary(
+          'template_figure',
+          self.FIGSIZE,
+          max_outputs=batch_size,
+          shared_subplot_kwargs={'show_colorbar': False})
+      fig.AddSubplot([data])
+      fig.AddSubplot([data])
+      im = fig.Finalize()
+      summary_str = s.run(im)
+    summary = tf.summary.Summary.FromString(summary_str)
+    self.assertEqual(len(summary.value), batch_size)
+    # Examples rendered on reused axes are identical to the first example,
+    # which is rendered on a freshly built figure.
+    for value in summary.value[1:]:
+      self.assertEqual(value.image.encoded_image_string,
+                       summary.value[0].image.encoded_image_string)
+
   def testCanUseAsContextManager(self):
     with self.session() as s:
       with plot.MatplotlibFigureSummary(
@@ -34,19 +34,43 @@ from lingvo.core import py_utils
 from google.protobuf import text_format
 
 
-def LoadInferenceGraph(path, clear_device_placement=False):
+def _BinaryInferenceGraphPath(path):
+  """Returns the path of the binary InferenceGraph exported next to path."""
+  if path.endswith(".pbtxt"):
+    return path[:-len(".pbtxt")] + ".pb"
+  return path
+
+
+def LoadInferenceGraph(path, clear_device_placement=False, prefer_binary=True):
   """Parse the given path as an InferenceGraph proto.
 
   Args:
-    path: The path to the file to load.
+    path: The path to the file to load. Paths ending with ".pb" are parsed as
+      binary protos, other paths as text protos.
     clear_device_placement: If true, clears device field from nodes in graph.
+    prefer_binary: If true and path is a text proto, loads the binary proto
+      exported next to it instead (e.g. inference.pb for inference.pbtxt), if
+      it exists and is at least as recent as path.
 
   Returns:
     An InferenceGraph object.
   """
+  binary_path = _BinaryInferenceGraphPath(path)
+  if (prefer_binary and binary_path != path and
+      tf.io.gfile.exists(binary_path) and
+      tf.io.gfile.stat(binary_path).mtime_nsec >=
+      tf.io.gfile.stat(path).mtime_nsec):
+    tf.logging.info("Loading binary inference graph %s instead of %s.",
+                    binary_path, path)
+    path = binary_path
+
   inference_graph = inference_graph_pb2.InferenceGraph()
-  with tf.io.gfile.GFile(path, "r") as f:
-    text_format.Parse(f.read(), inference_graph)
+  if path.endswith(".pb"):
+    with tf.io.gfile.GFile(path, "rb") as f:
+      inference_graph.ParseFromString(f.read())
+  else:
+    with tf.io.gfile.GFile(path, "r") as f:
+      text_format.Parse(f.read(), inference_graph)
   if clear_device_placement:
     for node in inference_graph.graph_def.node:
       node.ClearField("device")
@@ -73,7 +97,9 @@ class Predictor:
     """Constructor.
 
     Args:
-      inference_graph: A saved InferenceGraph proto.
+      inference_graph: A saved InferenceGraph proto, or the path to one. A
+        binary proto exported next to the path is preferred, see
+        LoadInferenceGraph().
       subgraph_name: The subgraph to use for prediction.
       checkpoint: An optional checkpoint to load.
       device_type: Device type string. Either "cpu", "gpu", or "tpu".
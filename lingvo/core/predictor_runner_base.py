@@ -23,11 +23,17 @@ To run on TPU, set:
   --xla_device=tpu
   --tf_master=url/to/tpu/server
   --inference_threads=num_tpu_cores
+
+To use all the cores of a host for offline inference, implement PredictBatch
+and WriteBatch instead of RunBatch, and set:
+  --inference_sessions=num_sessions
 """
 
+import collections
 import concurrent.futures
 import itertools
 import os
+import queue
 import re
 import threading
 import time
@@ -51,6 +57,17 @@ flags.DEFINE_string(
 flags.DEFINE_enum('device_type', 'gpu', ['cpu', 'gpu', 'tpu'], 'Device type.')
 flags.DEFINE_string('tf_master', 'local', 'tf_master for predictor session.')
 flags.DEFINE_integer('inference_threads', '1', 'Number of inference threads.')
+flags.DEFINE_integer(
+    'inference_sessions', 0, 'If > 0, runs inference in a pipeline with this '
+    'many independent predictor sessions. Requires PredictBatch and '
+    'WriteBatch to be implemented.')
+flags.DEFINE_integer(
+    'output_threads', 1, 'Number of threads writing outputs when '
+    '--inference_sessions > 0. With more than 1 thread, batches start being '
+    'written in order, but their writes may overlap.')
+flags.DEFINE_bool(
+    'pin_inference_sessions', True, 'If True and --inference_sessions > 0, '
+    'each cpu predictor session runs on its own subset of the cpu cores.')
 flags.DEFINE_integer('batch_size', 64, 'Batch size.')
 flags.DEFINE_integer(
     'prediction_step_interval', 3000, 'Number of steps between outputs. '
@@ -75,6 +92,19 @@ FLAGS = flags.FLAGS
 
 _RETRY_SLEEP_SECONDS = 10
 
+# Number of batches buffered between the stages of the pipelined mode, per
+# predictor session.
+_PIPELINE_QUEUE_SIZE = 2
+
+# Marks the end of the batches in the queues of the pipelined mode.
+_END_OF_BATCHES = object()
+
+_Batch = collections.namedtuple('_Batch', ['batch_id', 'batch', 'results'])
+
+
+class _PipelineAborted(Exception):
+  """Raised in a pipeline stage when another stage failed."""
+
 
 class PredictorRunnerBase:
   """Manages state for running predictor.
@@ -96,7 +126,10 @@ class PredictorRunnerBase:
                tf_master='local',
                inference_threads=1,
                batch_size=64,
-               prediction_step_interval=3000):
+               prediction_step_interval=3000,
+               inference_sessions=0,
+               output_threads=1,
+               pin_inference_sessions=True):
     """Constructor.
 
     Args:
@@ -121,6 +154,15 @@ class PredictorRunnerBase:
       batch_size: Batch size.
       prediction_step_interval: Number of steps between outputs. Only meaningful
         if `checkpoint` is a directory.
+      inference_sessions: If > 0, runs in pipelined mode: a thread generates
+        the input batches, `inference_sessions` threads run `PredictBatch` on
+        them in a round-robin order, each with its own predictor session, and
+        `output_threads` threads run `WriteBatch` on the results, in the order
+        of the batches. Stages are connected by bounded queues.
+      output_threads: Number of threads running `WriteBatch` in pipelined mode.
+        If 1, the batches are written one at a time, in order.
+      pin_inference_sessions: If True, in pipelined mode with cpu predictors,
+        each session runs on its own subset of the cpu cores.
     """
     self._checkpoint = checkpoint
     self._output_dir = output_dir
@@ -162,14 +204,24 @@ class PredictorRunnerBase:
         inference_graph_filename = 'inference_tpu.pbtxt'
       self._inference_graph = os.path.join(logdir, 'inference_graphs',
                                            inference_graph_filename)
-    self._predictor = predictor.Predictor(
+    predictor_kwargs = dict(
         inference_graph=self._inference_graph,
         subgraph_name=inference_subgraph_name,
         checkpoint=initial_checkpoint,
         device_type=device_type,
         tf_master=tf_master)
-    self._threadpool = concurrent.futures.ThreadPoolExecutor(inference_threads)
-    self._locks = [threading.Lock() for _ in range(inference_threads)]
+    self._output_threads = output_threads
+    if inference_sessions > 0:
+      self._predictors = self._CreatePipelinePredictors(
+          inference_sessions, pin_inference_sessions and device_type == 'cpu',
+          predictor_kwargs)
+      self._predictor = self._predictors[0]
+    else:
+      self._predictors = None
+      self._predictor = predictor.Predictor(**predictor_kwargs)
+      self._threadpool = concurrent.futures.ThreadPoolExecutor(
+          inference_threads)
+      self._locks = [threading.Lock() for _ in range(inference_threads)]
 
   @classmethod
   def FromFlags(cls, **kwargs):
@@ -188,8 +240,62 @@ class PredictorRunnerBase:
         inference_threads=FLAGS.inference_threads,
         batch_size=FLAGS.batch_size,
         prediction_step_interval=FLAGS.prediction_step_interval,
+        inference_sessions=FLAGS.inference_sessions,
+        output_threads=FLAGS.output_threads,
+        pin_inference_sessions=FLAGS.pin_inference_sessions,
         **kwargs)
 
+  def _CreatePipelinePredictors(self, num_sessions, pin_sessions,
+                                predictor_kwargs):
+    """Creates the predictors of the pipelined mode.
+
+    Each predictor gets its own session thread pools, sized to its share of
+    the cpu cores. If pin_sessions, the predictor is created on a thread bound
+    to that share of the cores, so that the threads of its session are too.
+
+    Args:
+      num_sessions: Number of predictors to create.
+      pin_sessions: Whether to bind the sessions to disjoint sets of cores.
+      predictor_kwargs: The kwargs of the predictor.Predictor constructor.
+
+    Returns:
+      A list of num_sessions predictor.Predictor.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+      cores = sorted(os.sched_getaffinity(0))
+    else:
+      cores = list(range(os.cpu_count() or 1))
+      pin_sessions = False
+    if pin_sessions and len(cores) < num_sessions:
+      tf.logging.warning('Not pinning %d sessions to only %d cores.',
+                         num_sessions, len(cores))
+      pin_sessions = False
+    threads_per_session = max(1, len(cores) // num_sessions)
+
+    def _CreatePredictor(session_cores):
+      if pin_sessions:
+        # Threads inherit the affinity of the thread creating them.
+        os.sched_setaffinity(0, session_cores)
+      session_config = py_utils.SessionConfig()
+      session_config.use_per_session_threads = True
+      session_config.intra_op_parallelism_threads = threads_per_session
+      session_config.inter_op_parallelism_threads = threads_per_session
+      return predictor.Predictor(
+          session_config=session_config, **predictor_kwargs)
+
+    predictors = []
+    for i in range(num_sessions):
+      session_cores = cores[i * threads_per_session:(i + 1) *
+                            threads_per_session]
+      tf.logging.info('Creating predictor session %d on cores %s.', i,
+                      session_cores if pin_sessions else 'all')
+      # A new thread per predictor, so that the affinity of this thread is
+      # not changed.
+      with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        predictors.append(
+            executor.submit(_CreatePredictor, session_cores).result())
+    return predictors
+
   def _ShouldProcessInputId(self, input_id):
     if self._max_inputs > 0 and input_id >= self._max_inputs:
       return False
@@ -221,9 +327,152 @@ class PredictorRunnerBase:
     """
     raise NotImplementedError('Abstract method.')
 
+  def PredictBatch(self, session_predictor, batch):
+    """Runs inference on a single batch of data, in pipelined mode.
+
+    Called concurrently for different batches, each with its own predictor.
+
+    Args:
+      session_predictor: the predictor.Predictor to run inference with.
+      batch: a list of (input_id, element) pairs, see `RunBatch`.
+
+    Returns:
+      The results of the batch, passed to `WriteBatch`.
+    """
+    raise NotImplementedError('Abstract method.')
+
+  def WriteBatch(self, output_dir, batch, results):
+    """Writes the results of a single batch, in pipelined mode.
+
+    With output_threads=1, called for one batch at a time, in the order of the
+    batches.
+
+    Args:
+      output_dir: the output directory.
+      batch: a list of (input_id, element) pairs, see `RunBatch`.
+      results: the results returned by `PredictBatch` for this batch.
+    """
+    raise NotImplementedError('Abstract method.')
+
+  def _Batches(self):
+    """Yields the batches of input to process."""
+    batch = []
+    # Iterate through the input and process it one batch at a time.
+    it = self.InputGenerator()
+    if self._max_inputs > 0:
+      it = itertools.islice(it, self._max_inputs)
+    for next_id, element in enumerate(it):
+      if self._ShouldProcessInputId(next_id):
+        batch.append((next_id, element))
+        if len(batch) == self._batch_size:
+          yield batch
+          batch = []
+    # Last batch.
+    if batch:
+      yield batch
+
+  def _PredictOneCheckpointPipelined(self, checkpoint, output_dir):
+    """Runs predictor in pipelined mode, see the constructor."""
+    for p in self._predictors:
+      p.Load(checkpoint)
+
+    num_sessions = len(self._predictors)
+    input_queues = [
+        queue.Queue(_PIPELINE_QUEUE_SIZE) for _ in range(num_sessions)
+    ]
+    output_queue = queue.Queue(_PIPELINE_QUEUE_SIZE * num_sessions)
+    aborted = threading.Event()
+
+    def _Put(q, item):
+      while not aborted.is_set():
+        try:
+          q.put(item, timeout=1)
+          return
+        except queue.Full:
+          pass
+      raise _PipelineAborted()
+
+    def _Get(q):
+      while not aborted.is_set():
+        try:
+          return q.get(timeout=1)
+        except queue.Empty:
+          pass
+      raise _PipelineAborted()
+
+    def _Stage(fn, *args):
+      """Runs fn, aborting the other stages if it fails."""
+      try:
+        fn(*args)
+      except _PipelineAborted:
+        pass
+      except Exception:
+        aborted.set()
+        raise
+
+    def _Predict(session_id):
+      while True:
+        item = _Get(input_queues[session_id])
+        if item is _END_OF_BATCHES:
+          _Put(output_queue, item)
+          return
+        _Put(
+            output_queue,
+            item._replace(results=self.PredictBatch(
+                self._predictors[session_id], item.batch)))
+
+    def _Write():
+      """Writes the results in the order of the batches."""
+      pending_batches = {}
+      next_batch_id = 0
+      num_finished_sessions = 0
+      writes = collections.deque()
+      with concurrent.futures.ThreadPoolExecutor(
+          self._output_threads) as executor:
+        while num_finished_sessions < num_sessions:
+          item = _Get(output_queue)
+          if item is _END_OF_BATCHES:
+            num_finished_sessions += 1
+            continue
+          pending_batches[item.batch_id] = item
+          while next_batch_id in pending_batches:
+            item = pending_batches.pop(next_batch_id)
+            writes.append(
+                executor.submit(self.WriteBatch, output_dir, item.batch,
+                                item.results))
+            next_batch_id += 1
+            # Bounds the number of results waiting to be written.
+            while len(writes) > self._output_threads:
+              writes.popleft().result()
+        for write in writes:
+          write.result()
+      assert not pending_batches, list(pending_batches.keys())
+
+    stage_futures = []
+    with concurrent.futures.ThreadPoolExecutor(num_sessions + 1) as executor:
+      for session_id in range(num_sessions):
+        stage_futures.append(executor.submit(_Stage, _Predict, session_id))
+      stage_futures.append(executor.submit(_Stage, _Write))
+
+      def _GenerateInputs():
+        for batch_id, batch in enumerate(self._Batches()):
+          # Round-robin over the sessions, in a deterministic order.
+          _Put(input_queues[batch_id % num_sessions],
+               _Batch(batch_id=batch_id, batch=batch, results=None))
+        for q in input_queues:
+          _Put(q, _END_OF_BATCHES)
+
+      _Stage(_GenerateInputs)
+      # Raises the error of the first stage that failed, if any.
+      for f in stage_futures:
+        f.result()
+
   def _PredictOneCheckpoint(self, checkpoint, output_dir):
     """Runs predictor."""
     tf.logging.info('Processing checkpoint %s.', checkpoint)
+    if self._predictors:
+      self._PredictOneCheckpointPipelined(checkpoint, output_dir)
+      return
     self._predictor.Load(checkpoint)
 
     def LockedRunBatch(batch, batch_id):
@@ -238,23 +487,8 @@ class PredictorRunnerBase:
       with self._locks[batch_id % len(self._locks)]:
         self.RunBatch(output_dir, batch)
 
-    batch_id = 0
-    batch = []
     futures = []
-    # Iterate through the input and process it one batch at a time.
-    it = self.InputGenerator()
-    if self._max_inputs > 0:
-      it = itertools.islice(it, self._max_inputs)
-    for next_id, element in enumerate(it):
-      if self._ShouldProcessInputId(next_id):
-        batch.append((next_id, element))
-        if len(batch) == self._batch_size:
-          futures.append(
-              self._threadpool.submit(LockedRunBatch, batch, batch_id))
-          batch_id += 1
-          batch = []
-    # Last batch.
-    if batch:
+    for batch_id, batch in enumerate(self._Batches()):
       futures.append(self._threadpool.submit(LockedRunBatch, batch, batch_id))
     # Wait for completion.
     for f in futures:
@@ -0,0 +1,184 @@
+# Lint as: python3
+# Copyright 2020 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for predictor_runner_base."""
+
+import os
+
+from absl.testing import parameterized
+import lingvo.compat as tf
+from lingvo.core import base_input_generator
+from lingvo.core import base_model
+from lingvo.core import inference_graph_exporter
+from lingvo.core import inference_graph_pb2
+from lingvo.core import predictor
+from lingvo.core import predictor_runner_base
+from lingvo.core import py_utils
+from lingvo.core import test_utils
+import mock
+
+
+class ScaleModel(base_model.BaseTask):
+  """Multiplies its inputs by a variable."""
+
+  def _CreateLayerVariables(self):
+    super()._CreateLayerVariables()
+    self.CreateVariable(
+        'w',
+        py_utils.WeightParams(
+            shape=[], init=py_utils.WeightInit.Constant(2.0), dtype=tf.float32))
+
+  def Inference(self):
+    with tf.name_scope('inference'):
+      x = tf.placeholder(dtype=tf.float32, shape=[None], name='x')
+      y = x * self.vars.w
+      inference_graph = inference_graph_pb2.InferenceGraph()
+      subgraph = inference_graph.subgraphs['default']
+      subgraph.feeds['x'] = x.name
+      subgraph.fetches['y'] = y.name
+      return inference_graph
+
+
+class ScaleRunner(predictor_runner_base.PredictorRunnerBase):
+  """Writes 'input_id output' lines to the output shard."""
+
+  def __init__(self, num_inputs, failing_input_id=None, **kwargs):
+    self._num_inputs = num_inputs
+    self._failing_input_id = failing_input_id
+    super().__init__(**kwargs)
+
+  def InputGenerator(self):
+    for i in range(self._num_inputs):
+      yield float(i)
+
+  def RunBatch(self, output_dir, batch):
+    self.WriteBatch(output_dir, batch, self.PredictBatch(self._predictor,
+                                                         batch))
+
+  def PredictBatch(self, session_predictor, batch):
+    if self._failing_input_id in [input_id for input_id, _ in batch]:
+      raise ValueError('Failing batch.')
+    return session_predictor.Run('y', x=[x for _, x in batch])
+
+  def WriteBatch(self, output_dir, batch, results):
+    with tf.io.gfile.GFile(self._OutputFilename(output_dir, 'out'), 'a') as f:
+      for (input_id, _), y in zip(batch, results):
+        f.write('%d %g\n' % (input_id, y))
+
+
+class PredictorRunnerBaseTest(test_utils.TestCase, parameterized.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    model_cfg = base_model.SingleTaskModel.Params(
+        ScaleModel.Params().Set(name='scale'))
+    model_cfg.input = base_input_generator.BaseInputGenerator.Params().Set(
+        name='input')
+    self._inference_graph = os.path.join(self.get_temp_dir(),
+                                         'inference.pbtxt')
+    inference_graph_exporter.InferenceGraphExporter.Export(
+        model_cfg.Copy(), export_path=self._inference_graph)
+    with tf.Graph().as_default():
+      model_cfg.Instantiate()
+      with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        self._checkpoint = tf.train.Saver().save(
+            sess,
+            os.path.join(self.get_temp_dir(), 'ckpt'),
+            write_meta_graph=False)
+
+  def _Run(self, output_dir, **kwargs):
+    runner = ScaleRunner(
+        checkpoint=self._checkpoint,
+        output_dir=output_dir,
+        inference_graph=self._inference_graph,
+        output_num_shards=2,
+        output_shard_id=1,
+        batch_size=3,
+        **kwargs)
+    runner.Run()
+    with tf.io.gfile.GFile(
+        os.path.join(output_dir, 'out-00001-of-00002')) as f:
+      return f.read()
+
+  @parameterized.named_parameters(
+      ('OneSession', 1),
+      ('ThreeSessions', 3),
+      ('MoreSessionsThanBatches', 16),
+  )
+  def testPipelinedMatchesSequential(self, inference_sessions):
+    num_inputs = 37
+    expected = ''.join(
+        '%d %g\n' % (i, 2.0 * i) for i in range(1, num_inputs, 2))
+    self.assertEqual(
+        expected,
+        self._Run(
+            os.path.join(self.get_temp_dir(), 'sequential'),
+            num_inputs=num_inputs))
+    self.assertEqual(
+        expected,
+        self._Run(
+            os.path.join(self.get_temp_dir(), 'pipelined'),
+            num_inputs=num_inputs,
+            inference_sessions=inference_sessions))
+
+  @parameterized.named_parameters(
+      ('Pinned', True),
+      ('NotPinned', False),
+  )
+  def testPipelinedCpuSessionAffinity(self, pin_inference_sessions):
+    if not hasattr(os, 'sched_setaffinity'):
+      self.skipTest('os.sched_setaffinity is not available.')
+    cores = os.sched_getaffinity(0)
+    if len(cores) < 2:
+      self.skipTest('Pinning 2 sessions needs at least 2 cores.')
+    # The cores of the threads creating the predictors, and so their sessions.
+    session_cores = []
+    predictor_cls = predictor.Predictor
+
+    def _CreatePredictor(**kwargs):
+      session_cores.append(os.sched_getaffinity(0))
+      return predictor_cls(**kwargs)
+
+    with mock.patch.object(
+        predictor, 'Predictor', side_effect=_CreatePredictor):
+      self._Run(
+          os.path.join(self.get_temp_dir(), 'pipelined'),
+          num_inputs=10,
+          device_type='cpu',
+          inference_sessions=2,
+          pin_inference_sessions=pin_inference_sessions)
+    self.assertLen(session_cores, 2)
+    # The affinity of the calling thread is not changed.
+    self.assertEqual(cores, os.sched_getaffinity(0))
+    if pin_inference_sessions:
+      self.assertTrue(session_cores[0])
+      self.assertTrue(session_cores[1])
+      self.assertEmpty(session_cores[0] & session_cores[1])
+      self.assertLessEqual(session_cores[0] | session_cores[1], cores)
+    else:
+      self.assertEqual([cores, cores], session_cores)
+
+  def testPipelinedRaisesErrors(self):
+    with self.assertRaisesRegex(ValueError, 'Failing batch'):
+      self._Run(
+          os.path.join(self.get_temp_dir(), 'failing'),
+          num_inputs=100,
+          failing_input_id=41,
+          inference_sessions=2)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -15,13 +15,18 @@
 # ==============================================================================
 """Tests for lingvo.core.predictor."""
 
+import os
+import time
+
 import lingvo.compat as tf
 from lingvo.core import base_input_generator
 from lingvo.core import base_model
 from lingvo.core import inference_graph_exporter
 from lingvo.core import inference_graph_pb2
 from lingvo.core import predictor
+from lingvo.core import py_utils
 from lingvo.core import test_utils
+import numpy as np
 
 
 class DummyModel(base_model.BaseTask):
@@ -37,6 +42,58 @@ class DummyModel(base_model.BaseTask):
       return inference_graph
 
 
+class LargeLinearModel(base_model.BaseTask):
+  """A linear model with a large weight matrix, for startup benchmarks."""
+
+  @classmethod
+  def Params(cls):
+    p = super().Params()
+    p.Define('input_dim', 1024, 'Input dimension.')
+    p.Define('output_dim', 1024, 'Output dimension.')
+    p.Define('num_layers', 8, 'Number of stacked linear layers.')
+    return p
+
+  def _CreateLayerVariables(self):
+    super()._CreateLayerVariables()
+    p = self.params
+    for i in range(p.num_layers):
+      self.CreateVariable(
+          'w%d' % i,
+          py_utils.WeightParams(
+              shape=[p.output_dim, p.input_dim],
+              init=py_utils.WeightInit.Gaussian(scale=0.01, seed=i),
+              dtype=p.dtype))
+
+  def Inference(self):
+    p = self.params
+    with tf.name_scope('inference'):
+      x = tf.placeholder(dtype=tf.float32, shape=[None, p.input_dim], name='x')
+      y = x
+      for i in range(p.num_layers):
+        # The transposes of frozen weights are folded by the optimizer.
+        y = tf.matmul(y, tf.transpose(self.vars['w%d' % i]))
+      inference_graph = inference_graph_pb2.InferenceGraph()
+      subgraph = inference_graph.subgraphs['default']
+      subgraph.feeds['x'] = x.name
+      subgraph.fetches['y'] = y.name
+      return inference_graph
+
+
+def _ExportLargeLinearModel(export_dir, num_layers=8):
+  """Exports frozen text and binary inference graphs, returns their paths."""
+  p = base_model.SingleTaskModel.Params(LargeLinearModel.Params().Set(
+      name='large', num_layers=num_layers))
+  p.input = base_input_generator.BaseInputGenerator.Params().Set(name='test')
+  text_path = os.path.join(export_dir, 'inference.pbtxt')
+  binary_path = os.path.join(export_dir, 'inference.pb')
+  inference_graph_exporter.InferenceGraphExporter.Export(
+      p,
+      freeze_defaults=True,
+      export_path=text_path,
+      export_binary_path=binary_path)
+  return text_path, binary_path
+
+
 class PredictorTest(test_utils.TestCase):
 
   def _testInferenceGraph(self):
@@ -76,6 +133,47 @@ class PredictorTest(test_utils.TestCase):
     self.assertEqual(12345, fetch1)
     self.assertIsNone(nonexistent)
 
+  def testLoadInferenceGraphPrefersBinary(self):
+    text_path, binary_path = _ExportLargeLinearModel(
+        self.get_temp_dir(), num_layers=2)
+    binary_graph = predictor.LoadInferenceGraph(binary_path)
+    self.assertEqual(binary_graph, predictor.LoadInferenceGraph(text_path))
+    text_graph = predictor.LoadInferenceGraph(text_path, prefer_binary=False)
+    self.assertNotEqual(binary_graph, text_graph)
+
+    x = np.random.uniform(size=[2, 1024]).astype(np.float32)
+    self.assertAllClose(
+        predictor.Predictor(text_graph, device_type='cpu').Run('y', x=x),
+        predictor.Predictor(text_path, device_type='cpu').Run('y', x=x),
+        rtol=1e-5,
+        atol=1e-5)
+
+
+class PredictorStartupBenchmark(tf.test.Benchmark):
+  """Measures the latency from loading an inference graph to a first result."""
+
+  def _BenchmarkStartup(self, name, path, prefer_binary):
+    x = np.ones([1, 1024], dtype=np.float32)
+    start = time.time()
+    inference_graph = predictor.LoadInferenceGraph(
+        path, prefer_binary=prefer_binary)
+    pred = predictor.Predictor(inference_graph, device_type='cpu')
+    pred.Run('y', x=x)
+    wall_time = time.time() - start
+    self.report_benchmark(
+        iters=1,
+        wall_time=wall_time,
+        name=name,
+        extras={
+            'file_bytes': tf.io.gfile.stat(path).length,
+            'num_nodes': len(inference_graph.graph_def.node),
+        })
+
+  def benchmarkStartup(self):
+    text_path, binary_path = _ExportLargeLinearModel(tf.test.get_temp_dir())
+    self._BenchmarkStartup('text_startup', text_path, prefer_binary=False)
+    self._BenchmarkStartup('binary_startup', binary_path, prefer_binary=True)
+
 
 if __name__ == '__main__':
   tf.test.main()
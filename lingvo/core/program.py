@@ -156,6 +156,17 @@ class BaseProgram:
     """
     raise NotImplementedError()
 
+  def ReportGraphConstructionTime(self, secs):
+    """Logs and summarizes the time it took to build this program's graph.
+
+    Args:
+      secs: The wall time, in seconds, of BuildTpuSubgraph().
+    """
+    program_dir_name = os.path.basename(self._program_dir)
+    tf.logging.info('Built the graph of %s in %.2fs.', program_dir_name, secs)
+    self._SummarizeValue(0, 'graph_construction_secs', secs)
+    self._summary_writer.flush()
+
   def SetStatusMessageFn(self, fn):
     """Workaround since we instantiate programs via Params."""
     self._status_msg_fn = fn
@@ -36,6 +36,7 @@ import traceback
 import lingvo.compat as tf
 from lingvo.core import hyperparams
 from lingvo.core import ops
+from lingvo.core import restore_planner as restore_planner_lib
 from lingvo.core import retry
 from lingvo.core import symbolic
 from lingvo.core import tshape
@@ -2019,8 +2020,12 @@ def _GetVarsToLoad(all_vars, variable_loading_rules, var_ignore_rules):
   return vars_to_load
 
 
-def OverrideVarsFromCheckpoint(sess, all_vars, checkpoint_path,
-                               variable_loading_rules, var_ignore_rules):
+def OverrideVarsFromCheckpoint(sess,
+                               all_vars,
+                               checkpoint_path,
+                               variable_loading_rules,
+                               var_ignore_rules,
+                               restore_planner=None):
   """Overrides variables from a provided checkpoint."""
   vars_to_load = _GetVarsToLoad(all_vars, variable_loading_rules,
                                 var_ignore_rules)
@@ -2029,28 +2034,22 @@ def OverrideVarsFromCheckpoint(sess, all_vars, checkpoint_path,
                       'All known: %r') % [v.name for v in all_vars])
   load_var_names = sorted([v.name for _, v in vars_to_load])
   tf.logging.info('Overriding vars from checkpoint: %r', load_var_names)
-
-  while vars_to_load:
-    # When restoring, it's possible the same value in the checkpoint
-    # can be restored to multiple variables (e.g. during
-    # distillation).  However, tf.train.Saver, since it's used for
-    # both saving and restoring, requires the name in the checkpoint
-    # to be unique for each variable.  So, we call it multiple times
-    # with a unique set of names each time.
-    unique_vars_to_load = {}
-    remaining_vars_to_load = []
-    for k, v in vars_to_load:
-      if k not in unique_vars_to_load:
-        unique_vars_to_load[k] = v
-      else:
-        remaining_vars_to_load.append((k, v))
-    tf.train.Saver(var_list=unique_vars_to_load).restore(sess, checkpoint_path)
-    vars_to_load = remaining_vars_to_load
+  # When restoring, it's possible the same value in the checkpoint can be
+  # restored to multiple variables (e.g. during distillation). The planner
+  # reads it once and assigns it to all of them.
+  restore_planner = restore_planner or restore_planner_lib.RestorePlanner()
+  restore_planner.Restore(sess, {checkpoint_path: vars_to_load})
 
 
-def OverrideVarsFromCheckpoints(session, all_vars, ckpts_loading_rules):
+def OverrideVarsFromCheckpoints(session,
+                                all_vars,
+                                ckpts_loading_rules,
+                                restore_planner=None):
   """Overrides model variables from checkpoints.
 
+  The variables of all the checkpoints are restored together, with a few
+  batched reads per checkpoint run in parallel.
+
   Args:
     session: Tensorflow session.
     all_vars: List of all the parameters in the model.
@@ -2062,6 +2061,9 @@ def OverrideVarsFromCheckpoints(session, all_vars, ckpts_loading_rules):
       the second list consisting of a list of regexes to match parameter names
       in the model which should not be overridden, even if they match those in
       the loading rules.
+    restore_planner: An optional `.RestorePlanner`. Reusing the same planner
+      across calls skips restoring the variables which are unchanged since it
+      last restored them.
 
   Raises:
     ValueError: if colliding vars exist or loading rules is not a list.
@@ -2070,6 +2072,7 @@ def OverrideVarsFromCheckpoints(session, all_vars, ckpts_loading_rules):
     tf.logging.info('Overriding vars from multiple checkpoints.')
 
   var_refs_overridden = set()
+  vars_to_load_by_ckpt = {}
   for ckpt_path, loading_rules in ckpts_loading_rules.items():
     tf.logging.info('Overriding vars from checkpoint: %s', ckpt_path)
 
@@ -2082,18 +2085,21 @@ def OverrideVarsFromCheckpoints(session, all_vars, ckpts_loading_rules):
                        ckpt_path)
 
     # Filter the model variables to be overridden.
-    var_refs_to_override = [
-        var[1].experimental_ref()
-        for var in _GetVarsToLoad(all_vars, loading_rules[0], loading_rules[1])
-    ]
+    vars_to_load = _GetVarsToLoad(all_vars, loading_rules[0], loading_rules[1])
+    if not vars_to_load:
+      raise ValueError(('Variable loading rules did not match any vars. '
+                        'All known: %r') % [v.name for v in all_vars])
+    var_refs_to_override = [var.experimental_ref() for _, var in vars_to_load]
 
     overlap_refs = set.intersection(var_refs_overridden, var_refs_to_override)
     if overlap_refs:
       raise ValueError('Colliding variables to override: %s' % overlap_refs)
 
-    OverrideVarsFromCheckpoint(session, all_vars, ckpt_path, loading_rules[0],
-                               loading_rules[1])
+    vars_to_load_by_ckpt[ckpt_path] = vars_to_load
     var_refs_overridden.update(var_refs_to_override)
+
+  restore_planner = restore_planner or restore_planner_lib.RestorePlanner()
+  restore_planner.Restore(session, vars_to_load_by_ckpt)
   tf.logging.info('Model variables overridden: %s', var_refs_overridden)
 
 
@@ -2419,6 +2425,72 @@ def ApplyGradMultiplier(vs_gs, grad_scale=None):
   return vs_gs.Transform(Scale)
 
 
+def DeduplicateIndexedSlices(grad):
+  """Sums the rows of `grad` with the same index.
+
+  Args:
+    grad: A tf.IndexedSlices, e.g. the gradient of an embedding lookup, whose
+      indices may have duplicates.
+
+  Returns:
+    A tf.IndexedSlices with unique indices and the same dense value as `grad`.
+  """
+  unique_indices, positions = tf.unique(HasRank(grad.indices, 1))
+  values = tf.math.unsorted_segment_sum(grad.values, positions,
+                                        tf.size(unique_indices))
+  return tf.IndexedSlices(values, unique_indices, grad.dense_shape)
+
+
+def DeduplicateSparseGradients(var_grads):
+  """Sums the rows of the tf.IndexedSlices gradients with the same index.
+
+  The norms of the deduplicated gradients, e.g. computed by SumSquared(), are
+  those of their dense values, and they are applied to fewer rows.
+
+  Args:
+    var_grads: A `.NestedMap` of VarGrad.
+
+  Returns:
+    A `.NestedMap` of VarGrad, where tf.IndexedSlices gradients have unique
+    indices.
+  """
+
+  def Deduplicate(item):
+    var, grad = item
+    if isinstance(grad, tf.IndexedSlices):
+      with tf.device(var.device):
+        grad = DeduplicateIndexedSlices(grad)
+    return VarGrad(var, grad)
+
+  return var_grads.Transform(Deduplicate)
+
+
+def GatherSparseGradientRows(var_grads):
+  """Replaces the vars of tf.IndexedSlices gradients by their gathered rows.
+
+  Norms of the returned vars, e.g. computed by SumSquared(), only read the rows
+  updated by the gradients instead of whole embedding tables. With
+  deduplicated gradients (see DeduplicateSparseGradients), each row is counted
+  once.
+
+  Args:
+    var_grads: A `.NestedMap` of VarGrad.
+
+  Returns:
+    A `.NestedMap` of VarGrad, where the var of each tf.IndexedSlices gradient
+    is replaced by its rows at the gradient indices.
+  """
+
+  def Gather(item):
+    var, grad = item
+    if isinstance(grad, tf.IndexedSlices):
+      with tf.device(var.device):
+        var = tf.gather(var, grad.indices)
+    return VarGrad(var, grad)
+
+  return var_grads.Transform(Gather)
+
+
 def HasNanOrInfGradient(var_grads):
   """Returns a bool tensor to indicate if `var_grads` contains NaNs or Infs.
 
@@ -2535,14 +2607,16 @@ def AdjustGradientsWithLpLoss(var_grads, lp_regularizer_weight, p=2.0):
       # only want to consider once for each ids.
       with tf.device(var.device):
         emb = HasRank(var, 2)
-        vocab_size = tf.shape(emb)[0]
         ids = HasRank(grad.indices, 1)
         values = tf.gather(emb, ids)  # [#ids, dims]
       with tf.device(grad.device):
-        # Counts is a vector of size vocab_size. counts[i] is i-th words
-        # occurances in 'ids'.
+        # Counts is a vector of size #unique ids. counts[i] is the number of
+        # occurrences of the i-th unique id in 'ids'. Unlike counting over the
+        # whole vocabulary, this does not touch every row of the embedding.
+        uniq_ids, positions = tf.unique(ids)
         counts = tf.math.unsorted_segment_sum(
-            tf.ones_like(ids, dtype=values.dtype), ids, vocab_size)
+            tf.ones_like(ids, dtype=values.dtype), positions,
+            tf.size(uniq_ids))
 
         # Gradients for duplicated ids will be summed when they get
         # applied, and hence we account for that by first dividing
@@ -2551,14 +2625,14 @@ def AdjustGradientsWithLpLoss(var_grads, lp_regularizer_weight, p=2.0):
         #
         # For each id in 'ids', we know counts[id] is non-zero,
         # hence, it's always safe to take reciprocal.
-        weights = tf.math.reciprocal(tf.gather(counts, ids))
+        weights = tf.math.reciprocal(tf.gather(counts, positions))
         weights = tf.expand_dims(weights, -1)  # [#ids, 1]
         if p == 2.0:
           grad_v = values
         elif p == 1.0:
           grad_v = tf.sign(values)
         delta = lp_regularizer_weight * weights * grad_v
-        grad = tf.IndexedSlices(grad.values + delta, ids)
+        grad = tf.IndexedSlices(grad.values + delta, ids, grad.dense_shape)
     elif var not in tf.get_collection(SKIP_LP_REGULARIZATION):
       with tf.device(var.device):
         if p == 2.0:
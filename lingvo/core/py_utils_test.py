@@ -692,6 +692,34 @@ class PyUtilsTest(test_utils.TestCase):
       self.assertAllClose(clipped_np.a[1], 1.0)
       self.assertAllClose(clipped_np.b[1], 0.5)
 
+  def testDeduplicateSparseGradients(self):
+    with self.session(use_gpu=False):
+      emb = tf.get_variable(
+          'emb',
+          initializer=tf.constant(np.arange(20).reshape([10, 2]), tf.float32))
+      act = tf.gather(emb, [2, 5, 2, 2, 7])
+      loss = tf.reduce_sum(act * tf.constant([[1.], [2.], [3.], [4.], [5.]]))
+      var_grads = py_utils.ComputeGradients(loss,
+                                            py_utils.NestedMap(emb=emb))
+      self.assertIsInstance(var_grads.emb.grad, tf.IndexedSlices)
+      deduped = py_utils.DeduplicateSparseGradients(var_grads)
+      self.assertIsInstance(deduped.emb.grad, tf.IndexedSlices)
+      clipped = py_utils.ApplyGradNormClipping(deduped, norm=1.0)
+      self.evaluate(tf.global_variables_initializer())
+      dense_grad, deduped_grad, deduped_norm, clipped_grad = self.evaluate([
+          tf.convert_to_tensor(var_grads.emb.grad), deduped.emb.grad,
+          tf.sqrt(py_utils.SumSquared([deduped.emb.grad])),
+          tf.convert_to_tensor(clipped.emb.grad)
+      ])
+      self.assertCountEqual([2, 5, 7], deduped_grad.indices)
+      dense_deduped_grad = np.zeros_like(dense_grad)
+      dense_deduped_grad[deduped_grad.indices] = deduped_grad.values
+      self.assertAllClose(dense_grad, dense_deduped_grad)
+      # The norm of the deduplicated gradient is that of the dense one.
+      self.assertAllClose(np.linalg.norm(dense_grad), deduped_norm)
+      self.assertAllClose(dense_grad / np.linalg.norm(dense_grad),
+                          clipped_grad)
+
   def testMaskGradient(self):
     with self.session(use_gpu=False):
       a = tf.get_variable('a', [])
@@ -0,0 +1,175 @@
+# Lint as: python3
+# Copyright 2020 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Post-training calibration of quantization ranges.
+
+The calibrated ranges are those of the QDomains' simulated quantization, which
+still computes in float. Typical use, to export a calibrated inference graph
+with int8 weights from a float checkpoint, and to measure it against the float
+export::
+
+  model_cfg = model_registry.GetParams('mt.wmt14_en_de.WmtEnDeTransformerBase',
+                                       'Dev')
+  # The layers to quantize need a qdomain, e.g. p.qdomain.default =
+  # quant_utils.PassiveAsymQDomain.Params().
+  ckpt = quant_calibration.CalibrateCheckpoint(
+      model_cfg, '/path/to/ckpt-00012345', '/path/to/calibrated', 100)
+  int8_graph = inference_graph_exporter.InferenceGraphExporter.Export(
+      model_cfg, freeze_checkpoint=ckpt, int8_weights=True, ...)
+  float_graph = inference_graph_exporter.InferenceGraphExporter.Export(
+      model_cfg, freeze_checkpoint=ckpt, ...)
+  comparison = quant_calibration.CompareInferenceGraphs(
+      float_graph, int8_graph, ['logits'], feeds)
+"""
+
+import time
+
+import lingvo.compat as tf
+from lingvo.core import predictor
+from lingvo.core import py_utils
+from lingvo.core import quant_utils
+import numpy as np
+
+
+def CalibrateCheckpoint(model_cfg,
+                        checkpoint,
+                        output_checkpoint,
+                        num_batches,
+                        model_task_name=None):
+  """Calibrates the ranges of the PassiveAsymQDomain layers of a model.
+
+  The model is run in eval mode and in float, see quant_utils.CalibrationMode(),
+  over num_batches batches of its input. The min/max variables of its
+  PassiveAsymQDomain layers are set to the ranges seen, and saved with the
+  other variables to a new checkpoint.
+
+  The checkpoint may come from a model trained without quantization. The
+  variables missing from it, e.g. the min/max variables, are initialized.
+
+  Args:
+    model_cfg: The model params, with the input params to calibrate with.
+    checkpoint: The checkpoint to calibrate.
+    output_checkpoint: The path prefix to save the calibrated checkpoint to.
+    num_batches: The number of input batches to calibrate with.
+    model_task_name: The task to calibrate. Should be None for single-task
+      models.
+
+  Returns:
+    The path of the calibrated checkpoint.
+  """
+  model_cfg = model_cfg.Copy()
+  model_cfg.cluster.do_eval = True
+  checkpoint_vars = set(name for name, _ in tf.train.list_variables(checkpoint))
+
+  graph = tf.Graph()
+  with graph.as_default():
+    cluster = model_cfg.cluster.Instantiate()
+    with cluster, tf.device(cluster.GetPlacer()):
+      mdl = model_cfg.Instantiate()
+      task = mdl.GetTask(model_task_name)
+      with quant_utils.CalibrationMode():
+        task.FPropDefaultTheta()
+      calibration = quant_utils.CalibrationOps(task)
+
+      restored_vars = {}
+      missing_vars = []
+      for v in tf.global_variables():
+        name = v.op.name
+        if name in checkpoint_vars:
+          restored_vars[name] = v
+        else:
+          missing_vars.append(v)
+      tf.logging.info('Variables missing from %s: %r', checkpoint,
+                      [v.op.name for v in missing_vars])
+      restore_saver = tf.train.Saver(restored_vars)
+      init_op = tf.group(
+          tf.variables_initializer(missing_vars), tf.tables_initializer())
+      saver = tf.train.Saver()
+
+  with tf.Session(graph=graph, config=py_utils.SessionConfig()) as sess:
+    restore_saver.restore(sess, checkpoint)
+    sess.run(init_op)
+    sess.run(calibration.reset)
+    for i in range(num_batches):
+      sess.run(calibration.update)
+      tf.logging.info('Calibrated with %d/%d batches.', i + 1, num_batches)
+    return saver.save(sess, output_checkpoint, write_meta_graph=False)
+
+
+def CompareInferenceGraphs(float_graph,
+                           quantized_graph,
+                           fetch_keys,
+                           feeds,
+                           num_runs=20,
+                           subgraph_name=None,
+                           device_type='cpu'):
+  """Measures the output error and the latency of a quantized inference graph.
+
+  Both graphs are run on the same feeds, e.g. the exports of the same checkpoint
+  with and without int8_weights. Task metrics, e.g. BLEU or WER, still need a
+  decoder run over a real eval set; the output error bounds their change.
+
+  Args:
+    float_graph: The reference InferenceGraph proto, or the path to one.
+    quantized_graph: The quantized InferenceGraph proto, or the path to one.
+    fetch_keys: The keys of the float outputs of the subgraph to compare.
+    feeds: A list of dicts from the feed keys of the subgraph to values, one
+      per batch.
+    num_runs: The number of timed runs over all feeds, after one untimed run.
+    subgraph_name: The subgraph to run. Defaults to the first one.
+    device_type: The device type the graphs are run on.
+
+  Returns:
+    A NestedMap with:
+
+    - max_abs_error: A dict from fetch keys to the largest absolute difference
+      between the quantized and the float outputs, over all feeds.
+    - max_rel_error: A dict from fetch keys to max_abs_error divided by the
+      largest absolute float output.
+    - float_latency, quantized_latency: The mean wall time in seconds of one
+      run of each graph.
+  """
+
+  def _Run(inference_graph):
+    pred = predictor.Predictor(
+        inference_graph, subgraph_name=subgraph_name, device_type=device_type)
+    outputs = [pred.Run(fetch_keys, **feed) for feed in feeds]
+    start = time.time()
+    for _ in range(num_runs):
+      for feed in feeds:
+        pred.Run(fetch_keys, **feed)
+    return outputs, (time.time() - start) / (num_runs * len(feeds))
+
+  float_outputs, float_latency = _Run(float_graph)
+  quantized_outputs, quantized_latency = _Run(quantized_graph)
+  max_abs_error = {}
+  max_rel_error = {}
+  for i, key in enumerate(fetch_keys):
+    expected = [np.asarray(outputs[i]) for outputs in float_outputs]
+    actual = [np.asarray(outputs[i]) for outputs in quantized_outputs]
+    max_abs_error[key] = max(
+        float(np.max(np.abs(a - e), initial=0.))
+        for a, e in zip(actual, expected))
+    scale = max(float(np.max(np.abs(e), initial=0.)) for e in expected)
+    max_rel_error[key] = max_abs_error[key] / scale if scale else 0.
+    tf.logging.info('%s: max abs error %g, max rel error %g.', key,
+                    max_abs_error[key], max_rel_error[key])
+  tf.logging.info('Latency: float %.6fs, quantized %.6fs.', float_latency,
+                  quantized_latency)
+  return py_utils.NestedMap(
+      max_abs_error=max_abs_error,
+      max_rel_error=max_rel_error,
+      float_latency=float_latency,
+      quantized_latency=quantized_latency)
@@ -0,0 +1,247 @@
+# Lint as: python3
+# Copyright 2020 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for quant_calibration."""
+
+import os
+
+import lingvo.compat as tf
+from lingvo.core import base_input_generator
+from lingvo.core import base_model
+from lingvo.core import inference_graph_exporter
+from lingvo.core import layers
+from lingvo.core import predictor
+from lingvo.core import py_utils
+from lingvo.core import quant_calibration
+from lingvo.core import quant_utils
+from lingvo.core import test_utils
+import numpy as np
+
+
+class RandomInputGenerator(base_input_generator.BaseInputGenerator):
+  """Generates batches of random ids."""
+
+  @classmethod
+  def Params(cls):
+    p = super().Params()
+    p.Define('vocab_size', 16, 'Vocabulary size.')
+    p.batch_size = 8
+    return p
+
+  def _InputBatch(self):
+    p = self.params
+    return py_utils.NestedMap(
+        ids=tf.random.uniform([p.batch_size], maxval=p.vocab_size,
+                              dtype=tf.int32))
+
+
+class EmbeddingFeedForwardModel(base_model.BaseTask):
+  """Embeds ids and runs them through a feed-forward network."""
+
+  @classmethod
+  def Params(cls):
+    p = super().Params()
+    p.name = 'emb_ffn'
+    p.Define('vocab_size', 16, 'Vocabulary size.')
+    p.Define('dim', 8, 'Model dimension.')
+    p.Define('qdomain', None, 'Quantization domain of all the layers.')
+    p.input = RandomInputGenerator.Params()
+    return p
+
+  def __init__(self, params):
+    super().__init__(params)
+    p = self.params
+    emb_p = layers.SimpleEmbeddingLayer.Params().Set(
+        vocab_size=p.vocab_size, embedding_dim=p.dim)
+    ffn_p = layers.FeedForwardNet.Params().Set(
+        input_dim=p.dim, hidden_layer_dims=[4 * p.dim, p.vocab_size])
+    ffn_p.activation = ['RELU', 'NONE']
+    if p.qdomain:
+      emb_p.qdomain.default = p.qdomain.Copy()
+      ffn_p.projection.qdomain.default = p.qdomain.Copy()
+    self.CreateChild('emb', emb_p)
+    self.CreateChild('ffn', ffn_p)
+
+  def _Logits(self, theta, ids):
+    return self.ffn.FProp(theta.ffn, self.emb.EmbLookup(theta.emb, ids))
+
+  def ComputePredictions(self, theta, input_batch):
+    return self._Logits(theta, input_batch.ids)
+
+  def ComputeLoss(self, theta, predictions, input_batch):
+    loss = tf.reduce_mean(tf.square(predictions))
+    return {'loss': (loss, 1.0)}, {}
+
+  def Inference(self):
+    with tf.name_scope('inference'):
+      ids = tf.placeholder(tf.int32, shape=[None], name='ids')
+      logits = self._Logits(self.theta, ids)
+      return {'default': ({'logits': logits}, {'ids': ids})}
+
+
+def _ModelParams(qdomain=None, vocab_size=16, dim=8):
+  task_p = EmbeddingFeedForwardModel.Params().Set(
+      vocab_size=vocab_size, dim=dim, qdomain=qdomain)
+  task_p.input.vocab_size = vocab_size
+  task_p.random_seed = 1234
+  return base_model.SingleTaskModel.Params(task_p)
+
+
+def _SaveDefaultCheckpoint(model_cfg, checkpoint):
+  """Saves the default initialized variables of a model."""
+  with tf.Graph().as_default():
+    model_cfg.Copy().Instantiate()
+    with tf.Session() as sess:
+      sess.run(tf.global_variables_initializer())
+      return tf.train.Saver().save(sess, checkpoint, write_meta_graph=False)
+
+
+class QuantCalibrationTest(test_utils.TestCase):
+
+  def testCalibrateCheckpoint(self):
+    model_cfg = _ModelParams(qdomain=quant_utils.PassiveAsymQDomain.Params())
+    checkpoint = _SaveDefaultCheckpoint(
+        model_cfg, os.path.join(self.get_temp_dir(), 'float'))
+    calibrated = quant_calibration.CalibrateCheckpoint(
+        model_cfg, checkpoint, os.path.join(self.get_temp_dir(), 'calibrated'),
+        num_batches=3)
+
+    min_max_vars = [
+        name for name, _ in tf.train.list_variables(calibrated)
+        if name.endswith('_min/var') or name.endswith('_max/var')
+    ]
+    self.assertNotEmpty(min_max_vars)
+    for name in min_max_vars:
+      value = tf.train.load_variable(calibrated, name)
+      # Calibrated ranges straddle zero and differ from the [-1, 1] default.
+      if name.endswith('_min/var'):
+        self.assertLessEqual(value, 0.)
+      else:
+        self.assertGreaterEqual(value, 0.)
+      self.assertNotIn(value, (-1., 1.), name)
+    # The float weights are unchanged.
+    self.assertAllEqual(
+        tf.train.load_variable(checkpoint, 'emb_ffn/emb/wm/var'),
+        tf.train.load_variable(calibrated, 'emb_ffn/emb/wm/var'))
+
+  def testExportInt8Weights(self):
+    model_cfg = _ModelParams()
+    checkpoint = _SaveDefaultCheckpoint(
+        model_cfg, os.path.join(self.get_temp_dir(), 'float'))
+    binary_path = os.path.join(self.get_temp_dir(), 'int8.pb')
+    float_graph = inference_graph_exporter.InferenceGraphExporter.Export(
+        model_cfg.Copy(), freeze_checkpoint=checkpoint)
+    int8_graph = inference_graph_exporter.InferenceGraphExporter.Export(
+        model_cfg.Copy(),
+        freeze_checkpoint=checkpoint,
+        export_binary_path=binary_path,
+        int8_weights=True)
+
+    def _Int8Weights(graph_def):
+      return sorted(node.name
+                    for node in graph_def.node
+                    if node.op == 'Const' and
+                    node.attr['dtype'].type == tf.int8.as_datatype_enum)
+
+    # The embedding and the two projections of the FeedForwardNet.
+    expected_int8_weights = _Int8Weights(int8_graph.graph_def)
+    self.assertLen(expected_int8_weights, 3)
+    binary_graph = predictor.LoadInferenceGraph(binary_path)
+    self.assertEqual(expected_int8_weights,
+                     _Int8Weights(binary_graph.graph_def))
+
+    ids = np.arange(16)
+    [float_logits] = predictor.Predictor(float_graph).Run(['logits'], ids=ids)
+    for graph in (int8_graph, binary_graph):
+      [int8_logits] = predictor.Predictor(graph).Run(['logits'], ids=ids)
+      self.assertAllClose(
+          float_logits,
+          int8_logits,
+          atol=0.02 * np.max(np.abs(float_logits)))
+
+  def testCompareInferenceGraphs(self):
+    model_cfg = _ModelParams()
+    checkpoint = _SaveDefaultCheckpoint(
+        model_cfg, os.path.join(self.get_temp_dir(), 'float'))
+    float_graph = inference_graph_exporter.InferenceGraphExporter.Export(
+        model_cfg.Copy(), freeze_checkpoint=checkpoint)
+    int8_graph = inference_graph_exporter.InferenceGraphExporter.Export(
+        model_cfg.Copy(), freeze_checkpoint=checkpoint, int8_weights=True)
+    feeds = [{'ids': np.arange(8)}, {'ids': np.arange(8, 16)}]
+
+    same = quant_calibration.CompareInferenceGraphs(
+        float_graph, float_graph, ['logits'], feeds, num_runs=1)
+    self.assertEqual({'logits': 0.}, same.max_abs_error)
+    comparison = quant_calibration.CompareInferenceGraphs(
+        float_graph, int8_graph, ['logits'], feeds, num_runs=1)
+    self.assertGreater(comparison.max_abs_error['logits'], 0.)
+    self.assertLess(comparison.max_rel_error['logits'], 0.02)
+    self.assertGreater(comparison.float_latency, 0.)
+    self.assertGreater(comparison.quantized_latency, 0.)
+
+  def testInt8WeightsRequireFreezing(self):
+    with self.assertRaisesRegex(ValueError, 'frozen graph'):
+      inference_graph_exporter.InferenceGraphExporter.Export(
+          _ModelParams(), int8_weights=True)
+
+
+class Int8WeightsBenchmark(tf.test.Benchmark):
+  """Benchmarks int8 weight graphs against float ones on CPU.
+
+  The int8 weights are dequantized on every run, see QuantizeWeightsToInt8(),
+  so the int8 graph is expected to be smaller but not faster. Reports the
+  latency, the size and the error of the outputs of the int8 graph relative to
+  the float one.
+
+  Run with::
+
+    bazel run -c opt lingvo/core:quant_calibration_test -- --benchmarks=.
+  """
+
+  def benchmarkInt8Weights(self):
+    model_cfg = _ModelParams(vocab_size=8192, dim=512)
+    checkpoint = _SaveDefaultCheckpoint(
+        model_cfg, os.path.join(tf.test.get_temp_dir(), 'float'))
+    float_graph, int8_graph = [
+        inference_graph_exporter.InferenceGraphExporter.Export(
+            model_cfg.Copy(),
+            freeze_checkpoint=checkpoint,
+            int8_weights=int8_weights) for int8_weights in (False, True)
+    ]
+    iters = 20
+    comparison = quant_calibration.CompareInferenceGraphs(
+        float_graph,
+        int8_graph, ['logits'], [{
+            'ids': np.arange(256)
+        }],
+        num_runs=iters)
+    self.report_benchmark(
+        name='float',
+        iters=iters,
+        wall_time=comparison.float_latency,
+        extras={'graph_bytes': float_graph.ByteSize()})
+    self.report_benchmark(
+        name='int8',
+        iters=iters,
+        wall_time=comparison.quantized_latency,
+        extras={
+            'graph_bytes': int8_graph.ByteSize(),
+            'logits_max_abs_error': comparison.max_abs_error['logits'],
+            'logits_max_rel_error': comparison.max_rel_error['logits'],
+        })
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -15,6 +15,8 @@
 # ==============================================================================
 """Utilities for model quantization."""
 
+import contextlib
+
 import lingvo.compat as tf
 from lingvo.core import base_layer
 from lingvo.core import hyperparams
@@ -23,6 +25,67 @@ from lingvo.core import summary_utils
 import numpy as np
 
 
+_CALIBRATION_MODE = py_utils.ThreadLocalStack()
+
+
+@contextlib.contextmanager
+def CalibrationMode():
+  """Graphs built in this context calibrate post-training quantization ranges.
+
+  In calibration mode, PassiveAsymQDomain layers do not quantize anything.
+  They instead collect the ranges of their QTensors into their accumulators,
+  regardless of do_eval. See CalibrationOps().
+
+  Yields:
+    None.
+  """
+  _CALIBRATION_MODE.stack.append(True)
+  try:
+    yield
+  finally:
+    _CALIBRATION_MODE.stack.pop()
+
+
+def IsCalibrating():
+  """Returns whether the graph is being built in CalibrationMode()."""
+  return bool(_CALIBRATION_MODE.stack)
+
+
+def _PassiveAsymQDomains(layer):
+  """Yields all the PassiveAsymQDomain layers under layer."""
+  for child in layer.children.Flatten():
+    if isinstance(child, PassiveAsymQDomain):
+      yield child
+    for qdomain in _PassiveAsymQDomains(child):
+      yield qdomain
+
+
+def CalibrationOps(layer):
+  """Returns the ops to calibrate the quantization ranges under layer.
+
+  This is the post-training alternative to tracking ranges with moving averages
+  during training. The layer's forward graph must have been built in
+  CalibrationMode() before calling this. Then, run `reset` once and `update`
+  once per input batch: the min/max vars of all PassiveAsymQDomain layers
+  under `layer` end up covering all the ranges seen. The vars can then be
+  saved in a checkpoint, from which the quantized graph is evaluated or
+  exported.
+
+  Args:
+    layer: A BaseLayer, typically a task.
+
+  Returns:
+    A NestedMap with ops 'reset' and 'update'.
+  """
+  reset_ops = []
+  update_ops = []
+  for qdomain in _PassiveAsymQDomains(layer):
+    reset_ops.extend(qdomain.CalibrationResetOps())
+    update_ops.extend(qdomain.CalibrationUpdateOps())
+  return py_utils.NestedMap(
+      reset=tf.group(reset_ops), update=tf.group(update_ops))
+
+
 class QuantizableLayer(base_layer.BaseLayer):
   """A layer that supports various forms of quantization.
 
@@ -1003,6 +1066,8 @@ class PassiveAsymQDomain(QDomain):
 
   def QuantizeWeight(self, w):
     p = self.params
+    if IsCalibrating():
+      return w
     w_min = tf.reduce_min(w)
     w_max = tf.reduce_max(w)
     # NOTE: We force a small, non-zero range because otherwise, zero weights
@@ -1022,10 +1087,14 @@ class PassiveAsymQDomain(QDomain):
 
   def QuantizeNaturalRange(self, t, min_value, max_value):
     p = self.params
+    if IsCalibrating():
+      return t
     return self._MaybeFakeQuant(t, min_value, max_value, num_bits=p.bits)
 
   def QuantizeConstantRange(self, t, min_value, max_value):
     p = self.params
+    if IsCalibrating():
+      return t
     return self._MaybeFakeQuant(t, min_value, max_value, num_bits=p.bits)
 
   def CreateTensor(self, t_name):
@@ -1051,7 +1120,14 @@ class PassiveAsymQDomain(QDomain):
   def QuantizeTensors(self, t_name, ts, eval_only=False):
     p = self.params
     # Always straddle a real zero point.
-    if self.do_eval:
+    if IsCalibrating():
+      # Only record the range, the vars are updated by CalibrationUpdateOps().
+      accumulator_name = self._GetAccumulatorNameForTensor(t_name)
+      batch_min, batch_max = self._BatchRange(ts)
+      self.accumulators[accumulator_name].Update(
+          tf.stack([1.0, batch_min, batch_max]))
+      return ts
+    elif self.do_eval:
       # At eval/inference time, use the memorized range.
       # Important: Don't capture these variables in training mode so as to
       # avoid extra/unnecessary captures.
@@ -1064,11 +1140,7 @@ class PassiveAsymQDomain(QDomain):
       # At training time, use the batch calculated min/max.
       accumulator_name = self._GetAccumulatorNameForTensor(t_name)
       # Calculate min/max for all tensors.
-      batch_min = 0.0
-      batch_max = 0.0
-      for t in ts:
-        batch_min = tf.minimum(tf.reduce_min(t), batch_min)
-        batch_max = tf.maximum(tf.reduce_max(t), batch_max)
+      batch_min, batch_max = self._BatchRange(ts)
 
       # New state.
       state1 = tf.stack([1.0, batch_min, batch_max])
@@ -1098,7 +1170,7 @@ class PassiveAsymQDomain(QDomain):
 
   def GetTensorRange(self, t_name, ts):
     # Always straddle a real zero point.
-    if self.do_eval:
+    if self.do_eval and not IsCalibrating():
       # At eval/inference time, use the memorized range.
       # Important: Don't capture these variables in training mode so as to
       # avoid extra/unnecessary captures.
@@ -1110,6 +1182,47 @@ class PassiveAsymQDomain(QDomain):
     batch_max = tf.maximum(tf.reduce_max(ts), 0.0)
     return (tf.stop_gradient(batch_min), tf.stop_gradient(batch_max))
 
+  def _BatchRange(self, ts):
+    """Returns the (min, max) of ts, expanded to straddle zero."""
+    batch_min = 0.0
+    batch_max = 0.0
+    for t in ts:
+      batch_min = tf.minimum(tf.reduce_min(t), batch_min)
+      batch_max = tf.maximum(tf.reduce_max(t), batch_max)
+    return batch_min, batch_max
+
+  def CalibrationResetOps(self):
+    """Returns ops that reset the min/max vars to [0, 0] before calibration."""
+    ops = []
+    for t_name in self._t_names:
+      for suffix in ('min', 'max'):
+        v = self._GetQStateVar(t_name, suffix)
+        ops.append(tf.assign(v, tf.zeros_like(v)))
+    return ops
+
+  def CalibrationUpdateOps(self):
+    """Returns ops that expand the min/max vars to the calibrated ranges.
+
+    Unlike _RecordTensor(), which tracks the ranges with a moving average, this
+    keeps the extremes over all the calibration batches.
+    """
+    ops = []
+    for t_name in self._t_names:
+      accumulator = self.accumulators[self._GetAccumulatorNameForTensor(t_name)]
+      count, min_value, max_value = tf.unstack(accumulator.GetValue())
+      accumulator.Reset()
+      min_var = self._GetQStateVar(t_name, 'min')
+      max_var = self._GetQStateVar(t_name, 'max')
+      ops.extend([
+          tf.assign(min_var,
+                    tf.where(count > 0., tf.minimum(min_var, min_value),
+                             min_var)),
+          tf.assign(max_var,
+                    tf.where(count > 0., tf.maximum(max_var, max_value),
+                             max_var)),
+      ])
+    return ops
+
   def PostTrainingStepUpdate(self, global_step):
     ops = [super().PostTrainingStepUpdate(global_step)]
     for t_name in self._t_names:
@@ -237,6 +237,31 @@ class QuantizableLayerTest(test_utils.TestCase):
           not_expected=self.NO_QDOMAIN_EXPECTED,
           global_step=9)
 
+  def testLayerWithPassiveAsymQDomainCalibration(self):
+    with self.session(), self.SetEval(True):
+      p = SampleQuantizedProjectionLayer.Params()
+      p.qdomain.default = quant_utils.PassiveAsymQDomain.Params()
+      # Calibration runs the layer in float.
+      with quant_utils.CalibrationMode():
+        l = self._testLayerHelper(
+            'testLayerWithPassiveAsymQDomainCalibration',
+            p,
+            expected=self.NO_QDOMAIN_EXPECTED)
+      calibration = quant_utils.CalibrationOps(l)
+      self.evaluate(calibration.reset)
+      for _ in range(2):
+        self.evaluate(calibration.update)
+      minmax_vars = l.qdomain_default._qvars.Transform(lambda x: x.eval())
+      print('Calibrated minmax vars:', minmax_vars)
+
+    # Same inputs as in _testLayerHelper().
+    np.random.seed(12345)
+    inputs = np.random.normal(0.1, 0.5, [2, 4, 3])
+    self.assertAllClose(min(inputs.min(), 0.), minmax_vars.inputs_min)
+    self.assertAllClose(max(inputs.max(), 0.), minmax_vars.inputs_max)
+    self.assertLessEqual(minmax_vars.transformed_min, 0.)
+    self.assertGreaterEqual(minmax_vars.transformed_max, 0.)
+
   def testLayerWithSymmetricScheduledClipQDomain(self):
     # pyformat: disable
     expected = [
@@ -81,6 +81,8 @@ allow_implicit_captures flag.
 """
 
 import collections
+import functools
+
 import lingvo.compat as tf
 from lingvo.core import cluster_factory
 from lingvo.core import py_utils
@@ -143,6 +145,55 @@ def _Update(nmap_acc, nmap_x, t):
   return nmap_acc.Pack(lst)
 
 
+def _IndexMany(nmap, indices):
+  """Returns a list of `.NestedMap` with x[indices[i], :] for each x in nmap.
+
+  Gathers the rows of each tensor with a single op, where calling `_Index` for
+  each index would use one op per index.
+
+  Args:
+    nmap: A `.NestedMap` of tensors.
+    indices: A 1-D tf integer tensor with a statically known size n.
+
+  Returns:
+    A list of n `.NestedMap` of tensors. For each key in nmap::
+
+      rets[i].key = nmap.key[indices[i], :]
+  """
+  indices.get_shape().assert_has_rank(1)
+  n = indices.get_shape().as_list()[0]
+  assert n is not None, indices
+  rows = [tf.unstack(tf.gather(x, indices), num=n) for x in nmap.Flatten()]
+  return [nmap.Pack([x[i] for x in rows]) for i in range(n)]
+
+
+def _UpdateMany(nmap_acc, nmap_xs, indices):
+  """Updates the indices[i]-th row in accumulators with nmap_xs[i].
+
+  Writes all the rows of each accumulator with a single op.
+
+  Args:
+    nmap_acc: A `.NestedMap` of tensors. The accumulators.
+    nmap_xs: A list of `.NestedMap` of tensors. The update values.
+    indices: A 1-D integer tensor, of the same size as nmap_xs.
+
+  Returns:
+    A `.NestedMap` of tensors. Say, ret is returned. For each key, we have::
+
+        ret[key] = nmap_acc[key];
+        ret[key][indices[i], :] = nmap_xs[i][key]
+  """
+  acc_lst = nmap_acc.Flatten()
+  kxs_lst = zip(*[nmap_x.FlattenItems() for nmap_x in nmap_xs])
+  indices = tf.cast(indices, tf.int32)  # tf.cast casts on-device tensors.
+  lst = []
+  for acc, kxs in zip(acc_lst, kxs_lst):
+    key = kxs[0][0]
+    with tf.name_scope('update_%s' % py_utils.SanitizeScopeKey(key)):
+      lst += [tf.InplaceUpdate(acc, indices, tf.stack([x for _, x in kxs]))]
+  return nmap_acc.Pack(lst)
+
+
 def _SeqLenDim(nmap):
   """Returns the 0-th dim size of tensors in nmap.
 
@@ -264,6 +315,19 @@ def _TransformDType(nmap):
                         if x.dtype == tf.int32 else x)
 
 
+def _NumCellFns(unroll):
+  """Returns how many cell_fns _Recurrent calls for an unroll factor.
+
+  The unrolled loop calls one cell_fn per step, and the loop computing the
+  remaining steps calls one more. In StackedRecurrent, each of them sends and
+  receives on its own links.
+
+  Args:
+    unroll: The number of time steps of each unrolled iteration.
+  """
+  return unroll + 1 if unroll > 1 else 1
+
+
 class _Recurrent:
   """A helper class to construct a recurrent neural net."""
 
@@ -278,15 +342,18 @@ class _Recurrent:
                cell_type=None,
                accumulator_layer=None,
                implicit_captures=None,
-               unused_acc_state=None):
+               unused_acc_state=None,
+               unroll=1):
     """RNN helper class.
 
     Args:
       cell_fn: A python function which computes:
          state1, extras = cell_fn(theta, state0, inputs[t, :])
+        Or a list of such functions, see `unroll`.
       cell_grad: A python function which computes:
          dtheta, dstate0, dinputs[t, :] = cell_grad(
            theta, state0, inputs[t, :], extras, dstate1)
+        Or a list of such functions, see `unroll`.
       stop_fn: A python function which computes: should_stop = stop_fn(t, theta,
         state0)
       theta: weights. A `.NestedMap`.
@@ -307,12 +374,29 @@ class _Recurrent:
         And we reduce_sum each timestep's new state into a scalar. Note, this
         feature should be used with StackedRecurrent where we send out the new
         state to the other devices.
+      unroll: The number of time steps computed by each iteration of the
+        forward and backward loops, as long as enough steps are left. The
+        remaining steps are computed one at a time. If cell_fn and cell_grad
+        are lists of _NumCellFns(unroll) functions, their i-th element computes
+        the i-th step of each unrolled iteration, and their last element the
+        remaining steps.
     """
+    assert unroll >= 1, unroll
+    assert unroll == 1 or stop_fn is None, 'unroll > 1 requires no stop_fn.'
+    num_cell_fns = _NumCellFns(unroll)
+    if not isinstance(cell_fn, (list, tuple)):
+      cell_fn = [cell_fn] * num_cell_fns
+    if not isinstance(cell_grad, (list, tuple)):
+      cell_grad = [cell_grad] * num_cell_fns
+    assert len(cell_fn) == num_cell_fns, (len(cell_fn), unroll)
+    assert len(cell_grad) == num_cell_fns, (len(cell_grad), unroll)
     self._theta = theta
     self._state = state0
     self._inputs = inputs
-    self._cell_fn = _DecorateCellFn(cell_fn, accumulator_layer)
-    self._cell_grad = _DecorateCellGrad(cell_grad, accumulator_layer)
+    self._cell_fns = [_DecorateCellFn(fn, accumulator_layer) for fn in cell_fn]
+    self._cell_grads = [
+        _DecorateCellGrad(fn, accumulator_layer) for fn in cell_grad
+    ]
     self._stop_fn = stop_fn
     self._extras = extras
     if cell_type is not None:
@@ -322,6 +406,9 @@ class _Recurrent:
     self._accumulator_layer = accumulator_layer
     self._implicit_captures = implicit_captures
     self._unused_acc_state = unused_acc_state
+    self._unroll = unroll
+    # The step of the cell_fn and cell_grad computing the remaining steps.
+    remainder_step = num_cell_fns - 1
 
     # NOTE: TF Function (Fwd, Bak, ForwardLoopBody, BackwardLoopBody,
     # Forward and Backward defined below) simply takes a list of
@@ -335,9 +422,9 @@ class _Recurrent:
     noinline = not compiled
 
     # state1, extras = cell_fn(theta, state0, inputs)
-    def Fwd(theta, state0, inputs):
+    def Fwd(theta, state0, inputs, step):
       py_utils.SetShapes(theta, self._theta)
-      state1, extras = self._cell_fn(theta, state0, inputs)
+      state1, extras = self._cell_fns[step](theta, state0, inputs)
       py_utils.AssertIsCompatible(state1, self._state)
       py_utils.AssertIsCompatible(extras, self._extras)
       return state1, extras
@@ -371,7 +458,7 @@ class _Recurrent:
       # external input at time step t.
       inputs_t = _Index(loop_state.inputs, t)
       loop_state.state0, extras = Fwd(loop_state.theta, loop_state.state0,
-                                      inputs_t)
+                                      inputs_t, remainder_step)
       # Saves state1 and extras in their accumulators.
       if not self._unused_acc_state:
         loop_state.acc_state = _Update(loop_state.acc_state, loop_state.state0,
@@ -380,6 +467,25 @@ class _Recurrent:
       loop_state.t = tf.add(t, 1)
       return loop_state
 
+    def UnrolledForwardLoopBody(loop_state):
+      """The body of forward loop computing `unroll` time steps."""
+      t = loop_state.t
+      indices = t + tf.range(self._unroll, dtype=t.dtype)
+      acc_state, acc_extras = [], []
+      for step, inputs_t in enumerate(_IndexMany(loop_state.inputs, indices)):
+        loop_state.state0, extras = Fwd(loop_state.theta, loop_state.state0,
+                                        inputs_t, step)
+        acc_state.append(loop_state.state0)
+        acc_extras.append(extras)
+      # Saves all the states and extras with one write per accumulator.
+      if not self._unused_acc_state:
+        loop_state.acc_state = _UpdateMany(loop_state.acc_state, acc_state,
+                                           indices)
+      loop_state.acc_extras = _UpdateMany(loop_state.acc_extras, acc_extras,
+                                          indices)
+      loop_state.t = tf.add(t, self._unroll)
+      return loop_state
+
     # Forward calls ForwardLoopBody n times. Each time computes one
     # time step of the recurrent net.
     def Forward(args):
@@ -403,18 +509,24 @@ class _Recurrent:
         t = tf.cast(pad_begin, tf.int64)
         limit = tf.cast(limit, tf.int64)
 
+      loop_state = py_utils.NestedMap(
+          t=t,
+          limit=limit,
+          theta=args.theta,
+          state0=args.state0,
+          inputs=args.inputs,
+          acc_state=acc_state,
+          acc_extras=acc_extras)
       with py_utils.RemoveAssertContext(remove=noinline):
+        if self._unroll > 1:
+          # Computes `unroll` steps per iteration while there are enough steps
+          # left, then the remaining ones in the loop below.
+          loop_state.limit = limit - (self._unroll - 1)
+          loop_state = py_utils.WhileLoop(ForwardLoopCond,
+                                          UnrolledForwardLoopBody, loop_state)
+          loop_state.limit = limit
         run = py_utils.WhileLoop(
-            ForwardLoopCond,
-            ForwardLoopBody,
-            loop_state=py_utils.NestedMap(
-                t=t,
-                limit=limit,
-                theta=args.theta,
-                state0=args.state0,
-                inputs=args.inputs,
-                acc_state=acc_state,
-                acc_extras=acc_extras))
+            ForwardLoopCond, ForwardLoopBody, loop_state=loop_state)
       return py_utils.NestedMap(
           limit=run.t,
           final_state=run.state0,
@@ -427,11 +539,12 @@ class _Recurrent:
     # where d_state1 is the backprop-ed gradient for state1, and
     # extras is the computed by the forward step to facilitate the
     # backward step.
-    def Bak(theta, state0, inputs, extras, d_state1):
+    def Bak(theta, state0, inputs, extras, d_state1, step):
       """Backward step."""
       py_utils.SetShapes(theta, self._theta)
       (dtheta, dstate0, dinputs,
-       dcaptures) = self._cell_grad(theta, state0, inputs, extras, d_state1)
+       dcaptures) = self._cell_grads[step](theta, state0, inputs, extras,
+                                           d_state1)
       py_utils.AssertIsCompatible(dtheta, self._theta)
       py_utils.AssertIsCompatible(dstate0, self._state)
       py_utils.AssertIsCompatible(dinputs, self._inputs)
@@ -475,36 +588,55 @@ class _Recurrent:
       """Backward loop condition function."""
       return loop_state.t >= loop_state.limit
 
-    def BackwardLoopBody(loop_state):
-      """Backward loop body function."""
-      t = loop_state.t
-      # The input recurrent state for time step t is previous time step's
-      # output, or the original state0 when on time step 0.
-      state_from_acc = _Index(loop_state.acc_state,
-                              tf.maximum(tf.constant(0, t.dtype), t - 1))
-      state0 = py_utils.If(
+    def StateBefore(t, orig_state0, state_from_acc):
+      """Returns the input recurrent state for time step t.
+
+      Args:
+        t: The time step.
+        orig_state0: The initial state of the recurrent net.
+        state_from_acc: The accumulated state of time step max(0, t - 1).
+
+      Returns:
+        The previous time step's output, or orig_state0 on time step 0.
+      """
+      return py_utils.If(
           tf.equal(t, tf.constant(0, t.dtype)),
           inputs=py_utils.NestedMap(
-              orig_state0=loop_state.state0, state_from_acc=state_from_acc),
+              orig_state0=orig_state0, state_from_acc=state_from_acc),
           then_branch=lambda nmap: nmap.orig_state0,
           else_branch=lambda nmap: nmap.state_from_acc)
 
-      # The external inputs for time step t.
-      inputs_t = _Index(loop_state.inputs, t)
-      # The extras for time step t.
-      extras_t = _Index(loop_state.acc_extras, t)
-
-      d_state1 = _Add(_Index(loop_state.d_acc_state, t), loop_state.d_state1)
+    def BackwardStep(loop_state, state0, inputs_t, extras_t, d_acc_state_t,
+                     step):
+      """Backprops one time step, returns its gradient for the inputs."""
+      d_state1 = _Add(d_acc_state_t, loop_state.d_state1)
       (d_theta_t, loop_state.d_state1, d_inputs_t,
        d_captured_t) = Bak(loop_state.theta, state0, inputs_t, extras_t,
-                           d_state1)
+                           d_state1, step)
 
       if self._unused_acc_state:
         # XLA IF op requires the same shape for if and else branches.
         loop_state.d_state1 = loop_state.d_state1.Transform(tf.reduce_sum)
       loop_state.d_theta = _Add(loop_state.d_theta, d_theta_t)
-      loop_state.d_inputs = _Update(loop_state.d_inputs, d_inputs_t, t)
       loop_state.d_captured = _Add(loop_state.d_captured, d_captured_t)
+      return d_inputs_t
+
+    def BackwardLoopBody(loop_state):
+      """Backward loop body function."""
+      t = loop_state.t
+      state_from_acc = _Index(loop_state.acc_state,
+                              tf.maximum(tf.constant(0, t.dtype), t - 1))
+      state0 = StateBefore(t, loop_state.state0, state_from_acc)
+
+      # The external inputs for time step t.
+      inputs_t = _Index(loop_state.inputs, t)
+      # The extras for time step t.
+      extras_t = _Index(loop_state.acc_extras, t)
+
+      d_inputs_t = BackwardStep(loop_state, state0, inputs_t, extras_t,
+                                _Index(loop_state.d_acc_state, t),
+                                remainder_step)
+      loop_state.d_inputs = _Update(loop_state.d_inputs, d_inputs_t, t)
       loop_state.t = tf.subtract(t, 1)
 
       # Make sure this function didn't capture anything different than the
@@ -515,6 +647,35 @@ class _Recurrent:
 
       return loop_state
 
+    def UnrolledBackwardLoopBody(loop_state):
+      """Backward loop body function computing `unroll` time steps."""
+      t = loop_state.t
+      indices = t - tf.range(self._unroll, dtype=t.dtype)
+      states0 = _IndexMany(loop_state.acc_state,
+                           tf.maximum(tf.constant(0, t.dtype), indices - 1))
+      # Only the last, i.e. earliest, time step can be time step 0.
+      states0[-1] = StateBefore(indices[-1], loop_state.state0, states0[-1])
+      inputs = _IndexMany(loop_state.inputs, indices)
+      extras = _IndexMany(loop_state.acc_extras, indices)
+      d_acc_state = _IndexMany(loop_state.d_acc_state, indices)
+
+      d_inputs = []
+      for step in range(self._unroll):
+        d_inputs.append(
+            BackwardStep(loop_state, states0[step], inputs[step],
+                         extras[step], d_acc_state[step], step))
+      loop_state.d_inputs = _UpdateMany(loop_state.d_inputs, d_inputs,
+                                        indices)
+      loop_state.t = tf.subtract(t, self._unroll)
+
+      # Make sure this function didn't capture anything different than the
+      # cell_fn when reflected on at the beginning. Must come after the call
+      # to Bak() which adds to the captured list.
+      _AssertSameTensors(py_utils.GetExtraInputs(),
+                         self._implicit_captures.Flatten())
+
+      return loop_state
+
     # Backward calls BackwardLoopBody n times. Each time computes the backprop
     # for one time step of the recurrent net.
     def Backward(xs, ys, dys):
@@ -550,23 +711,33 @@ class _Recurrent:
         state0 = state0.Transform(tf.reduce_sum)
         d_state1 = d_state1.Transform(tf.reduce_sum)
 
+      loop_state = py_utils.NestedMap(
+          t=ys.limit - 1,
+          limit=limit,
+          theta=xs.theta,
+          state0=state0,
+          inputs=xs.inputs,
+          acc_state=ys.acc_state,
+          acc_extras=ys.acc_extras,
+          d_theta=d_theta,
+          d_state1=d_state1,
+          d_inputs=d_inputs,
+          d_acc_state=dys.acc_state,
+          d_captured=d_captured)
       with py_utils.RemoveAssertContext(remove=noinline):
+        if self._unroll > 1:
+          # Backprops `unroll` steps per iteration while there are enough
+          # steps left, then the remaining ones in the loop below.
+          loop_state.limit = limit + (self._unroll - 1)
+          loop_state = py_utils.WhileLoop(
+              cond=BackwardLoopCond,
+              body=UnrolledBackwardLoopBody,
+              loop_state=loop_state)
+          loop_state.limit = limit
         run = py_utils.WhileLoop(
             cond=BackwardLoopCond,
             body=BackwardLoopBody,
-            loop_state=py_utils.NestedMap(
-                t=ys.limit - 1,
-                limit=limit,
-                theta=xs.theta,
-                state0=state0,
-                inputs=xs.inputs,
-                acc_state=ys.acc_state,
-                acc_extras=ys.acc_extras,
-                d_theta=d_theta,
-                d_state1=d_state1,
-                d_inputs=d_inputs,
-                d_acc_state=dys.acc_state,
-                d_captured=d_captured))
+            loop_state=loop_state)
 
       d_state0 = run.d_state1
       if self._unused_acc_state:
@@ -938,7 +1109,8 @@ def Recurrent(theta,
               extras=None,
               check_stateful_ops=False,
               accumulator_layer=None,
-              allow_implicit_capture=False):
+              allow_implicit_capture=False,
+              unroll=1):
   """Compute a recurrent neural net.
 
   Roughly, `Recurrent()` computes the following::
@@ -992,10 +1164,22 @@ def Recurrent(theta,
       disabled for gradients. Uses the state key `accumulators`.
     allow_implicit_capture: Whether to allow the `cell_fn` to implicitly capture
       tensors. Only allowed if an explicit `cell_grad` is not given.
+    unroll: The number of time steps computed by each iteration of the forward
+      and backward loops. Values > 1 reduce the per-step overhead of the loops
+      for small cells, e.g. on CPU, at the cost of a larger graph. The results
+      do not depend on it. Must be 1 if `stop_fn` is given.
 
   Returns:
     `accumulate_state` and the final state.
+
+  Raises:
+    ValueError: if unroll is not a positive integer, or is > 1 with a stop_fn.
   """
+  if unroll < 1:
+    raise ValueError('unroll must be >= 1, got %d.' % unroll)
+  if unroll > 1 and stop_fn is not None:
+    raise ValueError('unroll > 1 is not supported with a stop_fn.')
+
   symbol_to_tensor_map = symbolic.SymbolToValueMap.Get(symbolic.TENSOR_VALUES)
   if symbol_to_tensor_map:
     theta = theta.copy()  # Do not modify the caller's 'theta'.
@@ -1055,7 +1239,8 @@ def Recurrent(theta,
       inputs=inputs,
       extras=extras,
       accumulator_layer=accumulator_layer,
-      implicit_captures=implicit_captures).Compute()
+      implicit_captures=implicit_captures,
+      unroll=unroll).Compute()
 
   # TODO(b/129159299): The ResetStepSeed below is needed to work around this
   # bug, which is a problem with global tensors being shared by different
@@ -1102,7 +1287,8 @@ class _Input:
                inputs,
                extras,
                out_links,
-               unused_acc_state=False):
+               unused_acc_state=False,
+               unroll=1):
     self._cell_fn = cell_fn
     self._cell_out = cell_out
     self._cell_grad, self._implicit_captures = _GetCellGrad(
@@ -1121,23 +1307,25 @@ class _Input:
     self._extras = extras
     self._out_links = out_links
     self._unused_acc_state = unused_acc_state
+    self._unroll = unroll
     assert self._extras is not None
+    assert len(out_links) == _NumCellFns(unroll), (len(out_links), unroll)
 
   def Compute(self):
     """Compute the input layer."""
 
-    def InputFn(theta, state0, inputs):
+    def InputFn(theta, state0, inputs, out_links):
       state1, extras = self._cell_fn(theta, state0, inputs)
       py_utils.AssertIsCompatible(state1, state0)
       py_utils.AssertIsCompatible(extras, self._extras)
       out = self._cell_out(state1)
-      sends = _Join(self._out_links, out, lambda l, x: l.fwd.Send(x))
+      sends = _Join(out_links, out, lambda l, x: l.fwd.Send(x))
       with tf.control_dependencies(sends):
         return state1.Transform(tf.identity), extras.Transform(tf.identity)
 
-    def InputGrad(theta, state0, inputs, extras, dstate1):
+    def InputGrad(theta, state0, inputs, extras, dstate1, out_links):
       """Gradient function for InputFn."""
-      recv_dout = self._out_links.Transform(lambda l: l.bak.Recv())
+      recv_dout = out_links.Transform(lambda l: l.bak.Recv())
       dstate1 = _Add(dstate1, self._cell_out_grad(recv_dout))
       dtheta, dstate0, dinputs, dcaptures = self._cell_grad(
           theta, state0, inputs, extras, dstate1)  # pylint: disable=unbalanced-tuple-unpacking
@@ -1153,8 +1341,12 @@ class _Input:
       return dtheta, dstate0, dinputs, dcaptures
 
     return _Recurrent(
-        cell_fn=InputFn,
-        cell_grad=InputGrad,
+        cell_fn=[
+            functools.partial(InputFn, out_links=l) for l in self._out_links
+        ],
+        cell_grad=[
+            functools.partial(InputGrad, out_links=l) for l in self._out_links
+        ],
         stop_fn=None,
         theta=self._theta,
         state0=self._state0,
@@ -1162,7 +1354,8 @@ class _Input:
         extras=self._extras,
         accumulator_layer=self._accumulator_layer,
         implicit_captures=self._implicit_captures,
-        unused_acc_state=self._unused_acc_state).Compute()
+        unused_acc_state=self._unused_acc_state,
+        unroll=self._unroll).Compute()
 
 
 class _Middle:
@@ -1170,7 +1363,7 @@ class _Middle:
 
   def __init__(self, cell_fn, cell_out, cell_grad, cell_out_grad, theta, state0,
                accumulator_layer, in_links, padding, slen_dim, per_step_inputs,
-               extras, out_links, unused_acc_state):
+               extras, out_links, unused_acc_state, unroll=1):
     self._cell_fn = cell_fn
     self._cell_out = cell_out
     self._cell_grad, self._implicit_captures = _GetCellGrad(
@@ -1193,27 +1386,31 @@ class _Middle:
     assert self._extras is not None
     self._out_links = out_links
     self._unused_acc_state = unused_acc_state
+    self._unroll = unroll
+    assert len(in_links) == _NumCellFns(unroll), (len(in_links), unroll)
+    assert len(out_links) == _NumCellFns(unroll), (len(out_links), unroll)
 
   def Compute(self):
     """Compute the middle layer."""
 
-    def MiddleFn(theta, state0, inputs):
+    def MiddleFn(theta, state0, inputs, in_links, out_links):
       del inputs
-      inputs = self._in_links.Transform(lambda l: l.fwd.Recv())
+      inputs = in_links.Transform(lambda l: l.fwd.Recv())
       state1, extras = self._cell_fn(theta, state0, inputs)
       py_utils.AssertIsCompatible(state1, state0)
       py_utils.AssertIsCompatible(extras, self._extras)
       out = self._cell_out(state1)
-      sends = _Join(self._out_links, out, lambda l, x: l.fwd.Send(x))
+      sends = _Join(out_links, out, lambda l, x: l.fwd.Send(x))
       with tf.control_dependencies(sends):
         return (state1.Transform(tf.identity),
                 py_utils.NestedMap(inputs=inputs,
                                    cell_fn_extras=extras).Transform(
                                        tf.identity))
 
-    def MiddleGrad(theta, state0, inputs, extras, dstate1):
+    def MiddleGrad(theta, state0, inputs, extras, dstate1, in_links,
+                   out_links):
       """Gradient function for MiddleFn."""
-      recv_dout = self._out_links.Transform(lambda l: l.bak.Recv())
+      recv_dout = out_links.Transform(lambda l: l.bak.Recv())
       dstate1 = _Add(dstate1, self._cell_out_grad(recv_dout))
       dtheta, dstate0, dinputs, dcaptures = self._cell_grad(
           theta, state0, extras.inputs, extras.cell_fn_extras, dstate1)  # pylint: disable=unbalanced-tuple-unpacking
@@ -1226,7 +1423,7 @@ class _Middle:
         # that may be supported.
         dcaptures = _EmptyLike(self._implicit_captures)
       py_utils.AssertIsCompatible(dcaptures, self._implicit_captures)
-      sends = _Join(self._in_links, dinputs, lambda l, x: l.bak.Send(x))
+      sends = _Join(in_links, dinputs, lambda l, x: l.bak.Send(x))
       with tf.control_dependencies(sends):
         return (dtheta.Transform(tf.identity), dstate0.Transform(tf.identity),
                 inputs.Transform(tf.zeros_like),
@@ -1237,9 +1434,16 @@ class _Middle:
     if self._padding is not None:
       fake_inputs['padding'] = self._padding
 
+    links = list(zip(self._in_links, self._out_links))
     return _Recurrent(
-        cell_fn=MiddleFn,
-        cell_grad=MiddleGrad,
+        cell_fn=[
+            functools.partial(MiddleFn, in_links=i, out_links=o)
+            for i, o in links
+        ],
+        cell_grad=[
+            functools.partial(MiddleGrad, in_links=i, out_links=o)
+            for i, o in links
+        ],
         stop_fn=None,
         theta=self._theta,
         state0=self._state0,
@@ -1248,14 +1452,25 @@ class _Middle:
             inputs=self._per_step_inputs, cell_fn_extras=self._extras),
         accumulator_layer=self._accumulator_layer,
         implicit_captures=self._implicit_captures,
-        unused_acc_state=self._unused_acc_state).Compute()
+        unused_acc_state=self._unused_acc_state,
+        unroll=self._unroll).Compute()
 
 
 class _Output:
   """Output layers."""
 
-  def __init__(self, cell_fn, cell_grad, theta, state0, accumulator_layer,
-               in_links, padding, slen_dim, per_step_inputs, extras):
+  def __init__(self,
+               cell_fn,
+               cell_grad,
+               theta,
+               state0,
+               accumulator_layer,
+               in_links,
+               padding,
+               slen_dim,
+               per_step_inputs,
+               extras,
+               unroll=1):
     self._cell_fn = cell_fn
     self._cell_grad, self._implicit_captures = _GetCellGrad(
         cell_fn,
@@ -1273,20 +1488,22 @@ class _Output:
     self._slen_dim = slen_dim
     self._per_step_inputs = per_step_inputs
     self._extras = extras
+    self._unroll = unroll
     assert self._extras is not None
+    assert len(in_links) == _NumCellFns(unroll), (len(in_links), unroll)
 
   def Compute(self):
     """Compute the output layer."""
 
-    def OutputFn(theta, state0, inputs):
+    def OutputFn(theta, state0, inputs, in_links):
       del inputs
-      inputs = self._in_links.Transform(lambda l: l.fwd.Recv())
+      inputs = in_links.Transform(lambda l: l.fwd.Recv())
       state1, extras = self._cell_fn(theta, state0, inputs)
       py_utils.AssertIsCompatible(state1, state0)
       py_utils.AssertIsCompatible(extras, self._extras)
       return state1, py_utils.NestedMap(inputs=inputs, cell_fn_extras=extras)
 
-    def OutputGrad(theta, state0, inputs, extras, dstate1):
+    def OutputGrad(theta, state0, inputs, extras, dstate1, in_links):
       """Gradient function for OutputFn."""
       dtheta, dstate0, dinputs, dcaptures = self._cell_grad(
           theta, state0, extras.inputs, extras.cell_fn_extras, dstate1)  # pylint: disable=unbalanced-tuple-unpacking
@@ -1299,7 +1516,7 @@ class _Output:
         # that may be supported.
         dcaptures = _EmptyLike(self._implicit_captures)
       py_utils.AssertIsCompatible(dcaptures, self._implicit_captures)
-      sends = _Join(self._in_links, dinputs, lambda l, x: l.bak.Send(x))
+      sends = _Join(in_links, dinputs, lambda l, x: l.bak.Send(x))
       with tf.control_dependencies(sends):
         return (dtheta.Transform(tf.identity), dstate0.Transform(tf.identity),
                 inputs.Transform(tf.zeros_like),
@@ -1311,8 +1528,12 @@ class _Output:
       fake_inputs['padding'] = self._padding
 
     return _Recurrent(
-        cell_fn=OutputFn,
-        cell_grad=OutputGrad,
+        cell_fn=[
+            functools.partial(OutputFn, in_links=l) for l in self._in_links
+        ],
+        cell_grad=[
+            functools.partial(OutputGrad, in_links=l) for l in self._in_links
+        ],
         stop_fn=None,
         theta=self._theta,
         state0=self._state0,
@@ -1321,7 +1542,8 @@ class _Output:
             inputs=self._per_step_inputs, cell_fn_extras=self._extras),
         accumulator_layer=self._accumulator_layer,
         implicit_captures=self._implicit_captures,
-        unused_acc_state=False).Compute()
+        unused_acc_state=False,
+        unroll=self._unroll).Compute()
 
 
 def _DependsOn(xs, ys):
@@ -1355,7 +1577,8 @@ def StackedRecurrent(devices,
                      init_states,
                      inputs,
                      accumulator_layers=None,
-                     unused_acc_state=False):
+                     unused_acc_state=False,
+                     unroll=1):
   """Computes stacked recurrent neural nets placed on various devices.
 
   Conceptually, StackedRecurrent() computes the following::
@@ -1397,6 +1620,10 @@ def StackedRecurrent(devices,
       accumulator values will be carried.
     unused_acc_state: If True, we shink all the layer's acc_state to [num_ts]
       except the last layer(_Output).
+    unroll: The number of time steps computed by each iteration of the loops of
+      each layer, see Recurrent(). Each unrolled step, and the loop computing
+      the remaining steps, sends its outputs to the next layer on its own
+      channels.
 
   Returns:
     Tuple (output, states):
@@ -1445,7 +1672,8 @@ def StackedRecurrent(devices,
           inputs=inputs,
           cell_fn=cell_fns[0],
           cell_grad=cell_grads[0],
-          accumulator_layer=accumulator_layers[0])
+          accumulator_layer=accumulator_layers[0],
+          unroll=unroll)
       # Just the accumulated states.
       return cell_outs[0](acc_states), final
 
@@ -1502,8 +1730,11 @@ def StackedRecurrent(devices,
   padding = FlattenPadding(inputs.get('padding', None))
 
   # Builds the input layer.
-  out_links = _CreateLinks(expected_output_by_layers[0].xs,
-                           DevicePair(devices[0], devices[1]))
+  out_links = [
+      _CreateLinks(expected_output_by_layers[0].xs,
+                   DevicePair(devices[0], devices[1]))
+      for _ in range(_NumCellFns(unroll))
+  ]
 
   # Enable accumulators. Note that this must happen prior to the initial
   # _AugmentState() below or it will initialize with defaults.
@@ -1522,14 +1753,18 @@ def StackedRecurrent(devices,
       inputs=inputs,
       extras=expected_output_by_layers[0].extras,
       out_links=out_links,
-      unused_acc_state=unused_acc_state)
+      unused_acc_state=unused_acc_state,
+      unroll=unroll)
   layers += [inp_l]
 
   # Builds the intermediate layers.
   for i in range(1, num_layers - 1):
     in_links = out_links
-    out_links = _CreateLinks(expected_output_by_layers[i].xs,
-                             DevicePair(devices[i], devices[i + 1]))
+    out_links = [
+        _CreateLinks(expected_output_by_layers[i].xs,
+                     DevicePair(devices[i], devices[i + 1]))
+        for _ in range(_NumCellFns(unroll))
+    ]
     mid_l = _Middle(
         cell_fn=cell_fns[i],
         cell_grad=cell_grads[i],
@@ -1544,7 +1779,8 @@ def StackedRecurrent(devices,
         per_step_inputs=expected_output_by_layers[i - 1].xs,
         extras=expected_output_by_layers[i].extras,
         out_links=out_links,
-        unused_acc_state=unused_acc_state)
+        unused_acc_state=unused_acc_state,
+        unroll=unroll)
     layers += [mid_l]
 
   # Builds the final output layer.
@@ -1560,7 +1796,8 @@ def StackedRecurrent(devices,
       padding=padding,
       slen_dim=slen_dim,
       per_step_inputs=expected_output_by_layers[-2].xs,
-      extras=expected_output_by_layers[-1].extras)
+      extras=expected_output_by_layers[-1].extras,
+      unroll=unroll)
   layers += [out_l]
 
   assert len(layers) == num_layers
@@ -661,6 +661,55 @@ class RecurrentTest(test_utils.TestCase):
     self._testElmanHelper(7, False, StopFn)
     self._testElmanHelper(7, True, StopFn)
 
+  def testUnroll(self):
+    with self.session():
+      tf.random.set_seed(342462)
+
+      seqlen = 11
+      batch = 3
+      dims = 4
+      theta = py_utils.NestedMap()
+      theta.w = self.Rand([2 * dims, dims])
+      theta.b = self.Rand([dims])
+      state0 = py_utils.NestedMap()
+      state0.h = self.Rand([batch, dims])
+      state0.padding = tf.zeros([batch, 1], tf.float64)
+      inputs = py_utils.NestedMap()
+      inputs.x = self.Rand([seqlen, batch, dims])
+      # The first and the last two steps are skipped, and one in the middle is
+      # padded for only some of the examples.
+      padding = np.zeros([seqlen, batch, 1])
+      padding[0] = padding[-2:] = padding[5, 1] = 1.
+      inputs.padding = tf.constant(padding, tf.float64)
+
+      results = []
+      for use_grad in (False, True):
+        for unroll in (1, 2, 3, 8, 16):
+          acc, final = recurrent.Recurrent(
+              theta=theta,
+              state0=state0,
+              inputs=inputs,
+              cell_fn=Elman,
+              cell_grad=ElmanGrad if use_grad else None,
+              unroll=unroll)
+          loss = tf.reduce_sum(acc.h) + tf.reduce_sum(final.h)
+          results.append([acc.h, final.h] + tf.gradients(
+              loss, [theta.w, theta.b, state0.h, inputs.x]))
+      results = self.evaluate(results)
+      for result in results[1:]:
+        for expected, actual in zip(results[0], result):
+          self.assertAllClose(expected, actual)
+
+  def testUnrollWithStopFn(self):
+    with self.session():
+      theta = py_utils.NestedMap(x=tf.constant(2.))
+      state0 = py_utils.NestedMap(
+          value=tf.constant(0.), x_power=tf.constant(1.))
+      inputs = py_utils.NestedMap(coeff=tf.constant([1., 2., 3.]))
+      with self.assertRaisesRegex(ValueError, 'stop_fn'):
+        recurrent.Recurrent(
+            theta, state0, inputs, _Poly, stop_fn=lambda *_: False, unroll=2)
+
   def testSetShape(self):
     dst = py_utils.NestedMap(
         a=tf.placeholder(tf.int32, shape=None),
@@ -734,8 +783,13 @@ class StackedRecurrentTest(test_utils.TestCase):
     self.assertAllClose(dw1, 0.)
     self.assertAllClose(dw0, 7.)
 
-  def _BuildStackedRecurrentElman(self, seqlen, trailing_pad_len, batch, dims,
-                                  layers):
+  def _BuildStackedRecurrentElman(self,
+                                  seqlen,
+                                  trailing_pad_len,
+                                  batch,
+                                  dims,
+                                  layers,
+                                  unroll=1):
     tf.random.set_seed(342462)
     np.random.seed(32540)
 
@@ -775,7 +829,8 @@ class StackedRecurrentTest(test_utils.TestCase):
         cell_out_grads=cell_out_grads,
         thetas=thetas,
         init_states=init_states,
-        inputs=inputs)
+        inputs=inputs,
+        unroll=unroll)
     o = output.x
     if 'padding' in inputs:
       o *= (1 - inputs.padding)
@@ -799,13 +854,13 @@ class StackedRecurrentTest(test_utils.TestCase):
   def _LogDiff(self, x, y):
     tf.logging.info('max(abs(x - y)) = %s', np.max(np.abs(x - y)))
 
-  def _CompareStackedElman(self, seqlen, batch, dims, layers):
+  def _CompareStackedElman(self, seqlen, batch, dims, layers, unroll=1):
     """Tests that StackedRecurrent computest the same output as Recurrent()."""
     trailing_pad_len = 2
     g = tf.Graph()
     with g.as_default():
       ref, output, _, _, _ = self._BuildStackedRecurrentElman(
-          seqlen, trailing_pad_len, batch, dims, layers)
+          seqlen, trailing_pad_len, batch, dims, layers, unroll)
     ref = ref[:-trailing_pad_len]
     output = output[:-trailing_pad_len]
     with self.session(graph=g):
@@ -822,14 +877,24 @@ class StackedRecurrentTest(test_utils.TestCase):
   def testStackedElman_8(self):
     self._CompareStackedElman(11, 1, 4, 8)
 
-  def _TestStackedElmanGradient(self, num, seqlen=7, batch=5):
+  def testStackedElmanUnrolled_4(self):
+    self._CompareStackedElman(8, 5, 8, 4, unroll=3)
+
+  def testStackedElmanUnrolledWithRemainder_2(self):
+    # 7 steps are 2 unrolled iterations and 1 remaining step.
+    self._CompareStackedElman(7, 3, 8, 2, unroll=3)
+
+  def testStackedElmanUnrolledWithoutRemainder_2(self):
+    self._CompareStackedElman(6, 3, 8, 2, unroll=3)
+
+  def _TestStackedElmanGradient(self, num, seqlen=7, batch=5, unroll=1):
     """Tests a stacked Elman recurrent network with num layers."""
     g = tf.Graph()
     with g.as_default():
       # Sequence length, batdh size, hidden dimension
       trailing_pad_len, dims, layers = 2, 8, num
       _, _, loss, xs, dxs = self._BuildStackedRecurrentElman(
-          seqlen, trailing_pad_len, batch, dims, layers)
+          seqlen, trailing_pad_len, batch, dims, layers, unroll)
 
     # Fetches all gradients (dxs) in one session run and compare
     # them with their respective numerical gradient.
@@ -863,6 +928,15 @@ class StackedRecurrentTest(test_utils.TestCase):
   def testStackedElmanGrad_8(self):
     self._TestStackedElmanGradient(8, seqlen=5, batch=3)
 
+  def testStackedElmanGradUnrolled_1(self):
+    self._TestStackedElmanGradient(1, unroll=2)
+
+  def testStackedElmanGradUnrolled_4(self):
+    self._TestStackedElmanGradient(4, unroll=2)
+
+  def testStackedElmanGradUnrolledWithRemainder_2(self):
+    self._TestStackedElmanGradient(2, seqlen=7, unroll=3)
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -0,0 +1,307 @@
+# Lint as: python3
+# Copyright 2020 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Batched, parallel and incremental restores of variables from checkpoints.
+
+tf.train.Saver reads each variable with its own RestoreV2 op, so restoring a
+subset of a large model from several checkpoints issues many small reads one
+checkpoint after the other. `RestorePlanner` instead groups the variables by
+checkpoint, reads each group with a few batched RestoreV2 ops in parallel, and
+skips the variables that have not changed since it last restored them.
+"""
+
+import collections
+import concurrent.futures
+import time
+
+import lingvo.compat as tf
+import numpy as np
+# pylint: disable=g-direct-tensorflow-import
+from tensorflow.python.ops import io_ops
+from tensorflow.python.ops import variables
+# pylint: enable=g-direct-tensorflow-import
+
+# The source tensor a variable was restored from, and the fingerprint of the
+# value of the variable right after the restore.
+_RestoredVar = collections.namedtuple('_RestoredVar', ['source', 'fingerprint'])
+
+
+def _NumBytes(shape, dtype):
+  return int(np.prod(shape, dtype=np.int64)) * dtype.size
+
+
+def _IsPartitioned(var):
+  """Returns whether `var` is a partitioned variable or one of its slices."""
+  return (isinstance(var, variables.PartitionedVariable) or
+          getattr(var, '_save_slice_info', None) is not None)
+
+
+class RestorePlanner:
+  """Restores variables from checkpoints with few, large reads.
+
+  The variables restored from a checkpoint are split into as many groups of
+  about the same number of bytes as the checkpoint has data shards, and each
+  group is read with a single batched RestoreV2 op. The groups of all the
+  checkpoints are restored in parallel on a thread pool. A checkpoint tensor
+  restored into several variables is only read once.
+
+  The planner remembers, for each variable it restores, the checkpoint tensor
+  it came from and a fingerprint of its value. When asked to restore the same
+  tensor again from unchanged checkpoint files, it only does so if the
+  fingerprint of the variable has changed, e.g. because it was trained or
+  re-initialized in the meantime. The time to warm start again is then
+  proportional to the changed bytes, not to the size of the model.
+
+  Partitioned variables (tf.PartitionedVariable) and their slices are not
+  batched: they are restored with tf.train.Saver on every call.
+
+  The restore ops are added to the graph of the session, on the calling
+  thread; only the session runs happen on the thread pool.
+  """
+
+  def __init__(self, num_threads=8):
+    """Constructor.
+
+    Args:
+      num_threads: Maximum number of batched RestoreV2 ops to run concurrently.
+    """
+    self._num_threads = num_threads
+    # Variable ref -> _RestoredVar.
+    self._restored = {}
+    # Variable ref -> fingerprint tensor of the variable.
+    self._fingerprints = {}
+    # Tuple of (checkpoint tensor name, variable refs) -> (prefix placeholder,
+    # list of fingerprint tensors of the variables after the restore).
+    self._restore_ops = {}
+
+  def _Fingerprint(self, var):
+    """Returns a [1, 8] uint8 tensor fingerprinting the value of `var`."""
+    ref = var.experimental_ref()
+    if ref not in self._fingerprints:
+      with tf.name_scope('restore_planner'):
+        self._fingerprints[ref] = tf.fingerprint(
+            tf.reshape(var.read_value(), [1, -1]))
+    return self._fingerprints[ref]
+
+  def _GetRestoreOp(self, group):
+    """Returns the batched restore of `group`, a list of (name, vars)."""
+    key = tuple(
+        (name, tuple(v.experimental_ref() for v in variables))
+        for name, variables in group)
+    if key not in self._restore_ops:
+      with tf.name_scope('restore_planner'):
+        prefix = tf.placeholder(tf.string, shape=[], name='prefix')
+        values = io_ops.restore_v2(
+            prefix=prefix,
+            tensor_names=[name for name, _ in group],
+            shape_and_slices=[''] * len(group),
+            dtypes=[variables[0].dtype.base_dtype for _, variables in group])
+        assign_ops = []
+        for (_, variables), value in zip(group, values):
+          assign_ops += [var.assign(value) for var in variables]
+        with tf.control_dependencies(assign_ops):
+          fingerprints = [
+              tf.fingerprint(tf.reshape(var.read_value(), [1, -1]))
+              for _, variables in group
+              for var in variables
+          ]
+      self._restore_ops[key] = (prefix, fingerprints)
+    return self._restore_ops[key]
+
+  def _CheckpointStamp(self, checkpoint_path):
+    """Returns a value that changes when the checkpoint is rewritten."""
+    try:
+      stat = tf.io.gfile.stat(checkpoint_path + '.index')
+    except tf.errors.OpError:
+      # Not a V2 checkpoint: never skip the restore of its tensors.
+      return None
+    return (checkpoint_path, stat.length, stat.mtime_nsec)
+
+  def _SkipUnchanged(self, sess, stamp, vars_to_load):
+    """Returns `vars_to_load` without the vars that need not be restored."""
+    candidates = []
+    for name, var in vars_to_load:
+      restored = self._restored.get(var.experimental_ref())
+      if restored and restored.source == (stamp, name):
+        candidates.append(var)
+    if not candidates:
+      return vars_to_load
+    fingerprints = sess.run([self._Fingerprint(var) for var in candidates])
+    unchanged = set()
+    for var, fingerprint in zip(candidates, fingerprints):
+      ref = var.experimental_ref()
+      if np.array_equal(fingerprint, self._restored[ref].fingerprint):
+        unchanged.add(ref)
+    return [(name, var)
+            for name, var in vars_to_load
+            if var.experimental_ref() not in unchanged]
+
+  def _RestoreWithSaver(self, sess, checkpoint_path, vars_to_load):
+    """Restores partitioned variables with tf.train.Saver.
+
+    Args:
+      sess: A tf.Session.
+      checkpoint_path: Path of the checkpoint.
+      vars_to_load: A list of (name of the tensor in the checkpoint, variable)
+        pairs, where each variable is a tf.PartitionedVariable or one of its
+        slices.
+
+    Returns:
+      The number of bytes read from the checkpoint.
+    """
+    num_bytes = sum(
+        _NumBytes(var.get_shape().as_list(), var.dtype.base_dtype)
+        for _, var in vars_to_load)
+    while vars_to_load:
+      # tf.train.Saver requires the name in the checkpoint to be unique for
+      # each variable, so we call it multiple times with a unique set of names
+      # each time. A slice is passed as a list of one variable, for which the
+      # saver reads the slice of the tensor instead of the whole tensor.
+      unique_vars_to_load = {}
+      remaining_vars_to_load = []
+      for name, var in vars_to_load:
+        if name in unique_vars_to_load:
+          remaining_vars_to_load.append((name, var))
+        elif isinstance(var, variables.PartitionedVariable):
+          unique_vars_to_load[name] = var
+        else:
+          unique_vars_to_load[name] = [var]
+      tf.train.Saver(var_list=unique_vars_to_load).restore(
+          sess, checkpoint_path)
+      vars_to_load = remaining_vars_to_load
+    return num_bytes
+
+  def _PlanCheckpoint(self, checkpoint_path, vars_to_load):
+    """Splits the restore of `vars_to_load` into balanced batched reads.
+
+    Args:
+      checkpoint_path: Path of the checkpoint.
+      vars_to_load: A list of (name of the tensor in the checkpoint, variable)
+        pairs.
+
+    Returns:
+      A list of (group, num_bytes), where each group is a list of (name of the
+      tensor in the checkpoint, list of variables to restore it into).
+
+    Raises:
+      ValueError: if a tensor is not in the checkpoint.
+    """
+    reader = tf.train.load_checkpoint(checkpoint_path)
+    shape_map = reader.get_variable_to_shape_map()
+    dtype_map = reader.get_variable_to_dtype_map()
+    vars_by_name = collections.defaultdict(list)
+    for name, var in vars_to_load:
+      if name not in shape_map:
+        raise ValueError('Tensor %s to restore into %s not found in %s.' %
+                         (name, var.name, checkpoint_path))
+      vars_by_name[name].append(var)
+
+    num_shards = max(1, len(tf.io.gfile.glob(checkpoint_path + '.data-*')))
+    groups = [[] for _ in range(num_shards)]
+    group_bytes = [0] * num_shards
+    # Greedily adds the largest remaining tensor to the smallest group.
+    for name in sorted(
+        vars_by_name,
+        key=lambda n: _NumBytes(shape_map[n], dtype_map[n]),
+        reverse=True):
+      i = int(np.argmin(group_bytes))
+      groups[i].append((name, vars_by_name[name]))
+      group_bytes[i] += _NumBytes(shape_map[name], dtype_map[name])
+    # Tensors are stored sorted by name, so read them in that order.
+    return [(sorted(group, key=lambda x: x[0]), num_bytes)
+            for group, num_bytes in zip(groups, group_bytes)
+            if group]
+
+  def Restore(self, sess, vars_to_load_by_checkpoint):
+    """Restores variables from checkpoints.
+
+    Args:
+      sess: A tf.Session.
+      vars_to_load_by_checkpoint: A dict of checkpoint path: list of (name of
+        the tensor in the checkpoint, variable to restore it into) pairs.
+
+    Returns:
+      The number of bytes read from the checkpoints.
+
+    Raises:
+      ValueError: if a tensor is not in its checkpoint.
+    """
+    with sess.graph.as_default():
+      return self._Restore(sess, vars_to_load_by_checkpoint)
+
+  def _Restore(self, sess, vars_to_load_by_checkpoint):
+    """Restore in the graph of `sess`."""
+    start_time = time.time()
+    plan = []
+    num_vars = 0
+    num_skipped_vars = 0
+    partitioned_vars_by_checkpoint = {}
+    for checkpoint_path, vars_to_load in sorted(
+        vars_to_load_by_checkpoint.items()):
+      partitioned_vars = [(name, var)
+                          for name, var in vars_to_load
+                          if _IsPartitioned(var)]
+      if partitioned_vars:
+        partitioned_vars_by_checkpoint[checkpoint_path] = partitioned_vars
+        num_vars += len(partitioned_vars)
+        vars_to_load = [(name, var)
+                        for name, var in vars_to_load
+                        if not _IsPartitioned(var)]
+      stamp = self._CheckpointStamp(checkpoint_path)
+      changed_vars_to_load = vars_to_load
+      if stamp is not None:
+        changed_vars_to_load = self._SkipUnchanged(sess, stamp, vars_to_load)
+      num_vars += len(changed_vars_to_load)
+      num_skipped_vars += len(vars_to_load) - len(changed_vars_to_load)
+      if changed_vars_to_load:
+        for group, num_bytes in self._PlanCheckpoint(checkpoint_path,
+                                                     changed_vars_to_load):
+          plan.append((checkpoint_path, stamp, group, num_bytes))
+
+    if plan:
+      # The default graph is thread-local, so the restore ops must be built
+      # here rather than on the threads of the pool.
+      restore_ops = [self._GetRestoreOp(group) for _, _, group, _ in plan]
+      with concurrent.futures.ThreadPoolExecutor(
+          min(self._num_threads, len(plan))) as executor:
+        futures = [
+            executor.submit(
+                sess.run, fingerprints, feed_dict={prefix: checkpoint_path})
+            for (checkpoint_path, _, _, _), (prefix, fingerprints) in zip(
+                plan, restore_ops)
+        ]
+        for (_, stamp, group, _), future in zip(plan, futures):
+          fingerprints = iter(future.result())
+          for name, variables in group:
+            for var in variables:
+              ref = var.experimental_ref()
+              fingerprint = next(fingerprints)
+              if stamp is None:
+                self._restored.pop(ref, None)
+              else:
+                self._restored[ref] = _RestoredVar((stamp, name), fingerprint)
+
+    num_bytes = sum(num_bytes for _, _, _, num_bytes in plan)
+    for checkpoint_path, partitioned_vars in sorted(
+        partitioned_vars_by_checkpoint.items()):
+      num_bytes += self._RestoreWithSaver(sess, checkpoint_path,
+                                          partitioned_vars)
+    elapsed = time.time() - start_time
+    tf.logging.info(
+        'Restored %d vars (%d bytes in %d reads) from %d checkpoints in %.2fs '
+        '(%.1f MB/s), skipped %d unchanged vars.', num_vars, num_bytes,
+        len(plan), len(vars_to_load_by_checkpoint), elapsed,
+        num_bytes / max(elapsed, 1e-6) / 2**20, num_skipped_vars)
+    return num_bytes
@@ -0,0 +1,171 @@
+# Lint as: python3
+# Copyright 2020 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for restore_planner."""
+
+import os
+
+import lingvo.compat as tf
+from lingvo.core import py_utils
+from lingvo.core import restore_planner
+from lingvo.core import test_utils
+import numpy as np
+
+
+class RestorePlannerTest(test_utils.TestCase):
+
+  def _SaveCheckpoint(self, name, values):
+    """Saves a checkpoint of float32 `values`, a dict of name: value."""
+    with tf.Graph().as_default():
+      saved_vars = [
+          tf.get_variable(k, initializer=np.asarray(v, np.float32))
+          for k, v in values.items()
+      ]
+      with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        return tf.train.Saver(saved_vars).save(
+            sess, os.path.join(self.get_temp_dir(), name),
+            write_meta_graph=False)
+
+  def testRestore(self):
+    ckpt_a = self._SaveCheckpoint('a', {'x': [1., 2.], 'y': [[3.]]})
+    ckpt_b = self._SaveCheckpoint('b', {'z': [4., 5., 6.]})
+    with self.session() as sess:
+      x = tf.get_variable('x', initializer=[0., 0.])
+      y = tf.get_variable('y', initializer=[[0.]])
+      z = tf.get_variable('z', initializer=[0., 0., 0.])
+      # Restored from the same tensor as x.
+      x2 = tf.get_variable('x2', initializer=[0., 0.])
+      self.evaluate(tf.global_variables_initializer())
+      planner = restore_planner.RestorePlanner()
+      num_bytes = planner.Restore(sess, {
+          ckpt_a: [('x', x), ('y', y), ('x', x2)],
+          ckpt_b: [('z', z)],
+      })
+      # x is only read once.
+      self.assertEqual(4 * 6, num_bytes)
+      self.assertAllEqual([1., 2.], self.evaluate(x))
+      self.assertAllEqual([[3.]], self.evaluate(y))
+      self.assertAllEqual([4., 5., 6.], self.evaluate(z))
+      self.assertAllEqual([1., 2.], self.evaluate(x2))
+
+  def testSkipsUnchangedVars(self):
+    ckpt_a = self._SaveCheckpoint('a', {'x': [1., 2.], 'y': [3., 4., 5.]})
+    ckpt_b = self._SaveCheckpoint('b', {'x': [6., 7.]})
+    with self.session() as sess:
+      x = tf.get_variable('x', initializer=[0., 0.])
+      y = tf.get_variable('y', initializer=[0., 0., 0.])
+      self.evaluate(tf.global_variables_initializer())
+      planner = restore_planner.RestorePlanner()
+      vars_to_load = {ckpt_a: [('x', x), ('y', y)]}
+      self.assertEqual(4 * 5, planner.Restore(sess, vars_to_load))
+      self.assertEqual(0, planner.Restore(sess, vars_to_load))
+
+      # Only the modified variable is read again.
+      self.evaluate(tf.assign(y, [0., 0., 0.]))
+      self.assertEqual(4 * 3, planner.Restore(sess, vars_to_load))
+      self.assertAllEqual([3., 4., 5.], self.evaluate(y))
+
+      # A different source is always read.
+      self.assertEqual(4 * 2, planner.Restore(sess, {ckpt_b: [('x', x)]}))
+      self.assertAllEqual([6., 7.], self.evaluate(x))
+      self.assertEqual(4 * 2, planner.Restore(sess, vars_to_load))
+      self.assertAllEqual([1., 2.], self.evaluate(x))
+
+  def testRestorePartitionedVars(self):
+    value = np.arange(8, dtype=np.float32).reshape([4, 2])
+
+    def _CreateVars():
+      emb = tf.get_variable(
+          'emb',
+          shape=[4, 2],
+          initializer=tf.zeros_initializer(),
+          partitioner=tf.fixed_size_partitioner(2))
+      x = tf.get_variable('x', initializer=[0., 0.])
+      return emb, x
+
+    with tf.Graph().as_default():
+      emb, x = _CreateVars()
+      with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        sess.run([part.assign(v) for part, v in zip(emb, np.split(value, 2))])
+        sess.run(x.assign([1., 2.]))
+        ckpt = tf.train.Saver([emb, x]).save(
+            sess,
+            os.path.join(self.get_temp_dir(), 'partitioned'),
+            write_meta_graph=False)
+
+    with self.session() as sess:
+      emb, x = _CreateVars()
+      self.evaluate(tf.global_variables_initializer())
+      planner = restore_planner.RestorePlanner()
+      # The slices of emb, as in tf.global_variables().
+      vars_to_load = {ckpt: [('emb', part) for part in emb] + [('x', x)]}
+      self.assertEqual(4 * (8 + 2), planner.Restore(sess, vars_to_load))
+      self.assertAllEqual(value, self.evaluate(emb.as_tensor()))
+      self.assertAllEqual([1., 2.], self.evaluate(x))
+      # Slices are restored again, unchanged variables are not.
+      self.assertEqual(4 * 8, planner.Restore(sess, vars_to_load))
+
+      # The partitioned variable itself.
+      self.evaluate(tf.global_variables_initializer())
+      self.assertEqual(4 * 8, planner.Restore(sess, {ckpt: [('emb', emb)]}))
+      self.assertAllEqual(value, self.evaluate(emb.as_tensor()))
+
+  def testRestoreInNonDefaultGraph(self):
+    ckpt_a = self._SaveCheckpoint('a', {'x': [1., 2.], 'y': [3.]})
+    ckpt_b = self._SaveCheckpoint('b', {'z': [4., 5., 6.]})
+    # As in the trainer, the model is not built in the default graph.
+    graph = tf.Graph()
+    with graph.as_default():
+      x = tf.get_variable('x', initializer=[0., 0.])
+      y = tf.get_variable('y', initializer=[0.])
+      z = tf.get_variable('z', initializer=[0., 0., 0.])
+      init_op = tf.global_variables_initializer()
+    self.assertIsNot(graph, tf.get_default_graph())
+    num_default_graph_ops = len(tf.get_default_graph().get_operations())
+    with tf.Session(graph=graph) as sess:
+      sess.run(init_op)
+      planner = restore_planner.RestorePlanner()
+      self.assertEqual(
+          4 * 6,
+          planner.Restore(sess, {
+              ckpt_a: [('x', x)],
+              ckpt_b: [('z', z)]
+          }))
+      self.assertAllEqual([1., 2.], sess.run(x))
+      self.assertAllEqual([4., 5., 6.], sess.run(z))
+      py_utils.OverrideVarsFromCheckpoints(
+          sess, [x, y, z], {
+              ckpt_a: ([('(y.*)', '%s')], []),
+              ckpt_b: ([('(z.*)', '%s')], []),
+          }, planner)
+      self.assertAllEqual([3.], sess.run(y))
+      self.assertAllEqual([4., 5., 6.], sess.run(z))
+    # No restore op leaked into the default graph.
+    self.assertLen(tf.get_default_graph().get_operations(),
+                   num_default_graph_ops)
+
+  def testMissingTensor(self):
+    ckpt = self._SaveCheckpoint('a', {'x': [1., 2.]})
+    with self.session() as sess:
+      w = tf.get_variable('w', initializer=[0., 0.])
+      self.evaluate(tf.global_variables_initializer())
+      with self.assertRaisesRegex(ValueError, 'Tensor v to restore into w'):
+        restore_planner.RestorePlanner().Restore(sess, {ckpt: [('v', w)]})
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -379,6 +379,9 @@ class FRNN(base_layer.BaseLayer):
     p.Define('reverse', False,
              'Whether or not to unroll the sequence in reversed order.')
     p.Define('packed_input', False, 'To reset states for packed inputs.')
+    p.Define(
+        'unroll', 1, 'The number of time steps computed by each iteration of '
+        'the recurrent loops. See recurrent.Recurrent().')
     return p
 
   def __init__(self, params):
@@ -462,7 +465,8 @@ class FRNN(base_layer.BaseLayer):
         cell_fn=rcell.FProp,
         cell_type=rcell.layer_type,
         accumulator_layer=self,
-        allow_implicit_capture=p.allow_implicit_capture)
+        allow_implicit_capture=p.allow_implicit_capture,
+        unroll=p.unroll)
 
     act = rcell.GetOutput(acc_state)
     if p.reverse:
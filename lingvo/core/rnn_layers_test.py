@@ -832,7 +832,8 @@ class LayersTest(LayersTestBase, parameterized.TestCase):
 
   def _testBidirectionalFRNNHelper(self,
                                    trailing_pad_len=0,
-                                   cluster_params=None):
+                                   cluster_params=None,
+                                   unroll=1):
     batch = 3
     dims = 16
     slen = 10 + trailing_pad_len
@@ -858,6 +859,7 @@ class LayersTest(LayersTestBase, parameterized.TestCase):
       frnn_params.name = 'bifrnn'
       frnn_params.fwd = lstm_forward.Copy()
       frnn_params.bak = lstm_backward.Copy()
+      frnn_params.rnn.unroll = unroll
       with tf.variable_scope('frnn'):
         frnn = rnn_layers.BidirectionalFRNN(frnn_params)
 
@@ -898,6 +900,9 @@ class LayersTest(LayersTestBase, parameterized.TestCase):
   def testBidirectionalFRNNTrailingPadding(self):
     self._testBidirectionalFRNNHelper(trailing_pad_len=2)
 
+  def testBidirectionalFRNNUnroll(self):
+    self._testBidirectionalFRNNHelper(trailing_pad_len=2, unroll=3)
+
   def testBidirectionalFRNNSplit(self):
     cluster_params = cluster_factory.Cluster.Params()
     cluster_params.worker.Set(
@@ -1556,5 +1561,69 @@ class LayersTest(LayersTestBase, parameterized.TestCase):
     self._testFRNNWithAttentionUseZeroAttenState(_NestedMapZeroAttenState)
 
 
+class FRNNUnrollBenchmark(tf.test.Benchmark):
+  """Benchmarks the training step of FRNN layers on CPU for a few unrolls.
+
+  Run with::
+
+    bazel run -c opt lingvo/core:rnn_layers_test -- --benchmarks=.
+  """
+
+  def _LSTMParams(self, dims):
+    return rnn_cell.LSTMCellSimple.Params().Set(
+        num_input_nodes=dims,
+        num_output_nodes=dims,
+        params_init=py_utils.WeightInit.Uniform(0.02, 429891685))
+
+  def _Benchmark(self, name, layer_p, dims, slen, batch, num_iters=10):
+    for unroll in (1, 2, 4, 8):
+      with tf.Graph().as_default(), tf.device('/cpu:0'):
+        p = layer_p.Copy()
+        p.name = name
+        if issubclass(p.cls, rnn_layers.BidirectionalFRNN):
+          p.rnn.unroll = unroll
+        else:
+          p.unroll = unroll
+        layer = p.Instantiate()
+        np.random.seed(12345)
+        inputs = tf.constant(
+            np.random.uniform(size=(slen, batch, dims)), tf.float32)
+        paddings = np.zeros([slen, batch, 1])
+        paddings[slen * 3 // 4:, 1:] = 1.0
+        outputs = layer.FPropDefaultTheta(inputs, tf.constant(paddings,
+                                                              tf.float32))
+        if isinstance(outputs, tuple):
+          outputs = outputs[0]
+        grads = tf.gradients(tf.reduce_sum(outputs), layer.vars.Flatten())
+        with tf.Session() as sess:
+          sess.run(tf.global_variables_initializer())
+          self.run_op_benchmark(
+              sess,
+              grads,
+              min_iters=num_iters,
+              name='%s_unroll%d' % (name, unroll))
+
+  def benchmarkMTEncoderFRNN(self):
+    # The unidirectional layers of the MT encoder, with small cells.
+    self._Benchmark(
+        'mt_frnn',
+        rnn_layers.FRNN.Params().Set(cell=self._LSTMParams(128)),
+        dims=128,
+        slen=64,
+        batch=16)
+
+  def benchmarkMTEncoderBidirectionalFRNN(self):
+    # The bidirectional first layer of the MT encoder, with small cells.
+    p = rnn_layers.BidirectionalFRNN.Params().Set(
+        fwd=self._LSTMParams(128), bak=self._LSTMParams(128))
+    self._Benchmark('mt_bifrnn', p, dims=128, slen=64, batch=16)
+
+  def benchmarkAsrEncoderBidirectionalFRNN(self):
+    # The layers of the ASR encoder: long utterances, few of them.
+    p = rnn_layers.BidirectionalFRNN.Params().Set(
+        fwd=self._LSTMParams(256), bak=self._LSTMParams(256))
+    self._Benchmark('asr_bifrnn', p, dims=256, slen=200, batch=4)
+
+
 if __name__ == '__main__':
   tf.test.main()
@@ -18,6 +18,7 @@ The implementation mimics tf.train.Saver. Meanwhile, it allows us
 to carry out extra sanity checks on the checkpoint.
 """
 
+import concurrent.futures
 import re
 import time
 from lingvo import compat as tf
@@ -65,6 +66,19 @@ def _VarKey(var):
   return var.name[:-2]  # strip :0
 
 
+def _VarBytes(var):
+  num_elements = var.shape.num_elements()
+  return (num_elements or 0) * var.dtype.base_dtype.size
+
+
+def _HostDevice(device):
+  """Returns the CPU device of the host of `device`, where I/O ops run."""
+  if not device:
+    return device
+  return tf.DeviceSpec.from_string(device).replace(
+      device_type="CPU", device_index=0).to_string()
+
+
 class Saver:
   """Simpler version of tf.train.Saver with extra sanity checks."""
 
@@ -73,7 +87,26 @@ class Saver:
                variables,
                sanity_checks=None,
                keep_latest_n=None,
-               keep_every_n_hours=None):
+               keep_every_n_hours=None,
+               num_shards=1,
+               shard_by_device=False):
+    """Constructor.
+
+    Args:
+      logdir: The directory of the checkpoints.
+      variables: The variables to save and restore.
+      sanity_checks: A list of (variables, `SanityCheck`) run on each new
+        checkpoint.
+      keep_latest_n: If set, only keeps this many latest checkpoints.
+      keep_every_n_hours: If set, also keeps a checkpoint every this many
+        hours.
+      num_shards: Number of concurrent save_v2 ops among which the variables
+        are split by size. The shards are merged into a single checkpoint with
+        one data file per shard.
+      shard_by_device: If True, uses one shard per device of the variables,
+        each saved and restored on the host of the device, instead of
+        num_shards.
+    """
     self._logdir = logdir
     self._state_file = "{}/checkpoint".format(self._logdir)
     self._vars = variables
@@ -85,11 +118,43 @@ class Saver:
     self._re_pattern = re.compile(r"^.*/ckpt-(\d+).*$")
     self._logdir_ph = tf.placeholder(tf.string, shape=[])
     self._restore_prefix_ph = tf.placeholder(tf.string, shape=[])
+    self._shards = self._PartitionVars(num_shards, shard_by_device)
+    self._shard_of_key = {}
+    for i, (_, shard) in enumerate(self._shards):
+      self._shard_of_key.update((_VarKey(v), i) for v in shard)
     self._BuildSave()
     self._BuildRestore()
     tf.logging.info("Saver: %s %s %s", self._logdir, self._keep_latest_n,
                     self._keep_every_n_hours)
 
+  def _PartitionVars(self, num_shards, shard_by_device):
+    """Splits the variables into shards.
+
+    Args:
+      num_shards: Number of shards of about the same size in bytes.
+      shard_by_device: If True, uses one shard per device instead.
+
+    Returns:
+      A list of (device, list of variables) of the non-empty shards. The
+      device is the host to save and restore the shard on, or "" to let the
+      placer decide.
+    """
+    if shard_by_device:
+      vars_by_device = {}
+      for var in self._vars:
+        vars_by_device.setdefault(_HostDevice(var.device), []).append(var)
+      return sorted(vars_by_device.items())
+
+    assert num_shards >= 1, num_shards
+    shards = [[] for _ in range(num_shards)]
+    shard_bytes = [0] * num_shards
+    # Greedily adds the largest remaining variable to the smallest shard.
+    for var in sorted(self._vars, key=_VarBytes, reverse=True):
+      i = int(np.argmin(shard_bytes))
+      shards[i].append(var)
+      shard_bytes[i] += _VarBytes(var)
+    return [("", sorted(shard, key=_VarKey)) for shard in shards if shard]
+
   def _BuildSave(self):
     """Builds save ops."""
     self._save_global_step = py_utils.GetGlobalStep()
@@ -97,22 +162,56 @@ class Saver:
         self._logdir_ph, "/ckpt-",
         tf.as_string(self._save_global_step, width=8, fill="0")
     ])
-    self._save_op = io_ops.save_v2(
-        prefix=self._save_prefix,
-        tensor_names=[_VarKey(v) for v in self._vars],
-        tensors=[v.read_value() for v in self._vars],
-        shape_and_slices=[""] * len(self._vars))
+    if len(self._shards) <= 1:
+      self._save_op = io_ops.save_v2(
+          prefix=self._save_prefix,
+          tensor_names=[_VarKey(v) for v in self._vars],
+          tensors=[v.read_value() for v in self._vars],
+          shape_and_slices=[""] * len(self._vars))
+      return
+
+    # Like tf.train.Saver(sharded=True), writes the shards concurrently into
+    # a temporary directory and merges them into a single checkpoint.
+    tmp_prefix = tf.strings.join([self._save_prefix, "_temp/part"])
+    shard_prefixes = []
+    save_ops = []
+    for i, (device, shard) in enumerate(self._shards):
+      with tf.device(device):
+        shard_prefix = io_ops.sharded_filename(tmp_prefix, i, len(self._shards))
+        shard_prefixes.append(shard_prefix)
+        save_ops.append(
+            io_ops.save_v2(
+                prefix=shard_prefix,
+                tensor_names=[_VarKey(v) for v in shard],
+                tensors=[v.read_value() for v in shard],
+                shape_and_slices=[""] * len(shard)))
+    with tf.control_dependencies(save_ops):
+      self._save_op = io_ops.merge_v2_checkpoints(
+          tf.stack(shard_prefixes), self._save_prefix, delete_old_dirs=True)
 
   def _BuildRestore(self):
     """Builds restore ops."""
     assign_ops = []
-    for var in self._vars:
-      val, = io_ops.restore_v2(
-          prefix=self._restore_prefix_ph,
-          tensor_names=[_VarKey(var)],
-          shape_and_slices=[""],
-          dtypes=[var.dtype])
-      assign_ops.append(var.assign(val))
+    if len(self._shards) <= 1:
+      for var in self._vars:
+        val, = io_ops.restore_v2(
+            prefix=self._restore_prefix_ph,
+            tensor_names=[_VarKey(var)],
+            shape_and_slices=[""],
+            dtypes=[var.dtype])
+        assign_ops.append(var.assign(val))
+    else:
+      # One batched read per shard, all run concurrently. Tensors are looked
+      # up by name, so this also reads checkpoints saved with another sharding
+      # or unsharded.
+      for device, shard in self._shards:
+        with tf.device(device):
+          values = io_ops.restore_v2(
+              prefix=self._restore_prefix_ph,
+              tensor_names=[_VarKey(v) for v in shard],
+              shape_and_slices=[""] * len(shard),
+              dtypes=[v.dtype.base_dtype for v in shard])
+        assign_ops += [var.assign(val) for var, val in zip(shard, values)]
     self._restore_op = tf.group(*assign_ops)
 
   def _GetState(self):
@@ -152,22 +251,35 @@ class Saver:
         tf.logging.info("Garbage collecting %s", filename)
         tf.io.gfile.remove(filename)
 
+  def _ReadTensors(self, prefix, keys):
+    """Reads `keys` from a checkpoint, concurrently for different shards."""
+    keys_by_shard = {}
+    for key in keys:
+      keys_by_shard.setdefault(self._shard_of_key.get(key, 0), []).append(key)
+
+    def _Read(shard_keys):
+      # Checkpoint readers are not thread-safe, so each thread has its own.
+      reader = tf.train.NewCheckpointReader(prefix)
+      return {key: reader.get_tensor(key) for key in shard_keys}
+
+    if len(keys_by_shard) <= 1:
+      return _Read(keys)
+    content = {}
+    with concurrent.futures.ThreadPoolExecutor(len(keys_by_shard)) as executor:
+      for values in executor.map(_Read, keys_by_shard.values()):
+        content.update(values)
+    return content
+
   def _DoSanityCheck(self, prefix):
     """Sanity-check the content of the checkpoint."""
     if not self._sanity_checks:
       return
-    reader = tf.train.NewCheckpointReader(prefix)
-    content = {}
+    keys = []
+    for variables, _ in self._sanity_checks:
+      keys += [_VarKey(v) for v in variables]
+    content = self._ReadTensors(prefix, list(dict.fromkeys(keys)))
     for variables, rule in self._sanity_checks:
-      args = []
-      for v in variables:
-        key = _VarKey(v)
-        if key in content:
-          args.append(content[key])
-        else:
-          value = reader.get_tensor(key)
-          content[key] = value
-          args.append(value)
+      args = [content[_VarKey(v)] for v in variables]
       if not rule.Check(*args):
         # TODO(zhifengc): Maybe should return an explicit signal
         # so that the caller (the controller loop) can Restore()
@@ -204,12 +316,32 @@ class Saver:
     # We can do extra sanity checks.
     self._DoSanityCheck(prefix)
 
+    self._WriteShardInfo(prefix)
+
     # Commit new state.
     self._UpdateState(prefix)
 
     tf.logging.info("Saved %d %s", global_step, prefix)
     return global_step, prefix
 
+  def _WriteShardInfo(self, prefix):
+    """Records how a sharded checkpoint was split, next to the state file.
+
+    CheckpointState has no field for it, so one line per shard is written to
+    "<prefix>.shards", which is garbage collected with the checkpoint.
+
+    Args:
+      prefix: The prefix of the new checkpoint.
+    """
+    if len(self._shards) <= 1:
+      return
+    lines = []
+    for i, (device, shard) in enumerate(self._shards):
+      lines.append("shard: {} device: {!r} num_vars: {} num_bytes: {}\n".format(
+          i, device, len(shard), sum(_VarBytes(v) for v in shard)))
+    file_io.atomic_write_string_to_file("{}.shards".format(prefix),
+                                        "".join(lines))
+
   def _UpdateState(self, prefix):
     """Updates the checkpoint state with the new checkpoint prefix."""
     # The checkpoint looks OK. Commit it to the state.
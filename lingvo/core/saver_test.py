@@ -100,6 +100,62 @@ class SaverTest(test_utils.TestCase):
       sess.run(tf.global_variables_initializer())
       _ = sav.Save(sess)
 
+  def _CreateVars(self):
+    py_utils.GetOrCreateGlobalStepVar()
+    for i, size in enumerate([100, 3, 40, 7, 60]):
+      with tf.device('/cpu:0' if i % 2 else ''):
+        tf.get_variable(
+            'var%d' % i, initializer=np.arange(size, dtype=np.float32) + i)
+    return tf.all_variables()
+
+  def _AssertValues(self, sess, variables, expected):
+    for var, value in zip(variables, expected):
+      self.assertAllEqual(value, sess.run(var), var.name)
+
+  def testSharded(self):
+    logdir = tempfile.mkdtemp()
+    g = tf.Graph()
+    with g.as_default():
+      variables = self._CreateVars()
+      sanity_checks = [([var], saver.IsFinite()) for var in variables]
+      sav = saver.Saver(logdir, variables, sanity_checks, num_shards=3)
+    with self.session(graph=g) as sess:
+      sess.run(tf.global_variables_initializer())
+      expected = sess.run(variables)
+      _, prefix = sav.Save(sess)
+      self.assertLen(tf.io.gfile.glob(prefix + '.data-*-of-00003'), 3)
+      self.assertLen(
+          tf.io.gfile.GFile(prefix + '.shards').read().splitlines(), 3)
+      self.assertFalse(tf.io.gfile.exists(prefix + '_temp'))
+      sess.run([var.assign(tf.zeros_like(var)) for var in variables])
+      _ = sav.Restore(sess)
+      self._AssertValues(sess, variables, expected)
+
+  def testShardedCompatibleWithUnsharded(self):
+    logdir = tempfile.mkdtemp()
+    g = tf.Graph()
+    with g.as_default():
+      # The global step is the last variable.
+      variables = self._CreateVars()[::-1]
+      unsharded = saver.Saver(logdir, variables)
+      by_device = saver.Saver(logdir, variables, shard_by_device=True)
+    with self.session(graph=g) as sess:
+      sess.run(tf.global_variables_initializer())
+      expected = sess.run(variables)
+      _ = unsharded.Save(sess)
+      sess.run([var.assign(tf.zeros_like(var)) for var in variables])
+      _ = by_device.Restore(sess)
+      self._AssertValues(sess, variables, expected)
+
+      global_step = py_utils.GetGlobalStep()
+      sess.run(global_step.assign(1))
+      _, prefix = by_device.Save(sess)
+      self.assertLen(tf.io.gfile.glob(prefix + '.data-*-of-00002'), 2)
+      sess.run([var.assign(tf.zeros_like(var)) for var in variables])
+      _ = unsharded.Restore(sess)
+      self._AssertValues(sess, variables, expected[:-1])
+      self.assertEqual(1, sess.run(global_step))
+
   def testWriteReadNpArrays(self):
     prefix = os.path.join(tempfile.mkdtemp(), 'nptest')
     nmap = py_utils.NestedMap()
@@ -16,8 +16,10 @@
 """An experimental new unified TPU executor."""
 
 import os
+import time
 
 from lingvo import compat as tf
+from lingvo.core import base_layer
 from lingvo.core import base_model
 from lingvo.core import checkpointer
 from lingvo.core import cluster_factory
@@ -246,8 +248,12 @@ class ExecutorTpu(base_runner.BaseRunner):
           else self._cluster.GetPlacer()):
         with py_utils.VariableRenameScope(self._variable_renaming_rules):
           _ = py_utils.GetOrCreateGlobalStepVar()
-          for program in self._programs:
-            program.BuildTpuSubgraph()
+          # Every program builds its own copy of its task's model.
+          with base_layer.FPropMetaCacheScope():
+            for program in self._programs:
+              start_time = time.time()
+              program.BuildTpuSubgraph()
+              program.ReportGraphConstructionTime(time.time() - start_time)
         for program in self._programs:
           program.SetStatusMessageFn(self._SetStatusMessage)
           program.CreateCheckpointer()
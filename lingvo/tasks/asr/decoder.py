@@ -46,6 +46,31 @@ def _NewTensorArray(name, max_seq_length, dtype=None):
   return tf.TensorArray(dtype, max_seq_length, name=name)
 
 
+def _GatherRows(x, rows):
+  """Returns the given rows of x, or x itself if it is a scalar."""
+  if x.shape.ndims == 0:
+    return x
+  return tf.gather(x, rows)
+
+
+def _ScatterRows(x, rows, batch_size):
+  """Returns x scattered into the given rows of zeros of batch_size rows.
+
+  Rows equal to batch_size are dropped.
+  """
+  if x.shape.ndims == 0:
+    return x
+  shape = tf.concat([[batch_size + 1], tf.shape(x)[1:]], axis=0)
+  return tf.scatter_nd(tf.expand_dims(rows, 1), x, shape)[:batch_size]
+
+
+def _TargetLengths(paddings):
+  """Returns the number of steps up to the last non-padded one, [batch]."""
+  steps = tf.range(1, tf.shape(paddings)[1] + 1)
+  not_padded = tf.cast(tf.equal(paddings, 0), tf.int32)
+  return tf.reduce_max(not_padded * steps[tf.newaxis, :], axis=1)
+
+
 class AsrDecoderBase(base_decoder.BaseBeamSearchDecoder):
   """Base class for RNN-with-attention speech decoders.
 
@@ -218,6 +243,13 @@ class AsrDecoderBase(base_decoder.BaseBeamSearchDecoder):
     p.Define('fusion', fusion.NullFusion.Params(), 'Fusion class params.')
     p.Define('parallel_iterations', 30,
              'Max number of iterations to run in parallel for while loop.')
+    p.Define(
+        'compaction_interval', 0,
+        'If > 0, the while loop based unrolling only decodes the examples '
+        'whose targets are not finished yet, and updates the set of those '
+        'examples every this many steps. This saves the steps of the '
+        'finished examples when the target lengths of a batch vary a lot. '
+        'Their outputs after their last target are zeros.')
     p.Define(
         'per_token_avg_loss', True,
         'Use per-token average loss when set to True (default); when set '
@@ -325,6 +357,14 @@ class AsrDecoderBase(base_decoder.BaseBeamSearchDecoder):
     if self._decay_interval <= 0:
       raise ValueError('min_prob_step (%d) <= prob_decay_start_step (%d)' %
                        (p.min_prob_step, p.prob_decay_start_step))
+    if p.compaction_interval > 0:
+      if not p.use_while_loop_based_unrolling:
+        raise ValueError('compaction_interval requires '
+                         'use_while_loop_based_unrolling.')
+      if not issubclass(p.contextualizer.cls,
+                        contextualizer_base.NullContextualizer):
+        raise ValueError(
+            'compaction_interval does not support contextualizers.')
 
     if p.attention_plot_font_properties:
       self._font_properties = font_manager.FontProperties(
@@ -918,8 +958,6 @@ class AsrDecoderBase(base_decoder.BaseBeamSearchDecoder):
       target_embs = self.emb.EmbLookup(theta.emb, tf.reshape(targets.ids, [-1]))
       target_embs = tf.reshape(target_embs, [dec_bs, max_seq_length, p.emb_dim])
       target_embs = self._ApplyDropout(theta, target_embs)
-      target_info_tas = self._GetInitialTargetInfo(targets, max_seq_length,
-                                                   target_embs)
 
       # Initialize all loop variables.
       time = tf.constant(0, tf.int32)
@@ -936,62 +974,209 @@ class AsrDecoderBase(base_decoder.BaseBeamSearchDecoder):
           max_seq_length, decoder_step_state_zero_fusion_flat,
           decoder_step_state_zero_misc_flat)
 
-      def _LoopContinue(time, decoder_step_state, target_info_tas, seq_out_tas):
-        del decoder_step_state, target_info_tas, seq_out_tas
-        return time < max_seq_length
+      if p.compaction_interval > 0:
+        seq_out_tas = self._CompactedDecodeLoop(theta, encoder_outputs,
+                                                targets, target_embs,
+                                                decoder_step_state_zero,
+                                                seq_out_tas)
+      else:
+        target_info_tas = self._GetInitialTargetInfo(targets, max_seq_length,
+                                                     target_embs)
+
+        def _LoopContinue(time, decoder_step_state, target_info_tas,
+                          seq_out_tas):
+          del decoder_step_state, target_info_tas, seq_out_tas
+          return time < max_seq_length
+
+        def _LoopBody(time, old_decoder_step_state, target_info_tas,
+                      seq_out_tas):
+          """Computes decoder outputs and updates decoder_step_state."""
+          cur_target_info = self.TargetsToBeFedAtCurrentDecodeStep(
+              time, theta, old_decoder_step_state, target_info_tas,
+              seq_out_tas)
+
+          step_outs, decoder_step_state = self._DynamicDecodeStep(
+              theta, packed_src, cur_target_info, old_decoder_step_state)
+
+          # Update SequenceOutTensorArrays.
+          new_seq_out_tas = self._UpdateSequenceOutTensorArrays(
+              decoder_step_state, time, step_outs, seq_out_tas)
+          del decoder_step_state.logits
+          return (time + 1, decoder_step_state, target_info_tas,
+                  new_seq_out_tas)
+
+        loop_vars = time, decoder_step_state_zero, target_info_tas, seq_out_tas
+        # NOTE(skyewm): this could be more specific, but for now don't verify
+        # while_loop input/output shapes at all.
+        shape_invariants = tf.nest.map_structure(
+            lambda t: tf.TensorShape(None), loop_vars)
+
+        (time, _, target_info_tas, seq_out_tas) = tf.while_loop(
+            _LoopContinue,
+            _LoopBody,
+            loop_vars=loop_vars,
+            shape_invariants=shape_invariants,
+            parallel_iterations=p.parallel_iterations,
+            swap_memory=False)
 
-      def _LoopBody(time, old_decoder_step_state, target_info_tas, seq_out_tas):
-        """Computes decoder outputs and updates decoder_step_state."""
-        cur_target_info = self.TargetsToBeFedAtCurrentDecodeStep(
-            time, theta, old_decoder_step_state, target_info_tas, seq_out_tas)
+      softmax_input = seq_out_tas.step_outs.stack()
+      softmax_input = tf.transpose(softmax_input, [1, 0, 2])
+      self._AddDecoderActivationsSummary(encoder_outputs, targets,
+                                         seq_out_tas.atten_probs,
+                                         seq_out_tas.rnn_outs, softmax_input)
+      self.AddAdditionalDecoderSummaries(encoder_outputs, targets, seq_out_tas,
+                                         softmax_input)
+      return self._GetPredictionFromSequenceOutTensorArrays(seq_out_tas)
 
-        step_outs, decoder_step_state = self.SingleDecodeStep(
-            theta, packed_src, cur_target_info, old_decoder_step_state)
+  def _DynamicDecodeStep(self, theta, packed_src, cur_target_info,
+                         old_decoder_step_state):
+    """Decodes one step of ComputePredictionsDynamic.
 
-        step_outs, decoder_step_state.fusion_states = self.fusion.FProp(
-            theta.fusion, old_decoder_step_state.fusion_states, step_outs,
-            cur_target_info.id, cur_target_info.padding)
+    Args:
+      theta: A NestedMap object containing weights' values of this layer and its
+        child layers.
+      packed_src: A NestedMap to represent the packed source tensors generated
+        by the attention model.
+      cur_target_info: TargetInfo namedtuple of the targets of this step.
+      old_decoder_step_state: A NestedMap of the decoder state before this
+        step.
 
-        # Compute logits.
-        xent_loss = self.softmax.FProp(
-            theta.softmax, [step_outs],
-            class_weights=cur_target_info.weight,
-            class_ids=cur_target_info.label)
+    Returns:
+      A tuple (step_outs, decoder_step_state). decoder_step_state.logits are
+      the logits of this step.
+    """
+    step_outs, decoder_step_state = self.SingleDecodeStep(
+        theta, packed_src, cur_target_info, old_decoder_step_state)
+
+    step_outs, decoder_step_state.fusion_states = self.fusion.FProp(
+        theta.fusion, old_decoder_step_state.fusion_states, step_outs,
+        cur_target_info.id, cur_target_info.padding)
+
+    # Compute logits.
+    xent_loss = self.softmax.FProp(
+        theta.softmax, [step_outs],
+        class_weights=cur_target_info.weight,
+        class_ids=cur_target_info.label)
+
+    decoder_step_state = self.PostStepDecoderStateUpdate(
+        decoder_step_state, xent_loss.logits)
 
-        decoder_step_state = self.PostStepDecoderStateUpdate(
-            decoder_step_state, xent_loss.logits)
+    decoder_step_state.logits = self.fusion.ComputeLogitsWithLM(
+        decoder_step_state.fusion_states, decoder_step_state.logits)
+    return step_outs, decoder_step_state
 
-        decoder_step_state.logits = self.fusion.ComputeLogitsWithLM(
-            decoder_step_state.fusion_states, decoder_step_state.logits)
+  def _CompactedDecodeLoop(self, theta, encoder_outputs, targets, target_embs,
+                           decoder_step_state_zero, seq_out_tas):
+    """The decoding loop of ComputePredictionsDynamic with compaction.
 
-        # Update SequenceOutTensorArrays.
+    Every p.compaction_interval steps, gathers the examples whose targets are
+    not finished into a smaller batch. The next steps only decode that batch,
+    and scatter their outputs into the rows of the full batch.
+
+    The steps after the longest target, e.g. when targets are padded to a
+    fixed length, are a single segment. Attention cannot run on an empty
+    batch, so it decodes one dummy row whose outputs are dropped, and the
+    outputs of all the rows are zeros.
+
+    Args:
+      theta: A NestedMap object containing weights' values of this layer and its
+        child layers.
+      encoder_outputs: a NestedMap computed by encoder.
+      targets: A NestedMap of the targets, each of shape [batch, time].
+      target_embs: The embeddings of the target ids, of shape [batch, time,
+        dim].
+      decoder_step_state_zero: The initial decoder state of the full batch.
+      seq_out_tas: The SequenceOutTensorArrays to write the outputs to.
+
+    Returns:
+      The SequenceOutTensorArrays with the outputs of all the steps.
+    """
+    p = self.params
+    dec_bs = tf.shape(targets.ids)[0]
+    max_seq_length = tf.shape(targets.ids)[1]
+    src_bs = tf.shape(encoder_outputs.padding)[1]
+    target_lengths = _TargetLengths(targets.paddings)
+
+    def _ShapeInvariants(loop_vars):
+      return tf.nest.map_structure(lambda t: tf.TensorShape(None), loop_vars)
+
+    def _SegmentContinue(time, full_decoder_step_state, seq_out_tas):
+      del full_decoder_step_state, seq_out_tas
+      return time < max_seq_length
+
+    def _SegmentBody(start, full_decoder_step_state, seq_out_tas):
+      """Decodes the next compaction_interval steps of the unfinished rows."""
+      unfinished_rows = tf.cast(
+          tf.where(target_lengths > start)[:, 0], tf.int32)
+      has_rows = tf.size(unfinished_rows) > 0
+      # The rows to decode and the rows of the full batch to write their
+      # outputs to. Without unfinished rows, decodes row 0 and drops its
+      # outputs until the end.
+      rows, out_rows = tf.cond(
+          has_rows, lambda: (unfinished_rows, unfinished_rows),
+          lambda: (tf.zeros([1], tf.int32), tf.fill([1], dec_bs)))
+      # Decoder row r attends to source r % src_bs.
+      src_rows = rows % src_bs
+      src_encs = tf.gather(encoder_outputs.encoded, src_rows, axis=1)
+      packed_src = self.atten.InitForSourcePacked(
+          theta.atten, src_encs, src_encs,
+          tf.gather(encoder_outputs.padding, src_rows, axis=1))
+      target_info_tas = self._GetInitialTargetInfo(
+          targets.Transform(lambda x: _GatherRows(x, rows)), max_seq_length,
+          tf.gather(target_embs, rows))
+      end = tf.where(has_rows,
+                     tf.minimum(start + p.compaction_interval, max_seq_length),
+                     max_seq_length)
+
+      def _LoopContinue(time, decoder_step_state, seq_out_tas):
+        del decoder_step_state, seq_out_tas
+        return time < end
+
+      def _LoopBody(time, old_decoder_step_state, seq_out_tas):
+        """Computes decoder outputs and updates decoder_step_state."""
+        cur_target_info = self.TargetsToBeFedAtCurrentDecodeStep(
+            time, theta, old_decoder_step_state, target_info_tas, seq_out_tas)
+        step_outs, decoder_step_state = self._DynamicDecodeStep(
+            theta, packed_src, cur_target_info, old_decoder_step_state)
         new_seq_out_tas = self._UpdateSequenceOutTensorArrays(
-            decoder_step_state, time, step_outs, seq_out_tas)
+            decoder_step_state.Transform(
+                lambda x: _ScatterRows(x, out_rows, dec_bs)), time,
+            _ScatterRows(step_outs, out_rows, dec_bs), seq_out_tas)
         del decoder_step_state.logits
-        return (time + 1, decoder_step_state, target_info_tas, new_seq_out_tas)
+        return time + 1, decoder_step_state, new_seq_out_tas
 
-      loop_vars = time, decoder_step_state_zero, target_info_tas, seq_out_tas
-      # NOTE(skyewm): this could be more specific, but for now don't verify
-      # while_loop input/output shapes at all.
-      shape_invariants = tf.nest.map_structure(lambda t: tf.TensorShape(None),
-                                               loop_vars)
-
-      (time, _, target_info_tas, seq_out_tas) = tf.while_loop(
+      loop_vars = (start,
+                   full_decoder_step_state.Transform(
+                       lambda x: _GatherRows(x, rows)), seq_out_tas)
+      time, decoder_step_state, seq_out_tas = tf.while_loop(
           _LoopContinue,
           _LoopBody,
           loop_vars=loop_vars,
-          shape_invariants=shape_invariants,
+          shape_invariants=_ShapeInvariants(loop_vars),
           parallel_iterations=p.parallel_iterations,
           swap_memory=False)
 
-      softmax_input = seq_out_tas.step_outs.stack()
-      softmax_input = tf.transpose(softmax_input, [1, 0, 2])
-      self._AddDecoderActivationsSummary(encoder_outputs, targets,
-                                         seq_out_tas.atten_probs,
-                                         seq_out_tas.rnn_outs, softmax_input)
-      self.AddAdditionalDecoderSummaries(encoder_outputs, targets, seq_out_tas,
-                                         softmax_input)
-      return self._GetPredictionFromSequenceOutTensorArrays(seq_out_tas)
+      def _UpdateRows(full, x):
+        if x.shape.ndims == 0:
+          return x
+        # Nothing to update for the dummy row.
+        return tf.tensor_scatter_nd_update(
+            full, tf.expand_dims(unfinished_rows, 1),
+            x[:tf.size(unfinished_rows)])
+
+      full_decoder_step_state = py_utils.Transform(
+          _UpdateRows, full_decoder_step_state, decoder_step_state)
+      return time, full_decoder_step_state, seq_out_tas
+
+    loop_vars = (tf.constant(0, tf.int32), decoder_step_state_zero,
+                 seq_out_tas)
+    _, _, seq_out_tas = tf.while_loop(
+        _SegmentContinue,
+        _SegmentBody,
+        loop_vars=loop_vars,
+        shape_invariants=_ShapeInvariants(loop_vars),
+        swap_memory=False)
+    return seq_out_tas
 
   def ComputePredictionsFunctional(self, theta, encoder_outputs, targets):
     p = self.params
@@ -14,6 +14,8 @@
 # limitations under the License.
 """Tests for speech decoder."""
 
+import time
+
 import lingvo.compat as tf
 from lingvo.core import cluster_factory
 from lingvo.core import layers as lingvo_layers
@@ -71,8 +73,14 @@ class DecoderTest(test_utils.TestCase):
 
     return p
 
-  def _getDecoderFPropMetrics(self, params):
-    """Creates decoder from params and computes metrics with random inputs."""
+  def _getDecoderFPropMetrics(self, params, num_padded_steps=0):
+    """Creates decoder from params and computes metrics with random inputs.
+
+    Args:
+      params: The decoder params.
+      num_padded_steps: The number of all-padding steps appended to the
+        targets, as when they are padded to a fixed length.
+    """
     dec = params.Instantiate()
     src_seq_len = 5
     src_enc = tf.random.normal([src_seq_len, 2, 8],
@@ -99,6 +107,11 @@ class DecoderTest(test_utils.TestCase):
                      [1, 1, 1, 0]],
                     dtype=py_utils.FPropDtype(params)))
     target_transcripts = tf.constant(['abcd', 'bcde', 'klmp', 'fghi', 'kfcf'])
+    if num_padded_steps:
+      target_ids = tf.pad(target_ids, [[0, 0], [0, num_padded_steps]])
+      target_labels = tf.pad(target_labels, [[0, 0], [0, num_padded_steps]])
+      target_paddings = tf.pad(
+          target_paddings, [[0, 0], [0, num_padded_steps]], constant_values=1)
     target_weights = 1.0 - target_paddings
     # ids/labels/weights/paddings are all in [batch, time] shape.
     targets = py_utils.NestedMap({
@@ -204,6 +217,47 @@ class DecoderTest(test_utils.TestCase):
       # Target batch size is 4. Therefore, we should expect 4 here.
       self.assertEqual(per_sequence_loss_val.shape, (4,))
 
+  def testDecoderFPropCompaction(self):
+    """Checks that the compaction of finished targets keeps the results."""
+    results = []
+    for compaction_interval in (0, 1, 3):
+      with self.session(use_gpu=False, graph=tf.Graph()):
+        tf.random.set_seed(8372749040)
+        p = self._DecoderParams(
+            vn_config=py_utils.VariationalNoiseParams(None, False, False))
+        p.compaction_interval = compaction_interval
+        metrics, per_sequence_loss = self._getDecoderFPropMetrics(params=p)
+        loss = metrics['loss'][0]
+        grads = tf.gradients(loss, tf.trainable_variables())
+        self.evaluate(tf.global_variables_initializer())
+        results.append(self.evaluate([loss, per_sequence_loss, grads]))
+    for result in results[1:]:
+      self.assertAllClose(results[0][0], result[0])
+      self.assertAllClose(results[0][1], result[1])
+      for expected, actual in zip(results[0][2], result[2]):
+        self.assertAllClose(expected, actual)
+
+  def testDecoderFPropCompactionWithPaddedSteps(self):
+    """Checks compaction on targets padded past the longest one."""
+    results = []
+    for compaction_interval in (0, 1, 3):
+      with self.session(use_gpu=False, graph=tf.Graph()):
+        tf.random.set_seed(8372749040)
+        p = self._DecoderParams(
+            vn_config=py_utils.VariationalNoiseParams(None, False, False))
+        p.compaction_interval = compaction_interval
+        metrics, per_sequence_loss = self._getDecoderFPropMetrics(
+            params=p, num_padded_steps=4)
+        loss = metrics['loss'][0]
+        grads = tf.gradients(loss, tf.trainable_variables())
+        self.evaluate(tf.global_variables_initializer())
+        results.append(self.evaluate([loss, per_sequence_loss, grads]))
+    for result in results[1:]:
+      self.assertAllClose(results[0][0], result[0])
+      self.assertAllClose(results[0][1], result[1])
+      for expected, actual in zip(results[0][2], result[2]):
+        self.assertAllClose(expected, actual)
+
   def testDecoderFPropWithMeanSeqLoss(self):
     """Create and fprop a decoder with different dims per layer."""
     with self.session(use_gpu=False):
@@ -761,5 +815,62 @@ class DecoderTest(test_utils.TestCase):
       self.assertEqual(per_sequence_loss_val.shape, (4,))
 
 
+class DecoderCompactionBenchmark(tf.test.Benchmark):
+  """Benchmarks the training step of the decoder with and without compaction.
+
+  Run with::
+
+    bazel run -c opt lingvo/tasks/asr:decoder_test -- --benchmarks=.
+  """
+
+  def benchmarkLibriSpeechLengths(self):
+    np.random.seed(12345)
+    batch, max_len, src_len = 32, 400, 200
+    # Grapheme lengths of LibriSpeech training utterances are about
+    # log-normally distributed, with a long tail of long utterances.
+    lengths = np.clip(
+        np.random.lognormal(np.log(180), 0.5, size=batch), 10,
+        max_len).astype(np.int32)
+    paddings = (np.arange(max_len)[np.newaxis, :] >=
+                lengths[:, np.newaxis]).astype(np.float32)
+    ids = np.random.randint(3, 32, size=[batch, max_len]).astype(np.int32)
+    for compaction_interval in (0, 10, 50):
+      with tf.Graph().as_default():
+        p = decoder.AsrDecoder.Params().Set(
+            name='decoder',
+            source_dim=64,
+            rnn_cell_dim=64,
+            emb_dim=16,
+            random_seed=12345,
+            compaction_interval=compaction_interval)
+        p.emb.vocab_size = 32
+        p.softmax.num_classes = 32
+        p.attention.hidden_dim = 64
+        dec = p.Instantiate()
+        encoder_outputs = py_utils.NestedMap(
+            encoded=tf.random.normal([src_len, batch, 64], seed=12345),
+            padding=tf.zeros([src_len, batch]))
+        targets = py_utils.NestedMap(
+            ids=tf.constant(ids),
+            labels=tf.constant(ids),
+            paddings=tf.constant(paddings),
+            weights=tf.constant(1. - paddings))
+        loss = dec.FPropDefaultTheta(encoder_outputs, targets).metrics['loss']
+        grads = tf.gradients(loss[0], tf.trainable_variables())
+        with tf.Session() as sess:
+          sess.run(tf.global_variables_initializer())
+          sess.run(grads)
+          num_iters = 5
+          start = time.time()
+          for _ in range(num_iters):
+            sess.run(grads)
+          self.report_benchmark(
+              name='compaction_interval_%d' % compaction_interval,
+              iters=num_iters,
+              wall_time=(time.time() - start) / num_iters,
+              extras={'mean_length': float(np.mean(lengths)),
+                      'max_length': float(np.max(lengths))})
+
+
 if __name__ == '__main__':
   tf.test.main()
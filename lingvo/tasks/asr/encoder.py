@@ -24,6 +24,7 @@ from lingvo.core import rnn_cell
 from lingvo.core import rnn_layers
 from lingvo.core import spectrum_augmenter
 from lingvo.core import summary_utils
+import numpy as np
 
 from tensorflow.python.ops import inplace_ops
 
@@ -91,6 +92,13 @@ class AsrEncoder(base_layer.BaseLayer):
         'The (0-based) index of the lstm layer after which the stacking layer '
         'will be inserted. Negative value means no stacking layer will be '
         'used.')
+    p.Define(
+        'streaming', False,
+        'If True, uses causal conv layers and unidirectional LSTMs, so that '
+        'the utterance can be encoded in chunks, carrying the state returned '
+        'by FProp over to the next chunk. Requires pad_steps = 0, no conv '
+        'lstm layers, no stacking right context, and causal conv layers with a '
+        'frequency stride of 1 or a filter width of 1.')
 
     # TODO(yonghui): Maybe move those configs to a separate file.
     # Set some reasonable default values.
@@ -157,14 +165,35 @@ class AsrEncoder(base_layer.BaseLayer):
       conv_p.name = 'conv_L%d' % i
       conv_p.filter_shape = p.conv_filter_shapes[i]
       conv_p.filter_stride = p.conv_filter_strides[i]
+      if p.streaming:
+        conv_p.causal_convolution = True
       params_conv_layers.append(conv_p)
     self.CreateChildren('conv', params_conv_layers)
 
     conv_output_shape = p.input_shape
+    # The [width, channel] of the inputs of each conv layer.
+    self._conv_input_dims = []
     for i in range(p.num_cnn_layers):
+      self._conv_input_dims.append(conv_output_shape[2:])
       conv_output_shape = self.conv[i].OutShape(conv_output_shape)
     assert len(conv_output_shape) == 4  # batch, height, width, channel.
 
+    if p.streaming:
+      assert p.num_conv_lstm_layers == 0, (
+          'Conv lstm layers do not support streaming.')
+      assert p.pad_steps == 0, 'Streaming requires pad_steps = 0.'
+      assert (p.layer_index_before_stacking < 0 or
+              p.stacking_layer_tpl.right_context == 0), (
+                  'Streaming requires a stacking layer without right context.')
+      # The number of past frames each causal conv layer looks at, i.e. its
+      # causal padding, rounded up to its time stride so that chunks stay
+      # aligned with the strides.
+      self._conv_contexts = []
+      for conv_p in params_conv_layers:
+        context = (conv_p.filter_shape[0] - 1) * conv_p.dilation_rate[0]
+        stride = conv_p.filter_stride[0]
+        self._conv_contexts.append(-(-context // stride) * stride)
+
     params_conv_lstm_rnn = []
     params_conv_lstm_cnn = []
     for i in range(p.num_conv_lstm_layers):
@@ -201,23 +230,29 @@ class AsrEncoder(base_layer.BaseLayer):
     params_proj_layers = []
     params_highway_skip_layers = []
     output_dim = self._first_lstm_input_dim
+    # Streaming only uses the forward LSTMs.
+    rnn_output_dim = p.lstm_cell_size if p.streaming else 2 * p.lstm_cell_size
     for i in range(p.num_lstm_layers):
       input_dim = output_dim
       forward_p = p.lstm_tpl.Copy()
       forward_p.name = 'fwd_rnn_L%d' % i
       forward_p.num_input_nodes = input_dim
       forward_p.num_output_nodes = p.lstm_cell_size
-      backward_p = forward_p.Copy()
-      backward_p.name = 'bak_rnn_L%d' % i
-      rnn_p = self.CreateBidirectionalRNNParams(forward_p, backward_p)
-      rnn_p.name = 'brnn_L%d' % i
+      if p.streaming:
+        rnn_p = rnn_layers.FRNN.Params().Set(cell=forward_p)
+        rnn_p.name = 'rnn_L%d' % i
+      else:
+        backward_p = forward_p.Copy()
+        backward_p.name = 'bak_rnn_L%d' % i
+        rnn_p = self.CreateBidirectionalRNNParams(forward_p, backward_p)
+        rnn_p.name = 'brnn_L%d' % i
       params_rnn_layers.append(rnn_p)
-      output_dim = 2 * p.lstm_cell_size
+      output_dim = rnn_output_dim
 
       if p.project_lstm_output and (i < p.num_lstm_layers - 1):
         proj_p = p.proj_tpl.Copy()
-        proj_p.input_dim = 2 * p.lstm_cell_size
-        proj_p.output_dim = 2 * p.lstm_cell_size
+        proj_p.input_dim = rnn_output_dim
+        proj_p.output_dim = rnn_output_dim
         proj_p.name = 'proj_L%d' % i
         params_proj_layers.append(proj_p)
 
@@ -226,7 +261,7 @@ class AsrEncoder(base_layer.BaseLayer):
       if p.residual_start > 0 and residual_index >= 0 and p.highway_skip:
         highway_skip = p.highway_skip_tpl.Copy()
         highway_skip.name = 'enc_hwskip_%d' % len(params_highway_skip_layers)
-        highway_skip.input_dim = 2 * p.lstm_cell_size
+        highway_skip.input_dim = rnn_output_dim
         params_highway_skip_layers.append(highway_skip)
       # Adds the stacking layer.
       if p.layer_index_before_stacking == i:
@@ -236,6 +271,11 @@ class AsrEncoder(base_layer.BaseLayer):
         stacking_window_len = (
             p.stacking_layer_tpl.left_context + 1 +
             p.stacking_layer_tpl.right_context)
+        if p.streaming:
+          self._stacking_input_dim = output_dim
+          stride = p.stacking_layer_tpl.stride
+          self._stacking_context = (
+              -(-p.stacking_layer_tpl.left_context // stride) * stride)
         output_dim *= stacking_window_len
 
     self.CreateChildren('rnn', params_rnn_layers)
@@ -279,10 +319,108 @@ class AsrEncoder(base_layer.BaseLayer):
 
   @property
   def supports_streaming(self):
-    return False
+    return self.params.streaming
+
+  @property
+  def streaming_input_stride(self):
+    """The number of input frames of a streaming chunk must be a multiple of."""
+    p = self.params
+    stride = 1
+    for time_stride, _ in p.conv_filter_strides:
+      stride *= time_stride
+    if p.layer_index_before_stacking >= 0:
+      stride *= p.stacking_layer_tpl.stride
+    return stride
 
   def zero_state(self, theta, batch_size):
-    return py_utils.NestedMap()
+    """Returns the state of the encoder before the first chunk.
+
+    Args:
+      theta: A NestedMap object containing weights' values of this layer and
+        its children layers.
+      batch_size: The batch size.
+
+    Returns:
+      An empty NestedMap if not streaming. Otherwise a NestedMap with:
+
+      - 'conv': for each conv layer, the 'inputs' and 'paddings' of its past
+        context frames.
+      - 'rnn': for each lstm layer, the state of its cell.
+      - 'stacking': if there is a stacking layer, the 'inputs' and 'paddings'
+        of its past context frames.
+    """
+    p = self.params
+    if not p.streaming:
+      return py_utils.NestedMap()
+    dtype = py_utils.FPropDtype(p)
+
+    def _Context(num_frames, input_dims, padding_dims):
+      # Context before the start of the utterance is padded, like the zeros
+      # that causal layers pad the full utterance with.
+      return py_utils.NestedMap(
+          inputs=tf.zeros([batch_size, num_frames] + input_dims, dtype),
+          paddings=tf.ones([batch_size, num_frames] + padding_dims, dtype))
+
+    state = py_utils.NestedMap()
+    state.conv = [
+        _Context(num_frames, list(dims), [])
+        for num_frames, dims in zip(self._conv_contexts, self._conv_input_dims)
+    ]
+    state.rnn = [
+        rnn.zero_state(rnn_theta, batch_size)
+        for rnn, rnn_theta in zip(self.rnn, theta.rnn)
+    ]
+    if p.layer_index_before_stacking >= 0:
+      state.stacking = _Context(self._stacking_context,
+                                [self._stacking_input_dim], [1])
+    return state
+
+  def SplitStreamingChunks(self, src_inputs, paddings, chunk_size):
+    """Splits numpy encoder inputs into chunks for streaming.
+
+    Args:
+      src_inputs: A [batch, time, feature_dim, channels] numpy array.
+      paddings: A [batch, time] numpy array.
+      chunk_size: The number of frames of each chunk. Must be a multiple of
+        `streaming_input_stride`, so that the conv and stacking strides of
+        successive chunks line up.
+
+    Returns:
+      A list of (src_inputs, paddings) chunks. The last one is padded to
+      chunk_size frames.
+
+    Raises:
+      ValueError: if chunk_size is not a multiple of streaming_input_stride.
+    """
+    if chunk_size % self.streaming_input_stride:
+      raise ValueError('Chunk size %d is not a multiple of %d.' %
+                       (chunk_size, self.streaming_input_stride))
+    num_frames = src_inputs.shape[1]
+    pad = -num_frames % chunk_size
+    src_inputs = np.pad(src_inputs,
+                        [(0, 0), (0, pad)] + [(0, 0)] * (src_inputs.ndim - 2))
+    paddings = np.pad(paddings, [(0, 0), (0, pad)], constant_values=1)
+    return [(src_inputs[:, i:i + chunk_size], paddings[:, i:i + chunk_size])
+            for i in range(0, num_frames + pad, chunk_size)]
+
+  def _PrependContext(self, context, inputs, paddings, num_frames):
+    """Prepends past context frames to a chunk of [batch, time, ...] inputs.
+
+    Args:
+      context: A NestedMap of the 'inputs' and 'paddings' of the context.
+      inputs: The inputs of the chunk.
+      paddings: The paddings of the chunk.
+      num_frames: The number of context frames.
+
+    Returns:
+      (inputs, paddings, context) with the context prepended, and the context
+      of the next chunk.
+    """
+    inputs = tf.concat([context.inputs, inputs], 1)
+    paddings = tf.concat([context.paddings, paddings], 1)
+    start = tf.shape(inputs)[1] - num_frames
+    return inputs, paddings, py_utils.NestedMap(
+        inputs=inputs[:, start:], paddings=paddings[:, start:])
 
   def FProp(self, theta, batch, state0=None):
     """Encodes source as represented by 'inputs' and 'paddings'.
@@ -296,7 +434,9 @@ class AsrEncoder(base_layer.BaseLayer):
           time, feature_dim, channels].
         - paddings - The paddings tensor. It is expected to be of shape [batch,
           time].
-      state0: Recurrent input state. Not supported/ignored by this encoder.
+      state0: Recurrent input state, from zero_state() or the 'state' output of
+        the previous chunk. Only used when streaming, and defaults to
+        zero_state().
 
     Returns:
       A NestedMap containing
@@ -312,6 +452,12 @@ class AsrEncoder(base_layer.BaseLayer):
     p = self.params
     inputs, paddings = batch.src_inputs, batch.paddings
     outputs = py_utils.NestedMap()
+    state1 = py_utils.NestedMap()
+    if p.streaming:
+      if not state0:
+        state0 = self.zero_state(theta, tf.shape(inputs)[0])
+      state1.conv = []
+      state1.rnn = []
     with tf.name_scope(p.name):
       # Adding specAugmentation.
       if p.use_specaugment and not self.do_eval:
@@ -340,8 +486,18 @@ class AsrEncoder(base_layer.BaseLayer):
       conv_out = inputs
       out_padding = paddings
       for i, conv_layer in enumerate(self.conv):
+        if p.streaming:
+          num_context = self._conv_contexts[i]
+          conv_out, out_padding, context = self._PrependContext(
+              state0.conv[i], conv_out, out_padding, num_context)
+          state1.conv.append(context)
         conv_out, out_padding = conv_layer.FProp(theta.conv[i], conv_out,
                                                  out_padding)
+        if p.streaming:
+          # Drops the outputs of the context frames.
+          num_context //= p.conv_filter_strides[i][0]
+          conv_out = conv_out[:, num_context:]
+          out_padding = out_padding[:, num_context:]
         if p.extra_per_layer_outputs:
           conv_out *= (1.0 - out_padding[:, :, tf.newaxis, tf.newaxis])
           outputs['conv_%d' % i] = py_utils.NestedMap(
@@ -414,7 +570,12 @@ class AsrEncoder(base_layer.BaseLayer):
       # Now the rnn layers.
       num_skips = 0
       for i in range(p.num_lstm_layers):
-        rnn_out = self.rnn[i].FProp(theta.rnn[i], rnn_in, rnn_padding)
+        if p.streaming:
+          rnn_out, rnn_state1 = self.rnn[i].FProp(theta.rnn[i], rnn_in,
+                                                  rnn_padding, state0.rnn[i])
+          state1.rnn.append(rnn_state1)
+        else:
+          rnn_out = self.rnn[i].FProp(theta.rnn[i], rnn_in, rnn_padding)
         residual_index = i - p.residual_start + 1
         if p.residual_start > 0 and residual_index >= 0:
           if residual_index % p.residual_stride == 0:
@@ -441,9 +602,17 @@ class AsrEncoder(base_layer.BaseLayer):
         if p.layer_index_before_stacking == i:
           # Stacking layer expects input tensor shape as [batch, time, feature].
           # So transpose the tensors before and after the layer.
-          rnn_out, rnn_padding = self.stacking.FProp(
-              tf.transpose(rnn_out, [1, 0, 2]),
-              tf.transpose(rnn_padding, [1, 0, 2]))
+          rnn_out = tf.transpose(rnn_out, [1, 0, 2])
+          rnn_padding = tf.transpose(rnn_padding, [1, 0, 2])
+          if p.streaming:
+            rnn_out, rnn_padding, state1.stacking = self._PrependContext(
+                state0.stacking, rnn_out, rnn_padding, self._stacking_context)
+          rnn_out, rnn_padding = self.stacking.FProp(rnn_out, rnn_padding)
+          if p.streaming:
+            # Drops the outputs of the context frames.
+            num_context = self._stacking_context // p.stacking_layer_tpl.stride
+            rnn_out = rnn_out[:, num_context:]
+            rnn_padding = rnn_padding[:, num_context:]
           rnn_out = tf.transpose(rnn_out, [1, 0, 2])
           rnn_padding = tf.transpose(rnn_padding, [1, 0, 2])
 
@@ -459,5 +628,5 @@ class AsrEncoder(base_layer.BaseLayer):
 
       outputs['encoded'] = final_out
       outputs['padding'] = tf.squeeze(rnn_padding, [2])
-      outputs['state'] = py_utils.NestedMap()
+      outputs['state'] = state1
       return outputs
@@ -14,7 +14,10 @@
 # limitations under the License.
 """Tests for ASR encoder."""
 
+import time
+
 import lingvo.compat as tf
+from lingvo.core import cluster_factory
 from lingvo.core import py_utils
 from lingvo.core import test_utils
 from lingvo.tasks.asr import encoder
@@ -332,6 +335,153 @@ class EncoderTest(test_utils.TestCase):
       test_utils.CompareToGoldenSingleFloat(self, 0.0522322505713,
                                             regular_encoded_sum.eval())
 
+  def _StreamingEncoderParams(self, with_stacking):
+    vn_config = py_utils.VariationalNoiseParams(None, False, False)
+    p = self._EncoderParams(vn_config)
+    p.streaming = True
+    p.pad_steps = 0
+    # Causal convolutions only support a frequency stride of 1.
+    p.conv_filter_strides = [[2, 1], [2, 1]]
+    if with_stacking:
+      p.layer_index_before_stacking = 0
+      p.stacking_layer_tpl.left_context = 1
+      p.stacking_layer_tpl.stride = 2
+    return p
+
+  def _TestStreamingMatchesFullUtterance(self, p):
+    np.random.seed(12345)
+    src_inputs = np.random.normal(size=[2, 24, 16, 3]).astype(np.float32)
+    paddings = np.zeros([2, 24], np.float32)
+    paddings[1, 18:] = 1.
+    with self.session(use_gpu=False) as sess, self.SetEval(True):
+      tf.random.set_seed(8372749040)
+      enc = encoder.AsrEncoder(p)
+      self.assertTrue(enc.supports_streaming)
+      full = enc.FPropDefaultTheta(
+          py_utils.NestedMap(
+              src_inputs=tf.constant(src_inputs),
+              paddings=tf.constant(paddings)))
+      chunk_inputs = tf.placeholder(tf.float32, [2, None, 16, 3])
+      chunk_paddings = tf.placeholder(tf.float32, [2, None])
+      state0 = enc.zero_state(enc.theta, 2).Transform(
+          lambda x: tf.placeholder_with_default(x, x.shape))
+      chunk = enc.FPropDefaultTheta(
+          py_utils.NestedMap(src_inputs=chunk_inputs, paddings=chunk_paddings),
+          state0)
+      self.evaluate(tf.global_variables_initializer())
+
+      expected_encoded, expected_padding = sess.run(
+          [full.encoded, full.padding])
+      encoded, padding = [], []
+      state = None
+      for inputs, chunk_padding in enc.SplitStreamingChunks(
+          src_inputs, paddings, chunk_size=8):
+        feed_dict = {chunk_inputs: inputs, chunk_paddings: chunk_padding}
+        if state is not None:
+          feed_dict.update(zip(state0.Flatten(), state))
+        out, out_padding, state = sess.run(
+            [chunk.encoded, chunk.padding, chunk.state.Flatten()], feed_dict)
+        encoded.append(out)
+        padding.append(out_padding)
+      self.assertAllClose(expected_encoded, np.concatenate(encoded), atol=1e-5)
+      self.assertAllEqual(expected_padding, np.concatenate(padding))
+
+  def testStreamingMatchesFullUtterance(self):
+    self._TestStreamingMatchesFullUtterance(
+        self._StreamingEncoderParams(with_stacking=False))
+
+  def testStreamingWithStackingMatchesFullUtterance(self):
+    self._TestStreamingMatchesFullUtterance(
+        self._StreamingEncoderParams(with_stacking=True))
+
+  def testStreamingWithDilationMatchesFullUtterance(self):
+    p = self._StreamingEncoderParams(with_stacking=False)
+    p.cnn_tpl.dilation_rate = (2, 1)
+    # Dilated convolutions only support strides of 1.
+    p.conv_filter_strides = [[1, 1], [1, 1]]
+    self._TestStreamingMatchesFullUtterance(p)
+
+  def testSplitStreamingChunks(self):
+    with self.session(use_gpu=False):
+      enc = encoder.AsrEncoder(
+          self._StreamingEncoderParams(with_stacking=True))
+    self.assertEqual(8, enc.streaming_input_stride)
+    src_inputs = np.ones([1, 20, 16, 3])
+    chunks = enc.SplitStreamingChunks(src_inputs, np.zeros([1, 20]), 8)
+    self.assertLen(chunks, 3)
+    self.assertAllEqual([[0] * 4 + [1] * 4], chunks[-1][1])
+    self.assertAllEqual(np.zeros([1, 4, 16, 3]), chunks[-1][0][:, 4:])
+    with self.assertRaisesRegex(ValueError, 'not a multiple'):
+      enc.SplitStreamingChunks(src_inputs, np.zeros([1, 20]), 12)
+
+
+class StreamingEncoderBenchmark(tf.test.Benchmark):
+  """Benchmarks streaming encoding against encoding full utterances on CPU.
+
+  Run with::
+
+    bazel run -c opt lingvo/tasks/asr:encoder_test -- --benchmarks=.
+  """
+
+  def benchmarkStreaming(self):
+    p = encoder.AsrEncoder.Params().Set(
+        name='encoder',
+        streaming=True,
+        pad_steps=0,
+        input_shape=[None, None, 80, 1],
+        conv_filter_shapes=[(3, 3, 1, 32), (3, 3, 32, 32)],
+        conv_filter_strides=[(2, 1), (2, 1)],
+        num_conv_lstm_layers=0,
+        num_lstm_layers=4,
+        lstm_cell_size=512)
+    num_frames = 1000  # 10 seconds at 10ms per frame.
+    chunk_size = 40
+    iters = 3
+    np.random.seed(12345)
+    src_inputs = np.random.normal(size=[1, num_frames, 80, 1])
+    paddings = np.zeros([1, num_frames])
+    with tf.Graph().as_default(), tf.Session() as sess:
+      with cluster_factory.SetEval(True):
+        enc = p.Instantiate()
+        inputs_ph = tf.placeholder(tf.float32, [1, None, 80, 1])
+        paddings_ph = tf.placeholder(tf.float32, [1, None])
+        state0 = enc.zero_state(enc.theta, 1).Transform(
+            lambda x: tf.placeholder_with_default(x, x.shape))
+        out = enc.FPropDefaultTheta(
+            py_utils.NestedMap(src_inputs=inputs_ph, paddings=paddings_ph),
+            state0)
+      sess.run(tf.global_variables_initializer())
+
+      feed_dict = {inputs_ph: src_inputs, paddings_ph: paddings}
+      sess.run(out.encoded, feed_dict)
+      start = time.time()
+      for _ in range(iters):
+        sess.run(out.encoded, feed_dict)
+      self.report_benchmark(
+          name='full_utterance',
+          iters=iters,
+          wall_time=(time.time() - start) / iters)
+
+      chunks = enc.SplitStreamingChunks(src_inputs, paddings, chunk_size)
+      chunk_times = []
+      for _ in range(iters):
+        state = None
+        for chunk_inputs, chunk_paddings in chunks:
+          feed_dict = {inputs_ph: chunk_inputs, paddings_ph: chunk_paddings}
+          if state is not None:
+            feed_dict.update(zip(state0.Flatten(), state))
+          start = time.time()
+          _, state = sess.run([out.encoded, out.state.Flatten()], feed_dict)
+          chunk_times.append(time.time() - start)
+      self.report_benchmark(
+          name='chunk_%d_frames' % chunk_size,
+          iters=len(chunk_times),
+          wall_time=np.mean(chunk_times),
+          extras={
+              'p90_chunk_latency': np.percentile(chunk_times, 90),
+              'total_time_per_utterance': np.sum(chunk_times) / iters,
+          })
+
 
 if __name__ == '__main__':
   tf.test.main()
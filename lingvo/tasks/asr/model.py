@@ -36,6 +36,25 @@ DecoderTopK = collections.namedtuple(
     'topk', ['hyps', 'ids', 'lens', 'scores', 'decoded'])  # pyformat: disable
 
 
+def GroupWavsByLength(wavs, batch_size):
+  """Groups wav files of similar lengths for the 'batched' inference subgraph.
+
+  All the utterances of a batch are padded to the longest one, so batching
+  utterances of similar durations minimizes the padding computed on.
+
+  Args:
+    wavs: A list of wav file contents, as bytes.
+    batch_size: The maximum number of utterances per batch.
+
+  Returns:
+    A list of lists of indices into `wavs`, one per batch, in increasing order
+    of length.
+  """
+  # The size of a wav file is proportional to its duration.
+  order = sorted(range(len(wavs)), key=lambda i: len(wavs[i]))
+  return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
 class AsrModel(base_model.BaseTask):
   """Speech model."""
 
@@ -445,8 +464,42 @@ class AsrModel(base_model.BaseTask):
     subgraphs = {}
     with tf.name_scope('inference'):
       subgraphs['default'] = self._InferenceSubgraph_Default()
+      subgraphs['batched'] = self._InferenceSubgraph_Batched()
+      if getattr(self.encoder, 'supports_streaming', False):
+        subgraphs['streaming'] = self._InferenceSubgraph_Streaming()
     return subgraphs
 
+  def _InferenceFrontend(self):
+    """Returns the frontend extracting features from PCM audio."""
+    p = self.params
+    # TODO(laurenzo): Once the migration to integrated frontends is complete,
+    # this model should be upgraded to use the MelAsrFrontend in its
+    # params vs relying on pre-computed feature generation and the inference
+    # special casing.
+    frontend = self.frontend if p.frontend else None
+    if not frontend:
+      # No custom frontend. Instantiate the default.
+      frontend_p = asr_frontend.MelAsrFrontend.Params()
+      frontend = frontend_p.Instantiate()
+    return frontend
+
+  def _InferenceFetches(self, audio, paddings):
+    """Returns the inference fetches for [batch, time] audio and paddings."""
+    input_batch_src = py_utils.NestedMap(src_inputs=audio, paddings=paddings)
+    input_batch_src = self._InferenceFrontend().FPropDefaultTheta(
+        input_batch_src)
+
+    encoder_outputs = self.encoder.FPropDefaultTheta(input_batch_src)
+    decoder_outputs = self.decoder.BeamSearchDecode(encoder_outputs)
+    topk = self._GetTopK(decoder_outputs)
+
+    return {
+        'hypotheses': topk.decoded,
+        'scores': topk.scores,
+        'src_frames': input_batch_src.src_inputs,
+        'encoder_frames': encoder_outputs.encoded
+    }
+
   def _InferenceSubgraph_Default(self):
     """Constructs graph for offline inference.
 
@@ -455,18 +508,8 @@ class AsrModel(base_model.BaseTask):
       dictionary consists of keys corresponding to tensor names, and values
       corresponding to a tensor in the graph which should be input/read from.
     """
-    p = self.params
     with tf.name_scope('default'):
-      # TODO(laurenzo): Once the migration to integrated frontends is complete,
-      # this model should be upgraded to use the MelAsrFrontend in its
-      # params vs relying on pre-computed feature generation and the inference
-      # special casing.
       wav_bytes = tf.placeholder(dtype=tf.string, name='wav')
-      frontend = self.frontend if p.frontend else None
-      if not frontend:
-        # No custom frontend. Instantiate the default.
-        frontend_p = asr_frontend.MelAsrFrontend.Params()
-        frontend = frontend_p.Instantiate()
 
       # Decode the wave bytes and use the explicit frontend.
       unused_sample_rate, audio = audio_lib.DecodeWav(wav_bytes)
@@ -475,20 +518,92 @@ class AsrModel(base_model.BaseTask):
       audio = tf.squeeze(audio, axis=1)
       # Add batch.
       audio = tf.expand_dims(audio, axis=0)
-      input_batch_src = py_utils.NestedMap(
-          src_inputs=audio, paddings=tf.zeros_like(audio))
-      input_batch_src = frontend.FPropDefaultTheta(input_batch_src)
 
-      encoder_outputs = self.encoder.FPropDefaultTheta(input_batch_src)
-      decoder_outputs = self.decoder.BeamSearchDecode(encoder_outputs)
-      topk = self._GetTopK(decoder_outputs)
+      feeds = {'wav': wav_bytes}
+      fetches = self._InferenceFetches(audio, tf.zeros_like(audio))
+
+      return fetches, feeds
+
+  def _InferenceSubgraph_Batched(self):
+    """Constructs graph for offline inference on a batch of utterances.
+
+    The utterances are decoded and padded to the longest one, and run through
+    the frontend, the encoder and the beam search together. Use
+    `GroupWavsByLength` to batch utterances of similar lengths.
+
+    Returns:
+      (fetches, feeds) where both fetches and feeds are dictionaries. Each
+      dictionary consists of keys corresponding to tensor names, and values
+      corresponding to a tensor in the graph which should be input/read from.
+      The 'wav' feed is a vector of wav file contents.
+    """
+    with tf.name_scope('batched'):
+      wav_bytes = tf.placeholder(dtype=tf.string, shape=[None], name='wav')
+      batch_size = tf.shape(wav_bytes)[0]
+
+      def _DecodeOne(i, samples, lengths):
+        unused_sample_rate, audio = audio_lib.DecodeWav(wav_bytes[i])
+        # Remove channel dimension, since we have a single channel.
+        audio = tf.squeeze(audio, axis=1)
+        return (i + 1, samples.write(i, audio * 32768),
+                lengths.write(i, tf.shape(audio)[0]))
+
+      _, samples, lengths = tf.while_loop(
+          lambda i, *_: i < batch_size, _DecodeOne,
+          (0,
+           tf.TensorArray(
+               tf.float32,
+               size=batch_size,
+               infer_shape=False,
+               element_shape=[None]),
+           tf.TensorArray(tf.int32, size=batch_size)))
+      lengths = lengths.stack()
+      audio = tf.RaggedTensor.from_row_lengths(samples.concat(),
+                                               lengths).to_tensor()
+      paddings = 1.0 - tf.sequence_mask(
+          lengths, maxlen=tf.shape(audio)[1], dtype=tf.float32)
 
       feeds = {'wav': wav_bytes}
+      fetches = self._InferenceFetches(audio, paddings)
+      fetches['src_paddings'] = paddings
+
+      return fetches, feeds
+
+  def _InferenceSubgraph_Streaming(self):
+    """Constructs graph encoding an utterance chunk by chunk.
+
+    The 'src_inputs' and 'paddings' feeds take a chunk of encoder input
+    frames, e.g. from `AsrEncoder.SplitStreamingChunks`. The 'state0.*' feeds
+    take the encoder state and default to the state before the first chunk.
+    The 'state1.*' fetches are the state to feed with the next chunk.
+
+    Returns:
+      (fetches, feeds) where both fetches and feeds are dictionaries. Each
+      dictionary consists of keys corresponding to tensor names, and values
+      corresponding to a tensor in the graph which should be input/read from.
+    """
+    with tf.name_scope('streaming'):
+      src_inputs = tf.placeholder(
+          dtype=tf.float32,
+          shape=[None, None] + list(self.encoder.input_shape[2:]),
+          name='src_inputs')
+      paddings = tf.placeholder(
+          dtype=tf.float32, shape=[None, None], name='paddings')
+      state0 = self.encoder.zero_state(self.encoder.theta,
+                                       tf.shape(src_inputs)[0])
+      state0 = state0.Transform(lambda x: tf.placeholder_with_default(
+          x, tf.TensorShape([None]).concatenate(x.shape[1:])))
+      encoder_outputs = self.encoder.FPropDefaultTheta(
+          py_utils.NestedMap(src_inputs=src_inputs, paddings=paddings), state0)
+
+      feeds = {'src_inputs': src_inputs, 'paddings': paddings}
+      for key, value in state0.FlattenItems():
+        feeds['state0.' + key] = value
       fetches = {
-          'hypotheses': topk.decoded,
-          'scores': topk.scores,
-          'src_frames': input_batch_src.src_inputs,
-          'encoder_frames': encoder_outputs.encoded
+          'encoded': encoder_outputs.encoded,
+          'padding': encoder_outputs.padding,
       }
+      for key, value in encoder_outputs.state.FlattenItems():
+        fetches['state1.' + key] = value
 
       return fetches, feeds
@@ -14,6 +14,8 @@
 # limitations under the License.
 """Tests for Asr Model."""
 
+import time
+
 import lingvo.compat as tf
 from lingvo.core import base_layer
 from lingvo.core import cluster_factory
@@ -39,6 +41,41 @@ class DecoderForTest(decoder.AsrDecoder):
     return p
 
 
+def _InferenceModelParams():
+  p = model.AsrModel.Params()
+  p.name = 'test_config'
+
+  # Encoder params.
+  ep = p.encoder
+  ep.input_shape = [None, None, 80, 1]
+  ep.lstm_cell_size = 16
+  ep.num_lstm_layers = 2
+  ep.conv_filter_shapes = [(3, 3, 1, 32), (3, 3, 32, 32)]
+  ep.conv_filter_strides = [(2, 2), (2, 2)]
+  ep.num_conv_lstm_layers = 0
+  # Initialize decoder params.
+  dp = p.decoder
+  dp.rnn_cell_dim = 16
+  dp.rnn_layers = 2
+  dp.source_dim = ep.lstm_cell_size * 2
+  # Use functional while based unrolling.
+  dp.use_while_loop_based_unrolling = False
+
+  p.input = input_generator.AsrInput.Params()
+  ip = p.input
+  ip.frame_size = 80
+  ip.append_eos_frame = True
+  ip.pad_to_max_seq_length = False
+  return p
+
+
+def _ReadTestWav():
+  with open(
+      test_helper.test_src_dir_path('tools/testdata/gan_or_vae.16k.wav'),
+      'rb') as f:
+    return f.read()
+
+
 class AsrModelTest(test_utils.TestCase):
 
   def _testParams(self):
@@ -369,50 +406,20 @@ class AsrModelTest(test_utils.TestCase):
     self.assertAllEqual(res1[1], res2[1])
 
   def testInference(self):
-
-    def _CreateModelParamsForTest():
-      p = model.AsrModel.Params()
-      p.name = 'test_config'
-
-      # Encoder params.
-      ep = p.encoder
-      ep.input_shape = [None, None, 80, 1]
-      ep.lstm_cell_size = 16
-      ep.num_lstm_layers = 2
-      ep.conv_filter_shapes = [(3, 3, 1, 32), (3, 3, 32, 32)]
-      ep.conv_filter_strides = [(2, 2), (2, 2)]
-      ep.num_conv_lstm_layers = 0
-      # Initialize decoder params.
-      dp = p.decoder
-      dp.rnn_cell_dim = 16
-      dp.rnn_layers = 2
-      dp.source_dim = ep.lstm_cell_size * 2
-      # Use functional while based unrolling.
-      dp.use_while_loop_based_unrolling = False
-
-      p.input = input_generator.AsrInput.Params()
-      ip = p.input
-      ip.frame_size = 80
-      ip.append_eos_frame = True
-      ip.pad_to_max_seq_length = False
-      return p
-
     with self.session(
         use_gpu=False, graph=tf.Graph()) as sess, self.SetEval(True):
-      p = _CreateModelParamsForTest()
+      p = _InferenceModelParams()
       mdl = p.Instantiate()
       subgraphs = mdl.Inference()
       self.assertIn('default', subgraphs)
+      self.assertNotIn('streaming', subgraphs)
 
       fetches, feeds = subgraphs['default']
       self.assertIn('wav', feeds)
       for name in ['hypotheses', 'scores', 'src_frames', 'encoder_frames']:
         self.assertIn(name, fetches)
 
-      with open(
-          test_helper.test_src_dir_path('tools/testdata/gan_or_vae.16k.wav'),
-          'rb') as f:
-        wav = f.read()
+      wav = _ReadTestWav()
       self.evaluate(tf.global_variables_initializer())
       fetches = sess.run(fetches, {feeds['wav']: wav})
 
@@ -425,6 +432,102 @@ class AsrModelTest(test_utils.TestCase):
       self.assertAllEqual((80, 1, 2 * p.encoder.lstm_cell_size),
                           fetches['encoder_frames'].shape)
 
+  def testBatchedInference(self):
+    with self.session(
+        use_gpu=False, graph=tf.Graph()) as sess, self.SetEval(True):
+      p = _InferenceModelParams()
+      mdl = p.Instantiate()
+      fetches, feeds = mdl.Inference()['batched']
+      for name in [
+          'hypotheses', 'scores', 'src_frames', 'src_paddings', 'encoder_frames'
+      ]:
+        self.assertIn(name, fetches)
+
+      wav = _ReadTestWav()
+      # A shorter utterance, with the first half of the samples.
+      sample_rate, audio = sess.run(tf.audio.decode_wav(wav))
+      short_wav = sess.run(
+          tf.audio.encode_wav(audio[:audio.shape[0] // 2], sample_rate))
+      self.evaluate(tf.global_variables_initializer())
+      fetches = sess.run(fetches, {feeds['wav']: [wav, short_wav]})
+
+      num_hyps = p.decoder.beam_search.num_hyps_per_beam
+      self.assertAllEqual((2, num_hyps), fetches['hypotheses'].shape)
+      self.assertAllEqual((2, num_hyps), fetches['scores'].shape)
+      self.assertAllEqual((2, 314, p.encoder.input_shape[2], 1),
+                          fetches['src_frames'].shape)
+      self.assertAllEqual((80, 2, 2 * p.encoder.lstm_cell_size),
+                          fetches['encoder_frames'].shape)
+      self.assertAllEqual([audio.shape[0], audio.shape[0] // 2],
+                          np.sum(1. - fetches['src_paddings'], axis=1))
+
+  def testStreamingInference(self):
+    with self.session(
+        use_gpu=False, graph=tf.Graph()) as sess, self.SetEval(True):
+      p = _InferenceModelParams()
+      p.encoder.streaming = True
+      p.encoder.pad_steps = 0
+      p.encoder.conv_filter_strides = [(2, 1), (2, 1)]
+      p.decoder.source_dim = p.encoder.lstm_cell_size
+      mdl = p.Instantiate()
+      subgraphs = mdl.Inference()
+      fetches, feeds = subgraphs['streaming']
+      state0_names = sorted(k for k in feeds if k.startswith('state0.'))
+      state1_names = sorted(k for k in fetches if k.startswith('state1.'))
+      self.assertNotEmpty(state0_names)
+      self.assertEqual([k[len('state0.'):] for k in state0_names],
+                       [k[len('state1.'):] for k in state1_names])
+
+      self.evaluate(tf.global_variables_initializer())
+      chunk = np.random.normal(size=[1, 8, 80, 1])
+      feed_dict = {
+          feeds['src_inputs']: chunk,
+          feeds['paddings']: np.zeros([1, 8])
+      }
+      first = sess.run(fetches, feed_dict)
+      self.assertAllEqual((2, 1, p.encoder.lstm_cell_size),
+                          first['encoded'].shape)
+      for name0, name1 in zip(state0_names, state1_names):
+        feed_dict[feeds[name0]] = first[name1]
+      second = sess.run(fetches, feed_dict)
+      # The same chunk is encoded differently with the state of the first one.
+      self.assertNotAllClose(first['encoded'], second['encoded'])
+
+  def testGroupWavsByLength(self):
+    wavs = [b'a' * n for n in [5, 1, 4, 2, 3]]
+    self.assertEqual([[1, 3], [4, 2], [0]],
+                     model.GroupWavsByLength(wavs, batch_size=2))
+
+
+class BatchedInferenceBenchmark(tf.test.Benchmark):
+  """Benchmarks the CPU throughput of the batched inference subgraph.
+
+  Run with::
+
+    bazel run -c opt lingvo/tasks/asr:model_test -- --benchmarks=.
+  """
+
+  def benchmarkBatchedInference(self):
+    with tf.Graph().as_default(), tf.Session() as sess:
+      with cluster_factory.SetEval(True):
+        mdl = _InferenceModelParams().Instantiate()
+        fetches, feeds = mdl.Inference()['batched']
+      sess.run(tf.global_variables_initializer())
+      wav = _ReadTestWav()
+      for batch_size in (1, 2, 4, 8, 16, 32):
+        feed_dict = {feeds['wav']: [wav] * batch_size}
+        sess.run(fetches, feed_dict)
+        iters = 5
+        start = time.time()
+        for _ in range(iters):
+          sess.run(fetches, feed_dict)
+        wall_time = (time.time() - start) / iters
+        self.report_benchmark(
+            name='batch_size_%d' % batch_size,
+            iters=iters,
+            wall_time=wall_time,
+            extras={'utterances_per_sec': batch_size / wall_time})
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -15,7 +15,6 @@
 # ==============================================================================
 """Average precision metric interface."""
 
-import functools
 from lingvo import compat as tf
 from lingvo.core import hyperparams
 from lingvo.core import py_utils
@@ -24,6 +23,20 @@ from lingvo.tasks.car import breakdown_metric
 import numpy as np
 
 
+# Maps the keys of the dict returned by APMetrics._ComputeFinalMetrics() to the
+# fields of the NestedMap returned by APMetrics._BuildMetric().
+_FINAL_METRICS_FIELDS = (
+    ('scalars', 'scalar_metrics'),
+    ('curves', 'curve_metrics'),
+    ('calibrations', 'calibration_metrics'),
+)
+
+
+def _BinKey(conditions):
+  """Returns a hashable key for a dict of bin conditioning arguments."""
+  return tuple(sorted(conditions.items()))
+
+
 # TODO(shlens): Consider making this internal data structure a list of NestedMap
 # to simplify the implementation.
 class Boxes3D:
@@ -83,6 +96,63 @@ class Boxes3D:
     self._buf.speeds[self._size] = speed
     self._size += 1
 
+  def AddBatch(self, img_ids, scores, boxes, difficulties, distances,
+               num_points, rotations, heights_in_pixels, speeds):
+    """Adds a batch of N bboxes.
+
+    Every argument is the batched version of the corresponding argument of
+    Add(), i.e. an array whose leading dimension is N, or a value that
+    broadcasts to it (e.g. a single img_id shared by all boxes).
+
+    Args:
+      img_ids: Unique image identifiers.
+      scores: The confidence scores.
+      boxes: [N x 7] numpy array.
+      difficulties: The difficulties of the boxes.
+      distances: The binned distances of the boxes.
+      num_points: Number of laser points in the boxes.
+      rotations: The binned rotations of the boxes.
+      heights_in_pixels: The heights of the 2D bboxes of the objects in the
+        camera image.
+      speeds: A [N x 2] numpy array with speeds of objects in world frame.
+    """
+    n = boxes.shape[0]
+    if not n:
+      return
+    if self._size + n > self._capacity:
+      self._capacity = max(self._capacity + self._capacity // 4, 100,
+                           self._size + n)
+      self._buf = self._buf.Transform(self._Resize)
+    added = slice(self._size, self._size + n)
+    self._buf.imgids[added] = img_ids
+    self._buf.scores[added] = scores
+    self._buf.boxes[added] = boxes
+    self._buf.difficulties[added] = difficulties
+    self._buf.distances[added] = distances
+    self._buf.num_points[added] = num_points
+    self._buf.rotations[added] = rotations
+    self._buf.heights_in_pixels[added] = heights_in_pixels
+    self._buf.speeds[added] = speeds
+    self._size += n
+
+  def Select(self, mask):
+    """Returns the boxes where mask is True, in their original order.
+
+    Args:
+      mask: A boolean np.array of shape [size].
+
+    Returns:
+      A new Boxes3D, or None if mask selects no box.
+    """
+    indices = np.flatnonzero(mask)
+    if not indices.size:
+      return None
+    selected = Boxes3D()
+    selected._capacity = indices.size  # pylint: disable=protected-access
+    selected._size = indices.size  # pylint: disable=protected-access
+    selected._buf = self._buf.Transform(lambda arr: arr[indices])  # pylint: disable=protected-access
+    return selected
+
   def _Resize(self, arr):
     n = self._capacity
     ret = np.empty([n] + list(arr.shape)[1:], dtype=arr.dtype)
@@ -190,22 +260,26 @@ class APMetrics(BaseMetric):
       self._str_to_imgid[str_id] = imgid
       return imgid
 
-  def _AddGroundtruth(self, box):
-    """Record a ground truth box."""
-    (str_imgid, classid, score, box, difficulty, distance, num_points, rot,
-     speed) = box
-    imgid = self._GetImageId(str_imgid)
-    assert classid > 0 and classid < self.metadata.NumClasses(), (
-        '{} vs. {}'.format(classid, self.metadata.NumClasses()))
-
-    boxes = self._groundtruth.get(classid)
-    if boxes is None:
-      boxes = Boxes3D()
-      self._groundtruth[classid] = boxes
-    boxes.Add(imgid, score, box, difficulty, distance, num_points, rot, -1,
-              speed)
-    # Invalidate the evaluation.
-    self._is_eval_complete = False
+  def _BinMask(self, boxes, distance=None, num_points=None, rotation=None):
+    """Returns a boolean np.array selecting the boxes in the specified bins.
+
+    Args:
+      boxes: Boxes3D to filter.
+      distance: int32 specifying a binned Euclidean distance of the ground truth
+        bounding box. If None is specified, all distances are selected.
+      num_points: int32 specifying a binned number of laser points within the
+        ground truth bounding box. If None is specified, all boxes are selected.
+      rotation: int32 specifying a binned rotation within the ground truth
+        bounding box. If None is specified, all boxes are selected.
+    """
+    mask = np.ones(boxes.imgids.shape, dtype=bool)
+    if distance is not None:
+      mask &= boxes.distances == distance
+    if num_points is not None:
+      mask &= boxes.num_points == num_points
+    if rotation is not None:
+      mask &= boxes.rotations == rotation
+    return mask
 
   def _LoadBoundingBoxes(self,
                          box_type,
@@ -243,51 +317,9 @@ class APMetrics(BaseMetric):
       return None
     boxes = boxes_by_class[class_id]
 
-    if boxes is not None and distance is not None:
-      # Filter bounding boxes based a binned (integer) distance.
-      filtered_boxes = None
-      for i, s, b, d, dist, n, r, h, v in zip(boxes.imgids, boxes.scores,
-                                              boxes.boxes, boxes.difficulties,
-                                              boxes.distances, boxes.num_points,
-                                              boxes.rotations,
-                                              boxes.heights_in_pixels,
-                                              boxes.speeds):
-        if dist == distance:
-          if filtered_boxes is None:
-            filtered_boxes = Boxes3D()
-          filtered_boxes.Add(i, s, b, d, dist, n, r, h, v)
-      boxes = filtered_boxes
-
-    if boxes is not None and num_points is not None:
-      # Filter bounding boxes based a binned (integer) number of points.
-      filtered_boxes = None
-      for i, s, b, d, dist, n, r, h, v in zip(boxes.imgids, boxes.scores,
-                                              boxes.boxes, boxes.difficulties,
-                                              boxes.distances, boxes.num_points,
-                                              boxes.rotations,
-                                              boxes.heights_in_pixels,
-                                              boxes.speeds):
-        if n == num_points:
-          if filtered_boxes is None:
-            filtered_boxes = Boxes3D()
-          filtered_boxes.Add(i, s, b, d, dist, n, r, h, v)
-      boxes = filtered_boxes
-
-    if boxes is not None and rotation is not None:
-      # Filter bounding boxes based a binned (integer) rotation.
-      filtered_boxes = None
-      for i, s, b, d, dist, n, r, h, v in zip(boxes.imgids, boxes.scores,
-                                              boxes.boxes, boxes.difficulties,
-                                              boxes.distances, boxes.num_points,
-                                              boxes.rotations,
-                                              boxes.heights_in_pixels,
-                                              boxes.speeds):
-        if r == rotation:
-          if filtered_boxes is None:
-            filtered_boxes = Boxes3D()
-          filtered_boxes.Add(i, s, b, d, dist, n, r, h, v)
-      boxes = filtered_boxes
-
+    mask = self._BinMask(boxes, distance, num_points, rotation)
+    if not np.all(mask):
+      boxes = boxes.Select(mask)
     return boxes
 
   def _GetData(self,
@@ -354,6 +386,45 @@ class APMetrics(BaseMetric):
     """
     raise NotImplementedError('_ComputeFinalMetric must be implemented')
 
+  def _ComputeFinalMetricsForBins(self, classids, bin_conditions):
+    """Compute the final metrics of many bins in a single graph and session.
+
+    Bins share the per-class box buffers and their metric ops run in one
+    session call, so TF evaluates them concurrently.
+
+    Args:
+      classids: A list of N int32.
+      bin_conditions: A list of dicts, each holding the named conditioning
+        arguments (difficulty, distance, num_points, rotation) of one bin.
+
+    Returns:
+      A list with one entry per bin, each in the format returned by
+      _ComputeFinalMetrics().
+    """
+    if not bin_conditions:
+      return []
+    tf.logging.info('Computing final metrics for %d bins.',
+                    len(bin_conditions))
+    feed_dict = {}
+    fetches = []
+    g = tf.Graph()
+    with g.as_default():
+      for conditions in bin_conditions:
+        bin_fetches = {}
+        for classid in classids:
+          data = self._GetData(classid, **conditions)
+          metrics = self._BuildMetric(data, classid)
+          feed_dict.update(metrics.feed_dict)
+          for key, field in _FINAL_METRICS_FIELDS:
+            if field in metrics:
+              bin_fetches.setdefault(key, []).append(metrics[field])
+        fetches.append(bin_fetches)
+
+    with tf.Session(graph=g) as sess:
+      results = sess.run(fetches, feed_dict=feed_dict)
+    tf.logging.info('Finished computing final metrics.')
+    return results
+
   def Update(self, str_id, result):
     """Update this metric with a newly evaluated image.
 
@@ -403,9 +474,9 @@ class APMetrics(BaseMetric):
     # dummy values in the latter case.  We should figure
     # out how to avoid requiring these dummy values by making
     # the Boxes3D object take a dynamic set of attributes.
-    num_points = [0] * n
-    rotations = [0] * n
-    distances = [0] * n
+    num_points = np.zeros([n], dtype=np.int32)
+    rotations = np.zeros([n], dtype=np.int32)
+    distances = np.zeros([n], dtype=np.int32)
     if 'num_points' in self._breakdown_metrics:
       num_points = self._breakdown_metrics['num_points'].Discretize(
           result.groundtruth_num_points)
@@ -416,19 +487,36 @@ class APMetrics(BaseMetric):
       distances = self._breakdown_metrics['distance'].Discretize(
           result.groundtruth_bboxes)
 
-    for label, bbox, difficulty, distance, num_points, rotations, speed in zip(
-        result.groundtruth_labels, result.groundtruth_bboxes,
-        result.groundtruth_difficulties, distances, num_points, rotations,
-        result.groundtruth_speed):
-      self._AddGroundtruth((str_id, label, 1., bbox, difficulty, distance,
-                            num_points, rotations, speed))
+    labels = np.asarray(result.groundtruth_labels)
+    assert np.all((labels > 0) & (labels < self.metadata.NumClasses())), (
+        '{} vs. {}'.format(labels, self.metadata.NumClasses()))
+    str_imgid = self._GetImageId(str_id)
+    # Add the groundtruth boxes one class at a time, which keeps the per-class
+    # order of the boxes identical to adding them one by one.
+    for classid in np.unique(labels).tolist():
+      mask = labels == classid
+      boxes = self._groundtruth.get(classid)
+      if boxes is None:
+        boxes = Boxes3D()
+        self._groundtruth[classid] = boxes
+      boxes.AddBatch(
+          img_ids=str_imgid,
+          scores=1.,
+          boxes=result.groundtruth_bboxes[mask],
+          difficulties=np.asarray(result.groundtruth_difficulties)[mask],
+          distances=np.asarray(distances)[mask],
+          num_points=np.asarray(num_points)[mask],
+          rotations=np.asarray(rotations)[mask],
+          heights_in_pixels=-1,
+          speeds=result.groundtruth_speed[mask])
+    if n:
+      # Invalidate the evaluation.
+      self._is_eval_complete = False
 
     c = result.detection_scores.shape[0]
     assert c == self.metadata.NumClasses(), '%s vs. %s' % (
         c, self.metadata.NumClasses())
 
-    str_imgid = self._GetImageId(str_id)
-
     # Iterate first by class.
     for class_id in range(1, c):
       assert class_id > 0 and class_id < self.metadata.NumClasses(), (
@@ -451,8 +539,8 @@ class APMetrics(BaseMetric):
       non_zero_scores = scores[scores > 0]
       non_zero_heights_in_pixels = heights_in_pixels[scores > 0]
 
-      rotations = [0] * len(non_zero_bboxes)
-      distances = [0] * len(non_zero_bboxes)
+      rotations = np.zeros([len(non_zero_bboxes)], dtype=np.int32)
+      distances = np.zeros([len(non_zero_bboxes)], dtype=np.int32)
       if 'distance' in self._breakdown_metrics:
         # Compute all distances for non-zero-bboxes in one shot.
         distances = self._breakdown_metrics['distance'].Discretize(
@@ -461,32 +549,46 @@ class APMetrics(BaseMetric):
         rotations = self._breakdown_metrics['rotation'].Discretize(
             non_zero_bboxes)
 
-      # Add each box to the list.
-      #
-      # NOTE: The length of this loop can be large (e.g., for an early
-      # checkpoint), so any code inside of this for loop should be
-      # double-checked for efficiency.
-      dummy_speed = np.zeros((1, 2), dtype=np.float32)
-      for box_id in range(non_zero_bboxes.shape[0]):
-        boxes_for_class.Add(
-            img_id=str_imgid,
-            score=non_zero_scores[box_id],
-            box=non_zero_bboxes[box_id],
-            difficulty=0,
-            distance=distances[box_id],
-            num_points=0,
-            rotation=rotations[box_id],
-            height_in_pixels=non_zero_heights_in_pixels[box_id],
-            speed=dummy_speed)
+      # Add all boxes of the class at once; the number of boxes can be large
+      # (e.g., for an early checkpoint).
+      boxes_for_class.AddBatch(
+          img_ids=str_imgid,
+          scores=non_zero_scores,
+          boxes=non_zero_bboxes,
+          difficulties=0,
+          distances=distances,
+          num_points=0,
+          rotations=rotations,
+          heights_in_pixels=non_zero_heights_in_pixels,
+          speeds=np.zeros((1, 2), dtype=np.float32))
 
   def _EvaluateIfNecessary(self):
     """Evaluate all precision recall metrics."""
     if self._is_eval_complete:
       return
-    compute_metrics_fn = functools.partial(
-        self._ComputeFinalMetrics, classids=self.metadata.EvalClassIndices())
+    classids = self.metadata.EvalClassIndices()
+    # Compute the metrics of every bin of every breakdown up front, in a single
+    # graph and session, and serve the breakdowns' requests from the results.
+    bin_conditions = []
+    for metric_class in self._breakdown_metrics.values():
+      for conditions in metric_class.BinConditions():
+        if conditions not in bin_conditions:
+          bin_conditions.append(conditions)
+    results = self._ComputeFinalMetricsForBins(classids, bin_conditions)
+    results_by_bin = {
+        _BinKey(conditions): result
+        for conditions, result in zip(bin_conditions, results)
+    }
+
+    def _ComputeMetricsFn(**conditions):
+      key = _BinKey(conditions)
+      if key not in results_by_bin:
+        results_by_bin[key] = self._ComputeFinalMetrics(
+            classids=classids, **conditions)
+      return results_by_bin[key]
+
     for metric_class in self._breakdown_metrics.values():
-      metric_class.ComputeMetrics(compute_metrics_fn)
+      metric_class.ComputeMetrics(_ComputeMetricsFn)
     self._is_eval_complete = True
 
   @property
@@ -133,6 +133,18 @@ class BreakdownMetric:
     """Returns int32 of number of bins in histogram."""
     return NotImplementedError()
 
+  def BinConditions(self):
+    """Returns the conditioning arguments that ComputeMetrics() will request.
+
+    Evaluators use this to compute the metrics of all bins of all breakdowns
+    in one pass before calling ComputeMetrics().
+
+    Returns:
+      A list with one dict per bin, holding the named arguments that
+      ComputeMetrics() passes to compute_metrics_fn for that bin.
+    """
+    return []
+
   def ComputeMetrics(self, compute_metrics_fn):
     """Compute precision-recall analysis conditioned on particular metric.
 
@@ -184,14 +196,14 @@ class BreakdownMetric:
     assert np.issubdtype(statistics.dtype, int)
     if not statistics.size:
       return
-    p = self.params
     assert np.max(statistics) < self._histogram.shape[0], (
         'Histogram shape too small %d vs %d' %
         (np.max(statistics), self._histogram.shape[0]))
-    for l in range(p.metadata.NumClasses()):
-      indices = np.where(labels == l)[0]
-      for s in statistics[indices]:
-        self._histogram[s, l] += 1
+    statistics = np.reshape(statistics, [-1])
+    labels = np.reshape(labels, [-1])
+    valid = (labels >= 0) & (labels < self._histogram.shape[1])
+    np.add.at(self._histogram,
+              (statistics[valid], labels[valid].astype(np.int32)), 1)
 
   def _AccumulateCumulative(self, statistics=None, labels=None):
     """Accumulate cumulative of real-valued statistic by label.
@@ -285,6 +297,9 @@ class ByDistance(BreakdownMetric):
     distances = self.Discretize(result.bboxes)
     self._AccumulateHistogram(statistics=distances, labels=result.labels)
 
+  def BinConditions(self):
+    return [{'distance': d} for d in range(self.NumBinsOfHistogram())]
+
   def ComputeMetrics(self, compute_metrics_fn):
     tf.logging.info('Calculating by distance: start')
     p = self.params
@@ -393,6 +408,9 @@ class ByNumPoints(BreakdownMetric):
     self._AccumulateCumulative(
         statistics=result.num_points, labels=result.labels)
 
+  def BinConditions(self):
+    return [{'num_points': n} for n in range(self.NumBinsOfHistogram())]
+
   def ComputeMetrics(self, compute_metrics_fn):
     tf.logging.info('Calculating by number of points: start')
     # Note that we skip the last edge as the number of edges is one greater
@@ -576,6 +594,9 @@ class ByRotation(BreakdownMetric):
     rotations = self.Discretize(result.bboxes)
     self._AccumulateHistogram(statistics=rotations, labels=result.labels)
 
+  def BinConditions(self):
+    return [{'rotation': r} for r in range(self.NumBinsOfHistogram())]
+
   def ComputeMetrics(self, compute_metrics_fn):
     tf.logging.info('Calculating by rotation: start')
     p = self.params
@@ -671,6 +692,11 @@ class ByDifficulty(BreakdownMetric):
     difficulties = self.Discretize(result.difficulties)
     self._AccumulateHistogram(statistics=difficulties, labels=result.labels)
 
+  def BinConditions(self):
+    return [{
+        'difficulty': difficulty
+    } for difficulty in self.params.metadata.DifficultyLevels()]
+
   def ComputeMetrics(self, compute_metrics_fn):
     p = self.params
     tf.logging.info('Calculating by difficulty: start')
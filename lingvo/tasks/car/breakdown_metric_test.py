@@ -18,6 +18,7 @@
 from lingvo import compat as tf
 from lingvo.core import py_utils
 from lingvo.core import test_utils
+from lingvo.tasks.car import ap_metric
 from lingvo.tasks.car import breakdown_metric
 from lingvo.tasks.car import kitti_ap_metric
 from lingvo.tasks.car import kitti_metadata
@@ -41,7 +42,7 @@ class BreakdownMetricTest(test_utils.TestCase):
     bboxes[:, 0] = distance
     return bboxes
 
-  def _GenerateMetricsWithTestData(self, num_classes):
+  def _GenerateMetricsWithTestData(self, num_classes, use_iou_cache=False):
     metadata = kitti_metadata.KITTIMetadata()
     num_bins_of_distance = int(
         np.rint(metadata.MaximumDistance() / metadata.DistanceBinWidth()))
@@ -114,7 +115,7 @@ class BreakdownMetricTest(test_utils.TestCase):
     # Update the metrics.
     metric_names = ['rotation', 'num_points', 'distance']
     ap_params = kitti_ap_metric.KITTIAPMetrics.Params(metadata).Set(
-        breakdown_metrics=metric_names)
+        breakdown_metrics=metric_names, use_iou_cache=use_iou_cache)
     metrics = ap_params.Instantiate()
     metrics.Update(
         'dummy_image1',
@@ -349,6 +350,85 @@ class BreakdownMetricTest(test_utils.TestCase):
       self.assertEqual(n, test_breakdown_metric._histogram[1, class_index])
       self.assertEqual(2 * n, test_breakdown_metric._histogram[2, class_index])
 
+  def testAccumulateHistogramSkipsOutOfRangeLabels(self):
+    metadata = kitti_metadata.KITTIMetadata()
+    metrics_params = breakdown_metric.BreakdownMetric.Params().Set(
+        metadata=metadata)
+    test_breakdown_metric = breakdown_metric.ByDifficulty(metrics_params)
+    test_breakdown_metric._AccumulateHistogram(
+        statistics=np.array([0, 1, 1, 2, 3], dtype=np.int32),
+        labels=np.array([1, 1, 1, -1, metadata.NumClasses()]))
+
+    expected_histogram = np.zeros_like(test_breakdown_metric._histogram)
+    expected_histogram[0, 1] = 1
+    expected_histogram[1, 1] = 2
+    self.assertAllEqual(expected_histogram, test_breakdown_metric._histogram)
+
+  def testBoxes3DAddBatchMatchesAdd(self):
+    num_boxes = 250
+    bboxes = self._GenerateRandomBBoxes(num_boxes)
+    scores = np.random.uniform(size=[num_boxes])
+    distances = np.random.randint(10, size=[num_boxes])
+    speeds = np.random.uniform(size=[num_boxes, 2])
+
+    expected = ap_metric.Boxes3D()
+    for i in range(num_boxes):
+      expected.Add(3, scores[i], bboxes[i], 1, distances[i], 0, 0, -1,
+                   speeds[i])
+    actual = ap_metric.Boxes3D()
+    for batch in np.split(np.arange(num_boxes), [10, 20, 230]):
+      actual.AddBatch(3, scores[batch], bboxes[batch], 1, distances[batch], 0,
+                      0, -1, speeds[batch])
+
+    for field in ['imgids', 'scores', 'boxes', 'difficulties', 'distances',
+                  'num_points', 'rotations', 'heights_in_pixels', 'speeds']:
+      self.assertAllEqual(getattr(expected, field), getattr(actual, field))
+
+    selected = actual.Select(distances == 4)
+    self.assertAllEqual(bboxes[distances == 4], selected.boxes)
+    self.assertAllEqual(scores[distances == 4], selected.scores)
+    self.assertIsNone(actual.Select(distances == 10))
+
+  def testBreakdownBinsMatchPerBinComputation(self):
+    metadata = kitti_metadata.KITTIMetadata()
+    num_classes = len(metadata.ClassNames())
+    test_data = self._GenerateMetricsWithTestData(num_classes)
+    metrics = test_data.metrics
+    # Computes the metrics of all bins of all breakdowns in one pass.
+    metrics._EvaluateIfNecessary()
+
+    classids = metadata.EvalClassIndices()
+    for name in ['distance', 'num_points', 'rotation']:
+      breakdown = metrics._breakdown_metrics[name]
+      for b in range(breakdown.NumBinsOfHistogram()):
+        expected = metrics._ComputeFinalMetrics(classids=classids, **{name: b})
+        self.assertAllClose(
+            np.array([c['pr'] for c in expected['curves']]),
+            breakdown._precision_recall[b])
+
+    difficulty_metric = metrics._breakdown_metrics['difficulty']
+    for difficulty in metadata.DifficultyLevels():
+      expected = metrics._ComputeFinalMetrics(
+          classids=classids, difficulty=difficulty)
+      self.assertAllClose([s['ap'] for s in expected['scalars']],
+                          difficulty_metric._average_precisions[difficulty])
+
+  def testIoUCacheMatchesOpOnBreakdownBins(self):
+    num_classes = len(kitti_metadata.KITTIMetadata().ClassNames())
+    np.random.seed(12345)
+    expected = self._GenerateMetricsWithTestData(num_classes).metrics
+    np.random.seed(12345)
+    actual = self._GenerateMetricsWithTestData(
+        num_classes, use_iou_cache=True).metrics
+    expected._EvaluateIfNecessary()
+    actual._EvaluateIfNecessary()
+    for name, expected_breakdown in expected._breakdown_metrics.items():
+      actual_breakdown = actual._breakdown_metrics[name]
+      self.assertAllClose(expected_breakdown._average_precisions,
+                          actual_breakdown._average_precisions)
+      self.assertAllClose(expected_breakdown._precision_recall,
+                          actual_breakdown._precision_recall)
+
   def testByName(self):
     metric_class = breakdown_metric.ByName('difficulty')
     self.assertEqual(metric_class, breakdown_metric.ByDifficulty)
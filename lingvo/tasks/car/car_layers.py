@@ -41,6 +41,11 @@ class SamplingAndGroupingLayer(base_layer.BaseLayer):
         'sample_neighbors_uniformly', True,
         'Whether to sample neighbors uniformly within the ball radius. '
         'If False, this will pick the nearest neighbors by distance.')
+    p.Define(
+        'max_points_per_voxel', None,
+        'If set, neighbors are searched in a voxel hash of the points with '
+        'this many points per voxel, instead of by comparing all pairs of '
+        'points. See car_lib.NeighborhoodIndices().')
     return p
 
   def FProp(self, theta, input_data):
@@ -80,7 +85,8 @@ class SamplingAndGroupingLayer(base_layer.BaseLayer):
         p.group_size,
         points_padding=padding,
         max_distance=p.ball_radius,
-        sample_neighbors_uniformly=p.sample_neighbors_uniformly)
+        sample_neighbors_uniformly=p.sample_neighbors_uniformly,
+        max_points_per_voxel=p.max_points_per_voxel)
     grouped_points = car_lib.MatmulGather(points, grouped_idx)
     # Normalize the grouped points based on the location of the query point.
     grouped_points -= tf.expand_dims(query_points, -2)
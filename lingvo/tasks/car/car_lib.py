@@ -16,6 +16,8 @@
 """Library of functions on tensors for car layers, builders, and models."""
 
 
+import itertools
+
 # pylint:enable=g-direct-tensorflow-import
 import lingvo.compat as tf
 from lingvo.core import py_utils
@@ -84,7 +86,12 @@ def NeighborSquaredDistanceMatrix(points, neighbor_points):
   return py_utils.HasShape(sq_dist, [n, p1, k])
 
 
-def KnnIndices(points, query_points, k, valid_num=None, max_distance=None):
+def KnnIndices(points,
+               query_points,
+               k,
+               valid_num=None,
+               max_distance=None,
+               max_points_per_voxel=None):
   """k-nearest neighbors of query_points in points.
 
   The caller should ensure that points[i, :valid_num[i], :] are the non-padding
@@ -117,6 +124,9 @@ def KnnIndices(points, query_points, k, valid_num=None, max_distance=None):
       be. If there are no points within the distance, then the closest point is
       returned (regardless of distance). If this is set to None, then
       max_distance is not used.
+    max_points_per_voxel: optional integer. If set, neighbors are searched in a
+      voxel hash of the points instead of in the dense distance matrix. See
+      NeighborhoodIndices().
 
   Returns:
     A pair of tensors:
@@ -131,7 +141,13 @@ def KnnIndices(points, query_points, k, valid_num=None, max_distance=None):
   if valid_num is not None:
     padding = tf.greater_equal(tf.range(p1), tf.expand_dims(
         valid_num, -1))  # [N, P1], False/True padding
-  return NeighborhoodIndices(points, query_points, k, padding, max_distance)
+  return NeighborhoodIndices(
+      points,
+      query_points,
+      k,
+      padding,
+      max_distance,
+      max_points_per_voxel=max_points_per_voxel)
 
 
 def NeighborhoodIndices(points,
@@ -139,7 +155,8 @@ def NeighborhoodIndices(points,
                         k,
                         points_padding=None,
                         max_distance=None,
-                        sample_neighbors_uniformly=False):
+                        sample_neighbors_uniformly=False,
+                        max_points_per_voxel=None):
   """Get indices to k-neighbors of query_points in points.
 
   Padding is returned along-side indices. Non-padded points are guaranteed to
@@ -169,6 +186,14 @@ def NeighborhoodIndices(points,
       filtering by distance is performed.
     sample_neighbors_uniformly: boolean specifying whether to sample neighbors
       uniformly if they are within max distance.
+    max_points_per_voxel: optional integer. If set, the points are bucketed
+      into a grid of voxels of size max_distance, and each query point is only
+      compared to the first max_points_per_voxel points of each of the voxels
+      around it, instead of to all the points. This takes O(P1 + P2 * k) rather
+      than O(P1 * P2) memory, and gives the same neighbors as long as no voxel
+      has more than max_points_per_voxel points. Requires max_distance. The
+      indices of padded neighbors are those of the closest point found, or
+      arbitrary if there are no points in the voxels around the query point.
 
   Returns:
     A pair of tensors:
@@ -177,11 +202,22 @@ def NeighborhoodIndices(points,
     - padding: tensor of shape [N, P2, k] where 1 represents a padded point, and
       0 represents an unpadded (real) point.
 
+  Raises:
+    ValueError: if sample_neighbors_uniformly or max_points_per_voxel is set
+      without max_distance.
   """
   n, p1 = py_utils.GetShape(points, 2)
   query_points = py_utils.HasShape(query_points, [n, -1, -1])
   _, p2 = py_utils.GetShape(query_points, 2)
 
+  if max_points_per_voxel is not None:
+    if max_distance is None:
+      raise ValueError('Voxel hash search requires specifying max_distance.')
+    return _VoxelHashNeighborhoodIndices(points, query_points, k,
+                                         points_padding, max_distance,
+                                         sample_neighbors_uniformly,
+                                         max_points_per_voxel)
+
   # Compute pair-wise squared distances.
   # Note that dist_mat contains the squared distance (without sqrt). Thus, when
   # using max_distance, we will need to square max_distance to make sure it's
@@ -237,6 +273,122 @@ def NeighborhoodIndices(points,
   return indices, paddings
 
 
+def _VoxelIds(voxels, grid_shape):
+  """Returns the row-major ids of int64 voxels [..., dims] in a grid."""
+  strides = tf.math.cumprod(grid_shape, axis=-1, exclusive=True, reverse=True)
+  return tf.reduce_sum(voxels * strides, axis=-1)
+
+
+def _VoxelHashCandidates(points, query_points, voxel_size, max_points_per_voxel,
+                         points_padding):
+  """Returns the points in the voxels around each query point.
+
+  The points are bucketed by sorting them by voxel id, so that the points of a
+  voxel are contiguous. The 3^dims voxels around the voxel of each query point
+  are then looked up with a binary search, and up to max_points_per_voxel
+  points are taken from each of them. Padded points are in no voxel.
+
+  Args:
+    points: tensor of shape [N, P1, dims].
+    query_points: tensor of shape [N, P2, dims].
+    voxel_size: float, the size of the voxels.
+    max_points_per_voxel: integer number of points to take from each voxel.
+    points_padding: optional tensor of shape [N, P1].
+
+  Returns:
+    A pair of tensors of shape [N, P2, 3^dims * max_points_per_voxel]:
+
+    - candidates: int32 indices of the points.
+    - is_valid: bool, whether the candidate is a point of the voxel, rather
+      than a filler for voxels with fewer than max_points_per_voxel points.
+  """
+  n, p1, dims = py_utils.GetShape(points, 3)
+  _, p2 = py_utils.GetShape(query_points, 2)
+  if not isinstance(dims, int):
+    raise ValueError('Voxel hash search requires a static number of dims.')
+  offsets = tf.constant(
+      list(itertools.product([-1, 0, 1], repeat=dims)), dtype=tf.int64)
+
+  origin = tf.reduce_min(points, axis=1, keepdims=True)
+
+  def _Voxels(x):
+    return tf.cast(tf.floor((x - origin) / voxel_size), tf.int64)
+
+  point_voxels = _Voxels(points)
+  grid_shape = tf.reduce_max(point_voxels, axis=1, keepdims=True) + 1
+  point_ids = _VoxelIds(point_voxels, grid_shape)  # [N, P1]
+  if points_padding is not None:
+    # Padded points sort last, and do not match any query voxel.
+    point_ids = tf.where(
+        tf.cast(points_padding, tf.bool),
+        tf.ones_like(point_ids) * tf.int64.max, point_ids)
+  point_order = tf.argsort(point_ids, axis=-1, stable=True)
+  sorted_ids = tf.array_ops.batch_gather(point_ids, point_order)
+
+  # [N, P2, 3^dims, dims]
+  query_voxels = tf.expand_dims(_Voxels(query_points), 2) + offsets
+  query_grid_shape = tf.expand_dims(grid_shape, 1)
+  in_grid = tf.reduce_all(
+      tf.logical_and(query_voxels >= 0, query_voxels < query_grid_shape),
+      axis=-1)
+  # Voxels outside the grid get id -1, which matches no point.
+  query_ids = tf.where(in_grid, _VoxelIds(query_voxels, query_grid_shape),
+                       -tf.ones_like(in_grid, dtype=tf.int64))
+  query_ids = tf.reshape(query_ids, [n, -1])
+
+  starts = tf.searchsorted(sorted_ids, query_ids, side='left')
+  ends = tf.searchsorted(sorted_ids, query_ids, side='right')
+  slots = tf.expand_dims(starts, -1) + tf.range(max_points_per_voxel)
+  is_valid = tf.less(slots, tf.expand_dims(ends, -1))
+  slots = tf.minimum(slots, p1 - 1)
+  candidates = tf.array_ops.batch_gather(point_order,
+                                         tf.reshape(slots, [n, -1]))
+  return tf.reshape(candidates, [n, p2, -1]), tf.reshape(is_valid, [n, p2, -1])
+
+
+def _VoxelHashNeighborhoodIndices(points, query_points, k, points_padding,
+                                  max_distance, sample_neighbors_uniformly,
+                                  max_points_per_voxel):
+  """NeighborhoodIndices() searching the neighbors in a voxel hash."""
+  n, _, dims = py_utils.GetShape(points, 3)
+  _, p2 = py_utils.GetShape(query_points, 2)
+  num_candidates = 3**dims * max_points_per_voxel
+  if k > num_candidates:
+    raise ValueError('k=%d is larger than the %d neighbor candidates of %d '
+                     'points per voxel.' % (k, num_candidates,
+                                            max_points_per_voxel))
+
+  candidates, is_valid = _VoxelHashCandidates(points, query_points,
+                                              max_distance,
+                                              max_points_per_voxel,
+                                              points_padding)
+  candidate_points = tf.array_ops.batch_gather(
+      points, tf.reshape(candidates, [n, -1]))
+  candidate_points = tf.reshape(candidate_points, [n, p2, num_candidates, dims])
+  dist = tf.reduce_sum(
+      tf.square(candidate_points - tf.expand_dims(query_points, 2)), axis=-1)
+
+  max_squared_distance = tf.square(max_distance)
+  if sample_neighbors_uniformly:
+    mask_by_distance = tf.logical_and(
+        is_valid, tf.less_equal(dist, max_squared_distance))
+    dist = tf.where(
+        mask_by_distance,
+        max_squared_distance * tf.random.uniform(tf.shape(dist)), dist)
+  # Fillers are never selected before actual points.
+  dist = tf.where(is_valid, dist, tf.ones_like(dist) * dist.dtype.max)
+
+  top_k_dist, top_k_idx = tf.nn.top_k(-dist, k=k, sorted=True)  # N x P2 x K
+  indices = tf.array_ops.batch_gather(candidates, top_k_idx)
+
+  # Fillers and points further than max_distance are padding, and point to the
+  # closest point.
+  paddings = tf.greater(-top_k_dist, max_squared_distance)
+  closest_idx = tf.tile(indices[:, :, :1], [1, 1, k])
+  indices = tf.where(paddings, closest_idx, indices)
+  return indices, tf.cast(paddings, tf.float32)
+
+
 def MatmulGather(source, indices):
   """Drop in replacement for tf.gather_nd() optimized for speed on TPU.
 
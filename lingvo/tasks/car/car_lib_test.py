@@ -256,6 +256,86 @@ class CarLibTest(test_utils.TestCase):
       car_lib.NeighborhoodIndices(
           points, query_points, 1, padding, sample_neighbors_uniformly=True)
 
+  def _RandomPointsAndPadding(self):
+    points = np.random.uniform(0., 4., size=(2, 300, 3)).astype(np.float32)
+    # Some query points are outside of the grid of the points.
+    query_points = np.random.uniform(
+        -1., 5., size=(2, 50, 3)).astype(np.float32)
+    padding = (np.random.uniform(size=(2, 300)) < 0.3).astype(np.float32)
+    return points, query_points, padding
+
+  def testNeighborhoodIndicesVoxelHash(self):
+    np.random.seed(12345)
+    points, query_points, padding = self._RandomPointsAndPadding()
+    with self.session():
+      dense = self.evaluate(
+          car_lib.NeighborhoodIndices(
+              points, query_points, 8, padding, max_distance=0.7))
+      voxel_hash = self.evaluate(
+          car_lib.NeighborhoodIndices(
+              points,
+              query_points,
+              8,
+              padding,
+              max_distance=0.7,
+              max_points_per_voxel=300))
+    self.assertAllEqual(dense[1], voxel_hash[1])
+    self.assertGreater(np.sum(dense[1] == 0), 100)
+    self.assertGreater(np.sum(dense[1] == 1), 100)
+    # The indices of the padded neighbors may differ.
+    self.assertAllEqual(dense[0][dense[1] == 0],
+                        voxel_hash[0][voxel_hash[1] == 0])
+
+  def testKnnIndicesVoxelHash(self):
+    np.random.seed(12345)
+    points, query_points, _ = self._RandomPointsAndPadding()
+    valid_num = np.array([300, 120], dtype=np.int32)
+    with self.session():
+      dense = self.evaluate(
+          car_lib.KnnIndices(
+              points, query_points, 4, valid_num, max_distance=0.5))
+      voxel_hash = self.evaluate(
+          car_lib.KnnIndices(
+              points,
+              query_points,
+              4,
+              valid_num,
+              max_distance=0.5,
+              max_points_per_voxel=64))
+    self.assertAllEqual(dense[1], voxel_hash[1])
+    self.assertAllEqual(dense[0][dense[1] == 0],
+                        voxel_hash[0][voxel_hash[1] == 0])
+
+  def testNeighborhoodIndicesVoxelHashWithUniformSampling(self):
+    np.random.seed(12345)
+    points, query_points, padding = self._RandomPointsAndPadding()
+    with self.session():
+      indices, paddings = self.evaluate(
+          car_lib.NeighborhoodIndices(
+              points,
+              query_points,
+              8,
+              padding,
+              max_distance=0.7,
+              sample_neighbors_uniformly=True,
+              max_points_per_voxel=300))
+    for i in range(2):
+      for j in range(50):
+        neighbors = indices[i, j][paddings[i, j] == 0]
+        # The real neighbors are unique real points within max_distance.
+        self.assertLen(set(neighbors), len(neighbors))
+        self.assertAllEqual(np.zeros_like(neighbors), padding[i, neighbors])
+        self.assertAllLessEqual(
+            np.linalg.norm(points[i, neighbors] - query_points[i, j], axis=-1),
+            0.7)
+
+  def testNeighborhoodIndicesVoxelHashRaisesIfNoMaxDistance(self):
+    points, query_points, padding = self._RandomPointsAndPadding()
+    with self.assertRaisesRegex(
+        ValueError, r'.*Voxel hash search requires specifying max_distance.*'):
+      car_lib.NeighborhoodIndices(
+          points, query_points, 1, padding, max_points_per_voxel=16)
+
   def testFarthestPointSamplerOnePoint(self):
     points = tf.constant([
         [[1, 1, 1, 1]],
@@ -462,5 +542,46 @@ class CarLibTest(test_utils.TestCase):
     return self._testPooling3D(car_lib.SegmentPool3D)
 
 
+class NeighborhoodIndicesBenchmark(tf.test.Benchmark):
+  """Benchmarks the voxel hash neighbor search against the dense one.
+
+  Reports the wall time and the peak CPU memory of each search.
+
+  Run with::
+
+    bazel run -c opt lingvo/tasks/car:car_lib_test -- --benchmarks=.
+  """
+
+  def _Benchmark(self, num_points, max_points_per_voxel):
+    np.random.seed(12345)
+    # About the density of the points of a lidar sweep near the ground.
+    points = np.concatenate([
+        np.random.uniform(-40., 40., size=(1, num_points, 2)),
+        np.random.uniform(0., 3., size=(1, num_points, 1)),
+    ], axis=-1).astype(np.float32)
+    query_points = points[:, :num_points // 4]
+    with tf.Graph().as_default(), tf.device('/cpu:0'):
+      indices, _ = car_lib.NeighborhoodIndices(
+          tf.constant(points),
+          tf.constant(query_points),
+          16,
+          max_distance=1.,
+          max_points_per_voxel=max_points_per_voxel)
+      with tf.Session() as sess:
+        self.run_op_benchmark(
+            sess,
+            indices.op,
+            min_iters=3,
+            store_memory_usage=True,
+            name='%s_%d' % ('dense' if max_points_per_voxel is None else
+                            'voxel_hash', num_points))
+
+  def benchmarkNeighborhoodIndices(self):
+    for num_points in (1024, 4096, 16384):
+      self._Benchmark(num_points, None)
+    for num_points in (1024, 4096, 16384, 65536, 131072):
+      self._Benchmark(num_points, 32)
+
+
 if __name__ == '__main__':
   tf.test.main()
@@ -15,6 +15,8 @@
 # ==============================================================================
 """Metrics for 3D detection problems."""
 
+import functools
+
 from lingvo import compat as tf
 from lingvo.core import metrics
 from lingvo.core import plot
@@ -74,7 +76,9 @@ class TopDownVisualizationMetric(metrics.BaseMetric):
                image_width=1024,
                figsize=None,
                ground_removal_threshold=-1.35,
-               sampler_num_samples=8):
+               sampler_num_samples=8,
+               use_matplotlib=True,
+               num_render_threads=1):
     """Initialize TopDownVisualizationMetric.
 
     Args:
@@ -93,6 +97,11 @@ class TopDownVisualizationMetric(metrics.BaseMetric):
       ground_removal_threshold: Floating point value used to color ground points
         differently.  Defaults to -1.35 which happens to work well for KITTI.
       sampler_num_samples: Number of batches to keep for visualizing.
+      use_matplotlib: If False, the source id is drawn with PIL and the images
+        are encoded directly, skipping matplotlib altogether. figsize is unused
+        in that case: the summaries have the size of the top down image.
+      num_render_threads: Number of threads used to render the images with
+        matplotlib.
     """
     self._class_id_to_name = class_id_to_name or {}
     self._image_width = image_width
@@ -104,6 +113,8 @@ class TopDownVisualizationMetric(metrics.BaseMetric):
     self._ground_removal_threshold = ground_removal_threshold
     self._sampler = py_utils.UniformSampler(num_samples=sampler_num_samples)
     self._top_down_transform = top_down_transform
+    self._use_matplotlib = use_matplotlib
+    self._num_render_threads = num_render_threads
     self._summary = None
 
   def Update(self, decoded_outputs):
@@ -164,6 +175,9 @@ class TopDownVisualizationMetric(metrics.BaseMetric):
     ret = tf.Summary()
 
     transform = self._top_down_transform
+    names = []
+    images_to_render = []
+    source_ids_to_render = []
 
     for batch_idx, batch_sample in enumerate(self._sampler.samples):
       batch_size = batch_sample.labels.shape[0]
@@ -220,36 +234,64 @@ class TopDownVisualizationMetric(metrics.BaseMetric):
                           gt_bboxes_2d_weights, difficulties)
 
       for idx in range(batch_size):
-        source_id = source_ids[idx]
-
-        def AnnotateImage(fig, axes, source_id=source_id):
-          """Add source_id to image."""
-          del fig
-          # Draw in top middle of image.
-          text = axes.text(
-              500,
-              15,
-              source_id,
-              fontsize=16,
-              color='blue',
-              fontweight='bold',
-              horizontalalignment='center')
-          text.set_path_effects([
-              path_effects.Stroke(linewidth=3, foreground='lightblue'),
-              path_effects.Normal()
-          ])
-
-        image_summary = plot.Image(
-            name='{}/{}/{}'.format(name, batch_idx, idx),
-            aspect='equal',
-            figsize=self._figsize,
-            image=images[idx, ...],
-            setter=AnnotateImage)
-        ret.value.extend(image_summary.value)
+        names.append('{}/{}/{}'.format(name, batch_idx, idx))
+        images_to_render.append(images[idx, ...])
+        source_ids_to_render.append(source_ids[idx])
+
+    if self._use_matplotlib:
+
+      def AnnotateImage(fig, axes, source_id):
+        """Add source_id to image."""
+        del fig
+        # Draw in top middle of image.
+        text = axes.text(
+            500,
+            15,
+            source_id,
+            fontsize=16,
+            color='blue',
+            fontweight='bold',
+            horizontalalignment='center')
+        text.set_path_effects([
+            path_effects.Stroke(linewidth=3, foreground='lightblue'),
+            path_effects.Normal()
+        ])
+
+      ret = plot.Images(
+          names,
+          self._figsize,
+          images_to_render,
+          setters=[
+              functools.partial(AnnotateImage, source_id=source_id)
+              for source_id in source_ids_to_render
+          ],
+          num_threads=self._num_render_threads,
+          aspect='equal')
+    else:
+      for image_name, image, source_id in zip(names, images_to_render,
+                                              source_ids_to_render):
+        self.DrawSourceId(image, source_id)
+        ret.value.extend(plot.RawImage(image_name, image).value)
 
     tf.logging.info('Done generating top down summary.')
     self._summary = ret
 
+  def DrawSourceId(self, image, source_id):
+    """Draw source_id in the top middle of the [H, W, 3] uint8 image."""
+    try:
+      font = ImageFont.truetype('arial.ttf', size=16)
+    except IOError:
+      font = ImageFont.load_default()
+    source_id = plot.ToUnicode(source_id)
+    pil_image = Image.fromarray(image)
+    draw = ImageDraw.Draw(pil_image)
+    text_width, _ = font.getsize(source_id)
+    draw.text((image.shape[1] / 2 - text_width / 2, 5),
+              source_id,
+              fill='blue',
+              font=font)
+    np.copyto(image, np.array(pil_image))
+
   def DrawDifficulty(self, images, gt_bboxes, gt_box_weights, difficulties):
     """Draw the difficulty values on each ground truth box."""
     batch_size = np.shape(images)[0]
@@ -386,7 +428,8 @@ class CameraVisualization(metrics.BaseMetric):
                figsize=(15, 15),
                bbox_score_threshold=0.01,
                sampler_num_samples=8,
-               draw_3d_boxes=True):
+               draw_3d_boxes=True,
+               num_render_threads=1):
     """Initialize CameraVisualization.
 
     Args:
@@ -401,11 +444,14 @@ class CameraVisualization(metrics.BaseMetric):
         boxes depict the 8 corners of the bounding box, whereas the 2d
         bounding boxes depict the extrema x and y dimensions of the boxes
         on the image plane.
+      num_render_threads: Number of threads used to render the images with
+        matplotlib.
     """
     self._figsize = figsize
     self._bbox_score_threshold = bbox_score_threshold,
     self._sampler = py_utils.UniformSampler(num_samples=sampler_num_samples)
     self._draw_3d_boxes = draw_3d_boxes
+    self._num_render_threads = num_render_threads
     self._summary = None
 
   def Update(self, decoded_outputs):
@@ -422,8 +468,9 @@ class CameraVisualization(metrics.BaseMetric):
     if self._summary is not None:
       return
 
-    ret = tf.Summary()
-
+    names = []
+    images = []
+    setters = []
     for sample_idx, sample in enumerate(self._sampler.samples):
       batch_size = sample.camera_images.shape[0]
 
@@ -536,11 +583,13 @@ class CameraVisualization(metrics.BaseMetric):
 
         # For each image, draw the boxes on that image.
         draw_fn = Draw3DBoxes if self._draw_3d_boxes else Draw2DBoxes
-        image_summary = plot.Image(
-            name='{}/{}/{}'.format(name, sample_idx, batch_idx),
-            aspect='equal',
-            figsize=self._figsize,
-            image=image,
-            setter=draw_fn)
-        ret.value.extend(image_summary.value)
-    self._summary = ret
+        names.append('{}/{}/{}'.format(name, sample_idx, batch_idx))
+        images.append(image)
+        setters.append(draw_fn)
+    self._summary = plot.Images(
+        names,
+        self._figsize,
+        images,
+        setters=setters,
+        num_threads=self._num_render_threads,
+        aspect='equal')
@@ -25,14 +25,7 @@ import numpy as np
 
 class Detection3dMetricsTest(test_utils.TestCase):
 
-  def testTopDownVisualizationMetric(self):
-    top_down_transform = transform_util.MakeCarToImageTransform(
-        pixels_per_meter=32.,
-        image_ref_x=512.,
-        image_ref_y=1408.,
-        flip_axes=True)
-    metric = detection_3d_metrics.TopDownVisualizationMetric(top_down_transform)
-
+  def _TopDownVisualizationMetricUpdate(self):
     batch_size = 4
     num_preds = 10
     num_gt = 12
@@ -51,22 +44,48 @@ class Detection3dMetricsTest(test_utils.TestCase):
     points_padding = np.random.randint(0, 2, (batch_size, num_points))
     source_ids = np.full([batch_size], '012346')
 
-    metric.Update(
-        py_utils.NestedMap({
-            'visualization_labels': visualization_labels,
-            'predicted_bboxes': predicted_bboxes,
-            'visualization_weights': visualization_weights,
-            'labels': labels,
-            'gt_bboxes_2d': gt_bboxes_2d,
-            'gt_bboxes_2d_weights': gt_bboxes_2d_weights,
-            'points_xyz': points_xyz,
-            'points_padding': points_padding,
-            'difficulties': difficulties,
-            'source_ids': source_ids,
-        }))
+    return py_utils.NestedMap({
+        'visualization_labels': visualization_labels,
+        'predicted_bboxes': predicted_bboxes,
+        'visualization_weights': visualization_weights,
+        'labels': labels,
+        'gt_bboxes_2d': gt_bboxes_2d,
+        'gt_bboxes_2d_weights': gt_bboxes_2d_weights,
+        'points_xyz': points_xyz,
+        'points_padding': points_padding,
+        'difficulties': difficulties,
+        'source_ids': source_ids,
+    })
 
+  def testTopDownVisualizationMetric(self):
+    top_down_transform = transform_util.MakeCarToImageTransform(
+        pixels_per_meter=32.,
+        image_ref_x=512.,
+        image_ref_y=1408.,
+        flip_axes=True)
+    metric = detection_3d_metrics.TopDownVisualizationMetric(top_down_transform)
+    metric.Update(self._TopDownVisualizationMetricUpdate())
     _ = metric.Summary('test')
 
+  def testTopDownVisualizationMetricWithoutMatplotlib(self):
+    top_down_transform = transform_util.MakeCarToImageTransform(
+        pixels_per_meter=32.,
+        image_ref_x=512.,
+        image_ref_y=1408.,
+        flip_axes=True)
+    metric = detection_3d_metrics.TopDownVisualizationMetric(
+        top_down_transform,
+        image_height=256,
+        image_width=128,
+        use_matplotlib=False)
+    metric.Update(self._TopDownVisualizationMetricUpdate())
+    summary = metric.Summary('test')
+    self.assertLen(summary.value, 4)
+    for value in summary.value:
+      # The fast path writes the top down image without axes or padding.
+      self.assertEqual(value.image.height, 256)
+      self.assertEqual(value.image.width, 128)
+
   def testCameraVisualization(self):
     metric = detection_3d_metrics.CameraVisualization()
 
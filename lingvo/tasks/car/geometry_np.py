@@ -0,0 +1,351 @@
+# Lint as: python3
+# Copyright 2020 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""NumPy versions of the geometry routines in geometry.py and car_lib.py.
+
+These have the same semantics as their TF counterparts, but run on the host
+without a graph or session, e.g. in offline data processing tools.
+
+3D bboxes are represented by [x, y, z, dx, dy, dz, phi] where x, y and z is the
+center of the box, dx, dy and dz are its dimensions and phi is its rotation
+around the z axis.
+"""
+
+import numpy as np
+
+try:
+  import scipy.spatial  # pylint: disable=g-import-not-at-top
+  HAS_SCIPY_SPATIAL = True
+except ImportError:
+  HAS_SCIPY_SPATIAL = False
+
+# Corners of the unit cube centered at the origin, top ones first.
+_UNIT_CORNERS = np.array([
+    [0.5, 0.5, 0.5],  # top
+    [-0.5, 0.5, 0.5],  # top
+    [-0.5, -0.5, 0.5],  # top
+    [0.5, -0.5, 0.5],  # top
+    [0.5, 0.5, -0.5],  # bottom
+    [-0.5, 0.5, -0.5],  # bottom
+    [-0.5, -0.5, -0.5],  # bottom
+    [0.5, -0.5, -0.5],  # bottom
+])
+
+
+def TransformPoints(points, transforms):
+  """Apply 4x4 transforms to a set of points.
+
+  Args:
+    points: A [..., num_points, 3] array of xyz point locations.
+    transforms: A [..., 4, 4] array with the same leading shape as points.
+
+  Returns:
+    An array with the same shape as points, transformed respectively.
+  """
+  points = np.asarray(points)
+  points = np.concatenate([points, np.ones_like(points[..., :1])], axis=-1)
+  points = np.matmul(points, np.swapaxes(transforms, -1, -2))
+  return points[..., :3] / points[..., 3:]
+
+
+def WrapAngleRad(angles_rad, min_val=-np.pi, max_val=np.pi):
+  """Wrap the value of `angles_rad` to the range [min_val, max_val]."""
+  max_min_diff = max_val - min_val
+  return min_val + np.mod(angles_rad + max_val, max_min_diff)
+
+
+def TransformBBoxes3D(bboxes_3d, transforms):
+  """Apply 4x4 transforms to 7 DOF bboxes (change center and rotation).
+
+  Args:
+    bboxes_3d: A [..., num_boxes, 7] array representing 3D bboxes.
+    transforms: A [..., 4, 4] array with the same leading shape as bboxes_3d.
+      These transforms are expected to only affect translation and rotation.
+
+  Returns:
+    An array with the same shape as bboxes_3d, with transforms applied to each
+    bbox3d.
+  """
+  bboxes_3d = np.asarray(bboxes_3d)
+  transforms = np.asarray(transforms)
+  center_xyz = TransformPoints(bboxes_3d[..., :3], transforms)
+  rot = bboxes_3d[..., 6:] + np.arctan2(transforms[..., 1:2, 0:1],
+                                        transforms[..., 0:1, 0:1])
+  return np.concatenate([center_xyz, bboxes_3d[..., 3:6],
+                         WrapAngleRad(rot)], axis=-1)
+
+
+def PointsToImagePlane(points, velo_to_image_plane):
+  """Converts 3D points to the image plane.
+
+  Args:
+    points: A [N, 3] array containing xyz points in velo coordinates.
+    velo_to_image_plane: A [3, 4] matrix from velo xyz to image plane xy.
+
+  Returns:
+    A [N, 2] array containing points in the image plane.
+  """
+  points = np.asarray(points)
+  points = np.concatenate([points, np.ones_like(points[:, :1])], axis=-1)
+  points_image = np.matmul(points, np.transpose(velo_to_image_plane))
+  return points_image[:, :2] / points_image[:, 2:3]
+
+
+def BBoxCorners(bboxes):
+  """Extract the corner points from a 7-DOF bbox representation.
+
+  Args:
+    bboxes: A [..., 7] array of bboxes.
+
+  Returns:
+    A [..., 8, 3] array containing the corner (x, y, z) points for every
+    bounding box. The first four corners are the top of the box, in
+    counter-clockwise order.
+  """
+  bboxes = np.asarray(bboxes)
+  corners = bboxes[..., np.newaxis, 3:6] * _UNIT_CORNERS
+  cos = np.cos(bboxes[..., np.newaxis, 6])
+  sin = np.sin(bboxes[..., np.newaxis, 6])
+  x = cos * corners[..., 0] - sin * corners[..., 1]
+  y = sin * corners[..., 0] + cos * corners[..., 1]
+  corners = np.stack([x, y, corners[..., 2]], axis=-1)
+  return corners + bboxes[..., np.newaxis, :3]
+
+
+def _IsWithinBBox3D(points_3d, bbox_3d):
+  """Returns a [num_points] mask of the points within a single bbox."""
+  x, y, z, dx, dy, dz, phi = bbox_3d
+  offset_x = points_3d[:, 0] - x
+  offset_y = points_3d[:, 1] - y
+  # Rotates the points into the frame of the box.
+  cos, sin = np.cos(phi), np.sin(phi)
+  box_x = cos * offset_x + sin * offset_y
+  box_y = -sin * offset_x + cos * offset_y
+  return ((np.abs(box_x) <= dx / 2.) & (np.abs(box_y) <= dy / 2.) &
+          (np.abs(points_3d[:, 2] - z) <= dz / 2.))
+
+
+def IsWithinBBox3D(points_3d, bboxes_3d, grid_cell_size=None):
+  """Checks if points are within a 3-d bbox.
+
+  The points are bucketed into a 2-d grid over the xy plane, so each box is
+  only tested against the points of the cells its xy extent overlaps, rather
+  than against all the points.
+
+  Args:
+    points_3d: [num_points, 3] array of [x, y, z] points.
+    bboxes_3d: [num_bboxes, 7] array of 3-d bboxes.
+    grid_cell_size: The size of the grid cells, in the units of the points. If
+      None, uses the median xy extent of the boxes.
+
+  Returns:
+    Boolean array of shape [num_points, num_bboxes] indicating whether the
+    points belong within each box.
+  """
+  points_3d = np.asarray(points_3d)
+  bboxes_3d = np.asarray(bboxes_3d)
+  assert points_3d.ndim == 2 and points_3d.shape[1] == 3, points_3d.shape
+  assert bboxes_3d.ndim == 2 and bboxes_3d.shape[1] == 7, bboxes_3d.shape
+  num_points = points_3d.shape[0]
+  num_bboxes = bboxes_3d.shape[0]
+  result = np.zeros([num_points, num_bboxes], dtype=bool)
+  if not num_points or not num_bboxes:
+    return result
+
+  # Axis aligned xy extent of the boxes.
+  corners_2d = BBoxCorners(bboxes_3d)[:, :4, :2]
+  bboxes_min = np.min(corners_2d, axis=1)
+  bboxes_max = np.max(corners_2d, axis=1)
+  if grid_cell_size is None:
+    grid_cell_size = np.median(np.max(bboxes_max - bboxes_min, axis=-1))
+  # Degenerate boxes put all the points in one cell.
+  grid_cell_size = max(grid_cell_size, 1e-6)
+
+  grid_origin = np.min(points_3d[:, :2], axis=0)
+  cells = np.floor((points_3d[:, :2] - grid_origin) / grid_cell_size).astype(
+      np.int64)
+  grid_shape = np.max(cells, axis=0) + 1
+  cell_ids = cells[:, 0] * grid_shape[1] + cells[:, 1]
+  point_order = np.argsort(cell_ids, kind='stable')
+  sorted_cell_ids = cell_ids[point_order]
+
+  bboxes_min_cell = np.maximum(
+      np.floor((bboxes_min - grid_origin) / grid_cell_size), 0).astype(np.int64)
+  bboxes_max_cell = np.minimum(
+      np.floor((bboxes_max - grid_origin) / grid_cell_size),
+      grid_shape - 1).astype(np.int64)
+
+  for i in range(num_bboxes):
+    (min_x, min_y), (max_x, max_y) = bboxes_min_cell[i], bboxes_max_cell[i]
+    if min_x > max_x or min_y > max_y:
+      continue
+    # The cells of each grid row are contiguous in sorted_cell_ids.
+    rows = np.arange(min_x, max_x + 1) * grid_shape[1]
+    starts = np.searchsorted(sorted_cell_ids, rows + min_y, side='left')
+    ends = np.searchsorted(sorted_cell_ids, rows + max_y, side='right')
+    candidates = np.concatenate(
+        [point_order[start:end] for start, end in zip(starts, ends)])
+    if candidates.size:
+      result[candidates, i] = _IsWithinBBox3D(points_3d[candidates],
+                                              bboxes_3d[i])
+  return result
+
+
+def _SortedKnn(points, query_points, k):
+  """Returns the squared distances and indices of the k nearest points."""
+  if HAS_SCIPY_SPATIAL:
+    distances, indices = scipy.spatial.cKDTree(points).query(query_points, k=k)
+    distances = np.reshape(distances, [-1, k])
+    indices = np.reshape(indices, [-1, k])
+    return np.square(distances), indices
+  dist_mat = np.sum(
+      np.square(query_points[:, np.newaxis, :] - points[np.newaxis, :, :]),
+      axis=-1)
+  indices = np.argpartition(dist_mat, k - 1, axis=-1)[:, :k]
+  distances = np.take_along_axis(dist_mat, indices, axis=-1)
+  order = np.argsort(distances, axis=-1, kind='stable')
+  return (np.take_along_axis(distances, order, axis=-1),
+          np.take_along_axis(indices, order, axis=-1))
+
+
+def KnnIndices(points, query_points, k, valid_num=None, max_distance=None):
+  """k-nearest neighbors of query_points in points.
+
+  Same as car_lib.KnnIndices(). The neighbors are found with a KD-tree if
+  scipy is available, and by brute force otherwise.
+
+  Args:
+    points: array of shape [N, P1, dims].
+    query_points: array of shape [N, P2, dims].
+    k: Integer.
+    valid_num: optional array of shape [N,]. points[i, :valid_num[i], :] are
+      the non-padding points. If there are fewer than k of them, the closest
+      padding points are returned after them.
+    max_distance: float representing the maximum distance that each neighbor can
+      be. Neighbors further away are replaced by the closest point and padded.
+      If this is set to None, then max_distance is not used.
+
+  Returns:
+    A pair of arrays:
+
+    - indices: int32 array of shape [N, P2, k].
+    - padding: float32 array of shape [N, P2 ,k] where 1 represents a padded
+      point, and 0 represents an unpadded (real) point.
+  """
+  points = np.asarray(points)
+  query_points = np.asarray(query_points)
+  n, p1, _ = points.shape
+  assert query_points.shape[0] == n, (points.shape, query_points.shape)
+  assert k <= p1, (k, p1)
+  p2 = query_points.shape[1]
+
+  indices = np.zeros([n, p2, k], dtype=np.int32)
+  paddings = np.zeros([n, p2, k], dtype=np.float32)
+  for i in range(n):
+    num_valid = p1 if valid_num is None else int(valid_num[i])
+    num_real_neighbors = min(k, num_valid)
+    distances = np.zeros([p2, 0])
+    neighbors = np.zeros([p2, 0], dtype=np.int64)
+    if num_real_neighbors:
+      distances, neighbors = _SortedKnn(points[i, :num_valid], query_points[i],
+                                        num_real_neighbors)
+    is_padding = np.zeros([p2, k], dtype=bool)
+    if num_real_neighbors < k:
+      pad_distances, pad_neighbors = _SortedKnn(points[i, num_valid:],
+                                                query_points[i],
+                                                k - num_real_neighbors)
+      distances = np.concatenate([distances, pad_distances], axis=-1)
+      neighbors = np.concatenate([neighbors, pad_neighbors + num_valid],
+                                 axis=-1)
+      is_padding[:, num_real_neighbors:] = True
+    if max_distance is not None:
+      # Padding points are always considered too far away.
+      is_too_far = is_padding | (distances > max_distance**2)
+      neighbors = np.where(is_too_far, neighbors[:, :1], neighbors)
+      is_padding = is_too_far
+    indices[i] = neighbors
+    paddings[i] = is_padding
+  return indices, paddings
+
+
+def FarthestPointSampler(points,
+                         padding,
+                         num_sampled_points,
+                         num_seeded_points=0,
+                         random_seed=None):
+  """Samples num_sampled_points from points using farthest point sampling.
+
+  Same as car_lib.FarthestPointSampler(): starts from a random real point, or
+  from the first num_seeded_points points, and repeatedly adds the point
+  furthest from those already selected. Padded points are only selected once
+  all the real points have been.
+
+  Args:
+    points: floating point array of shape [N, P1, dims].
+    padding: A floating point array of shape [N, P1] with 0 if the point is
+      real, and 1 otherwise.
+    num_sampled_points: integer number of points to sample.
+    num_seeded_points: If num_seeded_points > 0, then the first
+      num_seeded_points in points are considered to be seeded in the FPS
+      sampling. They are assumed to be real points.
+    random_seed: optional integer random seed.
+
+  Returns:
+    A tuple of int32 arrays (sampled_idx, closest_idx).
+
+    sampled_idx is of shape [N, num_sampled_points] representing the indices
+    selected using the sampler.
+
+    closest_idx is of shape [N, P1] representing the index in sampled_idx of
+    the closest sampled point of each input point.
+  """
+  rng = np.random.RandomState(random_seed)
+  points = np.asarray(points, dtype=np.float32)
+  padding = np.asarray(padding)
+  batch_size, num_points, dims = points.shape
+  assert num_points >= num_sampled_points, (num_points, num_sampled_points)
+
+  # Add a tiny bit of noise so all points are unique, as in car_lib.
+  points = points + rng.uniform(
+      1e-6, 1e-5, size=(batch_size, num_points, dims)).astype(np.float32)
+  is_real = np.equal(padding, 0.)
+  num_valid_points = np.sum(is_real, axis=1)
+  batch_range = np.arange(batch_size)
+
+  sampled_idx = np.zeros([batch_size, num_sampled_points], dtype=np.int32)
+  closest_idx = np.zeros([batch_size, num_points], dtype=np.int32)
+  distance_to_selected = np.full([batch_size, num_points], np.inf, np.float32)
+  for curr_idx in range(num_sampled_points):
+    if curr_idx < num_seeded_points:
+      new_selected = np.full([batch_size], curr_idx)
+    elif curr_idx == 0:
+      # A random real point.
+      random_values = np.where(is_real, rng.uniform(size=is_real.shape),
+                               padding * 10)
+      new_selected = np.argmin(random_values, axis=1)
+    else:
+      # Ignores padded points while there are real points left.
+      masked_distance = np.where(
+          is_real | (curr_idx >= num_valid_points)[:, np.newaxis],
+          distance_to_selected, -1.)
+      new_selected = np.argmax(masked_distance, axis=1)
+    sampled_idx[:, curr_idx] = new_selected
+
+    new_points = points[batch_range, new_selected]
+    new_distance = np.sum(
+        np.square(points - new_points[:, np.newaxis, :]), axis=-1)
+    closest_idx[new_distance < distance_to_selected] = curr_idx
+    distance_to_selected = np.minimum(distance_to_selected, new_distance)
+  return sampled_idx, closest_idx
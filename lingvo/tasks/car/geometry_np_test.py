@@ -0,0 +1,187 @@
+# Lint as: python3
+# Copyright 2020 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for geometry_np, against the TF versions."""
+
+import time
+
+from absl.testing import parameterized
+import lingvo.compat as tf
+from lingvo.core import test_utils
+from lingvo.tasks.car import car_lib
+from lingvo.tasks.car import geometry
+from lingvo.tasks.car import geometry_np
+import mock
+import numpy as np
+
+
+def _RandomBBoxes(num_bboxes, extent=20.):
+  """Returns [num_bboxes, 7] random bboxes within [-extent, extent]."""
+  return np.concatenate([
+      np.random.uniform(-extent, extent, size=(num_bboxes, 3)),
+      np.random.uniform(0.5, 5., size=(num_bboxes, 3)),
+      np.random.uniform(-np.pi, np.pi, size=(num_bboxes, 1)),
+  ], axis=-1).astype(np.float32)
+
+
+def _RandomTransform():
+  """Returns a random 4x4 rotation around z and translation."""
+  phi = np.random.uniform(-np.pi, np.pi)
+  transform = np.eye(4, dtype=np.float32)
+  transform[:2, :2] = [[np.cos(phi), -np.sin(phi)], [np.sin(phi), np.cos(phi)]]
+  transform[:3, 3] = np.random.uniform(-10., 10., size=3)
+  return transform
+
+
+class GeometryNpTest(test_utils.TestCase, parameterized.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    np.random.seed(12345)
+
+  def testBBoxCorners(self):
+    bboxes = np.reshape(_RandomBBoxes(6), [2, 3, 7])
+    with self.session():
+      expected = self.evaluate(geometry.BBoxCorners(tf.constant(bboxes)))
+    self.assertAllClose(expected, geometry_np.BBoxCorners(bboxes), atol=1e-5)
+
+  def testTransformBBoxes3D(self):
+    bboxes = _RandomBBoxes(10)
+    transform = _RandomTransform()
+    with self.session():
+      expected = self.evaluate(
+          geometry.TransformBBoxes3D(
+              tf.constant(bboxes), tf.constant(transform)))
+    self.assertAllClose(
+        expected, geometry_np.TransformBBoxes3D(bboxes, transform), atol=1e-4)
+
+  def testPointsToImagePlane(self):
+    velo_to_image_plane = np.array(
+        [[6.09695409e+02, -7.21421597e+02, -1.25125855e+00, -1.23041806e+02],
+         [1.80384202e+02, 7.64479802e+00, -7.19651474e+02, -1.01016688e+02],
+         [9.99945389e-01, 1.24365378e-04, 1.04513030e-02, -2.69386912e-01]],
+        dtype=np.float32)
+    points = np.random.uniform(5., 50., size=(20, 3)).astype(np.float32)
+    with self.session():
+      expected = self.evaluate(
+          geometry.PointsToImagePlane(
+              tf.constant(points), tf.constant(velo_to_image_plane)))
+    self.assertAllClose(
+        expected,
+        geometry_np.PointsToImagePlane(points, velo_to_image_plane),
+        rtol=1e-4)
+
+  @parameterized.named_parameters(
+      ('DefaultGrid', None),
+      ('FineGrid', 0.5),
+      ('CoarseGrid', 100.),
+  )
+  def testIsWithinBBox3D(self, grid_cell_size):
+    points = np.random.uniform(-20., 20., size=(2000, 3)).astype(np.float32)
+    bboxes = _RandomBBoxes(30)
+    with self.session():
+      expected = self.evaluate(
+          geometry.IsWithinBBox3D(tf.constant(points), tf.constant(bboxes)))
+    actual = geometry_np.IsWithinBBox3D(points, bboxes, grid_cell_size)
+    self.assertGreater(np.sum(expected), 0)
+    self.assertAllEqual(expected, actual)
+
+  def testIsWithinBBox3DEmpty(self):
+    self.assertEqual((0, 3),
+                     geometry_np.IsWithinBBox3D(
+                         np.zeros([0, 3]), _RandomBBoxes(3)).shape)
+    self.assertEqual((5, 0),
+                     geometry_np.IsWithinBBox3D(
+                         np.ones([5, 3]), np.zeros([0, 7])).shape)
+
+  @parameterized.named_parameters(
+      ('BruteForce', False, None),
+      ('BruteForceMaxDistance', False, 0.3),
+      ('KdTree', True, None),
+      ('KdTreeMaxDistance', True, 0.3),
+  )
+  def testKnnIndices(self, use_kd_tree, max_distance):
+    if use_kd_tree and not geometry_np.HAS_SCIPY_SPATIAL:
+      self.skipTest('scipy.spatial is not available.')
+    points = np.random.uniform(size=(3, 50, 3)).astype(np.float32)
+    query_points = np.random.uniform(size=(3, 20, 3)).astype(np.float32)
+    # The second example has fewer valid points than neighbors.
+    valid_num = np.array([50, 4, 30], dtype=np.int32)
+    k = 6
+    with self.session():
+      expected = self.evaluate(
+          car_lib.KnnIndices(
+              tf.constant(points), tf.constant(query_points), k,
+              tf.constant(valid_num), max_distance))
+    with mock.patch.object(geometry_np, 'HAS_SCIPY_SPATIAL', use_kd_tree):
+      actual = geometry_np.KnnIndices(points, query_points, k, valid_num,
+                                      max_distance)
+    self.assertAllEqual(expected[0], actual[0])
+    self.assertAllEqual(expected[1], actual[1])
+    self.assertAllEqual(np.ones([20, 2]), actual[1][1, :, 4:])
+
+  def testFarthestPointSampler(self):
+    points = np.random.uniform(size=(2, 40, 3)).astype(np.float32)
+    padding = np.zeros([2, 40], dtype=np.float32)
+    padding[1, 30:] = 1.
+    # With a seeded point, the sampling does not depend on the random seed.
+    with self.session():
+      expected = self.evaluate(
+          car_lib.FarthestPointSampler(
+              tf.constant(points),
+              tf.constant(padding),
+              num_sampled_points=35,
+              num_seeded_points=1))
+    actual = geometry_np.FarthestPointSampler(
+        points, padding, num_sampled_points=35, num_seeded_points=1)
+    self.assertAllEqual(expected[0], actual[0])
+    self.assertAllEqual(expected[1], actual[1])
+    # The real points are sampled first.
+    self.assertTrue(np.all(actual[0][1, :30] < 30))
+
+  def testFarthestPointSamplerRandomFirstPoint(self):
+    points = np.random.uniform(size=(4, 20, 3)).astype(np.float32)
+    padding = np.zeros([4, 20], dtype=np.float32)
+    padding[:, 10:] = 1.
+    sampled_idx, closest_idx = geometry_np.FarthestPointSampler(
+        points, padding, num_sampled_points=8, random_seed=1)
+    self.assertTrue(np.all(sampled_idx < 10))
+    for i in range(4):
+      self.assertLen(set(sampled_idx[i]), 8)
+      # Sampled points are closest to themselves.
+      self.assertAllEqual(np.arange(8), closest_idx[i, sampled_idx[i]])
+
+
+class IsWithinBBox3DBenchmark(tf.test.Benchmark):
+  """Benchmarks the grid index against testing all the points in each box.
+
+  Run with::
+
+    bazel run -c opt lingvo/tasks/car:geometry_np_test -- --benchmarks=.
+  """
+
+  def benchmarkIsWithinBBox3D(self):
+    np.random.seed(12345)
+    # About the size of a KITTI pointcloud and its labels.
+    points = np.random.uniform(-40., 40., size=(120000, 3)).astype(np.float32)
+    bboxes = _RandomBBoxes(50, extent=40.)
+    for name, grid_cell_size in (('grid', None), ('single_cell', 1e6)):
+      start = time.time()
+      geometry_np.IsWithinBBox3D(points, bboxes, grid_cell_size)
+      self.report_benchmark(name=name, iters=1, wall_time=time.time() - start)
+
+
+if __name__ == '__main__':
+  tf.test.main()
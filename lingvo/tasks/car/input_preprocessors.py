@@ -27,6 +27,11 @@ import numpy as np
 from tensorflow.python.ops import inplace_ops
 # pylint:enable=g-direct-tensorflow-import
 
+# Multiplier of the (label, difficulty) group id in the sort keys of a compact
+# groundtruth database, as written by tools/create_compact_groundtruth_db.py.
+# The number of points of an object is below it.
+COMPACT_DB_GROUP_KEY_MULTIPLIER = 2**32
+
 
 def _ConsistentShuffle(tensors, seed):
   """Shuffle multiple tensors with the same shuffle order."""
@@ -1182,6 +1187,12 @@ class SparseCellGatherFeatures(Preprocessor):
         'Whether to sample the neighbor points for every cell center '
         'uniformly at random. If False, this will default to selecting by '
         'distance.')
+    p.Define(
+        'max_points_per_voxel', None,
+        'If set, the points of each cell are searched in a voxel hash of the '
+        'points with this many points per voxel, instead of by comparing all '
+        'the points to all the cell centers. See '
+        'car_lib.NeighborhoodIndices().')
     return p
 
   def TransformFeatures(self, features):
@@ -1208,7 +1219,8 @@ class SparseCellGatherFeatures(Preprocessor):
         p.num_points_per_cell,
         points_padding=None,
         max_distance=p.max_distance,
-        sample_neighbors_uniformly=p.sample_neighbors_uniformly)
+        sample_neighbors_uniformly=p.sample_neighbors_uniformly,
+        max_points_per_voxel=p.max_points_per_voxel)
 
     # Take first example since NeighboorhoodIndices expects batch dimension.
     sample_indices = sample_indices[0, :, :]
@@ -2654,11 +2666,21 @@ class GroundTruthAugmentor(Preprocessor):
         'groundtruth_database', None,
         'If not None, loads groundtruths from this database and adds '
         'them to the current scene. Groundtruth database is expected '
-        'to be a TFRecord of KITTI crops.')
+        'to be a TFRecord of KITTI crops, or a compact database if '
+        'database_format is compact.')
+    p.Define(
+        'database_format', 'crops',
+        'Format of groundtruth_database. "crops": the TFRecord of KITTI '
+        'crops written by create_kitti_crop_dataset, with one example per '
+        'object which is padded to max_num_points_per_bbox in memory. '
+        '"compact": the database written by create_compact_groundtruth_db, '
+        'with concatenated points and a per class and difficulty index, from '
+        'which objects are sampled without scanning the whole database.')
     p.Define(
         'num_db_objects', None,
         'Number of objects in the database. Because we use TFRecord '
-        'we cannot easily query the number of objects efficiencly.')
+        'we cannot easily query the number of objects efficiencly. Unused '
+        'for compact databases.')
     p.Define('max_num_points_per_bbox', 2048,
              'Maximum number of points in each bbox to augment with.')
     p.Define(
@@ -2750,6 +2772,176 @@ class GroundTruthAugmentor(Preprocessor):
         labels=db_labels,
         difficulties=db_difficulties)
 
+  def _ReadCompactDB(self, file_patterns):
+    """Read a compact groundtruth database as a NestedMap of Tensors."""
+
+    def Process(record):
+      """Process a record of consecutive objects of the compact database."""
+
+      def _List(dtype):
+        return tf.io.FixedLenSequenceFeature((),
+                                             dtype,
+                                             allow_missing=True,
+                                             default_value=0)
+
+      feature_map = {
+          'points': _List(tf.float32),
+          'points_feature': _List(tf.float32),
+          'num_points': _List(tf.int64),
+          'bboxes_3d': _List(tf.float32),
+          'labels': _List(tf.int64),
+          'difficulties': _List(tf.int64),
+          'sort_keys': _List(tf.int64),
+          'num_difficulties': tf.io.FixedLenFeature((), tf.int64, 0),
+          'num_groups': tf.io.FixedLenFeature((), tf.int64, 0),
+      }
+      db = tf.io.parse_single_example(record, feature_map)
+      num_record_points = tf.shape(db['points'])[0] // 3
+      return (tf.reshape(db['points'], [num_record_points, 3]),
+              tf.reshape(db['points_feature'], [num_record_points, -1]),
+              db['num_points'], tf.reshape(db['bboxes_3d'], [-1, 7]),
+              tf.cast(db['labels'], tf.int32),
+              tf.cast(db['difficulties'], tf.int32), db['sort_keys'],
+              num_record_points, tf.size(db['labels']), db['num_difficulties'],
+              db['num_groups'])
+
+    def Concat(points_xyz, points_feature, num_points, bboxes_3d, labels,
+               difficulties, sort_keys, num_record_points, num_record_objects,
+               num_difficulties, num_groups):
+      """Concatenates the padded records of the database."""
+      point_mask = tf.sequence_mask(num_record_points,
+                                    tf.shape(points_xyz)[1])
+      object_mask = tf.sequence_mask(num_record_objects, tf.shape(labels)[1])
+      num_points = tf.boolean_mask(num_points, object_mask)
+      offsets = tf.concat([tf.zeros([1], tf.int64), tf.cumsum(num_points)],
+                          axis=0)
+      return (tf.boolean_mask(points_xyz, point_mask),
+              tf.boolean_mask(points_feature, point_mask), offsets,
+              tf.boolean_mask(bboxes_3d, object_mask),
+              tf.boolean_mask(labels, object_mask),
+              tf.boolean_mask(difficulties, object_mask),
+              tf.boolean_mask(sort_keys, object_mask), num_difficulties[0],
+              num_groups[0])
+
+    # The database is split into records of consecutive objects, sorted by
+    # their sort keys, which we concatenate back in order and cache in memory.
+    # The writer balances the sizes of the records, so padding them to the
+    # largest one is cheap.
+    dataset = tf.data.Dataset.list_files(file_patterns, shuffle=False)
+    dataset = dataset.flat_map(tf.data.TFRecordDataset).map(Process)
+    dataset = dataset.padded_batch(
+        2**31 - 1,
+        padded_shapes=([None, 3], [None, None], [None], [None, 7], [None],
+                       [None], [None], [], [], [], []))
+    dataset = dataset.map(Concat).cache().repeat()
+    iterator = dataset.make_one_shot_iterator()
+    (points_xyz, points_feature, offsets, bboxes_3d, labels, difficulties,
+     sort_keys, num_difficulties, num_groups) = iterator.get_next()
+    return py_utils.NestedMap(
+        points_xyz=points_xyz,
+        points_feature=points_feature,
+        offsets=offsets,
+        bboxes_3d=bboxes_3d,
+        labels=labels,
+        difficulties=difficulties,
+        sort_keys=sort_keys,
+        num_difficulties=num_difficulties,
+        num_groups=num_groups)
+
+  def _SampleCompactDB(self, db, num_samples):
+    """Samples objects from a compact database.
+
+    Objects are sampled with replacement, with a probability proportional to
+    the probability that they pass the filters of _CreateExampleFilter. The
+    objects of a (label, difficulty) group which pass the num points filter
+    form a contiguous range of the database, so we only need to binary search
+    the group ranges, sample groups and then sample uniformly within each
+    group's range. Duplicates are removed by the overlap filter later.
+
+    Args:
+      db: NestedMap as returned by _ReadCompactDB.
+      num_samples: Number of objects to sample.
+
+    Returns:
+      A [num_samples] int64 Tensor of object ids, or an empty Tensor if no
+      object passes the filters.
+    """
+    p = self.params
+    group_multiplier = COMPACT_DB_GROUP_KEY_MULTIPLIER
+    group_ids = tf.range(db.num_groups, dtype=tf.int64)
+    group_labels = tf.cast(group_ids // db.num_difficulties, tf.int32)
+    group_difficulties = tf.cast(group_ids % db.num_difficulties, tf.int32)
+
+    # Range of each group's objects which pass the num points filter.
+    max_points = (
+        p.filter_max_points
+        if p.filter_max_points else group_multiplier - 1)
+    begin = tf.searchsorted(
+        db.sort_keys,
+        group_ids * group_multiplier + p.filter_min_points,
+        side='left',
+        out_type=tf.int64)
+    end = tf.searchsorted(
+        db.sort_keys,
+        group_ids * group_multiplier + max_points,
+        side='right',
+        out_type=tf.int64)
+    counts = end - begin
+
+    def _ProbabilityOf(values, probabilities):
+      probabilities = tf.constant(probabilities, dtype=tf.float32)
+      num_probabilities = tf.size(probabilities)
+      in_range = tf.math.logical_and(values >= 0, values < num_probabilities)
+      return tf.where(
+          in_range,
+          tf.gather(probabilities,
+                    tf.clip_by_value(values, 0, num_probabilities - 1)),
+          tf.zeros_like(values, dtype=tf.float32))
+
+    group_weights = tf.cast(counts, tf.float32)
+    if p.difficulty_sampling_probability is not None:
+      group_weights *= _ProbabilityOf(group_difficulties,
+                                      p.difficulty_sampling_probability)
+    else:
+      group_weights *= tf.cast(group_difficulties >= p.filter_min_difficulty,
+                               tf.float32)
+    if p.class_sampling_probability is not None:
+      group_weights *= _ProbabilityOf(group_labels,
+                                      p.class_sampling_probability)
+    elif p.label_filter:
+      group_weights *= tf.cast(
+          tf.reduce_any(
+              tf.equal(group_labels[..., tf.newaxis],
+                       tf.constant(p.label_filter)),
+              axis=1), tf.float32)
+
+    num_samples = tf.where(
+        tf.reduce_sum(group_weights) > 0, num_samples, tf.zeros_like(
+            num_samples))
+    sampled_groups = tf.random.categorical(
+        tf.math.log(group_weights)[tf.newaxis],
+        num_samples,
+        seed=p.random_seed)[0]
+    sampled_begin = tf.gather(begin, sampled_groups)
+    sampled_counts = tf.gather(counts, sampled_groups)
+    offsets_in_group = tf.cast(
+        tf.random.uniform([num_samples], seed=p.random_seed) *
+        tf.cast(sampled_counts, tf.float32), tf.int64)
+    return sampled_begin + tf.minimum(offsets_in_group, sampled_counts - 1)
+
+  def _GatherCompactDBObjects(self, db, object_ids):
+    """Gathers the points, bboxes and labels of objects of a compact db."""
+    p = self.params
+    begin = tf.gather(db.offsets, object_ids)
+    num_points = tf.minimum(
+        tf.gather(db.offsets, object_ids + 1) - begin,
+        p.max_num_points_per_bbox)
+    point_ids = tf.ragged.range(begin, begin + num_points).flat_values
+    return (tf.gather(db.points_xyz, point_ids),
+            tf.gather(db.points_feature, point_ids),
+            tf.gather(db.bboxes_3d, object_ids),
+            tf.gather(db.labels, object_ids))
+
   def _CreateExampleFilter(self, db):
     """Construct db example filter.
 
@@ -2865,7 +3057,11 @@ class GroundTruthAugmentor(Preprocessor):
 
     tf.logging.info('Loading groundtruth database at %s' %
                     (p.groundtruth_database))
-    db = p.groundtruth_database.Instantiate().BuildDataSource(self._ReadDB).data
+    assert p.database_format in ('crops', 'compact'), p.database_format
+    read_db_fn = (
+        self._ReadCompactDB
+        if p.database_format == 'compact' else self._ReadDB)
+    db = p.groundtruth_database.Instantiate().BuildDataSource(read_db_fn).data
 
     original_features_shape = tf.shape(features.lasers.points_feature)
 
@@ -2876,21 +3072,26 @@ class GroundTruthAugmentor(Preprocessor):
     num_augmented_bboxes = tf.minimum(max_bboxes - num_bboxes_in_scene,
                                       p.max_augmented_bboxes)
 
-    # Compute an object index over all objects in the database.
-    num_objects_in_database = tf.shape(db.points_xyz)[0]
-    db_idx = tf.range(num_objects_in_database)
-
-    # Find those indices whose examples pass the filters, and select only those
-    # indices.
-    example_filter = self._CreateExampleFilter(db)
-    db_idx = tf.boolean_mask(db_idx, example_filter)
-
-    # At this point, we might still have a large number of object candidates,
-    # from which we only need a sample.
-    # To reduce the amount of computation, we randomly subsample to slightly
-    # more than we want to augment.
-    db_idx = tf.random.shuffle(
-        db_idx, seed=p.random_seed)[0:num_augmented_bboxes * 2]
+    if p.database_format == 'compact':
+      # Sample slightly more candidates than we want to augment, directly
+      # from the objects which pass the filters.
+      db_idx = self._SampleCompactDB(db, num_augmented_bboxes * 2)
+    else:
+      # Compute an object index over all objects in the database.
+      num_objects_in_database = tf.shape(db.points_xyz)[0]
+      db_idx = tf.range(num_objects_in_database)
+
+      # Find those indices whose examples pass the filters, and select only
+      # those indices.
+      example_filter = self._CreateExampleFilter(db)
+      db_idx = tf.boolean_mask(db_idx, example_filter)
+
+      # At this point, we might still have a large number of object
+      # candidates, from which we only need a sample.
+      # To reduce the amount of computation, we randomly subsample to slightly
+      # more than we want to augment.
+      db_idx = tf.random.shuffle(
+          db_idx, seed=p.random_seed)[0:num_augmented_bboxes * 2]
 
     # After filtering, further filter out the db boxes that would occlude with
     # other boxes (including other database boxes).
@@ -2906,19 +3107,23 @@ class GroundTruthAugmentor(Preprocessor):
     shuffled_idx = db_idx[0:num_augmented_bboxes]
     num_augmented_bboxes = tf.shape(shuffled_idx)[0]
 
-    # Gather based off the indices.
-    sampled_points_xyz = tf.gather(db.points_xyz, shuffled_idx)
-    sampled_points_feature = tf.gather(db.points_feature, shuffled_idx)
-    sampled_mask = tf.reshape(
-        tf.gather(db.points_mask, shuffled_idx),
-        [num_augmented_bboxes, p.max_num_points_per_bbox])
-    sampled_bboxes = tf.gather(db.bboxes_3d, shuffled_idx)
-    sampled_labels = tf.gather(db.labels, shuffled_idx)
-
-    # Mask points/features.
-    sampled_points_xyz = tf.boolean_mask(sampled_points_xyz, sampled_mask)
-    sampled_points_feature = tf.boolean_mask(sampled_points_feature,
-                                             sampled_mask)
+    if p.database_format == 'compact':
+      (sampled_points_xyz, sampled_points_feature, sampled_bboxes,
+       sampled_labels) = self._GatherCompactDBObjects(db, shuffled_idx)
+    else:
+      # Gather based off the indices.
+      sampled_points_xyz = tf.gather(db.points_xyz, shuffled_idx)
+      sampled_points_feature = tf.gather(db.points_feature, shuffled_idx)
+      sampled_mask = tf.reshape(
+          tf.gather(db.points_mask, shuffled_idx),
+          [num_augmented_bboxes, p.max_num_points_per_bbox])
+      sampled_bboxes = tf.gather(db.bboxes_3d, shuffled_idx)
+      sampled_labels = tf.gather(db.labels, shuffled_idx)
+
+      # Mask points/features.
+      sampled_points_xyz = tf.boolean_mask(sampled_points_xyz, sampled_mask)
+      sampled_points_feature = tf.boolean_mask(sampled_points_feature,
+                                               sampled_mask)
 
     # Flatten before concatenation with ground truths.
     sampled_points_xyz = tf.reshape(sampled_points_xyz, [-1, 3])
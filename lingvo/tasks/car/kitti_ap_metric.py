@@ -15,6 +15,8 @@
 # ==============================================================================
 """Average Precision metric class for KITTI."""
 
+import concurrent.futures
+
 from lingvo import compat as tf
 from lingvo.core import py_utils
 from lingvo.tasks.car import ap_metric
@@ -22,9 +24,340 @@ from lingvo.tasks.car import ops
 import numpy as np
 
 
+# Ignore types of groundtruth and predicted boxes, see image_metrics.h.
+_DONT_IGNORE = 0
+_IGNORE_ONE_MATCH = 1
+_IGNORE_ALL_MATCHES = 2
+
+
+class PairwiseIoUCache:
+  """A per-frame cache of the sparse pairwise IoU of groundtruth and predictions.
+
+  Entries are keyed by image id and by the class ids of the groundtruth and the
+  predicted boxes, and only keep the pairs of boxes that overlap. Boxes are
+  referred to by their row in the per-class Boxes3D buffers of APMetrics, which
+  only ever grow, so entries stay valid until their image is updated again.
+  """
+
+  def __init__(self, num_threads=8):
+    self._num_threads = num_threads
+    # imgid -> {(gt_classid, pd_classid): (gt_rows, pd_rows, ious)}
+    self._entries = {}
+    self._sess = None
+
+  def _MaybeCreateSession(self):
+    if self._sess is not None:
+      return
+    graph = tf.Graph()
+    with graph.as_default():
+      self._boxes_a = tf.placeholder(tf.float32, [None, 7])
+      self._boxes_b = tf.placeholder(tf.float32, [None, 7])
+      self._iou = ops.pairwise_iou3d(self._boxes_a, self._boxes_b)
+    self._sess = tf.Session(graph=graph)
+
+  def Invalidate(self, imgid):
+    """Drops all cached IoUs of image imgid."""
+    self._entries.pop(imgid, None)
+
+  def Lookup(self, gt_boxes, gt_classid, pd_boxes, pd_classid):
+    """Returns the overlapping groundtruth and predicted boxes.
+
+    The IoUs of the images not in the cache yet are computed on a thread pool.
+
+    Args:
+      gt_boxes: Boxes3D of all groundtruth boxes of class gt_classid, or None.
+      gt_classid: int32 class id of gt_boxes.
+      pd_boxes: Boxes3D of all predicted boxes of class pd_classid, or None.
+      pd_classid: int32 class id of pd_boxes.
+
+    Returns:
+      A tuple (gt_rows, pd_rows, ious) of np.arrays of shape [K]. gt_rows and
+      pd_rows are rows in gt_boxes and pd_boxes of the same image whose IoU,
+      ious, is greater than 0.
+    """
+    key = (gt_classid, pd_classid)
+    empty = (np.zeros([0], np.int64), np.zeros([0], np.int64),
+             np.zeros([0], np.float32))
+    if gt_boxes is None or pd_boxes is None:
+      return empty
+    gt_rows_by_image = _RowsByImage(gt_boxes.imgids)
+    pd_rows_by_image = _RowsByImage(pd_boxes.imgids)
+    imgids = [i for i in gt_rows_by_image if i in pd_rows_by_image]
+    missing = [i for i in imgids if key not in self._entries.get(i, {})]
+
+    if missing:
+      self._MaybeCreateSession()
+      gt_all_boxes = gt_boxes.boxes
+      pd_all_boxes = pd_boxes.boxes
+
+      def _Compute(imgid):
+        gt_rows = gt_rows_by_image[imgid]
+        pd_rows = pd_rows_by_image[imgid]
+        iou = self._sess.run(
+            self._iou,
+            feed_dict={
+                self._boxes_a: gt_all_boxes[gt_rows],
+                self._boxes_b: pd_all_boxes[pd_rows]
+            })
+        i, j = np.nonzero(iou > 0)
+        return gt_rows[i], pd_rows[j], iou[i, j]
+
+      tf.logging.info('Computing pairwise IoUs of %d images.', len(missing))
+      with concurrent.futures.ThreadPoolExecutor(self._num_threads) as pool:
+        for imgid, entry in zip(missing, pool.map(_Compute, missing)):
+          self._entries.setdefault(imgid, {})[key] = entry
+
+    if not imgids:
+      return empty
+    entries = [self._entries[i][key] for i in imgids]
+    return tuple(np.concatenate(arrays) for arrays in zip(*entries))
+
+
+def _RowsByImage(imgids):
+  """Returns a dict mapping every image id to its rows in imgids."""
+  order = np.argsort(imgids, kind='stable')
+  unique_imgids, starts = np.unique(imgids[order], return_index=True)
+  return dict(zip(unique_imgids.tolist(), np.split(order, starts[1:])))
+
+
+def _GroundtruthRanks(bin_ids, imgids):
+  """Returns the position of every groundtruth among those of its bin and image.
+
+  Args:
+    bin_ids: np.array of shape [N] of the bin of every groundtruth box.
+    imgids: np.array of shape [N] of the image of every groundtruth box.
+
+  Returns:
+    An np.int64 array of shape [N]. Boxes keep their relative order within
+    their bin and image.
+  """
+  n = bin_ids.shape[0]
+  order = np.lexsort((np.arange(n), imgids, bin_ids))
+  starts = np.ones([n], dtype=bool)
+  starts[1:] = ((bin_ids[order][1:] != bin_ids[order][:-1]) |
+                (imgids[order][1:] != imgids[order][:-1]))
+  first = np.maximum.accumulate(np.where(starts, np.arange(n), 0))
+  ranks = np.empty([n], dtype=np.int64)
+  ranks[order] = np.arange(n) - first
+  return ranks
+
+
+def _MatchKITTI(edge_gt, edge_pd, edge_rank, pd_eligible):
+  """Greedily matches groundtruth and predictions like KITTI::MatchOneScene.
+
+  MatchOneScene visits the groundtruth of an image in order and gives each the
+  best prediction not matched yet. Images, and the bins stacked by
+  _KITTIAveragePrecisionForBins, never share predictions, so step k matches
+  the k-th groundtruth of all of them at once.
+
+  Args:
+    edge_gt: np.array of shape [K] of the groundtruth of the matchable pairs.
+    edge_pd: np.array of shape [K] of the prediction of those pairs.
+    edge_rank: np.array of shape [K] of the rank of edge_gt in its image. Pairs
+      are sorted by rank, then groundtruth, then best prediction first.
+    pd_eligible: np.bool array of shape [M] of the predictions that can match.
+
+  Returns:
+    An np.int64 array of shape [M], the groundtruth matched to every prediction
+    or -1.
+  """
+  pd_match = np.full(pd_eligible.shape, -1, dtype=np.int64)
+  num_ranks = edge_rank[-1] + 1 if edge_rank.shape[0] else 0
+  bounds = np.searchsorted(edge_rank, np.arange(num_ranks + 1))
+  for lo, hi in zip(bounds[:-1], bounds[1:]):
+    gt = edge_gt[lo:hi]
+    pd = edge_pd[lo:hi]
+    free = (pd_match[pd] < 0) & pd_eligible[pd]
+    gt = gt[free]
+    pd = pd[free]
+    # The first free pair of every groundtruth is its best match.
+    _, first = np.unique(gt, return_index=True)
+    pd_match[pd[first]] = gt[first]
+  return pd_match
+
+
+def _FindThresholds(matched_scores, total_gt, num_recall_points):
+  """Returns the score thresholds of the recall levels like FindThresholds."""
+  thresholds = []
+  if not total_gt:
+    return thresholds
+  matched_scores = np.sort(matched_scores)[::-1]
+  total_gt = np.float32(total_gt)
+  num_intervals = np.float32(num_recall_points - 1)
+  for i in range(1, matched_scores.shape[0] + 1):
+    left_recall = np.float32(i) / total_gt
+    right_recall = np.float32(i + 1) / total_gt
+    target_recall = np.float32(len(thresholds)) / num_intervals
+    if (right_recall - target_recall >= target_recall - left_recall or
+        i == matched_scores.shape[0]):
+      thresholds.append(matched_scores[i - 1])
+  return thresholds
+
+
+def _KITTIAveragePrecisionForBins(gt_imgid, pd_score, gt_indices, pd_indices,
+                                  ious, bins, iou_threshold,
+                                  num_recall_points):
+  """Computes the outputs of ops.average_precision3d for many bins at once.
+
+  This follows AveragePrecision::FromBoxesKITTI in image_metrics.h, including
+  its float32 arithmetic and tie-breaking, so that every bin reports the same
+  numbers as the op run on the boxes of that bin alone.
+
+  The bins are subsets of one set of boxes. Their overlapping pairs are taken
+  from the pairs of the whole set, and stacked into one matching problem in
+  which every bin has its own copy of its boxes. The pairs are sorted once per
+  matching pass, and the results are bucketed per bin with np.bincount.
+
+  Args:
+    gt_imgid: np.array of shape [N] of the images of all groundtruth boxes.
+    pd_score: np.array of shape [M] of the scores of all predictions.
+    gt_indices: np.array of shape [K] of groundtruth indices of overlapping
+      pairs of boxes. Both boxes of a pair belong to the same image.
+    pd_indices: np.array of shape [K] of prediction indices of those pairs.
+    ious: np.array of shape [K] of the IoUs of those pairs.
+    bins: A list of NestedMaps, one per bin, with the indices of the bin's
+      groundtruth, gt, and predictions, pd, in the order the op would see them,
+      and their ignore types, gt_ignore and pd_ignore.
+    iou_threshold: Boxes match if their IoU is greater than this.
+    num_recall_points: Number of points of the precision-recall curve.
+
+  Returns:
+    A list with one tuple (ap, pr, score_and_hit) per bin, like
+    ops.average_precision3d.
+  """
+  num_bins = len(bins)
+  if not num_bins:
+    return []
+  pd_score = np.asarray(pd_score, dtype=np.float32)
+  ious = np.asarray(ious, dtype=np.float32)
+  keep = ious > np.float32(iou_threshold)
+  gt_indices = gt_indices[keep]
+  pd_indices = pd_indices[keep]
+  ious = ious[keep]
+
+  # Stack the boxes of all bins.
+  gt_offsets = np.cumsum([0] + [b.gt.shape[0] for b in bins])
+  pd_offsets = np.cumsum([0] + [b.pd.shape[0] for b in bins])
+  gt_bin = np.repeat(np.arange(num_bins), np.diff(gt_offsets))
+  pd_bin = np.repeat(np.arange(num_bins), np.diff(pd_offsets))
+  gt_ignore = np.concatenate([b.gt_ignore for b in bins]).astype(np.int32)
+  pd_ignore = np.concatenate([b.pd_ignore for b in bins]).astype(np.int32)
+  score = pd_score[np.concatenate([b.pd for b in bins]).astype(np.int64)]
+  gt_rank = _GroundtruthRanks(
+      gt_bin, gt_imgid[np.concatenate([b.gt for b in bins]).astype(np.int64)])
+
+  # Bucket the overlapping pairs into the bins that hold both of their boxes.
+  edge_gt, edge_pd, edge_iou = [], [], []
+  for b, gt_offset, pd_offset in zip(bins, gt_offsets, pd_offsets):
+    gt_index = np.full([gt_imgid.shape[0]], -1)
+    gt_index[b.gt] = gt_offset + np.arange(b.gt.shape[0])
+    pd_index = np.full([pd_score.shape[0]], -1)
+    pd_index[b.pd] = pd_offset + np.arange(b.pd.shape[0])
+    in_bin = (gt_index[gt_indices] >= 0) & (pd_index[pd_indices] >= 0)
+    edge_gt.append(gt_index[gt_indices[in_bin]])
+    edge_pd.append(pd_index[pd_indices[in_bin]])
+    edge_iou.append(ious[in_bin])
+  edge_gt = np.concatenate(edge_gt)
+  edge_pd = np.concatenate(edge_pd)
+  edge_iou = np.concatenate(edge_iou)
+  # Groundtruth ignoring all matches is never matched.
+  keep = gt_ignore[edge_gt] != _IGNORE_ALL_MATCHES
+  edge_gt = edge_gt[keep]
+  edge_pd = edge_pd[keep]
+  edge_iou = edge_iou[keep]
+  edge_rank = gt_rank[edge_gt]
+
+  # Pass 1 matching: find overlapping detection of best score. Ties go to the
+  # first prediction.
+  order = np.lexsort((edge_pd, -score[edge_pd], edge_gt, edge_rank))
+  pd_match = _MatchKITTI(edge_gt[order], edge_pd[order], edge_rank[order],
+                         score >= 0.)
+  is_hit = pd_match >= 0
+  score_and_hit = np.stack([score, is_hit.astype(np.float32)], axis=-1)
+
+  # Find the score thresholds of the recall levels. Groundtruth ignoring all
+  # matches is never assigned and hence counts as a missed groundtruth.
+  hits = is_hit & (pd_ignore == _DONT_IGNORE)
+  hits[hits] = gt_ignore[pd_match[hits]] == _DONT_IGNORE
+  total_gt = np.bincount(
+      gt_bin[gt_ignore != _IGNORE_ONE_MATCH], minlength=num_bins)
+  thresholds = [
+      _FindThresholds(score[hits & (pd_bin == i)], total_gt[i],
+                      num_recall_points) for i in range(num_bins)
+  ]
+
+  # Pass 2 matching: find detection above the score threshold with largest
+  # overlap. Predictions that are not ignored come first, and ties go to the
+  # first prediction.
+  edge_ignored = pd_ignore[edge_pd] != _DONT_IGNORE
+  order = np.lexsort((edge_pd, np.where(edge_ignored, 0., -edge_iou),
+                      edge_ignored, edge_gt, edge_rank))
+  edge_gt = edge_gt[order]
+  edge_pd = edge_pd[order]
+  edge_rank = edge_rank[order]
+  ap = np.zeros([num_bins], dtype=np.float32)
+  prs = [[] for _ in range(num_bins)]
+  for i in range(max(len(t) for t in thresholds)):
+    active = [b for b in range(num_bins) if i < len(thresholds[b])]
+    bin_threshold = np.full([num_bins], np.inf, dtype=np.float32)
+    bin_threshold[active] = [thresholds[b][i] for b in active]
+    above = score >= bin_threshold[pd_bin]
+    pd_match = _MatchKITTI(edge_gt, edge_pd, edge_rank, above)
+    matched = pd_match >= 0
+    counted = above & (pd_ignore == _DONT_IGNORE)
+    counted[matched] &= gt_ignore[pd_match[matched]] == _DONT_IGNORE
+    total = np.bincount(pd_bin[counted], minlength=num_bins)
+    tp = np.bincount(pd_bin[counted & matched], minlength=num_bins)
+    recall = np.float32(i) / np.float32(num_recall_points - 1)
+    for b in active:
+      precision = (
+          np.float32(tp[b]) / np.float32(total[b])
+          if total[b] else np.float32(1.))
+      ap[b] += precision
+      prs[b].append([precision, recall])
+
+  results = []
+  for b, pr in enumerate(prs):
+    for i in range(len(pr) - 2, -1, -1):
+      pr[i][0] = max(pr[i + 1][0], pr[i][0])
+    pr_out = np.zeros([num_recall_points, 2], dtype=np.float32)
+    pr_out[:, 1] = (
+        np.arange(num_recall_points, dtype=np.float32) /
+        np.float32(num_recall_points - 1))
+    if pr:
+      pr_out[:len(pr)] = np.array(pr, dtype=np.float32)[:num_recall_points]
+    results.append(
+        (ap[b] / np.float32(num_recall_points), pr_out,
+         score_and_hit[pd_offsets[b]:pd_offsets[b + 1]]))
+  return results
+
+
 class KITTIAPMetrics(ap_metric.APMetrics):
   """The KITTI implementation of AP metric."""
 
+  @classmethod
+  def Params(cls, metadata):
+    """Params builder for KITTIAPMetrics."""
+    p = super().Params(metadata)
+    p.Define(
+        'use_iou_cache', False,
+        'If True, compute the pairwise IoUs of every frame once, cache them '
+        'across evaluations, and evaluate all breakdown bins of a class '
+        'together from them in NumPy, instead of running one '
+        'AveragePrecision3D op per bin, which recomputes the IoUs for every '
+        'bin and score threshold.')
+    p.Define('iou_cache_num_threads', 8,
+             'Number of threads computing the pairwise IoUs of new frames.')
+    return p
+
+  def __init__(self, params):
+    super().__init__(params)
+    self._iou_cache = PairwiseIoUCache(self.params.iou_cache_num_threads)
+
+  def Update(self, str_id, result):
+    super().Update(str_id, result)
+    self._iou_cache.Invalidate(self._GetImageId(str_id))
+
   def _GetData(self,
                classid,
                difficulty=None,
@@ -72,6 +405,14 @@ class KITTIAPMetrics(ap_metric.APMetrics):
     # into gt_boxes.
     gt_boxes = g.boxes
     gt_imgids = g.imgids
+    # The class and the row in the class's box buffer of every groundtruth and
+    # predicted box, which index the pairwise IoU cache.
+    gt_classids = np.full(gt_imgids.shape, classid, dtype=np.int32)
+    gt_rows = np.flatnonzero(
+        self._BinMask(self._groundtruth[classid], distance, num_points,
+                      rotation))
+    pd_rows = np.flatnonzero(
+        self._BinMask(self._prediction[classid], distance, None, rotation))
     # Ignore bboxes that are more difficult than this levels by setting their
     # gt_ignore to 1 (IgnoreOneMatch).
     if difficulty:
@@ -93,25 +434,43 @@ class KITTIAPMetrics(ap_metric.APMetrics):
           gt_imgids = np.concatenate([gt_imgids, g_ignore.imgids])
           gt_boxes = np.concatenate([gt_boxes, g_ignore.boxes])
           gt_ignore = np.concatenate([gt_ignore, np.ones(n_ignore_boxes)])
+          gt_classids = np.concatenate(
+              [gt_classids,
+               np.full([n_ignore_boxes], class_id_to_ignore, np.int32)])
+          gt_rows = np.concatenate([gt_rows, np.arange(n_ignore_boxes)])
 
     # Extract the DontCare bounding boxes from the data, and add
     # these to the list of bounding boxes to evaluate with an ignore
     # setting of 2 (IgnoreAllMatches).  Only relevant to KITTI.
     if 'DontCare' in self.metadata.ClassNames():
+      dont_care_classid = self.metadata.ClassNames().index('DontCare')
       g_ignore = self._LoadBoundingBoxes(
-          'groundtruth', class_id=self.metadata.ClassNames().index('DontCare'))
+          'groundtruth', class_id=dont_care_classid)
       if g_ignore is not None:
         n_ignore_boxes = g_ignore.boxes.shape[0]
         gt_imgids = np.concatenate([gt_imgids, g_ignore.imgids])
         gt_boxes = np.concatenate([gt_boxes, g_ignore.boxes])
         gt_ignore = np.concatenate([gt_ignore, 2 * np.ones(n_ignore_boxes)])
+        gt_classids = np.concatenate(
+            [gt_classids,
+             np.full([n_ignore_boxes], dont_care_classid, np.int32)])
+        gt_rows = np.concatenate([gt_rows, np.arange(n_ignore_boxes)])
 
     iou_threshold = self._iou_thresholds[self.metadata.ClassNames()[classid]]
     return py_utils.NestedMap(
         iou_threshold=iou_threshold,
-        gt=py_utils.NestedMap(imgid=gt_imgids, bbox=gt_boxes, ignore=gt_ignore),
+        gt=py_utils.NestedMap(
+            imgid=gt_imgids,
+            bbox=gt_boxes,
+            ignore=gt_ignore,
+            classid=gt_classids,
+            row=gt_rows),
         pd=py_utils.NestedMap(
-            imgid=p.imgids, bbox=p.boxes, score=p.scores, ignore=pd_ignore))
+            imgid=p.imgids,
+            bbox=p.boxes,
+            score=p.scores,
+            ignore=pd_ignore,
+            row=pd_rows))
 
   def _BuildMetric(self, feed_data, classid):
     """Construct tensors and the feed_dict for KITTI metric op.
@@ -190,6 +549,100 @@ class KITTIAPMetrics(ap_metric.APMetrics):
         curve_metrics=curve_metrics,
         calibration_metrics=calibration_metrics)
 
+  def _ComputeMetricsFromIoUCache(self, classid, bin_conditions):
+    """Computes the results of the metric op of many bins from cached IoUs.
+
+    The groundtruth and predictions of every bin are subsets of those of the
+    unconditioned bin, whose overlapping pairs are looked up once and shared by
+    all bins.
+
+    Args:
+      classid: integer. The class of the predictions.
+      bin_conditions: A list of dicts, each holding the named conditioning
+        arguments of one bin.
+
+    Returns:
+      A list with one NestedMap per bin with the scalar, curve and calibration
+      metrics, in the format the ops built by _BuildMetric() evaluate to.
+    """
+    num_recall_points = self.metadata.NumberOfPrecisionRecallPoints()
+    no_data = py_utils.NestedMap(
+        scalar_metrics={'ap': np.float32(np.nan)},
+        curve_metrics={
+            'pr': np.zeros([num_recall_points, 2], dtype=np.float32)
+        },
+        calibration_metrics={'calibrations': np.float32(np.nan)})
+    results = [no_data] * len(bin_conditions)
+    all_data = self._GetData(classid)
+    if all_data is None:
+      return results
+
+    # Index the groundtruth of all_data by their (class, row) in the per-class
+    # Boxes3D buffers. Predictions are all the rows of class classid.
+    gt_index_by_class = {}
+    gt_indices, pd_indices, ious = [], [], []
+    for gt_classid in np.unique(all_data.gt.classid).tolist():
+      gt_boxes = self._groundtruth[gt_classid]
+      in_class = np.flatnonzero(all_data.gt.classid == gt_classid)
+      gt_index = np.full([gt_boxes.imgids.shape[0]], -1)
+      gt_index[all_data.gt.row[in_class]] = in_class
+      gt_index_by_class[gt_classid] = gt_index
+      gt_rows, pd_rows, pair_ious = self._iou_cache.Lookup(
+          gt_boxes, gt_classid, self._prediction[classid], classid)
+      in_data = gt_index[gt_rows] >= 0
+      gt_indices.append(gt_index[gt_rows[in_data]])
+      pd_indices.append(pd_rows[in_data])
+      ious.append(pair_ious[in_data])
+
+    bins = []
+    with_data = []
+    for i, conditions in enumerate(bin_conditions):
+      feed_data = self._GetData(classid, **conditions)
+      if feed_data is None:
+        continue
+      gt = np.empty(feed_data.gt.row.shape, dtype=np.int64)
+      for gt_classid in np.unique(feed_data.gt.classid).tolist():
+        in_class = feed_data.gt.classid == gt_classid
+        gt[in_class] = gt_index_by_class[gt_classid][feed_data.gt.row[in_class]]
+      bins.append(
+          py_utils.NestedMap(
+              gt=gt,
+              gt_ignore=feed_data.gt.ignore,
+              pd=feed_data.pd.row,
+              pd_ignore=feed_data.pd.ignore))
+      with_data.append(i)
+
+    bin_results = _KITTIAveragePrecisionForBins(
+        all_data.gt.imgid, all_data.pd.score, np.concatenate(gt_indices),
+        np.concatenate(pd_indices), np.concatenate(ious), bins,
+        all_data.iou_threshold, num_recall_points)
+    for i, (ap, pr, score_and_hit) in zip(with_data, bin_results):
+      results[i] = py_utils.NestedMap(
+          scalar_metrics={'ap': ap},
+          curve_metrics={'pr': pr},
+          calibration_metrics={'calibrations': score_and_hit})
+    return results
+
+  def _ComputeFinalMetricsForBins(self, classids, bin_conditions):
+    if not self.params.use_iou_cache:
+      return super()._ComputeFinalMetricsForBins(classids, bin_conditions)
+    tf.logging.info(
+        'Computing final KITTI metrics of %d bins from cached IoUs.',
+        len(bin_conditions))
+    results = [{
+        'scalars': [],
+        'curves': [],
+        'calibrations': []
+    } for _ in bin_conditions]
+    for classid in classids:
+      metrics = self._ComputeMetricsFromIoUCache(classid, bin_conditions)
+      for result, bin_metrics in zip(results, metrics):
+        result['scalars'].append(bin_metrics.scalar_metrics)
+        result['curves'].append(bin_metrics.curve_metrics)
+        result['calibrations'].append(bin_metrics.calibration_metrics)
+    tf.logging.info('Finished computing final KITTI metrics.')
+    return results
+
   def _ComputeFinalMetrics(self,
                            classids=None,
                            difficulty=None,
@@ -223,33 +676,10 @@ class KITTIAPMetrics(ap_metric.APMetrics):
       predicted probabilty and the second column is 0 or 1 indicating that the
       prediction matched a ground truth item.
     """
-    tf.logging.info('Computing final KITTI metrics.')
     assert classids is not None, 'classids must be supplied.'
-    feed_dict = {}
-    g = tf.Graph()
-    scalar_fetches = []
-    curve_fetches = []
-    calibration_fetches = []
-    with g.as_default():
-      for classid in classids:
-        data = self._GetData(
-            classid,
-            difficulty=difficulty,
-            distance=distance,
-            num_points=num_points,
-            rotation=rotation)
-        metrics = self._BuildMetric(data, classid)
-        scalar_fetches += [metrics.scalar_metrics]
-        curve_fetches += [metrics.curve_metrics]
-        calibration_fetches += [metrics.calibration_metrics]
-        feed_dict.update(metrics.feed_dict)
-
-    with tf.Session(graph=g) as sess:
-      results = sess.run([scalar_fetches, curve_fetches, calibration_fetches],
-                         feed_dict=feed_dict)
-    tf.logging.info('Finished computing final KITTI metrics.')
-    return {
-        'scalars': results[0],
-        'curves': results[1],
-        'calibrations': results[2]
-    }
+    conditions = dict(
+        difficulty=difficulty,
+        distance=distance,
+        num_points=num_points,
+        rotation=rotation)
+    return self._ComputeFinalMetricsForBins(classids, [conditions])[0]
@@ -0,0 +1,183 @@
+# Lint as: python3
+# Copyright 2020 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for kitti_ap_metric."""
+
+from lingvo import compat as tf
+from lingvo.core import py_utils
+from lingvo.core import test_utils
+from lingvo.tasks.car import kitti_ap_metric
+from lingvo.tasks.car import kitti_metadata
+from lingvo.tasks.car import ops
+import numpy as np
+
+
+class KITTIAPMetricsTest(test_utils.TestCase):
+
+  def _RandomFrame(self, metadata, num_groundtruth, num_predictions):
+    num_classes = metadata.NumClasses()
+    labels = np.random.randint(1, num_classes, size=[num_groundtruth])
+    bboxes = np.concatenate([
+        np.random.uniform(-40., 40., size=[num_groundtruth, 2]),
+        np.random.uniform(-1., 1., size=[num_groundtruth, 1]),
+        np.random.uniform(1., 4., size=[num_groundtruth, 3]),
+        np.random.uniform(-np.pi, np.pi, size=[num_groundtruth, 1]),
+    ], axis=-1)
+
+    # Predictions are jittered copies of random groundtruth boxes, such that
+    # they overlap with groundtruth of their own and of neighboring classes.
+    copies = np.random.randint(
+        num_groundtruth, size=[num_classes, num_predictions])
+    detection_boxes = bboxes[copies] + np.random.normal(
+        scale=0.3, size=[num_classes, num_predictions, 7])
+    detection_scores = np.random.uniform(size=[num_classes, num_predictions])
+    # Some predictions are dropped by having a zero score.
+    detection_scores[detection_scores < 0.1] = 0.
+    return py_utils.NestedMap(
+        groundtruth_labels=labels,
+        groundtruth_bboxes=bboxes,
+        groundtruth_difficulties=np.random.randint(
+            0, 4, size=[num_groundtruth]),
+        groundtruth_num_points=np.random.randint(0, 3000, [num_groundtruth]),
+        detection_scores=detection_scores,
+        detection_boxes=detection_boxes,
+        detection_heights_in_pixels=np.random.uniform(
+            10., 60., size=[num_classes, num_predictions]))
+
+  def _Metrics(self, metadata, use_iou_cache):
+    p = kitti_ap_metric.KITTIAPMetrics.Params(metadata).Set(
+        breakdown_metrics=['distance', 'num_points', 'rotation'],
+        use_iou_cache=use_iou_cache)
+    return p.Instantiate()
+
+  def testIoUCacheMatchesAveragePrecisionOp(self):
+    np.random.seed(12345)
+    metadata = kitti_metadata.KITTIMetadata()
+    expected = self._Metrics(metadata, use_iou_cache=False)
+    actual = self._Metrics(metadata, use_iou_cache=True)
+    for i in range(20):
+      frame = self._RandomFrame(metadata, num_groundtruth=12, num_predictions=8)
+      expected.Update('frame%d' % i, frame)
+      actual.Update('frame%d' % i, frame)
+
+    self.assertAllClose(expected.value, actual.value)
+    for name, expected_breakdown in expected._breakdown_metrics.items():
+      actual_breakdown = actual._breakdown_metrics[name]
+      self.assertAllClose(expected_breakdown._average_precisions,
+                          actual_breakdown._average_precisions)
+      self.assertAllClose(expected_breakdown._precision_recall,
+                          actual_breakdown._precision_recall)
+
+    classids = metadata.EvalClassIndices()
+    expected_calibrations = expected._ComputeFinalMetrics(
+        classids=classids)['calibrations']
+    actual_calibrations = actual._ComputeFinalMetrics(
+        classids=classids)['calibrations']
+    for e, a in zip(expected_calibrations, actual_calibrations):
+      self.assertAllClose(e['calibrations'], a['calibrations'])
+
+  def testAveragePrecisionForBinsMatchesOp(self):
+    np.random.seed(12345)
+    num_images, num_groundtruth, num_predictions = 4, 24, 32
+    gt_imgid = np.random.randint(
+        num_images, size=[num_groundtruth], dtype=np.int32)
+    pd_imgid = np.random.randint(
+        num_images, size=[num_predictions], dtype=np.int32)
+    gt_bbox = np.concatenate([
+        np.random.uniform(-3., 3., size=[num_groundtruth, 3]),
+        np.random.uniform(1., 3., size=[num_groundtruth, 3]),
+        np.random.uniform(-np.pi, np.pi, size=[num_groundtruth, 1]),
+    ], axis=-1).astype(np.float32)
+    pd_bbox = (gt_bbox[np.random.randint(
+        num_groundtruth, size=[num_predictions])] + np.random.normal(
+            scale=0.3, size=[num_predictions, 7])).astype(np.float32)
+    # Few distinct scores, so that the matching has to break ties.
+    pd_score = np.random.randint(5, size=[num_predictions]) / 4.
+    pd_score = pd_score.astype(np.float32)
+
+    with self.session():
+      iou = self.evaluate(ops.pairwise_iou3d(gt_bbox, pd_bbox))
+    iou[gt_imgid[:, np.newaxis] != pd_imgid[np.newaxis, :]] = 0.
+    gt_indices, pd_indices = np.nonzero(iou > 0)
+
+    # The first bin holds all boxes, the others random subsets of them, and
+    # every bin has its own ignore types.
+    bins = []
+    for i in range(4):
+      gt = np.arange(num_groundtruth)
+      pd = np.arange(num_predictions)
+      if i:
+        gt = np.flatnonzero(np.random.uniform(size=[num_groundtruth]) < 0.7)
+        pd = np.flatnonzero(np.random.uniform(size=[num_predictions]) < 0.7)
+      bins.append(
+          py_utils.NestedMap(
+              gt=gt,
+              gt_ignore=np.random.choice([0, 0, 1, 2],
+                                         size=gt.shape).astype(np.int32),
+              pd=pd,
+              pd_ignore=np.random.choice([0, 0, 0, 1],
+                                         size=pd.shape).astype(np.int32)))
+    actual = kitti_ap_metric._KITTIAveragePrecisionForBins(
+        gt_imgid, pd_score, gt_indices, pd_indices,
+        iou[gt_indices, pd_indices], bins, 0.5, 11)
+
+    with self.session():
+      for b, (ap, pr, score_and_hit) in zip(bins, actual):
+        expected = self.evaluate(
+            ops.average_precision3d(
+                iou_threshold=0.5,
+                groundtruth_bbox=gt_bbox[b.gt],
+                groundtruth_imageid=gt_imgid[b.gt],
+                groundtruth_ignore=b.gt_ignore,
+                prediction_bbox=pd_bbox[b.pd],
+                prediction_imageid=pd_imgid[b.pd],
+                prediction_ignore=b.pd_ignore,
+                prediction_score=pd_score[b.pd],
+                num_recall_points=11))
+        self.assertAllClose(expected[0], ap)
+        self.assertAllClose(expected[1], pr)
+        self.assertAllClose(expected[2], score_and_hit)
+
+  def testIoUCacheComputesEachFrameOnce(self):
+    np.random.seed(12345)
+    metadata = kitti_metadata.KITTIMetadata()
+    metrics = self._Metrics(metadata, use_iou_cache=True)
+    for i in range(3):
+      metrics.Update(
+          'frame%d' % i,
+          self._RandomFrame(metadata, num_groundtruth=10, num_predictions=4))
+    _ = metrics.value
+    cache = metrics._iou_cache
+    self.assertCountEqual([0, 1, 2], cache._entries.keys())
+    cached_entry = cache._entries[0]
+
+    # Updating a new frame invalidates the evaluation but keeps the IoUs of
+    # the frames that are already cached.
+    metrics.Update(
+        'frame3',
+        self._RandomFrame(metadata, num_groundtruth=10, num_predictions=4))
+    _ = metrics.value
+    self.assertCountEqual([0, 1, 2, 3], cache._entries.keys())
+    self.assertIs(cached_entry, cache._entries[0])
+
+    # Updating a frame again drops its cached IoUs.
+    metrics.Update(
+        'frame0',
+        self._RandomFrame(metadata, num_groundtruth=10, num_predictions=4))
+    self.assertNotIn(0, cache._entries)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,232 @@
+# Lint as: python3
+# Copyright 2020 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+r"""Builds a compact groundtruth database out of KITTI crops.
+
+The input is the TFRecord crop dataset written by create_kitti_crop_dataset,
+with one tf.Example per object. The output is a TFRecord file holding the
+database, for use by input_preprocessors.GroundTruthAugmentor with
+database_format='compact'.
+
+Instead of padding every object to a fixed number of points, the points of all
+objects are concatenated and each object references its points by offset.
+Objects are sorted by (label, difficulty, num_points), so that the objects of
+each (label, difficulty) group which pass a min/max number of points filter
+form one contiguous range, found with a binary search over `sort_keys`.
+
+Serialized protos cannot exceed 2GB, so the database is split into records of
+consecutive objects, each of at most about --max_record_bytes. The reader
+concatenates the records in order.
+
+Produces a TFRecord where each tf.Example has the following format:
+--------------------------------------------------------------------------------
+
+Values:
+  points: Float list of the 3D locations (X, Y, Z) of the points of the
+  objects of the record, concatenated.
+
+  points_feature: Float list of the per-point features of the objects of the
+  record, concatenated.
+
+  num_points: Int64 list with the number of points of each object.
+
+  bboxes_3d: Float list of the 7 box coordinates of each object.
+
+  labels: Int64 list with the class label id of each object.
+
+  difficulties: Int64 list with the difficulty level of each object.
+
+  sort_keys: Int64 list with the sorted keys
+  (label * num_difficulties + difficulty) * COMPACT_DB_GROUP_KEY_MULTIPLIER +
+  num_points of each object, where COMPACT_DB_GROUP_KEY_MULTIPLIER is defined
+  in input_preprocessors.
+
+  num_difficulties: Int64 scalar with the number of difficulty levels.
+
+  num_groups: Int64 scalar with the number of (label, difficulty) groups,
+  num_classes * num_difficulties.
+--------------------------------------------------------------------------------
+
+To run:
+
+bazel run -c opt \
+  //lingvo/tasks/car/tools:create_compact_groundtruth_db \
+  --input_file_pattern=/path/to/output/gt_objects* \
+  --output_file=/path/to/output/gt_objects_compact.tfrecord
+"""
+
+from absl import app
+from absl import flags
+from lingvo import compat as tf
+from lingvo.core import py_utils
+from lingvo.tasks.car import input_preprocessors
+import numpy as np
+
+flags.DEFINE_string('input_file_pattern', None,
+                    'KITTI crop dataset written by create_kitti_crop_dataset.')
+flags.DEFINE_string('output_file', None, 'Where to write the database.')
+flags.DEFINE_integer('num_classes', 10, 'Number of class labels.')
+flags.DEFINE_integer('num_difficulties', 4, 'Number of difficulty levels.')
+flags.DEFINE_integer(
+    'max_record_bytes', 2**30,
+    'Approximate maximum size of each record of the database. Must stay below '
+    'the 2GB limit of serialized protos.')
+
+FLAGS = flags.FLAGS
+
+
+def ParseCropExample(serialized):
+  """Parses a serialized KITTI crop tf.Example into a NestedMap of arrays."""
+  feature = tf.train.Example.FromString(serialized).features.feature
+  num_points = feature['num_points'].int64_list.value[0]
+  points = np.array(feature['points'].float_list.value, dtype=np.float32)
+  points_feature = np.array(
+      feature['points_feature'].float_list.value, dtype=np.float32)
+  return py_utils.NestedMap(
+      points_xyz=points.reshape([num_points, 3]),
+      points_feature=points_feature.reshape([num_points, -1]),
+      bbox_3d=np.array(feature['bbox_3d'].float_list.value, dtype=np.float32),
+      label=feature['label'].int64_list.value[0],
+      difficulty=feature['difficulty'].int64_list.value[0])
+
+
+def BuildCompactDatabase(objects, num_classes, num_difficulties):
+  """Builds the compact database out of a list of objects.
+
+  Args:
+    objects: A list of NestedMaps as returned by ParseCropExample.
+    num_classes: Number of class labels.
+    num_difficulties: Number of difficulty levels.
+
+  Returns:
+    A NestedMap with the fields points_xyz, points_feature, bboxes_3d, labels,
+    difficulties, sort_keys and num_difficulties of the objects of all
+    records, as described in the module docstring, and
+
+    - offsets: An int64 array of length num_objects + 1. The points of object
+      i are points_xyz[offsets[i]:offsets[i + 1]].
+    - group_offsets: An int64 array of length num_classes * num_difficulties +
+      1. The objects of group g = label * num_difficulties + difficulty are the
+      objects group_offsets[g] to group_offsets[g + 1].
+
+  Raises:
+    ValueError: if an object's label or difficulty is out of range.
+  """
+  for obj in objects:
+    if not 0 <= obj.label < num_classes:
+      raise ValueError('Label %d out of range [0, %d).' %
+                       (obj.label, num_classes))
+    if not 0 <= obj.difficulty < num_difficulties:
+      raise ValueError('Difficulty %d out of range [0, %d).' %
+                       (obj.difficulty, num_difficulties))
+  labels = np.array([obj.label for obj in objects], dtype=np.int64)
+  difficulties = np.array([obj.difficulty for obj in objects], dtype=np.int64)
+  num_points = np.array([obj.points_xyz.shape[0] for obj in objects],
+                        dtype=np.int64)
+  groups = labels * num_difficulties + difficulties
+  sort_keys = (
+      groups * input_preprocessors.COMPACT_DB_GROUP_KEY_MULTIPLIER + num_points)
+  order = np.argsort(sort_keys, kind='stable')
+
+  num_features = objects[0].points_feature.shape[1] if objects else 1
+  db = py_utils.NestedMap()
+  db.points_xyz = np.concatenate(
+      [np.zeros([0, 3], np.float32)] + [objects[i].points_xyz for i in order])
+  db.points_feature = np.concatenate(
+      [np.zeros([0, num_features], np.float32)] +
+      [objects[i].points_feature for i in order])
+  db.offsets = np.concatenate([[0], np.cumsum(num_points[order])])
+  db.bboxes_3d = np.array([objects[i].bbox_3d for i in order],
+                          dtype=np.float32).reshape([-1, 7])
+  db.labels = labels[order]
+  db.difficulties = difficulties[order]
+  db.sort_keys = sort_keys[order]
+  db.group_offsets = np.searchsorted(
+      groups[order], np.arange(num_classes * num_difficulties + 1))
+  db.num_difficulties = num_difficulties
+  return db
+
+
+def ToTFExamples(db, max_record_bytes):
+  """Converts the compact database to a list of tf.Examples.
+
+  Each tf.Example holds consecutive objects of the database. Their values take
+  at most max_record_bytes plus the size of one object.
+
+  Args:
+    db: A NestedMap as returned by BuildCompactDatabase.
+    max_record_bytes: Approximate maximum size of each record.
+
+  Returns:
+    A non-empty list of tf.Examples with the format described in the module
+    docstring, in the order of the objects.
+  """
+  num_points = np.diff(db.offsets)
+  num_features = db.points_feature.shape[1]
+  # Floats take 4 bytes, int64s at most 10.
+  object_bytes = 4 * (num_points * (3 + num_features) + 7) + 4 * 10
+  # Starts a new record whenever the cumulative size crosses a multiple of
+  # max_record_bytes.
+  record_ids = np.cumsum(object_bytes) // max_record_bytes
+  bounds = np.concatenate([[0],
+                           np.flatnonzero(np.diff(record_ids)) + 1,
+                           [len(num_points)]]).astype(np.int64)
+
+  examples = []
+  for begin, end in zip(bounds[:-1], bounds[1:]):
+    example = tf.train.Example()
+    feature = example.features.feature
+    points = slice(db.offsets[begin], db.offsets[end])
+    feature['points'].float_list.value[:] = (
+        db.points_xyz[points].ravel().tolist())
+    feature['points_feature'].float_list.value[:] = (
+        db.points_feature[points].ravel().tolist())
+    feature['bboxes_3d'].float_list.value[:] = (
+        db.bboxes_3d[begin:end].ravel().tolist())
+    feature['num_points'].int64_list.value[:] = (
+        num_points[begin:end].astype(np.int64).tolist())
+    for key in ['labels', 'difficulties', 'sort_keys']:
+      feature[key].int64_list.value[:] = (
+          db[key][begin:end].astype(np.int64).tolist())
+    feature['num_difficulties'].int64_list.value[:] = [db.num_difficulties]
+    feature['num_groups'].int64_list.value[:] = [len(db.group_offsets) - 1]
+    examples.append(example)
+  return examples
+
+
+def main(_):
+  if not FLAGS.input_file_pattern or not FLAGS.output_file:
+    raise ValueError('Must provide an input_file_pattern and an output_file')
+
+  objects = []
+  for filename in sorted(tf.io.gfile.glob(FLAGS.input_file_pattern)):
+    for serialized in tf.io.tf_record_iterator(filename):
+      objects.append(ParseCropExample(serialized))
+  tf.logging.info('Read %d objects.', len(objects))
+
+  db = BuildCompactDatabase(objects, FLAGS.num_classes, FLAGS.num_difficulties)
+  tf.logging.info('Compact database has %d points; padding every object to '
+                  'its largest point count would need %d.',
+                  db.points_xyz.shape[0],
+                  len(objects) * np.max(np.diff(db.offsets), initial=0))
+  examples = ToTFExamples(db, FLAGS.max_record_bytes)
+  tf.logging.info('Writing the database in %d records.', len(examples))
+  with tf.io.TFRecordWriter(FLAGS.output_file) as writer:
+    for example in examples:
+      writer.write(example.SerializeToString())
+
+
+if __name__ == '__main__':
+  app.run(main)
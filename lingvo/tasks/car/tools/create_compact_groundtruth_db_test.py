@@ -0,0 +1,151 @@
+# Lint as: python3
+# Copyright 2020 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for create_compact_groundtruth_db."""
+
+import os
+
+from lingvo import compat as tf
+from lingvo.core import datasource
+from lingvo.core import py_utils
+from lingvo.core import test_utils
+from lingvo.tasks.car import input_preprocessors
+from lingvo.tasks.car.tools import create_compact_groundtruth_db
+import numpy as np
+
+
+def _CropExample(num_points, label, difficulty, center):
+  """Returns a serialized crop tf.Example as written by the crop dataset."""
+  example = tf.train.Example()
+  feature = example.features.feature
+  points = np.random.uniform(-0.4, 0.4, size=[num_points, 3]) + center
+  feature['num_points'].int64_list.value[:] = [num_points]
+  feature['points'].float_list.value[:] = points.ravel().tolist()
+  feature['points_feature'].float_list.value[:] = np.random.uniform(
+      size=[num_points]).tolist()
+  feature['bbox_3d'].float_list.value[:] = list(center) + [1., 1., 1., 0.]
+  feature['label'].int64_list.value[:] = [label]
+  feature['difficulty'].int64_list.value[:] = [difficulty]
+  return example.SerializeToString()
+
+
+class CreateCompactGroundtruthDbTest(test_utils.TestCase):
+
+  def _Objects(self):
+    # (num_points, label, difficulty) for objects placed 5m apart.
+    specs = [(3, 2, 1), (7, 1, 0), (1, 1, 0), (4, 1, 0), (5, 2, 3)]
+    return [
+        create_compact_groundtruth_db.ParseCropExample(
+            _CropExample(n, label, difficulty, [5. * i, 0., 0.]))
+        for i, (n, label, difficulty) in enumerate(specs)
+    ]
+
+  def testBuildCompactDatabase(self):
+    objects = self._Objects()
+    db = create_compact_groundtruth_db.BuildCompactDatabase(
+        objects, num_classes=3, num_difficulties=4)
+    # Sorted by (label, difficulty, num_points).
+    expected_order = [2, 3, 1, 0, 4]
+    self.assertAllEqual(db.labels, [1, 1, 1, 2, 2])
+    self.assertAllEqual(db.difficulties, [0, 0, 0, 1, 3])
+    self.assertAllEqual(db.offsets, [0, 1, 5, 12, 15, 20])
+    self.assertAllEqual(db.points_xyz.shape, [20, 3])
+    self.assertAllEqual(db.points_feature.shape, [20, 1])
+    self.assertAllEqual(np.diff(db.sort_keys) > 0, [True] * 4)
+    # 3 classes x 4 difficulties groups; group 4 is (label=1, difficulty=0).
+    self.assertAllEqual(db.group_offsets,
+                        [0, 0, 0, 0, 0, 3, 3, 3, 3, 3, 4, 4, 5])
+    for i, j in enumerate(expected_order):
+      self.assertAllClose(db.points_xyz[db.offsets[i]:db.offsets[i + 1]],
+                          objects[j].points_xyz)
+      self.assertAllClose(db.bboxes_3d[i], objects[j].bbox_3d)
+
+  def testBuildCompactDatabaseChecksRange(self):
+    with self.assertRaisesRegex(ValueError, 'Difficulty'):
+      create_compact_groundtruth_db.BuildCompactDatabase(
+          self._Objects(), num_classes=3, num_difficulties=2)
+
+  def testToTFExamples(self):
+    db = create_compact_groundtruth_db.BuildCompactDatabase(
+        self._Objects(), num_classes=3, num_difficulties=4)
+    # Objects of 1, 4, 7, 3 and 5 points take 84, 132, 180, 116 and 148 bytes.
+    examples = create_compact_groundtruth_db.ToTFExamples(
+        db, max_record_bytes=200)
+    features = [example.features.feature for example in examples]
+    self.assertEqual([[1], [4, 7], [3], [5]],
+                     [f['num_points'].int64_list.value for f in features])
+    self.assertAllEqual(
+        db.points_xyz.ravel(),
+        np.concatenate([f['points'].float_list.value for f in features]))
+    self.assertAllEqual(
+        db.sort_keys,
+        np.concatenate([f['sort_keys'].int64_list.value for f in features]))
+    for f in features:
+      self.assertEqual([12], f['num_groups'].int64_list.value)
+      self.assertEqual([4], f['num_difficulties'].int64_list.value)
+
+    # The whole database fits in one record.
+    self.assertLen(
+        create_compact_groundtruth_db.ToTFExamples(db, max_record_bytes=2**30),
+        1)
+
+  def testGroundTruthAugmentorWithCompactDatabase(self):
+    db = create_compact_groundtruth_db.BuildCompactDatabase(
+        self._Objects(), num_classes=3, num_difficulties=4)
+    db_path = os.path.join(tf.test.get_temp_dir(), 'compact_db.tfrecord')
+    # Splits the database into several records.
+    examples = create_compact_groundtruth_db.ToTFExamples(
+        db, max_record_bytes=200)
+    self.assertLen(examples, 4)
+    with tf.io.TFRecordWriter(db_path) as writer:
+      for example in examples:
+        writer.write(example.SerializeToString())
+
+    p = input_preprocessors.GroundTruthAugmentor.Params().Set(
+        name='bbox_aug',
+        groundtruth_database=datasource.SimpleDataSource.Params().Set(
+            file_pattern=db_path),
+        database_format='compact',
+        filter_min_points=2,
+        max_augmented_bboxes=5,
+        label_filter=[1])
+    num_points = 10
+    max_bboxes = 8
+    features = py_utils.NestedMap(
+        lasers=py_utils.NestedMap(
+            points_xyz=tf.random.uniform([num_points, 3]) + 100.,
+            points_feature=tf.random.uniform([num_points, 1])),
+        labels=py_utils.NestedMap(
+            bboxes_3d=tf.zeros([max_bboxes, 7]),
+            bboxes_3d_mask=tf.zeros([max_bboxes]),
+            labels=tf.zeros([max_bboxes], dtype=tf.int32)))
+    with self.session():
+      features = p.Instantiate().TransformFeatures(features)
+      for _ in range(5):
+        output = self.evaluate(features)
+        num_augmented = int(np.sum(output.labels.bboxes_3d_mask))
+        # Only the 2 objects of label 1 with at least 2 points can be sampled.
+        self.assertBetween(num_augmented, 1, 2)
+        self.assertAllEqual(output.labels.labels[:num_augmented],
+                            [1] * num_augmented)
+        self.assertAllEqual(
+            np.isin(output.labels.bboxes_3d[:num_augmented, 0], [5., 15.]),
+            [True] * num_augmented)
+        augmented_points = output.lasers.points_xyz.shape[0] - num_points
+        self.assertIn(augmented_points, [4, 7, 11])
+
+
+if __name__ == '__main__':
+  tf.test.main()
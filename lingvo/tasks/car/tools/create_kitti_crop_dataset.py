@@ -68,7 +68,7 @@ from lingvo import compat as tf
 from lingvo import model_registry
 from lingvo.core import cluster_factory
 from lingvo.core import py_utils
-from lingvo.tasks.car import geometry
+from lingvo.tasks.car import geometry_np
 from lingvo.tasks.car import input_extractor
 from lingvo.tasks.car.params import kitti  # pylint: disable=unused-import
 from lingvo.tools import beam_utils
@@ -108,9 +108,6 @@ def _GetFilteredBoundingBoxData(kitti_data):
   """
   points = kitti_data.lasers.points_xyz
   points_feature = kitti_data.lasers.points_feature
-  bboxes_3d = kitti_data.labels.bboxes_3d
-  bboxes_3d_mask = kitti_data.labels.bboxes_3d_mask
-  bboxes_3d = tf.boolean_mask(bboxes_3d, bboxes_3d_mask)
 
   if 'points_padding' in kitti_data.lasers:
     points_validity_mask = tf.cast(kitti_data.lasers.points_padding - 1,
@@ -118,14 +115,12 @@ def _GetFilteredBoundingBoxData(kitti_data):
     points = tf.boolean_mask(points, points_validity_mask)
     points_feature = tf.boolean_mask(points_feature, points_validity_mask)
 
-  points_in_bboxes_mask = geometry.IsWithinBBox3D(points, bboxes_3d)
-
   output_map = py_utils.NestedMap()
   # Points and features contain the whole pointcloud, which we will use
   # per box boolean masks later in _ToTFExampleProto to subselect data per box.
+  # The masks are computed on the host in _ProcessShard.process.
   output_map.points = points
   output_map.points_feature = points_feature
-  output_map.points_in_bboxes_mask = points_in_bboxes_mask
 
   output_map.source_id = kitti_data.labels.source_id
 
@@ -236,6 +231,7 @@ class _ProcessShard(beam.DoFn):
       return
 
     num_boxes = b.bboxes_3d.shape[0]
+    b.points_in_bboxes_mask = geometry_np.IsWithinBBox3D(b.points, b.bboxes_3d)
 
     # For each box, get the pointcloud and write it as an example.
     for bbox_id in range(num_boxes):
@@ -25,6 +25,13 @@ path/to/generate_waymo_tf.py \
   --project=$PROJECT \
   --temp_location=$TEMP_DIR \
   --runner=DataflowRunner
+
+To convert locally on all the cores of the machine, with the DirectRunner:
+
+path/to/generate_waymo_tf.py \
+  --input_file_pattern=/path/to/waymo/inputs \
+  --output_filebase=/path/to/output@100 \
+  --num_direct_workers=$(nproc)
 """
 
 from absl import app
@@ -36,10 +43,12 @@ from lingvo.tasks.car.waymo.tools import waymo_proto_to_tfe
 from lingvo.tools import beam_utils
 from waymo_open_dataset import dataset_pb2
 
-tf.enable_eager_execution()
-
 flags.DEFINE_string('input_file_pattern', None, 'Path to read input')
 flags.DEFINE_string('output_filebase', None, 'Path to write output')
+flags.DEFINE_integer(
+    'num_direct_workers', 0,
+    'If > 0, runs the pipeline with the DirectRunner in this many processes. '
+    'Otherwise, the runner is configured by the pipeline options.')
 
 FLAGS = flags.FLAGS
 
@@ -52,6 +61,13 @@ def main(argv):
 
   # Construct pipeline options from argv.
   options = beam.options.pipeline_options.PipelineOptions(argv[1:])
+  if FLAGS.num_direct_workers > 0:
+    options.view_as(
+        beam.options.pipeline_options.StandardOptions).runner = 'DirectRunner'
+    direct_options = options.view_as(
+        beam.options.pipeline_options.DirectOptions)
+    direct_options.direct_num_workers = FLAGS.num_direct_workers
+    direct_options.direct_running_mode = 'multi_processing'
 
   reader = beam_utils.GetReader(
       'tfrecord',
@@ -68,8 +84,7 @@ def main(argv):
     _ = (
         root
         | 'Read' >> reader
-        | 'ConvertToTFExample' >> beam.ParDo(
-            waymo_proto_to_tfe.WaymoOpenDatasetConverter(emitter_fn))
+        | 'ConvertToTFExample' >> waymo_proto_to_tfe.ConvertFrames(emitter_fn)
         | 'Write' >> writer)
 
 
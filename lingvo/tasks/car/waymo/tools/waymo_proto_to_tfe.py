@@ -158,14 +158,142 @@ nlz_proto_strs: string - Vector of NoLabelZone polygon protos.  Currently
 unused.
 """
 
+import collections
 import zlib
 
 import apache_beam as beam
 from lingvo import compat as tf
 import numpy as np
 from waymo_open_dataset import dataset_pb2
-from waymo_open_dataset.utils import range_image_utils
-from waymo_open_dataset.utils import transform_utils
+
+# One return of a laser, with what is needed to convert it to a point cloud.
+#
+# - name: e.g. 'TOP_ri1'.
+# - range_image: [H, W, 4] range image.
+# - extrinsics: [4, 4] transform from the laser frame to the vehicle frame.
+# - inclinations: [H] beam inclination of each range image row.
+# - pixel_pose: Optional [H, W, 6] pose, as [roll, pitch, yaw, x, y, z], of the
+#   vehicle when each pixel was captured.
+# - frame_pose: [4, 4] vehicle to world transform of the frame, if pixel_pose
+#   is set.
+LaserReturn = collections.namedtuple('LaserReturn', [
+    'name', 'range_image', 'extrinsics', 'inclinations', 'pixel_pose',
+    'frame_pose'
+])
+
+
+def _get_rotation_matrix(roll, pitch, yaw):
+  """NumPy version of transform_utils.get_rotation_matrix()."""
+  cos_roll, sin_roll = np.cos(roll), np.sin(roll)
+  cos_pitch, sin_pitch = np.cos(pitch), np.sin(pitch)
+  cos_yaw, sin_yaw = np.cos(yaw), np.sin(yaw)
+  ones, zeros = np.ones_like(yaw), np.zeros_like(yaw)
+  r_roll = np.stack([
+      np.stack([ones, zeros, zeros], axis=-1),
+      np.stack([zeros, cos_roll, -sin_roll], axis=-1),
+      np.stack([zeros, sin_roll, cos_roll], axis=-1),
+  ], axis=-2)  # pyformat: disable
+  r_pitch = np.stack([
+      np.stack([cos_pitch, zeros, sin_pitch], axis=-1),
+      np.stack([zeros, ones, zeros], axis=-1),
+      np.stack([-sin_pitch, zeros, cos_pitch], axis=-1),
+  ], axis=-2)  # pyformat: disable
+  r_yaw = np.stack([
+      np.stack([cos_yaw, -sin_yaw, zeros], axis=-1),
+      np.stack([sin_yaw, cos_yaw, zeros], axis=-1),
+      np.stack([zeros, zeros, ones], axis=-1),
+  ], axis=-2)  # pyformat: disable
+  return np.matmul(r_yaw, np.matmul(r_pitch, r_roll))
+
+
+def _range_image_pose_to_transform(range_image_pose):
+  """Converts [..., 6] range image poses to [..., 4, 4] transforms."""
+  transform = np.zeros(range_image_pose.shape[:-1] + (4, 4))
+  transform[..., :3, :3] = _get_rotation_matrix(range_image_pose[..., 0],
+                                                range_image_pose[..., 1],
+                                                range_image_pose[..., 2])
+  transform[..., :3, 3] = range_image_pose[..., 3:]
+  transform[..., 3, 3] = 1.
+  return transform
+
+
+def _compute_inclination(inclination_min, inclination_max, height):
+  """NumPy version of range_image_utils.compute_inclination()."""
+  return ((0.5 + np.arange(height)) / height *
+          (inclination_max - inclination_min) + inclination_min)
+
+
+class PointCloudConverter:
+  """Converts range images to point clouds in the vehicle frame.
+
+  NumPy version of range_image_utils.extract_point_cloud_from_range_image().
+  The direction of each range image pixel only depends on the calibration of
+  its laser, which is constant over a run segment, so the directions are
+  computed once and cached.
+  """
+
+  _MAX_CACHE_SIZE = 64
+
+  def __init__(self):
+    self._pixel_directions = {}
+
+  def _get_pixel_directions(self, extrinsics, inclinations, width):
+    """Returns the [H, W, 3] unit directions of the pixels in vehicle frame."""
+    key = (extrinsics.tobytes(), inclinations.tobytes(), width)
+    directions = self._pixel_directions.get(key)
+    if directions is not None:
+      return directions
+    az_correction = np.arctan2(extrinsics[1, 0], extrinsics[0, 0])
+    ratios = (np.arange(width, 0, -1) - .5) / width
+    azimuth = (ratios * 2. - 1.) * np.pi - az_correction
+    cos_inclination = np.cos(inclinations)[:, np.newaxis]
+    directions = np.stack([
+        cos_inclination * np.cos(azimuth),
+        cos_inclination * np.sin(azimuth),
+        np.broadcast_to(
+            np.sin(inclinations)[:, np.newaxis],
+            (len(inclinations), width)),
+    ], axis=-1)  # pyformat: disable
+    # Rotates the directions from the laser frame to the vehicle frame.
+    directions = np.matmul(directions, extrinsics[:3, :3].T)
+    if len(self._pixel_directions) >= self._MAX_CACHE_SIZE:
+      self._pixel_directions.clear()
+    self._pixel_directions[key] = directions
+    return directions
+
+  def convert(self, laser_return):
+    """Converts a LaserReturn to an [N, 6] float32 point cloud.
+
+    Args:
+      laser_return: A LaserReturn.
+
+    Returns:
+      An [N, 6] array of the valid pixels of the range image, with the x, y, z
+      cartesian coordinates of each point followed by its intensity,
+      elongation and "is_in_no_label_zone" bit.
+    """
+    range_image = laser_return.range_image
+    extrinsics = laser_return.extrinsics
+    # Invalid values in the range image are indicated with a -1. range.
+    mask = range_image[..., 0] >= 0
+    valid_pixels = range_image[mask]
+    directions = self._get_pixel_directions(extrinsics,
+                                            laser_return.inclinations,
+                                            range_image.shape[1])[mask]
+    points_xyz = valid_pixels[:, :1] * directions + extrinsics[:3, 3]
+    if laser_return.pixel_pose is not None:
+      # Moves each point to the world frame with the pose of the vehicle when
+      # it was captured, then back to the vehicle frame at the frame pose.
+      pixel_pose = _range_image_pose_to_transform(
+          laser_return.pixel_pose[mask].astype(np.float64))
+      points_xyz = np.einsum('nij,nj->ni', pixel_pose[:, :3, :3],
+                             points_xyz) + pixel_pose[:, :3, 3]
+      world_to_vehicle = np.linalg.inv(laser_return.frame_pose)
+      points_xyz = (
+          np.matmul(points_xyz, world_to_vehicle[:3, :3].T) +
+          world_to_vehicle[:3, 3])
+    return np.concatenate([points_xyz, valid_pixels[:, 1:]],
+                          axis=-1).astype(np.float32)
 
 
 class WaymoOpenDatasetConverter(beam.DoFn):
@@ -173,9 +301,27 @@ class WaymoOpenDatasetConverter(beam.DoFn):
 
   def __init__(self, emitter_fn):
     self._emitter_fn = emitter_fn
+    self._point_cloud_converter = PointCloudConverter()
 
   def process(self, item):
     """Convert 'item' into tf.Example format."""
+    key, output, laser_returns = self.convert_frame(item)
+    for laser_return in laser_returns:
+      self.add_point_cloud(output.features.feature, laser_return.name,
+                           self._point_cloud_converter.convert(laser_return))
+    return self._emitter_fn(key, output)
+
+  def convert_frame(self, item):
+    """Converts 'item', except for its point clouds.
+
+    Args:
+      item: A dataset_pb2.Frame.
+
+    Returns:
+      A tuple (key, tf.Example, laser_returns) where laser_returns is a list of
+      LaserReturn to convert to point clouds with a PointCloudConverter, and to
+      add to the tf.Example with add_point_cloud().
+    """
     output = tf.train.Example()
     feature = output.features.feature
 
@@ -201,30 +347,21 @@ class WaymoOpenDatasetConverter(beam.DoFn):
 
     # Convert pose: a 4x4 transformation matrix.
     feature['pose'].float_list.value[:] = list(item.pose.transform)
-    self.frame_pose = tf.convert_to_tensor(
-        np.reshape(np.array(item.pose.transform), [4, 4]), dtype=tf.float32)
-
-    # Extract laser names.
-    laser_names = []
-    for laser in item.lasers:
-      laser_name = laser.name
-      real_name = dataset_pb2.LaserName.Name.Name(laser_name)
-      laser_names += [real_name]
+    frame_pose = np.reshape(np.array(item.pose.transform), [4, 4])
 
     # Extract laser data (range images) and the calibrations.
-    self.extract_lasers(feature, item.lasers)
+    range_images = self.extract_lasers(feature, item.lasers)
 
     self.extract_laser_calibrations(feature, item.context.laser_calibrations)
 
     range_image_pose = self._get_range_image_pose(item.lasers)
-    feature['TOP_pose'].float_list.value[:] = range_image_pose.numpy().reshape(
-        [-1])
+    feature['TOP_pose'].float_list.value[:] = _range_image_pose_to_transform(
+        range_image_pose).reshape([-1])
 
-    # From the range images, also turn them into 3D point clouds.
-    self.add_point_cloud(feature, laser_names, range_image_pose)
-    merged_pointcloud_xyz = self._get_merged_pointcloud(feature, laser_names)
+    laser_returns = self._get_laser_returns(feature, range_images,
+                                            range_image_pose, frame_pose)
 
-    self.add_labels(feature, item.laser_labels, merged_pointcloud_xyz)
+    self.add_labels(feature, item.laser_labels)
     self.add_no_label_zones(feature, item.no_label_zones)
 
     camera_calibrations_dict = ({
@@ -236,10 +373,10 @@ class WaymoOpenDatasetConverter(beam.DoFn):
     self.extract_camera_calibrations(feature,
                                      list(camera_calibrations_dict.values()))
 
-    return self._emitter_fn(key, output)
+    return key, output, laser_returns
 
   def _get_range_image_pose(self, lasers):
-    """Fetches the per-pixel pose information for the range image."""
+    """Fetches the [H, W, 6] per-pixel pose of the TOP range image."""
     range_image_gbr_pose = None
     for laser in lasers:
       if laser.name != dataset_pb2.LaserName.TOP:
@@ -251,20 +388,8 @@ class WaymoOpenDatasetConverter(beam.DoFn):
 
     assert range_image_gbr_pose is not None
     shape = list(range_image_gbr_pose.shape.dims)
-    range_image_gbr_pose_tensor = np.array(
-        range_image_gbr_pose.data).reshape(shape)
-    range_image_gbr_pose_tensor_rotation = transform_utils.get_rotation_matrix(
-        range_image_gbr_pose_tensor[..., 0],
-        range_image_gbr_pose_tensor[..., 1],
-        range_image_gbr_pose_tensor[..., 2])
-    range_image_gbr_pose_tensor_translation = range_image_gbr_pose_tensor[...,
-                                                                          3:]
-    range_image_gbr_pose_tensor = transform_utils.get_transform(
-        range_image_gbr_pose_tensor_rotation,
-        range_image_gbr_pose_tensor_translation)
-
-    assert range_image_gbr_pose_tensor.shape == (64, 2650, 4, 4)
-    return range_image_gbr_pose_tensor
+    assert shape == [64, 2650, 6], shape
+    return np.array(range_image_gbr_pose.data).reshape(shape)
 
   def _parse_range_image(self, range_image):
     """Parse range_image proto and convert to MatrixFloat form."""
@@ -347,7 +472,12 @@ class WaymoOpenDatasetConverter(beam.DoFn):
     Args:
       feature: A tf.Example feature map.
       lasers: A repeated car.open_dataset.Laser proto.
+
+    Returns:
+      A dict from laser name (e.g., 'TOP') to a dict from range image return
+      ('ri1' or 'ri2') to its MatrixFloat proto.
     """
+    range_images = {}
     for laser in lasers:
       ri1 = self._parse_range_image(laser.ri_return1)
       ri2 = self._parse_range_image(laser.ri_return2)
@@ -360,6 +490,8 @@ class WaymoOpenDatasetConverter(beam.DoFn):
       feature['%s_ri1_shape' % real_name].int64_list.value[:] = ri1.shape.dims
       feature['%s_ri2' % real_name].float_list.value[:] = ri2.data
       feature['%s_ri2_shape' % real_name].int64_list.value[:] = ri2.shape.dims
+      range_images[real_name] = {'ri1': ri1, 'ri2': ri2}
+    return range_images
 
   def extract_laser_calibrations(self, feature, laser_calibrations):
     """Extract the laser calibrations into the tf.Example feature map.
@@ -382,17 +514,21 @@ class WaymoOpenDatasetConverter(beam.DoFn):
       feature['%s_extrinsics' % real_name].float_list.value[:] = list(
           laser_calibration.extrinsic.transform)
 
-  def add_point_cloud(self, feature, laser_names, range_image_pose):
-    """Convert the range images in `feature` to 3D point clouds.
-
-    Adds the point cloud data to the tf.Example feature map.
+  def _get_laser_returns(self, feature, range_images, range_image_pose,
+                         frame_pose):
+    """Gets the LaserReturns of a frame to convert to point clouds.
 
     Args:
-      feature: A tf.Example feature map.
-      laser_names: A list of laser names (e.g., 'TOP', 'REAR', 'SIDE_LEFT').
-      range_image_pose: A range image pose Tensor for the GBR.
+      feature: A tf.Example feature map with the laser calibrations.
+      range_images: The range images, as returned by extract_lasers().
+      range_image_pose: The [H, W, 6] per-pixel pose of the TOP range image.
+      frame_pose: The [4, 4] pose of the frame.
+
+    Returns:
+      A list of LaserReturn.
     """
-    for laser_name in laser_names:
+    laser_returns = []
+    for laser_name, laser_range_images in sorted(range_images.items()):
       beam_inclinations = np.array(feature['%s_beam_inclinations' %
                                            laser_name].float_list.value[:])
       # beam_inclinations will be populated if there is a non-uniform
@@ -402,93 +538,50 @@ class WaymoOpenDatasetConverter(beam.DoFn):
       # and turn them into a uniform inclinations array.
       if beam_inclinations.size == 0:
         beam_inclination_min = feature['%s_beam_inclination_min' %
-                                       laser_name].float_list.value[:]
+                                       laser_name].float_list.value[0]
         beam_inclination_max = feature['%s_beam_inclination_max' %
-                                       laser_name].float_list.value[:]
-
-        laser_ri_name = '%s_ri1' % laser_name
-        range_image_shape = feature[laser_ri_name +
-                                    '_shape'].int64_list.value[:]
-        height = tf.cast(range_image_shape[0], tf.float32)
-
-        beam_inclinations = tf.constant(
-            [beam_inclination_min[0], beam_inclination_max[0]])
-        beam_inclinations = range_image_utils.compute_inclination(
-            beam_inclinations, height)
+                                       laser_name].float_list.value[0]
+        height = laser_range_images['ri1'].shape.dims[0]
+        beam_inclinations = _compute_inclination(beam_inclination_min,
+                                                 beam_inclination_max, height)
+      # The first row of the range images is the highest beam.
+      beam_inclinations = beam_inclinations[::-1]
 
       beam_extrinsics = np.array(
           feature['%s_extrinsics' % laser_name].float_list.value[:]).reshape(
               4, 4)
 
       for ri_type in ['ri1', 'ri2']:
-        laser_ri_name = '%s_%s' % (laser_name, ri_type)
-        # For each of the 4 features of the lasers:
-        range_image = np.array(feature[laser_ri_name].float_list.value[:])
-        range_image_shape = feature[laser_ri_name +
-                                    '_shape'].int64_list.value[:]
-        range_image = range_image.reshape(range_image_shape)
-        # Compute mask.  At the moment, invalid values in the range image
-        # representation are indicated via a -1. entry.  Callers are expected
-        # to create this mask when passing into the conversion function below.
-        range_image_mask = range_image[..., 0] >= 0
-
-        # Get the 'range' feature from the range images.
-        range_image_range = range_image[..., 0]
-
-        # Call utility to convert point cloud to cartesian coordinates.
-        #
-        # API expects a batch dimension for all inputs.
-        batched_pixel_pose = None
-        batched_frame_pose = None
+        ri = laser_range_images[ri_type]
+        range_image = np.array(ri.data).reshape(list(ri.shape.dims))
         # At the moment, only the GBR has per-pixel pose.
+        pixel_pose = None
+        laser_frame_pose = None
         if laser_name == 'TOP':
-          batched_pixel_pose = range_image_pose[tf.newaxis, ...]
-          batched_frame_pose = self.frame_pose[tf.newaxis, ...]
-
-        batched_range_image_range = tf.convert_to_tensor(
-            range_image_range[np.newaxis, ...], dtype=tf.float32)
-        batched_extrinsics = tf.convert_to_tensor(
-            beam_extrinsics[np.newaxis, ...], dtype=tf.float32)
-        batched_inclinations = tf.convert_to_tensor(
-            beam_inclinations[np.newaxis, ...], dtype=tf.float32)
-
-        batched_inclinations = tf.reverse(batched_inclinations, axis=[-1])
-
-        range_image_cartesian = (
-            range_image_utils.extract_point_cloud_from_range_image(
-                batched_range_image_range,
-                batched_extrinsics,
-                batched_inclinations,
-                pixel_pose=batched_pixel_pose,
-                frame_pose=batched_frame_pose))
-
-        points_xyz = tf.gather_nd(range_image_cartesian[0],
-                                  tf.where(range_image_mask))
-
-        # Fetch the features corresponding to each xyz coordinate and
-        # concatentate them together.
-        points_features = tf.cast(
-            tf.gather_nd(range_image[..., 1:], tf.where(range_image_mask)),
-            tf.float32)
-        points_data = tf.concat([points_xyz, points_features], axis=-1)
-
-        # Add laser feature to output.
-        #
-        # Skip embedding shape since we assume that all points have six features
-        # and so we can reconstruct the number of points.
-        points_list = list(points_data.numpy().reshape([-1]))
-        feature['laser_%s' % laser_ri_name].float_list.value[:] = points_list
-
-  def _get_merged_pointcloud(self, feature, laser_names):
-    """From the feature list, get a merged pointcloud of all laser sources."""
-    points_list = []
-    for laser_name in laser_names:
-      for ri_type in ['ri1', 'ri2']:
-        laser_ri_name = '%s_%s' % (laser_name, ri_type)
-        points_xyz = np.array(feature['laser_%s' %
-                                      laser_ri_name].float_list.value[:])
-        points_list.append(np.reshape(points_xyz, (-1, 3)))
-    return np.concatenate(points_list, axis=0)
+          pixel_pose = range_image_pose
+          laser_frame_pose = frame_pose
+        laser_returns.append(
+            LaserReturn(
+                name='%s_%s' % (laser_name, ri_type),
+                range_image=range_image,
+                extrinsics=beam_extrinsics,
+                inclinations=beam_inclinations,
+                pixel_pose=pixel_pose,
+                frame_pose=laser_frame_pose))
+    return laser_returns
+
+  def add_point_cloud(self, feature, laser_ri_name, points):
+    """Adds the point cloud of a laser return to the tf.Example feature map.
+
+    Args:
+      feature: A tf.Example feature map.
+      laser_ri_name: The name of the laser return, e.g. 'TOP_ri1'.
+      points: The [N, 6] point cloud from PointCloudConverter.convert().
+    """
+    # Skip embedding shape since we assume that all points have six features
+    # and so we can reconstruct the number of points.
+    feature['laser_%s' % laser_ri_name].float_list.value[:] = (
+        points.reshape([-1]).tolist())
 
   def _single_frame_detection_difficulty(self, human_difficulty, num_points):
     """Create the `single_frame_detection_difficulty` field.
@@ -519,14 +612,12 @@ class WaymoOpenDatasetConverter(beam.DoFn):
     else:
       return 1
 
-  def add_labels(self, feature, labels, points_xyz):
+  def add_labels(self, feature, labels):
     """Add 3d bounding box labels into the output feature map.
 
     Args:
       feature: A tf.Example feature map.
       labels: A repeated car.open_dataset.Label proto.
-      points_xyz: A numpy array of shape [-1, 3] with the pointcloud. This is
-        used to calculate the number of points in each 3D bounding box.
     """
     label_classes = []
     label_ids = []
@@ -590,3 +681,70 @@ class WaymoOpenDatasetConverter(beam.DoFn):
     for nlz in no_label_zones:
       nlz_proto_strs += [tf.compat.as_bytes(nlz.SerializeToString())]
     feature['no_label_zones'].bytes_list.value[:] = nlz_proto_strs
+
+
+class _ConvertFrameFn(beam.DoFn):
+  """Converts frames, except for their point clouds.
+
+  Outputs the (key, tf.Example) of each frame, and the (key, LaserReturn) of
+  each of its laser returns to the 'laser_returns' output.
+  """
+
+  def __init__(self):
+    self._converter = WaymoOpenDatasetConverter(emitter_fn=None)
+
+  def process(self, item):
+    key, output, laser_returns = self._converter.convert_frame(item)
+    yield key, output
+    for laser_return in laser_returns:
+      yield beam.pvalue.TaggedOutput('laser_returns', (key, laser_return))
+
+
+class _ConvertLaserReturnFn(beam.DoFn):
+  """Converts (key, LaserReturn) to (key, (laser return name, points))."""
+
+  def __init__(self):
+    # Each worker keeps its own cache of the laser calibrations.
+    self._point_cloud_converter = PointCloudConverter()
+
+  def process(self, keyed_laser_return):
+    key, laser_return = keyed_laser_return
+    yield key, (laser_return.name,
+                self._point_cloud_converter.convert(laser_return))
+
+
+class ConvertFrames(beam.PTransform):
+  """Converts a PCollection of dataset_pb2.Frame.
+
+  Same as beam.ParDo(WaymoOpenDatasetConverter(emitter_fn)), but converts
+  each laser return of a frame to a point cloud in a separate stage, so that
+  the 10 laser returns of a frame can be converted in parallel.
+  """
+
+  def __init__(self, emitter_fn):
+    super().__init__()
+    self._emitter_fn = emitter_fn
+    self._converter = WaymoOpenDatasetConverter(emitter_fn)
+
+  def _merge_frame(self, keyed_frame):
+    key, frame = keyed_frame
+    [output] = frame['examples']
+    for laser_ri_name, points in frame['points']:
+      self._converter.add_point_cloud(output.features.feature, laser_ri_name,
+                                      points)
+    return self._emitter_fn(key, output)
+
+  def expand(self, frames):
+    examples, laser_returns = (
+        frames
+        | 'ConvertFrame' >> beam.ParDo(_ConvertFrameFn()).with_outputs(
+            'laser_returns', main='examples'))
+    points = (
+        laser_returns
+        # Breaks the fusion with ConvertFrame, so that the laser returns of a
+        # frame are distributed over the workers.
+        | 'ReshuffleLaserReturns' >> beam.Reshuffle()
+        | 'ConvertLaserReturn' >> beam.ParDo(_ConvertLaserReturnFn()))
+    frames = ({'examples': examples, 'points': points}
+              | 'GroupByFrame' >> beam.CoGroupByKey())
+    return frames | 'MergeFrame' >> beam.FlatMap(self._merge_frame)
@@ -0,0 +1,104 @@
+# Lint as: python3
+# Copyright 2020 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for waymo_proto_to_tfe."""
+
+from absl.testing import parameterized
+from lingvo import compat as tf
+from lingvo.core import test_utils
+from lingvo.tasks.car.waymo.tools import waymo_proto_to_tfe
+import numpy as np
+from waymo_open_dataset.utils import range_image_utils
+from waymo_open_dataset.utils import transform_utils
+
+# pylint: disable=protected-access
+
+
+def _RandomTransform():
+  transform = np.eye(4)
+  transform[:3, :3] = waymo_proto_to_tfe._get_rotation_matrix(
+      *np.random.uniform(-0.3, 0.3, size=3))
+  transform[:3, 3] = np.random.uniform(-2., 2., size=3)
+  return transform
+
+
+class PointCloudConverterTest(test_utils.TestCase, parameterized.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    np.random.seed(12345)
+
+  def testRangeImagePoseToTransform(self):
+    pose = np.random.uniform(-1., 1., size=(4, 5, 6))
+    with self.session():
+      rotation = transform_utils.get_rotation_matrix(
+          pose[..., 0], pose[..., 1], pose[..., 2])
+      expected = self.evaluate(
+          transform_utils.get_transform(rotation, pose[..., 3:]))
+    self.assertAllClose(expected,
+                        waymo_proto_to_tfe._range_image_pose_to_transform(pose))
+
+  @parameterized.named_parameters(('NoPixelPose', False),
+                                  ('PixelPose', True))
+  def testConvertMatchesRangeImageUtils(self, use_pixel_pose):
+    height, width = 8, 32
+    range_image = np.random.uniform(1., 50., size=(height, width, 4))
+    # Invalid pixels.
+    range_image[np.random.uniform(size=(height, width)) < 0.2, 0] = -1.
+    extrinsics = _RandomTransform()
+    inclinations = np.sort(np.random.uniform(-0.3, 0.05, size=height))[::-1]
+    pixel_pose = None
+    frame_pose = None
+    if use_pixel_pose:
+      frame_pose = _RandomTransform()
+      # Small perturbations of the frame pose.
+      rotation = np.random.uniform(-0.01, 0.01, size=(height, width, 3))
+      translation = frame_pose[:3, 3] + np.random.uniform(
+          -0.1, 0.1, size=(height, width, 3))
+      pixel_pose = np.concatenate([rotation, translation], axis=-1)
+
+    with self.session():
+      range_image_cartesian = (
+          range_image_utils.extract_point_cloud_from_range_image(
+              tf.constant(range_image[np.newaxis, ..., 0], tf.float32),
+              tf.constant(extrinsics[np.newaxis], tf.float32),
+              tf.constant(inclinations[np.newaxis], tf.float32),
+              pixel_pose=None if pixel_pose is None else tf.constant(
+                  waymo_proto_to_tfe._range_image_pose_to_transform(
+                      pixel_pose)[np.newaxis], tf.float32),
+              frame_pose=None if frame_pose is None else tf.constant(
+                  frame_pose[np.newaxis], tf.float32)))
+      expected_xyz = self.evaluate(range_image_cartesian)[0][
+          range_image[..., 0] >= 0]
+
+    converter = waymo_proto_to_tfe.PointCloudConverter()
+    laser_return = waymo_proto_to_tfe.LaserReturn(
+        name='TOP_ri1',
+        range_image=range_image,
+        extrinsics=extrinsics,
+        inclinations=inclinations,
+        pixel_pose=pixel_pose,
+        frame_pose=frame_pose)
+    points = converter.convert(laser_return)
+    self.assertEqual(np.float32, points.dtype)
+    self.assertAllClose(expected_xyz, points[:, :3], atol=1e-3)
+    self.assertAllClose(range_image[range_image[..., 0] >= 0][:, 1:],
+                        points[:, 3:])
+    # The second conversion uses the cached pixel directions.
+    self.assertAllEqual(points, converter.convert(laser_return))
+
+
+if __name__ == '__main__':
+  tf.test.main()
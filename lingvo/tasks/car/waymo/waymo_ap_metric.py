@@ -273,28 +273,9 @@ class WaymoAPMetrics(ap_metric.APMetrics):
       dimension, 0 indexes precision and 1 indexes recall.
     """
     del difficulty
-    tf.logging.info('Computing final Waymo metrics.')
     assert classids is not None, 'classids must be supplied.'
-    feed_dict = {}
-    g = tf.Graph()
-    scalar_fetches = []
-    curve_fetches = []
-    with g.as_default():
-      for classid in classids:
-        data = self._GetData(
-            classid,
-            distance=distance,
-            num_points=num_points,
-            rotation=rotation)
-        metrics = self._BuildMetric(data, classid)
-        scalar_fetches += [metrics.scalar_metrics]
-        curve_fetches += [metrics.curve_metrics]
-        feed_dict.update(metrics.feed_dict)
-
-    with tf.Session(graph=g) as sess:
-      results = sess.run([scalar_fetches, curve_fetches], feed_dict=feed_dict)
-    tf.logging.info('Finished computing final Waymo metrics.')
-    return {'scalars': results[0], 'curves': results[1]}
+    conditions = dict(distance=distance, num_points=num_points, rotation=rotation)
+    return self._ComputeFinalMetricsForBins(classids, [conditions])[0]
 
   @property
   def value(self):
@@ -375,6 +356,10 @@ class WaymoBreakdownMetric(breakdown_metric.BreakdownMetric):
     self._average_precision_headings = {}
     self._precision_recall_headings = {}
 
+  def BinConditions(self):
+    # All Waymo breakdowns are computed by a single unconditioned call.
+    return [{}]
+
   def ComputeMetrics(self, compute_metrics_fn):
     p = self.params
     tf.logging.info('Calculating waymo AP breakdowns: start')
@@ -54,6 +54,24 @@ class BaseLanguageModel(base_layer.BaseLayer):
   def zero_state(self, theta, batch_size):
     raise NotImplementedError('Abstract method')
 
+  def InitDecodingState(self, theta, batch_size, max_len):
+    """Returns the initial state for decoding at most max_len steps.
+
+    Unlike zero_state(), all tensors in the returned state keep their shapes
+    across Step() calls, so that they can be carried in a tf.while_loop.
+
+    Args:
+      theta: A `.NestedMap` object containing weights' values of this
+        layer and its children layers.
+      batch_size: The batch size.
+      max_len: The maximum number of Step() calls.
+
+    Returns:
+      A `.NestedMap` containing the initial recurrent state.
+    """
+    del max_len
+    return self.zero_state(theta, batch_size)
+
   def FProp(self, theta, inputs, paddings, state0, *args, **kwargs):
     """Computes xent loss given the language model inputs.
 
@@ -916,6 +934,17 @@ class TransformerLmNoEmbedding(BaseLanguageModel):
       })
     return state0
 
+  def InitDecodingState(self, theta, batch_size, max_len):
+    """Returns a state with key/value caches preallocated to max_len steps."""
+    p = self.params
+    state0 = py_utils.NestedMap(time_step=tf.zeros([], tf.int32))
+    for layer in range(p.num_trans_layers):
+      state0['layer_%d' % layer] = py_utils.NestedMap({
+          'key': tf.zeros([max_len, batch_size, p.model_dim]),
+          'value': tf.zeros([max_len, batch_size, p.model_dim]),
+      })
+    return state0
+
   @classmethod
   def StepOutputDimension(cls, params):
     return py_utils.NestedMap(
@@ -929,7 +958,9 @@ class TransformerLmNoEmbedding(BaseLanguageModel):
         layer and its children layers.
       inputs: a tensor of shape [batch, model_dim].
       paddings: a 0/1 tensor of shape [batch]. Unused here.
-      state0: A `.NestedMap` containing the prefix states up to step t-1.
+      state0: A `.NestedMap` containing the prefix states up to step t-1,
+        either from zero_state() or from InitDecodingState(). In the latter
+        case the caches have a fixed length and are updated in place.
       *args: optional extra arguments.
       **kwargs: optional extra keyword arguments.
 
@@ -943,24 +974,31 @@ class TransformerLmNoEmbedding(BaseLanguageModel):
         state1:
           The updated prefix states including step t.
     """
-
-    prefix_len, _ = py_utils.GetShape(state0['layer_0'].key, 2)
-    # [1, model_dim]
-    posit_embs = self.position_emb.FProp(theta.position_emb,
-                                         prefix_len + 1)[-1:, :]
+    state1 = py_utils.NestedMap()
+    if 'time_step' in state0:
+      t = state0.time_step
+      # [1, model_dim]
+      posit_embs = tf.reshape(
+          self.position_emb.FPropWithPosition(theta.position_emb,
+                                              tf.reshape(t, [1, 1])),
+          [1, -1])
+      state1.time_step = t + 1
+    else:
+      t = None
+      prefix_len, _ = py_utils.GetShape(state0['layer_0'].key, 2)
+      # [1, model_dim]
+      posit_embs = self.position_emb.FProp(theta.position_emb,
+                                           prefix_len + 1)[-1:, :]
     # [batch, model_dim]
     input_embs = inputs + posit_embs
     input_embs = self.input_dropout.FProp(theta.input_dropout, input_embs)
 
-    # Make a copy of the input.
-    state1 = state0.Pack(state0.Flatten())
-
     layer_in = input_embs
     for i, (layer, layer_theta) in enumerate(zip(self.trans, theta.trans)):
       layer_prefix_states = state0['layer_%i' % i]
       # [batch, model_dim]
       layer_out, _, updated_prefix_states = layer.ExtendStep(
-          layer_theta, layer_in, layer_prefix_states)
+          layer_theta, layer_in, layer_prefix_states, t=t)
       state1['layer_%i' % i] = updated_prefix_states
       layer_in = layer_out
 
@@ -1171,6 +1209,25 @@ class TransformerLm(TransformerLmNoEmbedding):
     activation = self.emb.EmbLookup(theta.emb, ids)
     return super().FProp(theta, activation, paddings, labels=labels)
 
+  def Step(self, theta, inputs, paddings, state0, *args, **kwargs):
+    """FProp one step.
+
+    Args:
+      theta: A `.NestedMap` object containing weights' values of this
+        layer and its children layers.
+      inputs: Input ids. An int32 tensor of shape [batch].
+      paddings: a 0/1 tensor of shape [batch]. Unused here.
+      state0: A `.NestedMap` containing the prefix states up to step t-1.
+      *args: optional extra arguments.
+      **kwargs: optional extra keyword arguments.
+
+    Returns:
+      A tuple (output, state1). See TransformerLmNoEmbedding.Step().
+    """
+    ids = py_utils.HasRank(inputs, 1)
+    activation = self.emb.EmbLookup(theta.emb, ids)
+    return super().Step(theta, activation, paddings, state0, *args, **kwargs)
+
 
 class GPipeTransformerLm(BaseLanguageModel):
   """GPipe Transformer based language model layer."""
@@ -17,6 +17,7 @@
 
 import lingvo.compat as tf
 from lingvo.core import batch_major_attention
+from lingvo.core import layers
 from lingvo.core import py_utils
 from lingvo.core import test_utils
 from lingvo.tasks.lm import layers as lm_layers
@@ -785,6 +786,50 @@ class TransformerLmTest(test_utils.TestCase):
       self.assertAllEqual(xent_output_val.per_example_argmax,
                           np.argmax(xent_output_val.logits, axis=-1))
 
+  def testAdaptiveSoftmax(self):
+    time, batch, dims, hidden_dim, vocab = 5, 3, 6, 4, 8
+
+    p = lm_layers.TransformerLm.Params()
+    p.name = 'transformerlm'
+    p.vocab_size = vocab
+    p.emb.vocab_size = vocab
+    p.emb.embedding_dim = dims
+    p.model_dim = dims
+    p.num_trans_layers = 2
+    p.position_emb.embedding_dim = dims
+    p.trans_tpl.source_dim = dims
+    p.trans_tpl.tr_atten_tpl.num_attention_heads = 2
+    p.trans_tpl.tr_fflayer_tpl.hidden_dim = hidden_dim
+    p.softmax = layers.AdaptiveSoftmax.Params().Set(
+        input_dim=dims, num_classes=vocab, cutoffs=[4, 6, vocab])
+
+    with self.session(use_gpu=True):
+      lm = p.Instantiate()
+      np.random.seed(12345)
+      inputs = np.random.randint(vocab, size=[time, batch])
+      targets = np.zeros([time, batch])
+      targets[:-1] = inputs[1:]
+      inputs = tf.constant(inputs, tf.int32)
+      paddings = np.zeros([time, batch])
+      paddings[-1] = 1.0
+      paddings = tf.constant(paddings, tf.float32)
+      targets = tf.constant(targets, tf.int32)
+      xent_output, _ = lm.FPropDefaultTheta(
+          inputs=inputs,
+          paddings=paddings,
+          labels=py_utils.NestedMap(
+              class_weights=1 - paddings, class_ids=targets))
+      logits_output, _ = lm.FPropDefaultTheta(inputs=inputs, paddings=paddings)
+      self.evaluate(tf.global_variables_initializer())
+      xent_output_val, logits, targets = self.evaluate(
+          [xent_output, logits_output.logits, targets])
+
+    self.assertAllEqual(xent_output_val.per_example_argmax,
+                        np.argmax(logits, axis=-1))
+    self.assertAllClose(
+        xent_output_val.per_example_xent,
+        -np.take_along_axis(logits, targets[..., np.newaxis], axis=-1)[..., 0])
+
   def testDropout(self):
     seed = 12345
     tf.random.set_seed(seed)
@@ -20,6 +20,7 @@ from lingvo.core import base_model
 from lingvo.core import py_utils
 from lingvo.core import schedule
 from lingvo.tasks.lm import layers
+from lingvo.tasks.lm import sampler
 
 
 class LanguageModel(base_model.BaseTask):
@@ -29,6 +30,10 @@ class LanguageModel(base_model.BaseTask):
   def Params(cls):
     p = super().Params()
     p.Define('lm', layers.RnnLm.Params(), 'LM layer.')
+    p.Define(
+        'sampler', sampler.LmSampler.Params(),
+        'Sampler used by the "sample" inference subgraph. The subgraph is '
+        'only built if sampler.target_seq_len > 0.')
 
     tp = p.train
     tp.Define(
@@ -60,6 +65,8 @@ class LanguageModel(base_model.BaseTask):
 
     # Construct the model.
     self.CreateChild('lm', p.lm)
+    if p.sampler.target_seq_len > 0:
+      self.CreateChild('sampler', p.sampler)
 
   @classmethod
   def UpdateTargetVocabSize(cls, p, vocab_size, wpm_model=None):
@@ -156,6 +163,8 @@ class LanguageModel(base_model.BaseTask):
     subgraphs = {}
     with tf.name_scope('inference'):
       subgraphs['default'] = self._InferenceSubgraph_Default()
+      if self.params.sampler.target_seq_len > 0:
+        subgraphs['sample'] = self._InferenceSubgraph_Sample()
     return subgraphs
 
   def _InferenceSubgraph_Default(self):
@@ -226,6 +235,48 @@ class LanguageModel(base_model.BaseTask):
     feeds = {'text': text}
     return fetches, feeds
 
+  def _InferenceSubgraph_Sample(self):
+    """Inference subgraph sampling continuations of the input texts.
+
+    Returns:
+      (fetches, feeds):
+
+      - fetches: A dictionary of fetches, containing:
+
+        - ids: A matrix of shape [batch, sampler.target_seq_len]. The rest of
+          each input text's tokens followed by the sampled ones.
+        - paddings: A matrix of shape [batch, sampler.target_seq_len]. The
+          padding mask.
+        - log_probs: A matrix of shape [batch, sampler.target_seq_len]. [i, j]
+          is the log prob of i-th output's j-th token.
+        - lengths: A vector of shape [batch]. The number of non-padded tokens.
+        - text: A vector of shape [batch]. The ids mapped back to strings.
+
+      - feeds: A dictionary of feeds, containing:
+
+        - text: A placeholder for a vector of strings. The prefixes to
+          continue, which may be empty.
+        - random_seed: An optional int32 scalar placeholder, defaults to 0.
+    """
+    text = tf.placeholder(tf.string, shape=[None])
+    random_seed = tf.placeholder_with_default(
+        tf.constant(0, tf.int32), shape=[])
+    # [batch, time]
+    ids, _, paddings = self.input_generator.StringsToIds(text)
+    prefix_lengths = tf.reduce_sum(tf.cast(1 - paddings, tf.int32), axis=1)
+    samples = self.sampler.Sample(self.lm, self.theta.lm, ids, prefix_lengths,
+                                  random_seed)
+    lengths = tf.reduce_sum(tf.cast(1 - samples.paddings, tf.int32), axis=1)
+    fetches = {
+        'ids': samples.ids,
+        'paddings': samples.paddings,
+        'log_probs': samples.log_probs,
+        'lengths': lengths,
+        'text': self.input_generator.IdsToStrings(samples.ids, lengths),
+    }
+    feeds = {'text': text, 'random_seed': random_seed}
+    return fetches, feeds
+
 
 class FixedShapeInputLanguageModel(LanguageModel):
 
@@ -120,6 +120,29 @@ class ModelTest(test_utils.TestCase):
       self.assertEqual(vals['log_pplx_per_token'].shape, (2, 20))
       self.assertEqual(vals['paddings'].shape, (2, 20))
 
+  def testLmInferenceSample(self):
+    tf.random.set_seed(93820986)
+    p = self._Params()
+    p.input = self._InputParams(for_training=False)
+    p.sampler.target_seq_len = 8
+
+    with self.session(use_gpu=False) as sess:
+      mdl = p.Instantiate()
+      subgraphs = mdl.Inference()
+      self.assertIn('sample', subgraphs)
+      fetches, feeds = subgraphs['sample']
+      self.evaluate(tf.global_variables_initializer())
+      vals = sess.run(
+          fetches=fetches,
+          feed_dict={feeds['text']: ['pray for world peace', '']})
+      self.assertEqual(vals['ids'].shape, (2, 8))
+      self.assertEqual(vals['paddings'].shape, (2, 8))
+      self.assertEqual(vals['log_probs'].shape, (2, 8))
+      self.assertEqual(vals['text'].shape, (2,))
+      # The first prefix is longer than target_seq_len, so it is not padded.
+      self.assertAllEqual(vals['lengths'], [8, vals['lengths'][1]])
+      self.assertLessEqual(vals['lengths'][1], 8)
+
   def testLmInferenceWordLevel(self):
     tf.random.set_seed(93820986)
     p = self._Params()
@@ -167,6 +167,28 @@ class WordLevelOneBwdsSimpleSampledSoftmaxTiny(
   RNN_STATE_DIM = 32
 
 
+@model_registry.RegisterSingleTaskModel
+class WordLevelOneBwdsAdaptiveSoftmax(WordLevelOneBwdsBase):
+  """Use an adaptive softmax in training and eval.
+
+  The vocab ids are sorted by decreasing frequency, so the head cluster holds
+  the 60k most frequent words and most tokens never evaluate a tail cluster.
+  """
+
+  # Use layers.AdaptiveSoftmaxCutoffs() to derive these from vocab counts.
+  SOFTMAX_CUTOFFS = [60000, 100000, 640000]
+
+  def Task(self):
+    p = super().Task()
+    num_input_dim = p.lm.softmax.input_dim
+    p.lm.softmax = layers.AdaptiveSoftmax.Params()
+    p.lm.softmax.input_dim = num_input_dim
+    p.lm.softmax.num_classes = self.VOCAB_SIZE
+    p.lm.softmax.cutoffs = self.SOFTMAX_CUTOFFS + [self.VOCAB_SIZE]
+    p.lm.softmax.params_init = py_utils.WeightInit.UniformUnitScaling(1.0)
+    return p
+
+
 # Example large transformer model using GPIPE.
 # Instructions:
 # trainer --run_locally=gpu --mode=sync \
@@ -0,0 +1,188 @@
+# Lint as: python3
+# Copyright 2020 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Autoregressive sampling from language models in a single while loop."""
+
+from lingvo import compat as tf
+from lingvo.core import base_layer
+from lingvo.core import py_utils
+# pylint: disable=g-direct-tensorflow-import
+from tensorflow.python.ops import inplace_ops
+# pylint: enable=g-direct-tensorflow-import
+
+
+def _FilterTopP(sorted_logits, top_p):
+  """Masks the tail of sorted_logits outside of the top_p probability mass.
+
+  Args:
+    sorted_logits: [batch, k] logits sorted in decreasing order.
+    top_p: The probability mass to keep, in (0, 1].
+
+  Returns:
+    [batch, k] logits where the discarded entries are very negative. The first
+    entry of each row is always kept.
+  """
+  probs = tf.nn.softmax(sorted_logits)
+  # Mass of all the classes before each class.
+  mass_before = tf.cumsum(probs, axis=-1, exclusive=True)
+  return tf.where(mass_before < top_p, sorted_logits,
+                  tf.fill(tf.shape(sorted_logits), sorted_logits.dtype.min))
+
+
+class LmSampler(base_layer.BaseLayer):
+  """Samples sequences from a language model's Step() function.
+
+  The whole decoding loop is a single tf.while_loop over a fixed-shape state
+  (see BaseLanguageModel.InitDecodingState()), so it runs without host
+  round-trips and can be exported as an inference subgraph. Each sequence
+  stops at its first sampled target_eos_id; the loop exits once all of them
+  have stopped or after target_seq_len steps.
+  """
+
+  @classmethod
+  def Params(cls):
+    p = super().Params()
+    p.Define('target_eos_id', 2, 'Id of the end of sentence token.')
+    p.Define('target_seq_len', 0, 'Maximum number of tokens to sample.')
+    p.Define(
+        'temperature', 1.0, 'Logits are divided by this before sampling. '
+        'If 0, decodes greedily.')
+    p.Define('top_k', 0, 'If > 0, only samples from the top_k classes.')
+    p.Define(
+        'top_p', 1.0, 'If < 1, nucleus sampling: only samples from the '
+        'smallest set of classes whose probability mass reaches top_p.')
+    p.name = 'lm_sampler'
+    return p
+
+  def __init__(self, params):
+    super().__init__(params)
+    p = self.params
+    assert p.target_seq_len > 0, p.target_seq_len
+    assert p.temperature >= 0, p.temperature
+    assert p.top_k >= 0, p.top_k
+    assert 0 < p.top_p <= 1, p.top_p
+
+  def _SampleIds(self, logits, seed):
+    """Samples [batch] ids from [batch, vocab] logits."""
+    p = self.params
+    logits = tf.cast(logits, tf.float32)
+    if p.temperature == 0:
+      return tf.cast(py_utils.ArgMax(logits), tf.int32)
+    logits /= p.temperature
+    if p.top_k:
+      # Only the top_k classes need to be sorted and filtered.
+      logits, class_ids = tf.math.top_k(logits, p.top_k)
+      if p.top_p < 1:
+        logits = _FilterTopP(logits, p.top_p)
+    elif p.top_p < 1:
+      vocab_size = py_utils.GetShape(logits)[-1]
+      logits, class_ids = tf.math.top_k(logits, vocab_size)
+      logits = _FilterTopP(logits, p.top_p)
+    else:
+      class_ids = None
+    ids = tf.random.stateless_categorical(
+        logits, num_samples=1, seed=seed, dtype=tf.int32)
+    if class_ids is not None:
+      ids = tf.gather(class_ids, ids, batch_dims=1)
+    return tf.reshape(ids, [-1])
+
+  def Sample(self, lm, lm_theta, prefix_ids, prefix_lengths, random_seed):
+    """Samples a continuation of each prefix.
+
+    Args:
+      lm: A BaseLanguageModel whose Step() takes [batch] int ids, e.g. RnnLm or
+        TransformerLm.
+      lm_theta: The lm's theta.
+      prefix_ids: [batch, prefix_len] int32 ids, starting with the start of
+        sentence id.
+      prefix_lengths: [batch] int32 lengths of the prefixes, all >= 1.
+      random_seed: A scalar int32 seed. The same seed gives the same samples.
+
+    Returns:
+      A NestedMap containing the following tensors
+
+      - 'ids': [batch, target_seq_len] int32, the tokens following
+        prefix_ids[:, 0], including the rest of the prefix. Padded steps are
+        target_eos_id.
+      - 'paddings': [batch, target_seq_len] of 0/1, where 1 represents a step
+        after the first sampled target_eos_id.
+      - 'log_probs': [batch, target_seq_len], the log-prob of each token.
+    """
+    p = self.params
+    batch_size, prefix_len = py_utils.GetShape(prefix_ids, 2)
+    max_len = p.target_seq_len
+    # Pads the prefixes to max_len + 1 steps so they can be indexed by step.
+    prefix_ids = tf.pad(
+        prefix_ids[:, :max_len + 1],
+        [[0, 0], [0, tf.maximum(0, max_len + 1 - prefix_len)]])
+    prefix_ids = tf.transpose(prefix_ids)
+    zeros = tf.zeros([batch_size], dtype=py_utils.FPropDtype(p))
+
+    state0 = py_utils.NestedMap(
+        t=tf.zeros([], tf.int32),
+        ids=prefix_ids[0],
+        done=tf.zeros([batch_size], tf.bool),
+        lm_state=lm.InitDecodingState(lm_theta, batch_size, max_len),
+        out_ids=tf.fill([max_len, batch_size], p.target_eos_id),
+        out_paddings=tf.ones([max_len, batch_size], zeros.dtype),
+        out_log_probs=tf.zeros([max_len, batch_size], tf.float32))
+
+    def _LoopContinue(*args):
+      state = state0.Pack(args)
+      return tf.logical_and(state.t < max_len,
+                            tf.logical_not(tf.reduce_all(state.done)))
+
+    def _LoopBody(*args):
+      """Computes one decoding step for the whole batch."""
+      state = state0.Pack(args)
+      t = state.t
+      output, lm_state1 = lm.Step(lm_theta, state.ids, zeros, state.lm_state)
+      log_probs = tf.nn.log_softmax(tf.cast(output.logits, tf.float32))
+      sampled = self._SampleIds(log_probs, tf.stack([random_seed, t]))
+      in_prefix = t + 1 < prefix_lengths
+      ids = tf.where(in_prefix, tf.gather(prefix_ids, t + 1), sampled)
+      ids = tf.where(state.done, tf.fill([batch_size], p.target_eos_id), ids)
+      ids = tf.cast(ids, tf.int32)
+      token_log_probs = tf.gather(log_probs, ids[:, tf.newaxis],
+                                  batch_dims=1)[:, 0]
+      state1 = py_utils.NestedMap(
+          t=t + 1,
+          ids=ids,
+          done=tf.logical_or(
+              state.done,
+              tf.logical_and(
+                  tf.logical_not(in_prefix), tf.equal(ids,
+                                                      p.target_eos_id))),
+          lm_state=lm_state1,
+          out_ids=inplace_ops.alias_inplace_update(state.out_ids, t, ids),
+          out_paddings=inplace_ops.alias_inplace_update(
+              state.out_paddings, t,
+              tf.where(state.done, 1.0 + zeros, zeros)),
+          out_log_probs=inplace_ops.alias_inplace_update(
+              state.out_log_probs, t,
+              tf.where(state.done, tf.zeros_like(token_log_probs),
+                       token_log_probs)))
+      return state1.Flatten()
+
+    final_state = state0.Pack(
+        tf.while_loop(
+            _LoopContinue,
+            _LoopBody,
+            loop_vars=state0.Flatten(),
+            back_prop=False))
+    return py_utils.NestedMap(
+        ids=tf.transpose(final_state.out_ids),
+        paddings=tf.transpose(final_state.out_paddings),
+        log_probs=tf.transpose(final_state.out_log_probs))
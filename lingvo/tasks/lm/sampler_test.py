@@ -0,0 +1,230 @@
+# Lint as: python3
+# Copyright 2020 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for sampler."""
+
+import time
+
+from absl.testing import parameterized
+import lingvo.compat as tf
+from lingvo.core import test_utils
+from lingvo.tasks.lm import layers as lm_layers
+from lingvo.tasks.lm import sampler
+import numpy as np
+
+
+def _TransformerLmParams(vocab=16, dims=8, num_layers=2):
+  p = lm_layers.TransformerLm.Params()
+  p.name = 'transformerlm'
+  p.vocab_size = vocab
+  p.emb.vocab_size = vocab
+  p.emb.embedding_dim = dims
+  p.model_dim = dims
+  p.num_trans_layers = num_layers
+  p.position_emb.embedding_dim = dims
+  p.trans_tpl.source_dim = dims
+  p.trans_tpl.tr_atten_tpl.num_attention_heads = 2
+  p.trans_tpl.tr_fflayer_tpl.hidden_dim = 4 * dims
+  p.softmax.input_dim = dims
+  p.softmax.num_classes = vocab
+  p.random_seed = 12345
+  return p
+
+
+def _SamplerParams(**kwargs):
+  return sampler.LmSampler.Params().Set(target_seq_len=6, **kwargs)
+
+
+class LmSamplerTest(test_utils.TestCase, parameterized.TestCase):
+
+  def testFixedCacheStepMatchesFProp(self):
+    time_steps, batch, vocab = 5, 3, 16
+    with self.session(use_gpu=False):
+      lm = _TransformerLmParams(vocab=vocab).Instantiate()
+      np.random.seed(12345)
+      ids = tf.constant(
+          np.random.randint(vocab, size=[time_steps, batch]), tf.int32)
+      xent_output, _ = lm.FPropDefaultTheta(ids, tf.zeros([time_steps, batch]))
+
+      state = lm.InitDecodingState(lm.theta, batch, time_steps)
+      step_logits = []
+      for t in range(time_steps):
+        output, state = lm.Step(lm.theta, ids[t], tf.zeros([batch]), state)
+        step_logits.append(output.logits)
+
+      self.evaluate(tf.global_variables_initializer())
+      expected, actual = self.evaluate(
+          [xent_output.logits, tf.stack(step_logits)])
+      self.assertAllClose(expected, actual, atol=1e-5)
+
+  def testGreedyMatchesArgMax(self):
+    batch, vocab = 3, 16
+    p = _SamplerParams(temperature=0.0)
+    with self.session(use_gpu=False):
+      lm = _TransformerLmParams(vocab=vocab).Instantiate()
+      smp = p.Instantiate()
+      prefix_ids = tf.constant([[1], [4], [7]], tf.int32)
+      samples = smp.Sample(lm, lm.theta, prefix_ids, tf.ones([batch],
+                                                              tf.int32), 0)
+
+      # Greedy decoding with the growing cache, one Step() at a time.
+      state = lm.zero_state(lm.theta, batch)
+      ids = prefix_ids[:, 0]
+      expected_ids = []
+      for _ in range(p.target_seq_len):
+        output, state = lm.Step(lm.theta, ids, tf.zeros([batch]), state)
+        ids = tf.cast(tf.argmax(output.logits, axis=-1), tf.int32)
+        expected_ids.append(ids)
+
+      self.evaluate(tf.global_variables_initializer())
+      samples, expected_ids = self.evaluate(
+          [samples, tf.stack(expected_ids, axis=1)])
+      # Sequences that emitted eos are padded afterwards.
+      for i in range(batch):
+        for t in range(p.target_seq_len):
+          if samples.paddings[i, t]:
+            self.assertEqual(p.target_eos_id, samples.ids[i, t])
+          else:
+            self.assertEqual(expected_ids[i, t], samples.ids[i, t])
+
+  def testPrefixAndEarlyStopping(self):
+    batch, vocab = 2, 16
+    p = _SamplerParams(temperature=0.0)
+    with self.session(use_gpu=False):
+      lm = _TransformerLmParams(vocab=vocab).Instantiate()
+      smp = p.Instantiate()
+      # The first prefix ends with eos, which does not stop decoding; only
+      # sampled eos tokens do.
+      prefix_ids = tf.constant([[1, 5, 2, 6], [1, 9, 0, 0]], tf.int32)
+      prefix_lengths = tf.constant([4, 2], tf.int32)
+      samples = smp.Sample(lm, lm.theta, prefix_ids, prefix_lengths, 0)
+      self.evaluate(tf.global_variables_initializer())
+      samples = self.evaluate(samples)
+
+    self.assertAllEqual([5, 2, 6], samples.ids[0, :3])
+    self.assertAllEqual([0, 0, 0], samples.paddings[0, :3])
+    self.assertEqual(9, samples.ids[1, 0])
+    self.assertEqual(0, samples.paddings[1, 0])
+    # Steps before these are forced to the prefix.
+    first_sampled_steps = [3, 1]
+    for i in range(batch):
+      sampled_eos = [
+          t for t in range(first_sampled_steps[i], p.target_seq_len)
+          if samples.ids[i, t] == p.target_eos_id
+      ]
+      if not sampled_eos:
+        self.assertAllEqual(np.zeros(p.target_seq_len), samples.paddings[i])
+        continue
+      # Everything after the first sampled eos is padded.
+      first = sampled_eos[0]
+      self.assertAllEqual(
+          np.zeros(first + 1), samples.paddings[i, :first + 1])
+      self.assertAllEqual(
+          np.ones(p.target_seq_len - first - 1),
+          samples.paddings[i, first + 1:])
+      self.assertAllEqual(
+          np.zeros(p.target_seq_len - first - 1),
+          samples.log_probs[i, first + 1:])
+    self.assertTrue(np.all(samples.log_probs <= 0))
+
+  @parameterized.named_parameters(
+      ('TopK', dict(top_k=3)),
+      ('TopP', dict(top_p=0.3)),
+      ('TopKTopP', dict(top_k=5, top_p=0.5)),
+  )
+  def testRestrictedSampling(self, kwargs):
+    batch, vocab = 8, 16
+    p = _SamplerParams(target_eos_id=-1, target_seq_len=1, **kwargs)
+    with self.session(use_gpu=False) as sess:
+      lm = _TransformerLmParams(vocab=vocab).Instantiate()
+      smp = p.Instantiate()
+      prefix_ids = tf.ones([batch, 1], tf.int32)
+      random_seed = tf.placeholder(tf.int32, shape=[])
+      samples = smp.Sample(lm, lm.theta, prefix_ids, tf.ones([batch],
+                                                              tf.int32),
+                           random_seed)
+      output, _ = lm.Step(lm.theta, prefix_ids[:, 0], tf.zeros([batch]),
+                          lm.zero_state(lm.theta, batch))
+      probs = tf.nn.softmax(output.logits)
+      self.evaluate(tf.global_variables_initializer())
+      probs = self.evaluate(probs)[0]
+      sampled = set()
+      for seed in range(10):
+        sampled.update(
+            sess.run(samples.ids, feed_dict={random_seed: seed}).flat)
+
+    order = np.argsort(-probs)
+    allowed = order
+    if 'top_k' in kwargs:
+      allowed = allowed[:kwargs['top_k']]
+    if 'top_p' in kwargs:
+      mass_before = np.cumsum(probs[allowed] / np.sum(probs[allowed])) - (
+          probs[allowed] / np.sum(probs[allowed]))
+      allowed = allowed[mass_before < kwargs['top_p']]
+    self.assertTrue(sampled.issubset(set(allowed)), (sampled, allowed))
+
+  def testSameSeedSameSamples(self):
+    batch, vocab = 4, 16
+    p = _SamplerParams(temperature=1.0)
+    with self.session(use_gpu=False) as sess:
+      lm = _TransformerLmParams(vocab=vocab).Instantiate()
+      smp = p.Instantiate()
+      random_seed = tf.placeholder(tf.int32, shape=[])
+      samples = smp.Sample(lm, lm.theta, tf.ones([batch, 1], tf.int32),
+                           tf.ones([batch], tf.int32), random_seed)
+      self.evaluate(tf.global_variables_initializer())
+      a = sess.run(samples.ids, feed_dict={random_seed: 7})
+      b = sess.run(samples.ids, feed_dict={random_seed: 7})
+    self.assertAllEqual(a, b)
+
+
+class SamplerBenchmark(tf.test.Benchmark):
+  """Benchmarks sampling throughput.
+
+  Run with::
+
+    bazel run -c opt lingvo/tasks/lm:sampler_test -- --benchmarks=.
+  """
+
+  def _BenchmarkSample(self, batch_size, target_seq_len=128, iters=5):
+    with tf.Graph().as_default(), tf.Session() as sess:
+      lm = _TransformerLmParams(
+          vocab=1024, dims=256, num_layers=4).Instantiate()
+      smp = sampler.LmSampler.Params().Set(
+          target_eos_id=-1, target_seq_len=target_seq_len,
+          top_k=40).Instantiate()
+      samples = smp.Sample(lm, lm.theta, tf.ones([batch_size, 1], tf.int32),
+                           tf.ones([batch_size], tf.int32), 0)
+      sess.run(tf.global_variables_initializer())
+      # Warm up.
+      sess.run(samples.ids)
+      start = time.time()
+      for _ in range(iters):
+        sess.run(samples.ids)
+      wall_time = (time.time() - start) / iters
+    tokens_per_sec = batch_size * target_seq_len / wall_time
+    self.report_benchmark(
+        name='sample_batch%d' % batch_size,
+        iters=iters,
+        wall_time=wall_time,
+        extras={'tokens_per_sec': tokens_per_sec})
+
+  def benchmarkSample(self):
+    for batch_size in (1, 4, 16, 64):
+      self._BenchmarkSample(batch_size)
+
+
+if __name__ == '__main__':
+  tf.test.main()
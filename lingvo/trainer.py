@@ -42,6 +42,7 @@ from lingvo import executor
 from lingvo import model_imports
 from lingvo import model_registry
 import lingvo.compat as tf
+from lingvo.core import base_layer
 from lingvo.core import base_model
 from lingvo.core import base_model_params
 from lingvo.core import checkpointer
@@ -1526,17 +1527,23 @@ class RunnerManager:
     """
 
     runners = []
-    for j in jobs:
-      tf_master = FLAGS.tf_master
-      # Ensure that decoder or evaler threads do not clobber variables being
-      # updated by trainer by forcing them to use independent sessions.
-      if ('trainer' in jobs and
-          (j.startswith('decoder') or j.startswith('evaler'))):
-        tf_master = ''
-
-      runner = self._CreateRunner(j, FLAGS.model_task_name, logdir, tf_master,
-                                  trial)
-      runners.append(runner)
+    # The runners build their own copy of the same model.
+    with base_layer.FPropMetaCacheScope():
+      for j in jobs:
+        tf_master = FLAGS.tf_master
+        # Ensure that decoder or evaler threads do not clobber variables being
+        # updated by trainer by forcing them to use independent sessions.
+        if ('trainer' in jobs and
+            (j.startswith('decoder') or j.startswith('evaler'))):
+          tf_master = ''
+
+        start_time = time.time()
+        runner = self._CreateRunner(j, FLAGS.model_task_name, logdir,
+                                    tf_master, trial)
+        # Runners build their graph when created.
+        tf.logging.info('Created %s runner in %.2fs.', j,
+                        time.time() - start_time)
+        runners.append(runner)
     return runners
 
   def StartRunners(self, runners):
@@ -1708,6 +1715,7 @@ class RunnerManager:
             model_cfg=cfg,
             model_task_name=task_name,
             export_path=filename_prefix + '.pbtxt',
+            export_binary_path=filename_prefix + '.pb',
             random_seed=FLAGS.inference_graph_random_seed)
       except NotImplementedError as e:
         tf.logging.error('Cannot write inference graph: %s', e)
@@ -1724,6 +1732,7 @@ class RunnerManager:
                 gen_init_op=True,
                 dtype_override=None),
             export_path=filename_prefix + '_tpu.pbtxt',
+            export_binary_path=filename_prefix + '_tpu.pb',
             random_seed=FLAGS.inference_graph_random_seed)
       except Exception as e:  # pylint: disable=broad-except
         tf.logging.error('Error exporting TPU inference graph: %s' % e)
@@ -239,6 +239,9 @@ class TrainerTest(BaseTrainerTest):
     inference_files = tf.io.gfile.glob(logdir + '/inference_graphs/*')
     self.assertTrue(self._HasFile(inference_files, 'inference.pbtxt'))
     self.assertTrue(self._HasFile(inference_files, 'inference_tpu.pbtxt'))
+    self.assertTrue(
+        tf.io.gfile.exists(
+            os.path.join(logdir, 'inference_graphs/inference.pb')))
 
   @flagsaver.flagsaver(model_task_name='a')
   def testWriteOneOfMultiTaskInferenceGraph(self):